@@ -4,21 +4,53 @@ os.environ["DISCORD_NO_VOICE"] = "1"
 # === ИМПОРТЫ ===
 import asyncio
 import logging
+import math
 from aiohttp import web  # ← добавили aiohttp
 
 from src.core.bot import NaeratusBot
 from src.core.config import settings
-from src.database.connection import init_db
-from src.database.discipline import init_discipline_db
-from src.database.economy import init_economy_db
+from src.database.engine import engine
+from src.database.migrations import run_migrations
+from src.servies.loop_monitor import loop_monitor
+from src.servies.metrics import metrics
+from src.servies.startup import startup
 
 # === ВЕБ-СЕРВЕР ДЛЯ UPTIMEROBOT ===
 async def health_check(request):
     return web.Response(text="Бот жив! 💚")
 
-async def start_web_server():
+async def metrics_handler(request):
+    return web.Response(
+        body=metrics.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def healthz(request):
+    """ok — бот готов и отзывчив; degraded (503) — высокая задержка gateway или цикла событий"""
+    bot = request.app["bot"]
+    latency = bot.latency
+    lag = loop_monitor.recent_max
+    problems = []
+    if not bot.is_ready():
+        problems.append("not_ready")
+    if not math.isfinite(latency) or latency > settings.HEALTH_MAX_GATEWAY_LATENCY:
+        problems.append("gateway_latency")
+    if lag > settings.HEALTH_MAX_LOOP_LAG:
+        problems.append("loop_lag")
+    return web.json_response({
+        "status": "degraded" if problems else "ok",
+        "problems": problems,
+        "gateway_latency": latency if math.isfinite(latency) else None,
+        "loop_lag": lag,
+        "uptime": startup.elapsed(),
+    }, status=503 if problems else 200)
+
+async def start_web_server(bot):
     app = web.Application()
+    app["bot"] = bot
     app.router.add_get('/', health_check)
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/healthz', healthz)
     runner = web.AppRunner(app)
     await runner.setup()
     # Replit требует порт 8080
@@ -34,15 +66,19 @@ async def main():
         datefmt="%Y-%m-%d %H:%M:%S",
     )
     logging.info("🚀 Запуск бота...")
+    startup.mark("imports")
 
-    init_db()
-    init_discipline_db()
-    init_economy_db()
+    # Раскладка файлов выбирается до первого соединения
+    engine.use_single_file(getattr(settings, 'DATABASE_SINGLE_FILE', None))
 
-    # Запускаем веб-сервер в фоне
-    asyncio.create_task(start_web_server())
+    # Миграции схем, WAL и прагмы — один раз при старте
+    with startup.phase("migrations"):
+        run_migrations()
 
     bot = NaeratusBot()
+
+    # Запускаем веб-сервер в фоне
+    asyncio.create_task(start_web_server(bot))
     try:
         await bot.start(settings.TOKEN)
     except KeyboardInterrupt:
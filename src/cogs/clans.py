@@ -9,8 +9,9 @@ from typing import Optional
 
 from src.core.config import settings
 from src.utils.embed import create_embed, EmbedColors
+from src.utils.members import member_resolver
+from src.servies.startup import startup
 from src.database.clans import (
-    init_clans_db,
     create_clan,
     get_clan_by_id,
     get_clan_by_name,
@@ -30,7 +31,12 @@ from src.database.clans import (
     get_clans_for_payment,
     get_connection
 )
-from src.database.economy import get_or_create_account, add_cash, transfer_cash_to_bank
+from src.database.economy import get_or_create_account, add_cash, spend_cash, transfer_cash_to_bank
+from src.database.economy import DB_PATH as ECONOMY_DB_PATH
+from src.database.engine import engine, run_db
+from src.database.ledger import InsufficientFunds
+from src.database.connection import DB_PATH
+from src.database.migrations import ensure_schema
 
 # Словарь для преобразования Discord кодов эмодзи в Unicode
 EMOJI_MAP = {
@@ -174,7 +180,7 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
         await interaction.response.defer(ephemeral=True)
         
         # Проверяем, что пользователь не состоит в клане
-        user_clan = check_user_in_clan(interaction.user, interaction.guild)
+        user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
         if user_clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -185,7 +191,7 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             return
         
         # Проверяем, что клан с таким именем не существует
-        existing_clan = get_clan_by_name(self.name.value, include_inactive=True)
+        existing_clan = await run_db(get_clan_by_name, self.name.value, include_inactive=True)
         if existing_clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -195,18 +201,6 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
     
-        # Проверяем баланс пользователя
-        account = get_or_create_account(interaction.user.id, interaction.guild.id)
-        cash = account[0]  # Первый элемент кортежа - cash
-        if cash < settings.CLAN_CREATE_COST:
-            embed = create_embed(
-                title="❌ Недостаточно средств",
-                description=f"Для создания клана нужно {settings.CLAN_CREATE_COST} {settings.ECONOMY_SYMBOL}",
-                color=EmbedColors.ERROR
-            )
-            await interaction.followup.send(embed=embed, ephemeral=True)
-            return
-        
         # Проверяем валидность hex цвета
         try:
             color_hex = self.color.value.lstrip('#')
@@ -221,7 +215,7 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             return
         
         # Проверяем уникальность имени клана
-        existing_clan = get_clan_by_name(self.name.value, include_inactive=True)
+        existing_clan = await run_db(get_clan_by_name, self.name.value, include_inactive=True)
         if existing_clan:
             embed = create_embed(
                 title="❌ Имя занято",
@@ -231,7 +225,20 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
         
+        # Списываем деньги до создания роли и каналов: без оплаты ничего не создаётся,
+        # а проверка баланса и списание — один UPDATE
+        if not await run_db(spend_cash, interaction.user.id, interaction.guild.id, settings.CLAN_CREATE_COST,
+                            kind='clan', ref=self.name.value):
+            embed = create_embed(
+                title="❌ Недостаточно средств",
+                description=f"Для создания клана нужно {settings.CLAN_CREATE_COST} {settings.ECONOMY_SYMBOL}",
+                color=EmbedColors.ERROR
+            )
+            await interaction.followup.send(embed=embed, ephemeral=True)
+            return
+        
         # Создаем клан
+        clan_id = None
         try:
             # Получаем эмодзи (по умолчанию 🛡️) и преобразуем Discord коды
             clan_emoji = convert_emoji(self.emoji.value) if self.emoji.value else '🛡️'
@@ -292,7 +299,7 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             logging.info(f"- Текстовый канал: {text_channel.id}")
             logging.info(f"- Голосовой канал: {voice_channel.id}")
             
-            clan_id = create_clan(
+            clan_id = await run_db(create_clan,
                 name=self.name.value,
                 description=self.description.value,
                 color=color_int,
@@ -305,13 +312,10 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
             )
         
             # Дополнительная проверка: убеждаемся, что владелец добавлен как участник
-            if not check_user_in_clan(interaction.user, interaction.guild):
-                add_clan_member(clan_id, interaction.user.id, 'owner')
+            if not await run_db(check_user_in_clan, interaction.user, interaction.guild):
+                await run_db(add_clan_member, clan_id, interaction.user.id, 'owner')
                 logging.warning(f"Владелец клана {clan_id} не был найден в участниках, добавлен принудительно")
             
-            # Списываем деньги
-            add_cash(interaction.user.id, interaction.guild.id, -settings.CLAN_CREATE_COST)
-            
             # Даем роль владельца клана
             owner_role = interaction.guild.get_role(settings.CLAN_OWNER_ROLE_ID)
             if owner_role:
@@ -359,6 +363,11 @@ class CreateClanModal(ui.Modal, title="Создание клана"):
                 color=EmbedColors.ERROR
             )
             await interaction.followup.send(embed=embed, ephemeral=True)
+        finally:
+            if clan_id is None:
+                # Клан не создан — возвращаем оплату
+                await run_db(add_cash, interaction.user.id, interaction.guild.id, settings.CLAN_CREATE_COST,
+                             kind='clan_refund', ref=self.name.value)
 
 class CreateClanButton(ui.View):
     def __init__(self, bot):
@@ -368,7 +377,7 @@ class CreateClanButton(ui.View):
     @ui.button(label="Создать клан", style=discord.ButtonStyle.primary, emoji="🏰", custom_id="clan_create_button")
     async def create_clan_button(self, interaction: discord.Interaction, button: ui.Button):
         # Проверяем, что пользователь не состоит в клане
-        user_clan = check_user_in_clan(interaction.user, interaction.guild)
+        user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
         if user_clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -379,7 +388,7 @@ class CreateClanButton(ui.View):
             return
         
         # Проверяем баланс
-        account = get_or_create_account(interaction.user.id, interaction.guild.id)
+        account = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         cash = account[0]  # Первый элемент кортежа - cash
         if cash < settings.CLAN_CREATE_COST:
             embed = create_embed(
@@ -409,7 +418,7 @@ class ClanEmojiModal(ui.Modal, title="Изменить эмодзи клана")
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -440,7 +449,7 @@ class ClanEmojiModal(ui.Modal, title="Изменить эмодзи клана")
                 conversion_note = f"\n💡 `{self.emoji.value}` → {new_emoji}"
             
             # Обновляем эмодзи в базе данных
-            update_clan_info(self.clan_id, emoji=new_emoji)
+            await run_db(update_clan_info, self.clan_id, emoji=new_emoji)
             logging.info(f"✅ Эмодзи обновлена в БД для клана {self.clan_id}")
             
             # Обновляем названия каналов с задержками
@@ -455,7 +464,7 @@ class ClanEmojiModal(ui.Modal, title="Изменить эмодзи клана")
                 await asyncio.sleep(1)  # Задержка для избежания rate limit
             
             # Обновляем все голосовые каналы с нумерацией 1, 2, 3...
-            voice_channels = get_clan_voice_channels(self.clan_id)
+            voice_channels = await run_db(get_clan_voice_channels, self.clan_id)
             user_limit = clan['max_members']
             
             for i, channel_id in enumerate(voice_channels):
@@ -501,7 +510,7 @@ class ClanDeputyModal(ui.Modal, title="Назначить заместителя
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -552,7 +561,7 @@ class ClanDeputyModal(ui.Modal, title="Назначить заместителя
                 return
             
             # Проверяем, что пользователь состоит в клане
-            member_role = get_clan_member_role(self.clan_id, user_id)
+            member_role = await run_db(get_clan_member_role, self.clan_id, user_id)
             if not member_role:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -573,7 +582,7 @@ class ClanDeputyModal(ui.Modal, title="Назначить заместителя
                 return
             
             # Назначаем заместителя
-            update_clan_member_role(self.clan_id, user_id, 'deputy')
+            await run_db(update_clan_member_role, self.clan_id, user_id, 'deputy')
             
             embed = create_embed(
                 title="✅ Заместитель назначен",
@@ -629,7 +638,7 @@ class ClanKickModal(ui.Modal, title="Исключить участника"):
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -680,7 +689,7 @@ class ClanKickModal(ui.Modal, title="Исключить участника"):
                 return
             
             # Проверяем, что пользователь состоит в клане
-            member_role = get_clan_member_role(self.clan_id, user_id)
+            member_role = await run_db(get_clan_member_role, self.clan_id, user_id)
             if not member_role:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -691,7 +700,7 @@ class ClanKickModal(ui.Modal, title="Исключить участника"):
                 return
             
             # Исключаем пользователя из клана
-            remove_clan_member(self.clan_id, user_id)
+            await run_db(remove_clan_member, self.clan_id, user_id)
             
             # Убираем роль клана
             try:
@@ -775,7 +784,7 @@ class ClanManagementModal(ui.Modal, title="Управление кланом"):
     )
     
     async def on_submit(self, interaction: discord.Interaction):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -799,7 +808,7 @@ class ClanManagementModal(ui.Modal, title="Управление кланом"):
         
         if self.name.value and self.name.value != clan['name']:
             # Проверяем, что название не занято
-            existing_clan = get_clan_by_name(self.name.value)
+            existing_clan = await run_db(get_clan_by_name, self.name.value)
             if existing_clan and existing_clan['id'] != self.clan_id:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -832,7 +841,7 @@ class ClanManagementModal(ui.Modal, title="Управление кланом"):
         
         if updates:
             # Обновляем в базе данных
-            update_clan_info(
+            await run_db(update_clan_info,
                 self.clan_id,
                 name=updates.get('name'),
                 description=updates.get('description'),
@@ -865,7 +874,7 @@ class ClanManagementModal(ui.Modal, title="Управление кланом"):
                     await asyncio.sleep(1)  # Задержка для избежания rate limit
                 
                 # Обновляем все голосовые каналы с нумерацией 1, 2, 3...
-                voice_channels = get_clan_voice_channels(self.clan_id)
+                voice_channels = await run_db(get_clan_voice_channels, self.clan_id)
                 user_limit = clan['max_members']
                 
                 for i, channel_id in enumerate(voice_channels):
@@ -899,7 +908,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="✏️")
     async def edit_info(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -928,7 +937,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="👥")
     async def manage_members(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -939,7 +948,7 @@ class ClanManagementView(ui.View):
             return
         
         # Получаем список участников
-        members = get_clan_members(self.clan_id)
+        members = await run_db(get_clan_members, self.clan_id)
         
         embed = create_embed(
             title=f"👥 Участники клана {clan['name']}",
@@ -969,7 +978,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="📈")
     async def buy_slots(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -990,7 +999,7 @@ class ClanManagementView(ui.View):
             return
         
         # Проверяем баланс
-        account = get_or_create_account(interaction.user.id, interaction.guild.id)
+        account = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         cash = account[0]  # Первый элемент кортежа - cash
         if cash < settings.CLAN_MEMBER_SLOT_COST:
             embed = create_embed(
@@ -1021,7 +1030,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="🔊")
     async def buy_voice_channel(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1061,7 +1070,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="😀")
     async def change_emoji(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1077,7 +1086,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="👤")
     async def assign_deputy(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1093,7 +1102,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="🚫")
     async def kick_member(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1109,7 +1118,7 @@ class ClanManagementView(ui.View):
     
     @ui.button(style=discord.ButtonStyle.secondary, emoji="💳")
     async def payment_info(self, interaction: discord.Interaction, button: ui.Button):
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan or clan['owner_id'] != interaction.user.id:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1157,7 +1166,7 @@ class PaymentConfirmationView(ui.View):
     @ui.button(label="Оплатить", style=discord.ButtonStyle.success, emoji="✅")
     async def confirm_payment(self, interaction: discord.Interaction, button: ui.Button):
         # Проверяем баланс
-        account = get_or_create_account(interaction.user.id, interaction.guild.id)
+        account = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         cash = account[0]
         
         if cash < self.cost:
@@ -1171,16 +1180,26 @@ class PaymentConfirmationView(ui.View):
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
         
+        # Проверка и списание одним UPDATE: параллельная трата не уведёт баланс в минус
+        if not await run_db(spend_cash, interaction.user.id, interaction.guild.id, self.cost, kind='clan', ref=str(self.clan_id)):
+            embed = create_embed(
+                title="❌ Недостаточно средств",
+                description=f"У вас недостаточно средств для покупки!\n"
+                           f"💰 Нужно: {self.cost} {settings.ECONOMY_SYMBOL}",
+                color=EmbedColors.ERROR
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+        
         try:
             if self.purchase_type == "slots":
                 # Покупаем слоты
-                add_cash(interaction.user.id, interaction.guild.id, -self.cost)
-                clan = get_clan_by_id(self.clan_id)
+                clan = await run_db(get_clan_by_id, self.clan_id)
                 new_max_members = min(clan['max_members'] + 10, settings.CLAN_MAX_MEMBER_SLOTS)
-                update_clan_max_members(self.clan_id, new_max_members)
+                await run_db(update_clan_max_members, self.clan_id, new_max_members)
                 
                 # Обновляем лимит участников во всех голосовых каналах
-                voice_channels = get_clan_voice_channels(self.clan_id)
+                voice_channels = await run_db(get_clan_voice_channels, self.clan_id)
                 for channel_id in voice_channels:
                     channel = interaction.guild.get_channel(channel_id)
                     if channel:
@@ -1198,8 +1217,7 @@ class PaymentConfirmationView(ui.View):
                 
             elif self.purchase_type == "voice":
                 # Покупаем голосовой канал
-                add_cash(interaction.user.id, interaction.guild.id, -self.cost)
-                clan = get_clan_by_id(self.clan_id)
+                clan = await run_db(get_clan_by_id, self.clan_id)
                 
                 # Создаем голосовой канал
                 voice_category = interaction.guild.get_channel(settings.CLAN_VOICE_CATEGORY_ID)
@@ -1230,7 +1248,7 @@ class PaymentConfirmationView(ui.View):
                     await voice_channel.set_permissions(role, connect=True, speak=True)
                 
                 # Добавляем в базу данных
-                add_clan_voice_channel(self.clan_id, voice_channel.id)
+                await run_db(add_clan_voice_channel, self.clan_id, voice_channel.id)
                 
                 embed = create_embed(
                     title="✅ Голосовой канал создан",
@@ -1272,7 +1290,7 @@ class ClanInviteView(ui.View):
     @ui.button(label="Принять", style=discord.ButtonStyle.success, emoji="✅")
     async def accept_invite(self, interaction: discord.Interaction, button: ui.Button):
         # Проверяем, что пользователь не в клане
-        user_clan = check_user_in_clan(interaction.user, interaction.guild)
+        user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
         if user_clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1283,7 +1301,7 @@ class ClanInviteView(ui.View):
             return
         
         # Получаем информацию о клане
-        clan = get_clan_by_id(self.clan_id)
+        clan = await run_db(get_clan_by_id, self.clan_id)
         if not clan:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1294,7 +1312,7 @@ class ClanInviteView(ui.View):
             return
         
         # Проверяем лимит участников
-        members = get_clan_members(self.clan_id)
+        members = await run_db(get_clan_members, self.clan_id)
         if len(members) >= clan['max_members']:
             embed = create_embed(
                 title="❌ Ошибка",
@@ -1316,7 +1334,7 @@ class ClanInviteView(ui.View):
                 await interaction.response.send_message(embed=embed, ephemeral=True)
                 return
             
-            member = guild.get_member(interaction.user.id)
+            member = await member_resolver.get(guild, interaction.user.id)
             if not member:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -1327,7 +1345,7 @@ class ClanInviteView(ui.View):
                 return
             
             # Добавляем в базу данных
-            if add_clan_member(self.clan_id, interaction.user.id, 'member'):
+            if await run_db(add_clan_member, self.clan_id, interaction.user.id, 'member'):
                 # Выдаем роль клана
                 role = guild.get_role(clan['role_id'])
                 if role:
@@ -1437,10 +1455,11 @@ class Clans(commands.Cog):
 
     async def cog_load(self):
         """Инициализация при загрузке кога"""
-        init_clans_db()
+        ensure_schema(DB_PATH)
         self.clan_payment_task.start()
-        await self.setup_info_channel()
-        await self.sync_clan_members()
+        # Каналу и участникам нужен кэш серверов — после on_ready, не задерживая запуск
+        startup.defer("clans.info_channel", self.setup_info_channel)
+        startup.defer("clans.sync_members", self.sync_clan_members)
     
     async def cog_unload(self):
         """Очистка при выгрузке кога"""
@@ -1451,23 +1470,25 @@ class Clans(commands.Cog):
         """Синхронизация участников кланов с ролями Discord"""
         logging.info("🔄 Начинаем синхронизацию участников кланов...")
         
-        all_clans = get_all_clans()
+        all_clans = await run_db(get_all_clans)
         synced_count = 0
         
         # Получаем все гильдии бота
         for guild in self.bot.guilds:
+            # Участники сервера запрашиваются один раз, если не загружены при старте
+            guild_members = await member_resolver.all_members(guild)
             for clan in all_clans:
                 role = guild.get_role(clan['role_id'])
                 if not role:
                     continue
                 
                 # Получаем всех участников с этой ролью
-                for member in guild.members:
+                for member in guild_members:
                     if role in member.roles:
                         # Проверяем, есть ли запись в БД
-                        if not get_user_clan(member.id):
+                        if not await run_db(get_user_clan, member.id):
                             # Добавляем в БД
-                            add_clan_member(clan['id'], member.id, 'member')
+                            await run_db(add_clan_member, clan['id'], member.id, 'member')
                             synced_count += 1
                             logging.info(f"✅ Синхронизирован участник {member.name} ({member.id}) в клан {clan['name']}")
         
@@ -1521,7 +1542,7 @@ class Clans(commands.Cog):
         
         try:
             # Получаем список всех кланов
-            clans = get_all_clans()
+            clans = await run_db(get_all_clans)
             
             embed = create_embed(
                 title="🏰 Система кланов",
@@ -1589,10 +1610,29 @@ class Clans(commands.Cog):
         except Exception as e:
             logging.error(f"Ошибка при обновлении информационного сообщения кланов: {e}")
     
+    @staticmethod
+    def _charge_clan_payment(clan_id: int, owner_id: int, guild_id: int) -> bool:
+        """
+        Списывает ежемесячную плату и отмечает оплату клана. В режиме одного файла —
+        одной транзакцией, иначе деньги и отметка фиксируются по очереди
+        """
+        if not engine.shares_file(ECONOMY_DB_PATH, DB_PATH):
+            if not spend_cash(owner_id, guild_id, settings.CLAN_MONTHLY_COST, kind='clan', ref=str(clan_id)):
+                return False
+            update_clan_payment(clan_id)
+            return True
+        try:
+            with engine.transaction(ECONOMY_DB_PATH, DB_PATH) as conn:
+                spend_cash(owner_id, guild_id, settings.CLAN_MONTHLY_COST, kind='clan', ref=str(clan_id), conn=conn)
+                update_clan_payment(clan_id, conn=conn)
+            return True
+        except InsufficientFunds:
+            return False
+
     @tasks.loop(hours=24)
     async def clan_payment_task(self):
         """Ежедневная проверка и списание оплаты за кланы"""
-        clans_for_payment = get_clans_for_payment()
+        clans_for_payment = await run_db(get_clans_for_payment)
         
         for clan in clans_for_payment:
             try:
@@ -1613,14 +1653,11 @@ class Clans(commands.Cog):
                     logging.warning(f"Не удалось определить guild_id для клана {clan['id']}, пропускаем оплату")
                     continue
 
-                account = get_or_create_account(owner.id, guild_id)
+                account = await run_db(get_or_create_account, owner.id, guild_id)
                 cash = account[0]  # Первый элемент кортежа - cash
-                if cash >= settings.CLAN_MONTHLY_COST:
-                    # Списываем деньги
-                    add_cash(owner.id, guild_id, -settings.CLAN_MONTHLY_COST)
-                    update_clan_payment(clan['id'])
-
-                    updated_clan = get_clan_by_id(clan['id']) or clan
+                # Списываем деньги, только если их хватает
+                if cash >= settings.CLAN_MONTHLY_COST and await run_db(self._charge_clan_payment, clan['id'], owner.id, guild_id):
+                    updated_clan = await run_db(get_clan_by_id, clan['id']) or clan
                     payment_time = format_discord_timestamp(updated_clan.get('last_payment'), "только что")
 
                     logging.info(f"Списана оплата за клан {clan['name']} (ID: {clan['id']})")
@@ -1640,7 +1677,7 @@ class Clans(commands.Cog):
                         logging.warning(f"Не удалось отправить уведомление владельцу {owner} о платеже")
                 else:
                     # Недостаточно средств - деактивируем клан
-                    deactivate_clan(clan['id'])
+                    await run_db(deactivate_clan, clan['id'])
                     
                     # Уведомляем владельца
                     embed = create_embed(
@@ -1667,7 +1704,7 @@ class Clans(commands.Cog):
     @app_commands.command(name="clan", description="Управление кланом")
     async def clan_command(self, interaction: discord.Interaction):
         """Основная команда для управления кланом"""
-        user_clan = check_user_in_clan(interaction.user, interaction.guild)
+        user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
         
         if not user_clan:
             embed = create_embed(
@@ -1679,7 +1716,7 @@ class Clans(commands.Cog):
             return
         
         # Получаем информацию о клане
-        members = get_clan_members(user_clan['id'])
+        members = await run_db(get_clan_members, user_clan['id'])
         owner = self.bot.get_user(user_clan['owner_id'])
         
         embed = create_embed(
@@ -1732,7 +1769,7 @@ class Clans(commands.Cog):
     @app_commands.command(name="clan_manage", description="Панель управления кланом (только для владельцев)")
     async def clan_manage_command(self, interaction: discord.Interaction):
         """Команда для доступа к панели управления кланом"""
-        user_clan = check_user_in_clan(interaction.user, interaction.guild)
+        user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
         
         if not user_clan:
             embed = create_embed(
@@ -1753,7 +1790,7 @@ class Clans(commands.Cog):
             return
         
         # Создаем эмбед с информацией о клане
-        members = get_clan_members(user_clan['id'])
+        members = await run_db(get_clan_members, user_clan['id'])
         
         embed = create_embed(
             title=f"🏰 Панель управления кланом {user_clan['name']}",
@@ -1830,7 +1867,7 @@ class Clans(commands.Cog):
     async def clan_id_command(self, interaction: discord.Interaction):
         """Команда для получения ID клана пользователя"""
         try:
-            user_clan = check_user_in_clan(interaction.user, interaction.guild)
+            user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
             
             if not user_clan:
                 embed = create_embed(
@@ -1866,7 +1903,7 @@ class Clans(commands.Cog):
         """Команда для приглашения игрока в клан"""
         try:
             # Проверяем, что пользователь состоит в клане
-            user_clan = check_user_in_clan(interaction.user, interaction.guild)
+            user_clan = await run_db(check_user_in_clan, interaction.user, interaction.guild)
             if not user_clan:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -1877,7 +1914,7 @@ class Clans(commands.Cog):
                 return
             
             # Проверяем, что пользователь - владелец или заместитель клана
-            user_role = get_clan_member_role(user_clan['id'], interaction.user.id)
+            user_role = await run_db(get_clan_member_role, user_clan['id'], interaction.user.id)
             if user_role not in ['owner', 'deputy']:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -1898,7 +1935,7 @@ class Clans(commands.Cog):
                 return
             
             # Проверяем, что приглашаемый игрок не состоит в клане
-            member_clan = check_user_in_clan(member, interaction.guild)
+            member_clan = await run_db(check_user_in_clan, member, interaction.guild)
             if member_clan:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -1909,7 +1946,7 @@ class Clans(commands.Cog):
                 return
             
             # Проверяем лимит участников
-            members = get_clan_members(user_clan['id'])
+            members = await run_db(get_clan_members, user_clan['id'])
             if len(members) >= user_clan['max_members']:
                 embed = create_embed(
                     title="❌ Ошибка",
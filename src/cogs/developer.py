@@ -7,6 +7,7 @@ from discord import app_commands
 from src.core.config import settings
 from src.database.economy import get_cooldowns, set_cooldown, get_or_create_account, get_notifications_enabled
 from src.utils.embed import create_embed, EmbedColors
+from src.servies.loop_monitor import loop_monitor
 from src.database.clans import (
     init_clans_db,
     get_clan_by_id,
@@ -17,8 +18,9 @@ from src.database.clans import (
     get_all_clans,
     deactivate_clan,
     get_clan_voice_channels,
-    get_connection
+    update_clan_owner,
 )
+from src.database.engine import run_db
 import time
 import logging
 
@@ -44,7 +46,7 @@ class DeveloperCog(commands.Cog):
         """Отправляет уведомление пользователю о готовности команды"""
         try:
             # Проверяем, включены ли уведомления у пользователя
-            if not get_notifications_enabled(member.id, guild.id):
+            if not await run_db(get_notifications_enabled, member.id, guild.id):
                 return
             
             # Создаем embed уведомления
@@ -71,10 +73,10 @@ class DeveloperCog(commands.Cog):
             return
         
         # Сбрасываем все кулдауны
-        set_cooldown(member.id, interaction.guild.id, 'daily_cd', 0)
-        set_cooldown(member.id, interaction.guild.id, 'work_cd', 0)
-        set_cooldown(member.id, interaction.guild.id, 'weekly_cd', 0)
-        set_cooldown(member.id, interaction.guild.id, 'rob_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'daily_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'work_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'weekly_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'rob_cd', 0)
         
         # Отправляем уведомления для всех команд
         await self._send_notification(member, "daily", interaction.guild)
@@ -90,7 +92,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
             return
         
-        set_cooldown(member.id, interaction.guild.id, 'daily_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'daily_cd', 0)
         
         # Отправляем уведомление пользователю
         await self._send_notification(member, "daily", interaction.guild)
@@ -104,7 +106,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
             return
         
-        set_cooldown(member.id, interaction.guild.id, 'work_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'work_cd', 0)
         
         # Отправляем уведомление пользователю
         await self._send_notification(member, "work", interaction.guild)
@@ -118,7 +120,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
             return
         
-        set_cooldown(member.id, interaction.guild.id, 'weekly_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'weekly_cd', 0)
         
         # Отправляем уведомление пользователю
         await self._send_notification(member, "weekly", interaction.guild)
@@ -132,7 +134,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
             return
         
-        set_cooldown(member.id, interaction.guild.id, 'rob_cd', 0)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'rob_cd', 0)
         await interaction.response.send_message(f"✅ Кулдаун rob для {member.mention} сброшен.", ephemeral=False)
     
     @app_commands.command(name="check_cooldowns", description="Проверить кулдауны пользователя")
@@ -142,7 +144,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
             return
         
-        cds = get_cooldowns(member.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, member.id, interaction.guild.id)
         now = int(time.time())
         
         if not cds:
@@ -188,17 +190,17 @@ class DeveloperCog(commands.Cog):
             return
         
         # Создаем аккаунт если не существует
-        get_or_create_account(member.id, interaction.guild.id)
+        await run_db(get_or_create_account, member.id, interaction.guild.id)
         
         # Начисляем daily
         from src.database.economy import add_bank
         daily_amount = getattr(settings, 'ECONOMY_DAILY_AMOUNT', 250)
-        add_bank(member.id, interaction.guild.id, daily_amount)
+        add_bank(member.id, interaction.guild.id, daily_amount, kind='admin')
         
         # Устанавливаем кулдаун
         daily_cd_sec = getattr(settings, 'ECONOMY_DAILY_COOLDOWN_SECONDS', 86400)
         next_time = int(time.time() + daily_cd_sec)
-        set_cooldown(member.id, interaction.guild.id, 'daily_cd', next_time)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'daily_cd', next_time)
         
         await interaction.response.send_message(f"✅ Daily выполнен для {member.mention}. Начислено: {daily_amount}💰", ephemeral=False)
     
@@ -210,17 +212,17 @@ class DeveloperCog(commands.Cog):
             return
         
         # Создаем аккаунт если не существует
-        get_or_create_account(member.id, interaction.guild.id)
+        await run_db(get_or_create_account, member.id, interaction.guild.id)
         
         # Начисляем work
         from src.database.economy import add_bank
         work_amount = getattr(settings, 'ECONOMY_WORK_AMOUNT', 150)
-        add_bank(member.id, interaction.guild.id, work_amount)
+        add_bank(member.id, interaction.guild.id, work_amount, kind='admin')
         
         # Устанавливаем кулдаун
         work_cd_sec = getattr(settings, 'ECONOMY_WORK_COOLDOWN_SECONDS', 3600)
         next_time = int(time.time() + work_cd_sec)
-        set_cooldown(member.id, interaction.guild.id, 'work_cd', next_time)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'work_cd', next_time)
         
         await interaction.response.send_message(f"✅ Work выполнен для {member.mention}. Начислено: {work_amount}💰", ephemeral=False)
     
@@ -232,17 +234,17 @@ class DeveloperCog(commands.Cog):
             return
         
         # Создаем аккаунт если не существует
-        get_or_create_account(member.id, interaction.guild.id)
+        await run_db(get_or_create_account, member.id, interaction.guild.id)
         
         # Начисляем weekly
         from src.database.economy import add_bank
         weekly_amount = getattr(settings, 'ECONOMY_WEEKLY_AMOUNT', 1000)
-        add_bank(member.id, interaction.guild.id, weekly_amount)
+        add_bank(member.id, interaction.guild.id, weekly_amount, kind='admin')
         
         # Устанавливаем кулдаун
         weekly_cd_sec = getattr(settings, 'ECONOMY_WEEKLY_COOLDOWN_SECONDS', 604800)
         next_time = int(time.time() + weekly_cd_sec)
-        set_cooldown(member.id, interaction.guild.id, 'weekly_cd', next_time)
+        await run_db(set_cooldown, member.id, interaction.guild.id, 'weekly_cd', next_time)
         
         await interaction.response.send_message(f"✅ Weekly выполнен для {member.mention}. Начислено: {weekly_amount}💰", ephemeral=False)
     
@@ -298,6 +300,38 @@ class DeveloperCog(commands.Cog):
         )
         
         await interaction.response.send_message(embed=embed, ephemeral=False)
+
+    @app_commands.command(name="dev_loop", description="Места в коде, блокирующие цикл событий")
+    @app_commands.describe(reset="Очистить статистику после показа")
+    async def dev_loop(self, interaction: discord.Interaction, reset: bool = False):
+        """Показывает топ блокировок цикла событий со стеком самой затратной"""
+        if not self._is_developer(interaction.user):
+            await interaction.response.send_message("❌ Нет доступа к командам разработчика.", ephemeral=True)
+            return
+
+        stats = loop_monitor.stats()
+        embed = discord.Embed(
+            title="🐢 Блокировки цикла событий",
+            description=(
+                f"**Задержка сейчас:** {stats['last'] * 1000:.1f} мс\n"
+                f"**Максимум за ~10 с:** {stats['recent_max'] * 1000:.1f} мс\n"
+                f"**Блокировок дольше {loop_monitor.stall_threshold:.2f} с:** {stats['stalls']}"
+            ),
+            color=discord.Color.orange()
+        )
+        offenders = loop_monitor.top_offenders(5)
+        for o in offenders:
+            embed.add_field(
+                name=f"{o.total:.2f} с • {o.stalls} раз • макс {o.max:.2f} с",
+                value=f"`{o.site}`\nЗадача: `{o.task or '?'}`",
+                inline=False
+            )
+        if offenders:
+            # Стек самого затратного места; лимит поля embed — 1024 символа
+            embed.add_field(name="Стек", value=f"```{offenders[0].stack[-1000:]}```", inline=False)
+        if reset:
+            loop_monitor.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
     
     @commands.command(name="help_developer")
     async def help_developer(self, ctx):
@@ -468,7 +502,7 @@ class DeveloperCog(commands.Cog):
         """Команда для создания информационного сообщения в текущем канале"""
         try:
             # Получаем список всех кланов
-            clans = get_all_clans()
+            clans = await run_db(get_all_clans)
             
             # Импортируем CreateClanButton из clans
             from src.cogs.clans import CreateClanButton
@@ -546,7 +580,7 @@ class DeveloperCog(commands.Cog):
         """Команда для миграции базы данных кланов"""
         try:
             # Принудительно инициализируем базу данных
-            init_clans_db()
+            await run_db(init_clans_db)
             
             embed = create_embed(
                 title="✅ Миграция завершена",
@@ -571,7 +605,7 @@ class DeveloperCog(commands.Cog):
     async def clan_fix_owner_command(self, interaction: discord.Interaction, clan_id: int):
         """Команда для исправления владельца клана"""
         try:
-            clan = get_clan_by_id(clan_id)
+            clan = await run_db(get_clan_by_id, clan_id)
             if not clan:
                 embed = create_embed(
                     title="❌ Клан не найден",
@@ -582,11 +616,11 @@ class DeveloperCog(commands.Cog):
                 return
             
             # Добавляем владельца как участника если его нет
-            members = get_clan_members(clan_id)
+            members = await run_db(get_clan_members, clan_id)
             owner_found = any(member['user_id'] == clan['owner_id'] for member in members)
             
             if not owner_found:
-                add_clan_member(clan_id, clan['owner_id'], 'owner')
+                await run_db(add_clan_member, clan_id, clan['owner_id'], 'owner')
                 embed = create_embed(
                     title="✅ Владелец исправлен",
                     description=f"Владелец клана **{clan['name']}** добавлен как участник.",
@@ -617,7 +651,7 @@ class DeveloperCog(commands.Cog):
         """Команда для принудительного обновления владельца клана"""
         try:
             # Проверяем, что клан существует
-            clan = get_clan_by_id(clan_id)
+            clan = await run_db(get_clan_by_id, clan_id)
             if not clan:
                 embed = create_embed(
                     title="❌ Клан не найден",
@@ -628,22 +662,11 @@ class DeveloperCog(commands.Cog):
                 return
             
             # Принудительно обновляем владельца
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Прямое обновление
-            cursor.execute("""
-                UPDATE clans SET owner_id = ? WHERE id = ?
-            """, (new_owner_id, clan_id))
-            
-            rows_affected = cursor.rowcount
-            logging.info(f"Принудительно обновлено строк: {rows_affected}")
-            
-            conn.commit()
-            conn.close()
+            updated = await run_db(update_clan_owner, clan_id, new_owner_id)
+            logging.info(f"Принудительно обновлено строк: {int(updated)}")
             
             # Проверяем результат
-            updated_clan = get_clan_by_id(clan_id)
+            updated_clan = await run_db(get_clan_by_id, clan_id)
             if updated_clan and updated_clan['owner_id'] == new_owner_id:
                 embed = create_embed(
                     title="✅ Владелец обновлен",
@@ -674,7 +697,7 @@ class DeveloperCog(commands.Cog):
     async def clan_change_owner_command(self, interaction: discord.Interaction, clan_id: int, new_owner: discord.Member):
         """Команда для изменения владельца клана"""
         try:
-            clan = get_clan_by_id(clan_id)
+            clan = await run_db(get_clan_by_id, clan_id)
             if not clan:
                 embed = create_embed(
                     title="❌ Клан не найден",
@@ -685,7 +708,7 @@ class DeveloperCog(commands.Cog):
                 return
             
             # Проверяем, что новый владелец не состоит в другом клане
-            user_clan = get_user_clan(new_owner.id)
+            user_clan = await run_db(get_user_clan, new_owner.id)
             if user_clan and user_clan['id'] != clan_id:
                 embed = create_embed(
                     title="❌ Ошибка",
@@ -696,47 +719,26 @@ class DeveloperCog(commands.Cog):
                 return
             
             # Обновляем владельца в базе данных
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Проверяем, что клан существует
-            cursor.execute("SELECT id, owner_id FROM clans WHERE id = ?", (clan_id,))
-            result = cursor.fetchone()
-            if not result:
+            logging.info(f"Текущий владелец в базе: {clan['owner_id']}")
+            if not await run_db(update_clan_owner, clan_id, new_owner.id):
                 logging.error(f"Клан {clan_id} не найден в базе данных")
-                conn.close()
                 return
             
-            result_dict = dict(result)
-            logging.info(f"Текущий владелец в базе: {result_dict.get('owner_id')}")
-            
-            # Выполняем обновление
-            cursor.execute("""
-                UPDATE clans SET owner_id = ? WHERE id = ?
-            """, (new_owner.id, clan_id))
-            
-            # Проверяем количество измененных строк
-            rows_affected = cursor.rowcount
-            logging.info(f"Обновлено строк: {rows_affected}")
-            
-            conn.commit()
-            conn.close()
-            
             # Отладочная информация
             logging.info(f"Владелец клана {clan_id} изменен с {clan['owner_id']} на {new_owner.id}")
             
             # Проверяем, что обновление прошло успешно
-            updated_clan = get_clan_by_id(clan_id)
+            updated_clan = await run_db(get_clan_by_id, clan_id)
             if updated_clan:
                 logging.info(f"Новый владелец в базе: {updated_clan['owner_id']}")
             else:
                 logging.error(f"Не удалось получить обновленный клан {clan_id}")
             
             # Удаляем старого владельца из участников
-            remove_clan_member(clan_id, clan['owner_id'])
+            await run_db(remove_clan_member, clan_id, clan['owner_id'])
             
             # Добавляем нового владельца как участника
-            add_clan_member(clan_id, new_owner.id, 'owner')
+            await run_db(add_clan_member, clan_id, new_owner.id, 'owner')
             
             # Даем роль клана новому владельцу
             role = interaction.guild.get_role(clan['role_id'])
@@ -772,7 +774,7 @@ class DeveloperCog(commands.Cog):
         try:
             await interaction.response.defer(ephemeral=True)
             
-            clan = get_clan_by_id(clan_id)
+            clan = await run_db(get_clan_by_id, clan_id)
             if not clan:
                 embed = create_embed(
                     title="❌ Клан не найден",
@@ -797,7 +799,7 @@ class DeveloperCog(commands.Cog):
                 logging.error("У бота нет прав на управление каналами!")
             
             # Получаем всех участников клана
-            members = get_clan_members(clan_id)
+            members = await run_db(get_clan_members, clan_id)
             logging.info(f"Найдено участников клана: {len(members)}")
             
             # Удаляем роль клана у всех участников
@@ -861,7 +863,7 @@ class DeveloperCog(commands.Cog):
                 logging.warning(f"Основной голосовой канал с ID {clan['voice_channel_id']} не найден!")
             
             # Удаляем дополнительные голосовые каналы
-            voice_channels = get_clan_voice_channels(clan_id)
+            voice_channels = await run_db(get_clan_voice_channels, clan_id)
             logging.info(f"Найдено дополнительных голосовых каналов: {len(voice_channels)}")
             for channel_id in voice_channels:
                 channel = interaction.guild.get_channel(channel_id)
@@ -877,7 +879,7 @@ class DeveloperCog(commands.Cog):
                     logging.warning(f"Дополнительный голосовой канал с ID {channel_id} не найден!")
             
             # Деактивируем клан в базе данных
-            deactivate_clan(clan_id)
+            await run_db(deactivate_clan, clan_id)
             
             embed = create_embed(
                 title="✅ Клан удален",
@@ -906,7 +908,7 @@ class DeveloperCog(commands.Cog):
             await interaction.response.defer(ephemeral=True)
             
             # Получаем все кланы
-            clans = get_all_clans()
+            clans = await run_db(get_all_clans)
             fixed_count = 0
             
             for clan in clans:
@@ -928,7 +930,7 @@ class DeveloperCog(commands.Cog):
                     logging.warning(f"Основной голосовой канал клана {clan['name']} не найден (ID: {clan['voice_channel_id']})")
                 
                 # Проверяем дополнительные голосовые каналы
-                voice_channels = get_clan_voice_channels(clan['id'])
+                voice_channels = await run_db(get_clan_voice_channels, clan['id'])
                 for channel_id in voice_channels:
                     channel = interaction.guild.get_channel(channel_id)
                     if not channel:
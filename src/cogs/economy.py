@@ -1,59 +1,75 @@
 import random
 import time
 import asyncio
+import logging
 from datetime import datetime, timedelta
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands, ui
 from src.utils.embed import create_embed, EmbedColors
+from src.utils.members import member_resolver
 from src.core.config import settings
 from src.database.economy import (
-    init_economy_db,
     get_or_create_account,
     add_cash,
     add_bank,
+    spend_bank,
     transfer_cash_to_bank,
     transfer_bank_to_cash,
     get_cooldowns,
     set_cooldown,
     set_arrest,
     get_rob_stats,
-    inc_robbery_stat,
-    add_voice_seconds,
-    get_top_by_balance,
-    get_top_by_level,
-    get_top_by_voice,
-    get_top_by_robberies,
-    get_rank_by_balance,
-    get_rank_by_level,
-    get_rank_by_voice,
-    get_rank_by_robberies,
+    rob_success,
+    rob_fail,
     get_shop_items,
     purchase_shop_item,
     add_custom_role_request,
     set_request_status,
     get_request,
     add_owned_custom_role,
+    remove_owned_custom_role,
     get_market_items,
     purchase_market_item,
     get_owned_custom_roles,
+    get_role_listing,
     create_role_listing,
     update_role_listing,
     remove_role_listing,
-    add_xp,
     set_temp_role,
-    get_expired_temp_roles,
+    get_temp_roles,
     remove_temp_roles,
     cleanup_invalid_listings,
     add_shop_role,
 )
 from src.database.clans import get_top_clans_by_members
-from src.servies import MessageCounterService, ExperienceService
+from src.database.engine import run_db
+from src.database.ledger import Leg, transfer
+from src.database.economy import DB_PATH as ECONOMY_DB_PATH
+from src.database.migrations import ensure_schema
+from src.database.repository import overlay_activity
+from src.servies import ExperienceService, activity_buffer, leaderboards, voice_sessions, voice_router, xp_limiter
+from src.servies.voice_router import CHANNEL_CHANGES, MUTE, VoiceTransition
+from src.servies.scheduler import scheduler, utc_naive_to_epoch
 
 
 MONEY = getattr(settings, 'ECONOMY_SYMBOL', '💰')
 
 
+async def _grant_temp_role(user_id: int, guild_id: int, role_id: int, duration: float):
+    """Сохраняет временную роль и ставит её снятие в планировщик"""
+    await run_db(set_temp_role, user_id, guild_id, role_id, datetime.utcnow().timestamp() + duration)
+    scheduler.schedule("temp_role", f"{guild_id}:{user_id}:{role_id}", time.time() + duration)
+
+
+def _charge_case(user_id: int, guild_id: int, name: str, price: int, reward: dict) -> bool:
+    """Списывает цену кейса и зачисляет денежную награду одной транзакцией"""
+    legs = [Leg(user_id, bank=-price)]
+    if reward.get('type') == 'money':
+        legs.append(Leg(user_id, bank=int(reward.get('amount', 0))))
+    return transfer(guild_id, 'case', legs, ref=name)
+
+
 class AmountModal(ui.Modal, title="Введите сумму"):
     amount = ui.TextInput(label="Сумма", required=True, placeholder="1000")
 
@@ -69,24 +85,26 @@ class AmountModal(ui.Modal, title="Введите сумму"):
             await interaction.response.send_message("❌ Некорректная сумма", ephemeral=False)
             return
 
-        get_or_create_account(interaction.user.id, interaction.guild.id)
+        await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
 
         if self.action == 'deposit':
-            ok = transfer_cash_to_bank(interaction.user.id, interaction.guild.id, amount)
+            ok = await run_db(transfer_cash_to_bank, interaction.user.id, interaction.guild.id, amount)
             if ok:
                 # Создаем новый view с обновленным эмбедом
                 view = BalanceButtons(interaction.guild, interaction.user, interaction.user)
-                updated_embed = view._build_balance_embed()
+                await view._update_button_states()
+                updated_embed = await view._build_balance_embed()
                 await interaction.response.edit_message(embed=updated_embed, view=view)
                 await interaction.followup.send("✅ Депозит выполнен.", ephemeral=True)
             else:
                 await interaction.response.send_message("❌ Недостаточно наличных.", ephemeral=True)
         else:
-            ok = transfer_bank_to_cash(interaction.user.id, interaction.guild.id, amount)
+            ok = await run_db(transfer_bank_to_cash, interaction.user.id, interaction.guild.id, amount)
             if ok:
                 # Создаем новый view с обновленным эмбедом
                 view = BalanceButtons(interaction.guild, interaction.user, interaction.user)
-                updated_embed = view._build_balance_embed()
+                await view._update_button_states()
+                updated_embed = await view._build_balance_embed()
                 await interaction.response.edit_message(embed=updated_embed, view=view)
                 await interaction.followup.send("✅ Снятие выполнено.", ephemeral=True)
             else:
@@ -100,10 +118,9 @@ class BalanceButtons(ui.View):
         self.author = author
         self.target = target
         self.show_rob_info_only = show_rob_info_only
-        self._update_button_states()
     
-    def _update_button_states(self):
-        """Обновляет состояние кнопок на основе кулдаунов"""
+    async def _update_button_states(self):
+        """Обновляет состояние кнопок на основе кулдаунов; вызывается после создания view"""
         try:
             # Если показываем только rob_info, скрываем все остальные кнопки
             if self.show_rob_info_only:
@@ -125,11 +142,11 @@ class BalanceButtons(ui.View):
                 for child in self.children:
                     if isinstance(child, ui.Button) and "Уведомления" in (child.label or ""):
                         from src.database.economy import get_notifications_enabled
-                        notifications_enabled = get_notifications_enabled(self.target.id, self.guild.id)
+                        notifications_enabled = await run_db(get_notifications_enabled, self.target.id, self.guild.id)
                         child.label = "🔕 Уведомления ВЫКЛ" if not notifications_enabled else "🔔 Уведомления ВКЛ"
                         break
             
-            cds = get_cooldowns(self.author.id, self.guild.id) or (None, None, None, None, None)
+            cds = await run_db(get_cooldowns, self.author.id, self.guild.id) or (None, None, None, None, None)
             now = int(time.time())
             daily_cd, work_cd, weekly_cd, _, arrest_until = cds
             for child in self.children:
@@ -149,10 +166,11 @@ class BalanceButtons(ui.View):
         except Exception:
             pass
     
-    def _build_balance_embed(self) -> discord.Embed:
+    async def _build_balance_embed(self) -> discord.Embed:
         """Создает обновленный эмбед баланса"""
         user = self.target
-        acc = get_or_create_account(user.id, self.guild.id)
+        acc = await overlay_activity(user.id, self.guild.id, await run_db(get_or_create_account, user.id, self.guild.id))
+        acc = activity_buffer.merge_account(user.id, self.guild.id, voice_sessions.merge_account(user.id, self.guild.id, acc))
         cash, bank = acc[0] or 0, acc[1] or 0
         
         # Voice time
@@ -164,7 +182,7 @@ class BalanceButtons(ui.View):
         xp = acc[4] or 0
         
         # Cooldowns
-        cds = get_cooldowns(self.author.id, self.guild.id)
+        cds = await run_db(get_cooldowns, self.author.id, self.guild.id)
         now = int(time.time())
         def cd_label(ts):
             return "доступно" if not ts or ts <= now else f"доступно <t:{int(ts)}:R>"
@@ -173,7 +191,7 @@ class BalanceButtons(ui.View):
         weekly_label = cd_label(cds[2] if cds else None)
 
         # Получаем XP для следующего уровня
-        next_level_xp = settings.ECONOMY_XP_PER_LEVEL.get(level, level * 100)
+        next_level_xp = ExperienceService.xp_to_next_level(level)
         
         embed = create_embed(
             title=f"Профиль {user.display_name}",
@@ -199,7 +217,7 @@ class BalanceButtons(ui.View):
 
     async def _check_locked(self, interaction: discord.Interaction) -> bool:
         # Arrest blocks actions except viewing balance
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         if cds and cds[-1]:
             if cds[-1] and cds[-1] > datetime.utcnow().timestamp():
                 await interaction.response.send_message("🚫 Вы под арестом и не можете использовать экономические команды.", ephemeral=False)
@@ -212,20 +230,20 @@ class BalanceButtons(ui.View):
             return
         now = int(time.time())
         daily_amount = getattr(settings, 'ECONOMY_DAILY_AMOUNT', 250)
-        get_or_create_account(interaction.user.id, interaction.guild.id)
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         next_cd = cds[0] if (cds and len(cds) > 0) else None
         if next_cd and next_cd > now:
             await interaction.response.send_message(f"⌛ Доступно через <t:{int(next_cd)}:R>", ephemeral=True)
             return
-        add_bank(interaction.user.id, interaction.guild.id, daily_amount)
+        await run_db(add_bank, interaction.user.id, interaction.guild.id, daily_amount, kind='daily')
         daily_cd_sec = getattr(settings, 'ECONOMY_DAILY_COOLDOWN_SECONDS', 86400)
         next_time = int(time.time() + daily_cd_sec)
-        set_cooldown(interaction.user.id, interaction.guild.id, 'daily_cd', next_time)
+        await run_db(set_cooldown, interaction.user.id, interaction.guild.id, 'daily_cd', next_time)
         
         # Обновляем состояние кнопок и эмбед
-        self._update_button_states()
-        updated_embed = self._build_balance_embed()
+        await self._update_button_states()
+        updated_embed = await self._build_balance_embed()
         
         # Создаем эмбед с результатом daily
         daily_embed = create_embed(
@@ -261,20 +279,20 @@ class BalanceButtons(ui.View):
             work_amount = random.randint(min_reward, max_reward)
         
         # Ensure account exists
-        get_or_create_account(interaction.user.id, interaction.guild.id)
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         next_cd = cds[1] if (cds and len(cds) > 1) else None
         if next_cd and next_cd > now:
             await interaction.response.send_message(f"⌛ Доступно через <t:{int(next_cd)}:R>", ephemeral=True)
             return
-        add_bank(interaction.user.id, interaction.guild.id, work_amount)
+        await run_db(add_bank, interaction.user.id, interaction.guild.id, work_amount, kind='work')
         work_cd_sec = getattr(settings, 'ECONOMY_WORK_COOLDOWN_SECONDS', 3600)
         next_time = int(time.time() + work_cd_sec)
-        set_cooldown(interaction.user.id, interaction.guild.id, 'work_cd', next_time)
+        await run_db(set_cooldown, interaction.user.id, interaction.guild.id, 'work_cd', next_time)
         
         # Обновляем состояние кнопок и эмбед
-        self._update_button_states()
-        updated_embed = self._build_balance_embed()
+        await self._update_button_states()
+        updated_embed = await self._build_balance_embed()
         
         # Создаем эмбед с результатом работы
         work_embed = create_embed(
@@ -296,20 +314,20 @@ class BalanceButtons(ui.View):
             return
         now = int(time.time())
         weekly_amount = getattr(settings, 'ECONOMY_WEEKLY_AMOUNT', 1000)
-        get_or_create_account(interaction.user.id, interaction.guild.id)
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         next_cd = cds[2] if (cds and len(cds) > 2) else None
         if next_cd and next_cd > now:
             await interaction.response.send_message(f"⌛ Доступно через <t:{int(next_cd)}:R>", ephemeral=True)
             return
-        add_bank(interaction.user.id, interaction.guild.id, weekly_amount)
+        await run_db(add_bank, interaction.user.id, interaction.guild.id, weekly_amount, kind='weekly')
         weekly_cd_sec = getattr(settings, 'ECONOMY_WEEKLY_COOLDOWN_SECONDS', 604800)
         next_time = int(time.time() + weekly_cd_sec)
-        set_cooldown(interaction.user.id, interaction.guild.id, 'weekly_cd', next_time)
+        await run_db(set_cooldown, interaction.user.id, interaction.guild.id, 'weekly_cd', next_time)
         
         # Обновляем состояние кнопок и эмбед
-        self._update_button_states()
-        updated_embed = self._build_balance_embed()
+        await self._update_button_states()
+        updated_embed = await self._build_balance_embed()
         
         # Создаем эмбед с результатом weekly
         weekly_embed = create_embed(
@@ -333,7 +351,7 @@ class BalanceButtons(ui.View):
     @ui.button(label="/rob info", style=discord.ButtonStyle.secondary)
     async def rob_info(self, interaction: discord.Interaction, button: ui.Button):
         # Показываем статистику целевого пользователя, а не того, кто нажал кнопку
-        total, success, fail, arrests = get_rob_stats(self.target.id, self.guild.id)
+        total, success, fail, arrests = await run_db(get_rob_stats, self.target.id, self.guild.id)
         embed = create_embed(
             title=f"Статистика ограблений {self.target.display_name}",
             description=(
@@ -357,17 +375,17 @@ class BalanceButtons(ui.View):
         from src.database.economy import get_notifications_enabled, set_notifications_enabled
         
         # Получаем текущий статус
-        current_status = get_notifications_enabled(interaction.user.id, interaction.guild.id)
+        current_status = await run_db(get_notifications_enabled, interaction.user.id, interaction.guild.id)
         
         # Переключаем статус
         new_status = not current_status
-        set_notifications_enabled(interaction.user.id, interaction.guild.id, new_status)
+        await run_db(set_notifications_enabled, interaction.user.id, interaction.guild.id, new_status)
         
         # Обновляем текст кнопки
         button.label = "🔕 Уведомления ВЫКЛ" if not new_status else "🔔 Уведомления ВКЛ"
         
         # Обновляем основной эмбед баланса
-        updated_embed = self._build_balance_embed()
+        updated_embed = await self._build_balance_embed()
         
         # Обновляем сообщение с новым embed и кнопками
         await interaction.response.edit_message(embed=updated_embed, view=self)
@@ -388,7 +406,7 @@ class BalanceButtons(ui.View):
     @ui.button(label="Управление ролями", style=discord.ButtonStyle.secondary)
     async def manage_roles(self, interaction: discord.Interaction, button: ui.Button):
         from src.database.economy import get_owned_custom_roles_with_info
-        roles_info = get_owned_custom_roles_with_info(interaction.user.id, interaction.guild.id)
+        roles_info = await run_db(get_owned_custom_roles_with_info, interaction.user.id, interaction.guild.id)
         if not roles_info:
             await interaction.response.send_message("У вас нет купленных кастомных ролей.", ephemeral=False)
             return
@@ -418,7 +436,7 @@ class ListingModal(ui.Modal, title="Создать/обновить листин
             await interaction.response.send_message("❌ Некорректные значения.", ephemeral=False)
             return
         
-        create_role_listing(self.guild.id, self.role_id, self.seller_id, price, max_sales_val, description)
+        await run_db(create_role_listing, self.guild.id, self.role_id, self.seller_id, price, max_sales_val, description)
         
         # Если есть callback для обновления, вызываем его
         if self.update_callback:
@@ -444,12 +462,7 @@ class RoleManageView(ui.View):
         role = self.guild.get_role(self.selected_role)
         if role:
             # Получаем информацию о листинге
-            from src.database.economy import get_connection
-            conn = get_connection()
-            c = conn.cursor()
-            c.execute("SELECT price, description FROM role_listings WHERE role_id=? AND guild_id=?", (self.selected_role, self.guild.id))
-            listing = c.fetchone()
-            conn.close()
+            listing = await run_db(get_role_listing, self.guild.id, self.selected_role)
             
             listing_info = ""
             if listing:
@@ -464,12 +477,12 @@ class RoleManageView(ui.View):
             embed.set_thumbnail(url=self.guild.icon.url if self.guild.icon else None)
             
             # Rebuild components to show unlist button
-            self._build_components()
+            self._build_components(listing)
             
             await interaction.response.edit_message(embed=embed, view=self)
     
-    def _build_components(self):
-        """Build UI components based on current state"""
+    def _build_components(self, listing=None):
+        """Build UI components based on current state; listing — (price, description) выбранной роли"""
         self.clear_items()
         
         if not self.selected_role:
@@ -490,14 +503,6 @@ class RoleManageView(ui.View):
                 self.add_item(select)
         else:
             # Show action buttons for selected role
-            # Check if role is listed
-            from src.database.economy import get_connection
-            conn = get_connection()
-            c = conn.cursor()
-            c.execute("SELECT price, description FROM role_listings WHERE role_id=? AND guild_id=?", (self.selected_role, self.guild.id))
-            listing = c.fetchone()
-            conn.close()
-            
             list_btn = ui.Button(label="Выставить на продажу", style=discord.ButtonStyle.secondary, row=0)
             list_btn.callback = self.list_role_callback
             self.add_item(list_btn)
@@ -535,12 +540,7 @@ class RoleManageView(ui.View):
         role = self.guild.get_role(self.selected_role)
         if role:
             # Check if role is listed
-            from src.database.economy import get_connection
-            conn = get_connection()
-            c = conn.cursor()
-            c.execute("SELECT price, description FROM role_listings WHERE role_id=? AND guild_id=?", (self.selected_role, self.guild.id))
-            listing = c.fetchone()
-            conn.close()
+            listing = await run_db(get_role_listing, self.guild.id, self.selected_role)
             
             listing_info = ""
             if listing:
@@ -555,7 +555,7 @@ class RoleManageView(ui.View):
             embed.set_thumbnail(url=self.guild.icon.url if self.guild.icon else None)
             
             # Rebuild components to show action buttons
-            self._build_components()
+            self._build_components(listing)
             
             await interaction.response.edit_message(embed=embed, view=self)
         else:
@@ -581,7 +581,7 @@ class RoleManageView(ui.View):
             await interaction.response.send_message("❌ Сначала выберите роль из списка.", ephemeral=False)
             return
         
-        remove_role_listing(self.guild.id, self.selected_role)
+        await run_db(remove_role_listing, self.guild.id, self.selected_role)
         
         # Update embed to remove listing info
         role = self.guild.get_role(self.selected_role)
@@ -627,7 +627,7 @@ class RoleEditModal(ui.Modal, title="Заявка на изменение рол
         self.user_id = user_id
 
     async def on_submit(self, interaction: discord.Interaction):
-        from src.database.economy import add_role_edit_request, get_or_create_account, add_bank
+        from src.database.economy import add_role_edit_request, get_or_create_account, spend_bank
         
         role = self.guild.get_role(self.role_id)
         if not role:
@@ -635,7 +635,7 @@ class RoleEditModal(ui.Modal, title="Заявка на изменение рол
             return
         
         # Check if user has enough money (1000 coins)
-        acc = get_or_create_account(interaction.user.id, interaction.guild.id)
+        acc = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         bank = acc[1] or 0
         price = 1000
         
@@ -644,12 +644,14 @@ class RoleEditModal(ui.Modal, title="Заявка на изменение рол
             return
         
         # Deduct money
-        add_bank(interaction.user.id, interaction.guild.id, -price)
+        if not await run_db(spend_bank, interaction.user.id, interaction.guild.id, price, kind='role_edit'):
+            await interaction.response.send_message(f"❌ Недостаточно средств. Нужно: {format_number(price)}{MONEY}", ephemeral=True)
+            return
         
         # Create request
         new_name = str(self.name.value).strip()
         new_color = str(self.color.value).strip()
-        req_id = add_role_edit_request(interaction.user.id, interaction.guild.id, self.role_id, new_name, new_color)
+        req_id = await run_db(add_role_edit_request, interaction.user.id, interaction.guild.id, self.role_id, new_name, new_color)
         
         # Post to review channel
         channel_id = getattr(settings, 'ECONOMY_REVIEW_CHANNEL_ID', None)
@@ -700,7 +702,7 @@ class RoleEditReviewView(ui.View):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
         
-        row = get_role_edit_request(self.req_id)
+        row = await run_db(get_role_edit_request, self.req_id)
         if not row:
             await interaction.response.send_message("❌ Заявка не найдена.", ephemeral=False)
             return
@@ -711,13 +713,13 @@ class RoleEditReviewView(ui.View):
         
         if not role:
             await interaction.response.send_message("❌ Роль не найдена на сервере.", ephemeral=False)
-            set_role_edit_request_status(self.req_id, 'denied', interaction.user.id)
+            await run_db(set_role_edit_request_status, self.req_id, 'denied', interaction.user.id)
             return
         
         # Check if name is unique
         if discord.utils.get(guild.roles, name=new_name) and role.name != new_name:
             await interaction.response.send_message("❌ Роль с таким названием уже существует.", ephemeral=False)
-            set_role_edit_request_status(self.req_id, 'denied', interaction.user.id)
+            await run_db(set_role_edit_request_status, self.req_id, 'denied', interaction.user.id)
             try:
                 user = guild.get_member(user_id) or await guild.fetch_member(user_id)
                 await user.send("❌ Ваша заявка на изменение роли отклонена: роль с таким названием уже существует.")
@@ -729,7 +731,7 @@ class RoleEditReviewView(ui.View):
         try:
             new_color_parsed = _parse_color(new_color)
             await role.edit(name=new_name, colour=new_color_parsed, reason=f"Заявка одобрена модератором {interaction.user}")
-            set_role_edit_request_status(self.req_id, 'approved', interaction.user.id)
+            await run_db(set_role_edit_request_status, self.req_id, 'approved', interaction.user.id)
             
             # Update embed
             embed = create_embed(
@@ -780,7 +782,7 @@ class RoleEditReviewView(ui.View):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
         
-        row = get_role_edit_request(self.req_id)
+        row = await run_db(get_role_edit_request, self.req_id)
         if not row:
             await interaction.response.send_message("❌ Заявка не найдена.", ephemeral=False)
             return
@@ -789,10 +791,10 @@ class RoleEditReviewView(ui.View):
         guild = interaction.guild
         role = guild.get_role(role_id)
         
-        set_role_edit_request_status(self.req_id, 'denied', interaction.user.id)
+        await run_db(set_role_edit_request_status, self.req_id, 'denied', interaction.user.id)
         
         # Refund money
-        add_bank(user_id, guild_id, 1000)
+        await run_db(add_bank, user_id, guild_id, 1000, kind='role_edit_refund')
         
         # Update embed
         embed = create_embed(
@@ -837,84 +839,113 @@ class RoleEditReviewView(ui.View):
 class EconomyCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        init_economy_db()
-        # Track joined timestamps for voice to accumulate time
-        self._voice_joined_ts: dict[tuple[int, int], float] = {}
-        self._temp_roles_cleanup.start()
+        ensure_schema(ECONOMY_DB_PATH)
+        # Снятие временных ролей и арестов — задачи планировщика на каждый срок
+        scheduler.register("temp_role", self._expire_temp_role)
+        scheduler.register("arrest", self._expire_arrest)
+        self._timers_restored: set[int] = set()
+        self._activity_flush.change_interval(seconds=getattr(settings, 'ECONOMY_ACTIVITY_FLUSH_SECONDS', 15.0))
+        self._activity_flush.start()
+        self._voice_checkpoint.change_interval(seconds=getattr(settings, 'ECONOMY_VOICE_CHECKPOINT_SECONDS', 60.0))
+        self._voice_checkpoint.start()
+        # Смена канала и mute/deaf влияют на начисление; стримы и прочее — нет
+        voice_router.subscribe("economy", self._on_voice_transition, kinds=CHANNEL_CHANGES | {MUTE},
+                               predicate=lambda t: not t.member.bot)
+
+    async def cog_load(self):
+        """Инициализация при загрузке кога"""
+        # Пересчёт уровней, если кривая в конфиге изменилась с прошлого запуска (в потоке хранилища или в PostgreSQL)
+        await ExperienceService.sync_level_curve()
+
+    async def cog_unload(self):
+        voice_router.unsubscribe("economy")
+        scheduler.unregister("temp_role")
+        scheduler.unregister("arrest")
+        self._activity_flush.cancel()
+        self._voice_checkpoint.cancel()
+        await activity_buffer.flush()
+        await voice_sessions.checkpoint()
 
     # Track voice time
+    async def _on_voice_transition(self, transition: VoiceTransition):
+        # Время копится в памяти и пишется пачкой на контрольной точке
+        voice_sessions.update(transition.member, transition.after)
+
     @commands.Cog.listener()
-    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        if member.bot:
-            return
-        key = (member.guild.id, member.id)
-        now = int(time.time())
-        # Joined voice
-        if (not before.channel) and after.channel:
-            self._voice_joined_ts[key] = now
-            return
-        # Left voice
-        if before.channel and (not after.channel):
-            start = self._voice_joined_ts.pop(key, None)
-            if start:
-                voice_seconds = int(now - start)
-                add_voice_seconds(member.id, member.guild.id, voice_seconds)
-                # Add XP for voice time
-                ExperienceService.add_xp_from_voice(member.id, member.guild.id, voice_seconds / 60)
-            return
-        # Switched between channels
-        if before.channel and after.channel and before.channel.id != after.channel.id:
-            start = self._voice_joined_ts.get(key)
-            if start:
-                voice_seconds = int(now - start)
-                add_voice_seconds(member.id, member.guild.id, voice_seconds)
-                # Add XP for voice time
-                ExperienceService.add_xp_from_voice(member.id, member.guild.id, voice_seconds / 60)
-            self._voice_joined_ts[key] = now
+    async def on_ready(self):
+        # Сессии, начавшиеся до запуска бота или во время разрыва соединения
+        voice_sessions.hold(guild.id for guild in self.bot.guilds)
+        for guild in self.bot.guilds:
+            restored = await voice_sessions.restore(guild)
+            if restored:
+                logging.info(f"🎙️ Восстановлено голосовых сессий на {guild.name}: {restored}")
+            if guild.id not in self._timers_restored:
+                # Временные роли, выданные до появления планировщика
+                temp_roles = await run_db(get_temp_roles, guild.id)
+                scheduler.schedule_many(
+                    "temp_role",
+                    [(f"{guild.id}:{user_id}:{role_id}", utc_naive_to_epoch(until), None) for user_id, role_id, until in temp_roles],
+                    replace=False,
+                )
+                self._timers_restored.add(guild.id)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        # simple xp per message (anti-spam not implemented here)
         if message.guild and not message.author.bot:
-            # Use new experience service
-            ExperienceService.add_xp_from_message(message.author.id, message.guild.id)
-            # Increment message counter using service
-            MessageCounterService.increment_message_count(message.author.id, message.guild.id)
-
-    @tasks.loop(minutes=10)
-    async def _temp_roles_cleanup(self):
-        now_ts = datetime.utcnow().timestamp()
-        for guild in self.bot.guilds:
-            expired = get_expired_temp_roles(guild.id, now_ts)
-            for user_id, role_ids in expired:
-                member = guild.get_member(user_id)
-                if not member:
-                    continue
-                roles = [guild.get_role(rid) for rid in role_ids]
-                roles = [r for r in roles if r and r in member.roles]
-                if roles:
-                    try:
-                        await member.remove_roles(*roles, reason="Срок временной роли истёк")
-                    except Exception:
-                        pass
-                remove_temp_roles(user_id, guild.id, role_ids)
-
-    @_temp_roles_cleanup.before_loop
-    async def _before_cleanup(self):
+            # XP и счётчик сообщений копятся в буфере и пишутся пачкой; при спаме
+            # опыт не начисляется, но сообщение всё равно учитывается в статистике
+            xp = None if xp_limiter.allow(message.guild.id, message.author.id, message.content) else 0.0
+            activity_buffer.add_message(message.author.id, message.guild.id, xp)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        # Вернувшийся участник снова должен отображаться в топах
+        member_resolver.forget(member.guild.id, member.id)
+
+    @tasks.loop(seconds=15)
+    async def _activity_flush(self):
+        await activity_buffer.flush()
+
+    @tasks.loop(seconds=60)
+    async def _voice_checkpoint(self):
+        await voice_sessions.checkpoint()
+
+    @_voice_checkpoint.before_loop
+    async def _before_voice_checkpoint(self):
         await self.bot.wait_until_ready()
 
+    async def _expire_temp_role(self, key: str, payload):
+        guild_id, user_id, role_id = map(int, key.split(":"))
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            # Сервер ещё недоступен — планировщик повторит попытку
+            raise RuntimeError(f"сервер {guild_id} недоступен")
+        member = await member_resolver.get(guild, user_id)
+        role = guild.get_role(role_id)
+        if member and role and role in member.roles:
+            try:
+                await member.remove_roles(role, reason="Срок временной роли истёк")
+            except Exception:
+                pass
+        await run_db(remove_temp_roles, user_id, guild_id, [role_id])
+
+    async def _expire_arrest(self, key: str, payload):
+        guild_id, user_id = map(int, key.split(":"))
+        await run_db(set_arrest, user_id, guild_id, None)
+
 
     @app_commands.command(name="balance", description="Профиль экономики пользователя")
     @app_commands.describe(member="Пользователь (необязательно)")
     async def balance(self, interaction: discord.Interaction, member: discord.Member | None = None):
         user = member or interaction.user
-        row = get_or_create_account(user.id, interaction.guild.id)
+        row = await overlay_activity(user.id, interaction.guild.id, await run_db(get_or_create_account, user.id, interaction.guild.id))
+        row = activity_buffer.merge_account(user.id, interaction.guild.id, voice_sessions.merge_account(user.id, interaction.guild.id, row))
         cash, bank, xp, level, voice_seconds, *_ = row
         voice_h = int(voice_seconds // 3600) if voice_seconds else 0
         voice_m = int((voice_seconds % 3600) // 60) if voice_seconds else 0
 
         # Получаем XP для следующего уровня
-        next_level_xp = settings.ECONOMY_XP_PER_LEVEL.get(level, level * 100)
+        next_level_xp = ExperienceService.xp_to_next_level(level)
         
         embed = create_embed(
             title=f"Профиль {user.display_name}",
@@ -933,7 +964,7 @@ class EconomyCog(commands.Cog):
         # Если команда вызвана на другого пользователя, показываем только информацию об ограблениях
         if member and member.id != interaction.user.id:
             # Получаем статистику ограблений для целевого пользователя
-            total, success, fail, arrests = get_rob_stats(user.id, interaction.guild.id)
+            total, success, fail, arrests = await run_db(get_rob_stats, user.id, interaction.guild.id)
             embed.add_field(name="Статистика ограблений", value=(
                 f"**Всего ограблений:** {total}\n"
                 f"**Успешных:** {success}\n"
@@ -945,7 +976,7 @@ class EconomyCog(commands.Cog):
             await interaction.response.send_message(embed=embed, ephemeral=False)
         else:
             # Обычная логика для собственного профиля
-            cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+            cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
             now = int(time.time())
             def cd_label(ts):
                 return "доступно" if not ts or ts <= now else f"доступно <t:{int(ts)}:R>"
@@ -960,6 +991,7 @@ class EconomyCog(commands.Cog):
             ), inline=False)
             
             view = BalanceButtons(interaction.guild, interaction.user, user)
+            await view._update_button_states()
             await interaction.response.send_message(embed=embed, view=view, ephemeral=False)
 
     @app_commands.command(name="shop", description="Магазин предметов Naeratus")
@@ -968,14 +1000,14 @@ class EconomyCog(commands.Cog):
         
         # Очищаем недействительные листинги перед показом магазина
         valid_role_owners = {}
-        for member in interaction.guild.members:
+        for member in await member_resolver.all_members(interaction.guild):
             if not member.bot:
                 valid_role_owners[member.id] = [role.id for role in member.roles]
         
-        cleanup_invalid_listings(interaction.guild.id, valid_role_owners)
+        await run_db(cleanup_invalid_listings, interaction.guild.id, valid_role_owners)
         
         view = ShopView(interaction.guild, interaction.user)
-        embed = view.build_embed()
+        embed = await view.build_embed()
         await interaction.followup.send(embed=embed, view=view, ephemeral=False)
 
     @app_commands.command(name="rob", description="Ограбить пользователя (только наличные)")
@@ -1002,7 +1034,7 @@ class EconomyCog(commands.Cog):
             return
         
         # check arrest
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         now = int(time.time())
         if cds and len(cds) > 4 and cds[4] and cds[4] > now:
             arrest_time = int(cds[4])
@@ -1032,7 +1064,7 @@ class EconomyCog(commands.Cog):
         success = random.random() < success_chance
         
         # compute loot from target cash up to 30%
-        target_row = get_or_create_account(member.id, interaction.guild.id)
+        target_row = await run_db(get_or_create_account, member.id, interaction.guild.id)
         target_cash = target_row[0] or 0
         
         # Проверяем минимальное количество денег у жертвы
@@ -1082,12 +1114,18 @@ class EconomyCog(commands.Cog):
         ]
 
         if success and loot > 0:
-            # transfer cash
-            add_cash(member.id, interaction.guild.id, -loot)
-            add_cash(interaction.user.id, interaction.guild.id, loot)
-            inc_robbery_stat(interaction.user.id, interaction.guild.id, success=True)
             next_rob = int(time.time() + 300)  # 5 минут
-            set_cooldown(interaction.user.id, interaction.guild.id, 'rob_cd', next_rob)
+            # Перевод, статистика и кулдаун — одна транзакция
+            if not await run_db(rob_success, interaction.user.id, member.id, interaction.guild.id, loot, next_rob):
+                # Жертва успела потратить наличные — это не провал грабителя
+                embed = create_embed(
+                    title="❌ Недостаточно средств",
+                    description=f"У {member.mention} больше нет столько наличных",
+                    color=discord.Color.from_str("#45248e"),
+                    author=interaction.user
+                )
+                await interaction.response.send_message(embed=embed, ephemeral=False)
+                return
             
             embed = create_embed(
                 title="✅ Успешное ограбление!",
@@ -1102,11 +1140,11 @@ class EconomyCog(commands.Cog):
         else:
             # fail; 50/50 arrested
             arrested = random.random() < 0.5
-            inc_robbery_stat(interaction.user.id, interaction.guild.id, success=False, arrest=arrested)
             
             if arrested:
                 until = int(time.time() + 21600)  # 6 часов
-                set_arrest(interaction.user.id, interaction.guild.id, until)
+                await run_db(rob_fail, interaction.user.id, interaction.guild.id, until, None)
+                scheduler.schedule("arrest", f"{interaction.guild.id}:{interaction.user.id}", until)
                 
                 embed = create_embed(
                     title="🚨 Арест!",
@@ -1120,7 +1158,7 @@ class EconomyCog(commands.Cog):
                 await interaction.response.send_message(embed=embed, ephemeral=False)
             else:
                 next_rob = int(time.time() + 300)  # 5 минут
-                set_cooldown(interaction.user.id, interaction.guild.id, 'rob_cd', next_rob)
+                await run_db(rob_fail, interaction.user.id, interaction.guild.id, None, next_rob)
                 
                 embed = create_embed(
                     title="❌ Ограбление провалилось",
@@ -1140,7 +1178,8 @@ class EconomyCog(commands.Cog):
             return
         
         # Remove arrest
-        set_arrest(member.id, interaction.guild.id, None)
+        await run_db(set_arrest, member.id, interaction.guild.id, None)
+        scheduler.cancel("arrest", f"{interaction.guild.id}:{member.id}")
         
         embed = create_embed(
             title="🔓 Арест снят",
@@ -1180,13 +1219,13 @@ class EconomyCog(commands.Cog):
             await interaction.response.send_message("❌ Ставка должна быть от 50 до 1000.", ephemeral=False)
             return
         # arrest check
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         now = int(time.time())
         if cds and cds[-1] and cds[-1] > now:
             await interaction.response.send_message("🚫 Вы под арестом.", ephemeral=False)
             return
         # funds
-        acc = get_or_create_account(interaction.user.id, interaction.guild.id)
+        acc = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         bank = acc[1] or 0
         if bank < bet:
             await interaction.response.send_message("❌ Недостаточно средств в банке.", ephemeral=True)
@@ -1219,15 +1258,14 @@ class EconomyCog(commands.Cog):
         else:
             self._active_blackjack_games = set()
         
-        cds = get_cooldowns(interaction.user.id, interaction.guild.id)
+        cds = await run_db(get_cooldowns, interaction.user.id, interaction.guild.id)
         now = datetime.utcnow().timestamp()
         if cds and cds[-1] and cds[-1] > now:
             await interaction.response.send_message("🚫 Вы под арестом.", ephemeral=False)
             return
         
-        acc = get_or_create_account(interaction.user.id, interaction.guild.id)
-        bank = acc[1] or 0
-        if bank < bet:
+        # Ставка списывается сразу и строго; выигрыш или возврат — при расчёте в конце игры
+        if not await run_db(spend_bank, interaction.user.id, interaction.guild.id, bet, kind='blackjack'):
             await interaction.response.send_message("❌ Недостаточно средств в банке.", ephemeral=True)
             return
         
@@ -1236,7 +1274,14 @@ class EconomyCog(commands.Cog):
         
         view = BlackjackView(interaction.user, interaction.guild.id, bet, self)
         embed = view.build_embed()
-        await interaction.response.send_message(embed=embed, view=view, ephemeral=False)
+        try:
+            await interaction.response.send_message(embed=embed, view=view, ephemeral=False)
+        except Exception:
+            # Игра не показана — ставка возвращается
+            view.finished = True
+            await view._settle('push')
+            self._active_blackjack_games.discard(interaction.user.id)
+            raise
         
         # Store message reference for timeout handling
         message = await interaction.original_response()
@@ -1251,7 +1296,7 @@ class EconomyCog(commands.Cog):
             return
         
         view = AdminBalanceView(interaction.guild, member)
-        embed = view.build_embed()
+        embed = await view.build_embed()
         await interaction.response.send_message(embed=embed, view=view, ephemeral=False)
 
     @app_commands.command(name="admin_role_shop", description="Добавить роль в магазин (админ)")
@@ -1361,15 +1406,12 @@ class CasesView(ui.View):
         rewards = case.get('rewards', [])
         
         # Check funds
-        acc = get_or_create_account(interaction.user.id, interaction.guild.id)
+        acc = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         bank = acc[1] or 0
         if bank < price:
             await interaction.response.send_message(f"❌ Недостаточно средств. Нужно: {format_number(price)}{MONEY}, у вас: {format_number(bank)}{MONEY}", ephemeral=True)
             return
         
-        # Charge
-        add_bank(interaction.user.id, interaction.guild.id, -price)
-        
         # Weighted choice
         if not rewards:
             await interaction.response.send_message("❌ В кейсе нет наград", ephemeral=False)
@@ -1378,6 +1420,11 @@ class CasesView(ui.View):
         weights = [int(r.get('chance', 1)) for r in rewards]
         reward = random.choices(rewards, weights=weights, k=1)[0]
         
+        # Списание и денежная награда — одна операция журнала
+        if not await run_db(_charge_case, interaction.user.id, interaction.guild.id, name, price, reward):
+            await interaction.response.send_message(f"❌ Недостаточно средств. Нужно: {format_number(price)}{MONEY}", ephemeral=True)
+            return
+        
         # Анимация открытия кейса
         animation_embed = create_embed(
             title="📦 Открытие кейса...",
@@ -1413,12 +1460,11 @@ class CasesView(ui.View):
         
         if rtype == 'money':
             amount = int(reward.get('amount', 0))
-            add_bank(interaction.user.id, interaction.guild.id, amount)
             reward_name = reward.get('name', 'Деньги')
             embed.add_field(name="Награда", value=f"{reward_name}: **{amount}{MONEY}**\n**Редкость:** {rarity}", inline=False)
         elif rtype == 'xp':
             amount = int(reward.get('xp', 0))
-            add_xp(interaction.user.id, interaction.guild.id, amount)
+            activity_buffer.add_xp(interaction.user.id, interaction.guild.id, amount)
             reward_name = reward.get('name', 'Опыт')
             embed.add_field(name="Награда", value=f"{reward_name}: **{amount} XP**\n**Редкость:** {rarity}", inline=False)
         elif rtype == 'role':
@@ -1431,7 +1477,7 @@ class CasesView(ui.View):
                 try:
                     await interaction.user.add_roles(role, reason=f"Награда из кейса {name}")
                     if duration > 0:
-                        set_temp_role(interaction.user.id, interaction.guild.id, role.id, datetime.utcnow().timestamp() + duration)
+                        await _grant_temp_role(interaction.user.id, interaction.guild.id, role.id, duration)
                         embed.add_field(name="Награда", value=f"{reward_name}: {role.mention}\n⏱️ Временная ({duration//3600}ч)\n**Редкость:** {rarity}", inline=False)
                     else:
                         embed.add_field(name="Награда", value=f"{reward_name}: {role.mention}\n♾️ Постоянная\n**Редкость:** {rarity}", inline=False)
@@ -1469,14 +1515,24 @@ class CasesReplayView(ui.View):
         rewards = case.get('rewards', [])
         
         # Проверяем баланс
-        acc = get_or_create_account(interaction.user.id, interaction.guild.id)
+        acc = await run_db(get_or_create_account, interaction.user.id, interaction.guild.id)
         bank = acc[1] or 0
         if bank < price:
             await interaction.response.send_message(f"❌ Недостаточно средств! Нужно {format_number(price)}{MONEY}, у вас {format_number(bank)}{MONEY}", ephemeral=True)
             return
         
-        # Списываем деньги
-        add_bank(interaction.user.id, interaction.guild.id, -price)
+        # Выбираем награду
+        if not rewards:
+            await interaction.response.send_message("❌ В кейсе нет наград", ephemeral=True)
+            return
+        
+        weights = [int(r.get('chance', 1)) for r in rewards]
+        reward = random.choices(rewards, weights=weights, k=1)[0]
+        
+        # Списываем деньги и начисляем денежную награду одной операцией
+        if not await run_db(_charge_case, interaction.user.id, interaction.guild.id, name, price, reward):
+            await interaction.response.send_message(f"❌ Недостаточно средств! Нужно {format_number(price)}{MONEY}", ephemeral=True)
+            return
         
         # Анимация открытия кейса
         animation_embed = create_embed(
@@ -1500,14 +1556,6 @@ class CasesReplayView(ui.View):
             await message.edit(embed=animation_embed)
             await asyncio.sleep(0.8)
         
-        # Выбираем награду
-        if not rewards:
-            await message.edit(embed=create_embed(title="❌ Ошибка", description="В кейсе нет наград", color=discord.Color.from_str("#45248e")), view=None)
-            return
-        
-        weights = [int(r.get('chance', 1)) for r in rewards]
-        reward = random.choices(rewards, weights=weights, k=1)[0]
-        
         # Обрабатываем награду
         rtype = reward.get('type')
         embed = create_embed(
@@ -1521,7 +1569,6 @@ class CasesReplayView(ui.View):
         
         if rtype == 'money':
             amount = int(reward.get('amount', 0))
-            add_bank(interaction.user.id, interaction.guild.id, amount)
             reward_name = reward.get('name', 'Деньги')
             embed.add_field(name="Награда", value=f"{reward_name}: {format_number(amount)}{MONEY}\n**Редкость:** {rarity}", inline=False)
         elif rtype == 'role':
@@ -1530,7 +1577,7 @@ class CasesReplayView(ui.View):
             try:
                 role = self.guild.get_role(role_id)
                 if role:
-                    member = self.guild.get_member(interaction.user.id)
+                    member = await member_resolver.get(self.guild, interaction.user.id)
                     if member:
                         await member.add_roles(role)
                         reward_name = reward.get('name', 'Роль')
@@ -1561,8 +1608,16 @@ class ShopView(ui.View):
         self.page = page
         self.order = order
         self.selected_item = selected_item
+        # Текущая страница и общее число предметов; загружаются в build_embed
+        self.items = []
+        self.total_items = 0
         self._build_components()
 
+    async def _load_items(self):
+        """Загружает предметы текущей страницы в потоке БД"""
+        self.items = await run_db(get_market_items, self.guild.id, order=self.order, limit=5, offset=self.page*5)
+        self.total_items = len(await run_db(get_market_items, self.guild.id, order=self.order, limit=1000, offset=0))
+
     def _build_components(self):
         """Build UI components based on current state"""
         self.clear_items()
@@ -1580,9 +1635,8 @@ class ShopView(ui.View):
             
         if not self.selected_item:
             # Show role selection and pagination
-            items = get_market_items(self.guild.id, order=self.order, limit=5, offset=self.page*5)
             choose_options = []
-            for i, it in enumerate(items):
+            for i, it in enumerate(self.items):
                 role = self.guild.get_role(it['role_id'])
                 role_name = role.name if role else 'Неизвестно'
                 description = it.get('description', 'Описание отсутствует')
@@ -1604,8 +1658,7 @@ class ShopView(ui.View):
             self.add_item(choose_select)
             
             # Pagination select
-            total_items = len(get_market_items(self.guild.id, order=self.order, limit=1000, offset=0))
-            total_pages = max(1, (total_items + 4) // 5)  # Round up
+            total_pages = max(1, (self.total_items + 4) // 5)  # Round up
             
             if total_pages > 1:
                 page_options = [
@@ -1627,15 +1680,12 @@ class ShopView(ui.View):
 
     def _update_buttons(self):
         """Update button states based on current state"""
-        items = get_market_items(self.guild.id, order=self.order, limit=5, offset=self.page*5)
-        total_items = len(get_market_items(self.guild.id, order=self.order, limit=1000, offset=0))
-        
         for child in self.children:
             if isinstance(child, ui.Button):
                 if child.label == "⬅️":
                     child.disabled = self.page == 0 or self.selected_item is not None
                 elif child.label == "➡️":
-                    child.disabled = (self.page + 1) * 5 >= total_items or self.selected_item is not None
+                    child.disabled = (self.page + 1) * 5 >= self.total_items or self.selected_item is not None
                 elif child.label == "Купить":
                     child.disabled = self.selected_item is None
                     child.style = discord.ButtonStyle.success if self.selected_item else discord.ButtonStyle.secondary
@@ -1645,7 +1695,7 @@ class ShopView(ui.View):
             elif isinstance(child, ui.Select):
                 child.disabled = self.selected_item is not None
 
-    def build_embed(self) -> discord.Embed:
+    async def build_embed(self) -> discord.Embed:
         if self.selected_item:
             # Show only selected item details
             role = self.guild.get_role(self.selected_item['role_id'])
@@ -1683,9 +1733,9 @@ class ShopView(ui.View):
             self._build_components()
         else:
             # Show list of items
-            items = get_market_items(self.guild.id, order=self.order, limit=5, offset=self.page*5)
+            await self._load_items()
             lines = []
-            for idx, item in enumerate(items, start=1 + self.page*5):
+            for idx, item in enumerate(self.items, start=1 + self.page*5):
                 role = self.guild.get_role(item['role_id'])
                 availability = "∞" if item['stock'] is None else str(item['stock'])
                 role_text = role.mention if role else f"ID: {item['role_id']}"
@@ -1714,7 +1764,7 @@ class ShopView(ui.View):
     async def filter_select_callback(self, interaction: discord.Interaction):
         self.order = interaction.data['values'][0]
         self.page = 0  # Reset to first page
-        embed = self.build_embed()
+        embed = await self.build_embed()
         await interaction.response.edit_message(embed=embed, view=self)
 
     async def choose_item_callback(self, interaction: discord.Interaction):
@@ -1723,23 +1773,23 @@ class ShopView(ui.View):
             await interaction.response.defer()
             return
         
-        items = get_market_items(self.guild.id, order=self.order, limit=5, offset=self.page*5)
+        items = await run_db(get_market_items, self.guild.id, order=self.order, limit=5, offset=self.page*5)
         for it in items:
             if (it['kind']=='shop' and str(it['id'])==val) or (it['kind']!='shop' and str(it['role_id'])==val):
                 self.selected_item = it
                 break
         
-        embed = self.build_embed()
+        embed = await self.build_embed()
         await interaction.response.edit_message(embed=embed, view=self)
 
     async def page_select_callback(self, interaction: discord.Interaction):
         self.page = int(interaction.data['values'][0])
-        embed = self.build_embed()
+        embed = await self.build_embed()
         await interaction.response.edit_message(embed=embed, view=self)
 
     async def cancel_callback(self, interaction: discord.Interaction):
         self.selected_item = None
-        embed = self.build_embed()
+        embed = await self.build_embed()
         await interaction.response.edit_message(embed=embed, view=self)
 
     async def buy_callback(self, interaction: discord.Interaction):
@@ -1749,7 +1799,7 @@ class ShopView(ui.View):
         
         kind = self.selected_item['kind']
         id_or_role = self.selected_item['id'] if kind=='shop' else self.selected_item['role_id']
-        ok, msg, role_id, price = purchase_market_item(self.guild.id, interaction.user.id, kind, id_or_role)
+        ok, msg, role_id, price = await run_db(purchase_market_item, self.guild.id, interaction.user.id, kind, id_or_role)
         
         if ok:
             role = self.guild.get_role(role_id)
@@ -1765,7 +1815,7 @@ class ShopView(ui.View):
                     await interaction.response.send_message(embed=embed, ephemeral=False)
                     # Reset and go back to list
                     self.selected_item = None
-                    embed = self.build_embed()
+                    embed = await self.build_embed()
                     await interaction.message.edit(embed=embed, view=self)
                     return
                 except Exception as e:
@@ -1804,22 +1854,22 @@ class BalanceAmountModal(ui.Modal, title="Введите сумму"):
 
         if self.action == 'add':
             if balance_type == 'bank':
-                add_bank(self.target.id, self.guild.id, amount)
+                await run_db(add_bank, self.target.id, self.guild.id, amount, kind='admin')
             else:
-                add_cash(self.target.id, self.guild.id, amount)
+                await run_db(add_cash, self.target.id, self.guild.id, amount, kind='admin')
             await interaction.response.send_message(f"✅ Добавлено {formatted_amount}{MONEY} на {balance_type} пользователя {self.target.mention}", ephemeral=False)
         elif self.action == 'remove':
             if balance_type == 'bank':
-                add_bank(self.target.id, self.guild.id, -amount)
+                await run_db(add_bank, self.target.id, self.guild.id, -amount, kind='admin')
             else:
-                add_cash(self.target.id, self.guild.id, -amount)
+                await run_db(add_cash, self.target.id, self.guild.id, -amount, kind='admin')
             await interaction.response.send_message(f"✅ Убрано {formatted_amount}{MONEY} с {balance_type} пользователя {self.target.mention}", ephemeral=False)
         elif self.action == 'set':
             from src.database.economy import set_money
             if balance_type == 'bank':
-                set_money(self.target.id, self.guild.id, bank=amount)
+                await run_db(set_money, self.target.id, self.guild.id, bank=amount)
             else:
-                set_money(self.target.id, self.guild.id, cash=amount)
+                await run_db(set_money, self.target.id, self.guild.id, cash=amount)
             await interaction.response.send_message(f"✅ Установлен {balance_type} баланс {formatted_amount}{MONEY} для пользователя {self.target.mention}", ephemeral=False)
 
 
@@ -1847,8 +1897,7 @@ class TempRoleModal(ui.Modal, title="Добавить временную рол
 
         try:
             await self.target.add_roles(role, reason=f"Временная роль от {interaction.user}")
-            until_ts = datetime.utcnow().timestamp() + duration
-            set_temp_role(self.target.id, self.guild.id, role_id, until_ts)
+            await _grant_temp_role(self.target.id, self.guild.id, role_id, duration)
             await interaction.response.send_message(
                 f"✅ Роль {role.mention} выдана пользователю {self.target.mention} на {duration} секунд",
                 ephemeral=False
@@ -1863,8 +1912,8 @@ class AdminBalanceView(ui.View):
         self.guild = guild
         self.target = target
 
-    def build_embed(self) -> discord.Embed:
-        acc = get_or_create_account(self.target.id, self.guild.id)
+    async def build_embed(self) -> discord.Embed:
+        acc = await run_db(get_or_create_account, self.target.id, self.guild.id)
         cash, bank, xp, level, voice_seconds = acc[0], acc[1], acc[2], acc[3], acc[4]
         
         embed = create_embed(
@@ -1878,7 +1927,7 @@ class AdminBalanceView(ui.View):
         embed.add_field(name="⭐ Уровень", value=f"{level} ({xp} XP)", inline=True)
         
         # Show custom roles
-        roles_ids = get_owned_custom_roles(self.target.id, self.guild.id)
+        roles_ids = await run_db(get_owned_custom_roles, self.target.id, self.guild.id)
         if roles_ids:
             roles_list = [f"<@&{rid}>" for rid in roles_ids[:5]]
             embed.add_field(name="🎭 Кастомные роли", value="\n".join(roles_list) or "Нет", inline=False)
@@ -1903,7 +1952,7 @@ class AdminBalanceView(ui.View):
 
     @ui.button(label="🗑️ Удалить кастомные роли", style=discord.ButtonStyle.secondary, row=1)
     async def delete_custom_roles(self, interaction: discord.Interaction, button: ui.Button):
-        roles_ids = get_owned_custom_roles(self.target.id, self.guild.id)
+        roles_ids = await run_db(get_owned_custom_roles, self.target.id, self.guild.id)
         if not roles_ids:
             await interaction.response.send_message("❌ У пользователя нет кастомных ролей", ephemeral=False)
             return
@@ -1913,7 +1962,7 @@ class AdminBalanceView(ui.View):
 
     @ui.button(label="🔄 Обновить", style=discord.ButtonStyle.secondary, row=1)
     async def refresh(self, interaction: discord.Interaction, button: ui.Button):
-        embed = self.build_embed()
+        embed = await self.build_embed()
         await interaction.response.edit_message(embed=embed, view=self)
 
 
@@ -1947,13 +1996,7 @@ class DeleteRolesView(ui.View):
                     await self.target.remove_roles(role, reason=f"Удалено админом {interaction.user}")
                     removed.append(role.mention)
                     # Remove from DB
-                    from src.database.economy import get_connection
-                    conn = get_connection()
-                    c = conn.cursor()
-                    c.execute("DELETE FROM owned_custom_roles WHERE user_id=? AND guild_id=? AND role_id=?",
-                             (self.target.id, self.guild.id, rid))
-                    conn.commit()
-                    conn.close()
+                    await run_db(remove_owned_custom_role, self.target.id, self.guild.id, rid)
                 except Exception:
                     pass
         
@@ -2014,7 +2057,7 @@ class AdminShopRoleModal(ui.Modal, title="Добавить роль в мага
             description = str(self.description.value).strip()
             
             # Добавляем роль в магазин
-            success, message = add_shop_role(
+            success, message = await run_db(add_shop_role,
                 self.guild.id, 
                 self.role_id, 
                 price, 
@@ -2054,7 +2097,7 @@ class CustomRoleModal(ui.Modal, title="Создать кастомную рол
 
     async def on_submit(self, interaction: discord.Interaction):
         # Create request
-        req_id = add_custom_role_request(interaction.user.id, interaction.guild.id, str(self.name.value).strip(), str(self.color.value).strip(), str(self.image_url.value or '').strip())
+        req_id = await run_db(add_custom_role_request, interaction.user.id, interaction.guild.id, str(self.name.value).strip(), str(self.color.value).strip(), str(self.image_url.value or '').strip())
         # Post to review channel
         channel_id = getattr(settings, 'ECONOMY_REVIEW_CHANNEL_ID', None)
         if not channel_id:
@@ -2106,33 +2149,30 @@ class CustomRoleReviewView(ui.View):
         if not self._is_reviewer(interaction.user):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
-        row = get_request(self.req_id)
+        row = await run_db(get_request, self.req_id)
         if not row:
             await interaction.response.send_message("❌ Заявка не найдена.", ephemeral=False)
             return
         _, user_id, guild_id, name, color_text, image_url, status = row
         guild = interaction.guild
-        # check funds now
-        from src.database.economy import get_or_create_account, add_bank
-        acc = get_or_create_account(user_id, guild_id)
-        bank = acc[1] or 0
         price = getattr(settings, 'ECONOMY_CUSTOM_ROLE_PRICE', 5000)
-        if bank < price:
-            await interaction.response.send_message("❌ Недостаточно средств у пользователя.", ephemeral=False)
-            set_request_status(self.req_id, 'denied', interaction.user.id)
+        # unique name
+        if discord.utils.get(guild.roles, name=name):
+            await interaction.response.send_message("❌ Роль с таким названием уже существует.", ephemeral=False)
+            await run_db(set_request_status, self.req_id, 'denied', interaction.user.id)
             try:
                 user = guild.get_member(user_id) or await guild.fetch_member(user_id)
-                await user.send("❌ Ваша заявка отклонена: недостаточно средств на момент проверки.")
+                await user.send("❌ Ваша заявка отклонена: роль с таким названием уже существует.")
             except Exception:
                 pass
             return
-        # unique name
-        if discord.utils.get(guild.roles, name=name):
-            await interaction.response.send_message("❌ Роль с таким названием уже существует.", ephemeral=False)
-            set_request_status(self.req_id, 'denied', interaction.user.id)
+        # Оплата списывается до создания роли и только при достаточном балансе
+        if not await run_db(spend_bank, user_id, guild_id, price, kind='custom_role', ref=str(self.req_id)):
+            await interaction.response.send_message("❌ Недостаточно средств у пользователя.", ephemeral=False)
+            await run_db(set_request_status, self.req_id, 'denied', interaction.user.id)
             try:
                 user = guild.get_member(user_id) or await guild.fetch_member(user_id)
-                await user.send("❌ Ваша заявка отклонена: роль с таким названием уже существует.")
+                await user.send("❌ Ваша заявка отклонена: недостаточно средств на момент проверки.")
             except Exception:
                 pass
             return
@@ -2140,15 +2180,15 @@ class CustomRoleReviewView(ui.View):
         try:
             role = await guild.create_role(name=name, colour=_parse_color(color_text), reason="Кастомная роль")
         except Exception as e:
+            await run_db(add_bank, user_id, guild_id, price, kind='custom_role_refund', ref=str(self.req_id))
             await interaction.response.send_message(f"❌ Не удалось создать роль: {e}", ephemeral=False)
             return
-        # deduct funds and grant role
-        add_bank(user_id, guild_id, -price)
+        # grant role
         try:
             user = guild.get_member(user_id) or await guild.fetch_member(user_id)
             await user.add_roles(role, reason="Кастомная роль одобрена")
-            add_owned_custom_role(user_id, guild_id, role.id)
-            set_request_status(self.req_id, 'approved', interaction.user.id)
+            await run_db(add_owned_custom_role, user_id, guild_id, role.id)
+            await run_db(set_request_status, self.req_id, 'approved', interaction.user.id)
             
             # Update embed with approved status
             embed = create_embed(
@@ -2200,13 +2240,13 @@ class CustomRoleReviewView(ui.View):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
         
-        row = get_request(self.req_id)
+        row = await run_db(get_request, self.req_id)
         if not row:
             await interaction.response.send_message("❌ Заявка не найдена.", ephemeral=False)
             return
         
         _, user_id, guild_id, name, color_text, image_url, status = row
-        set_request_status(self.req_id, 'denied', interaction.user.id)
+        await run_db(set_request_status, self.req_id, 'denied', interaction.user.id)
         
         # Update embed with denied status
         user = interaction.guild.get_member(user_id) or await interaction.guild.fetch_member(user_id)
@@ -2262,8 +2302,7 @@ class CoinflipView(ui.View):
             await interaction.response.send_message("❌ Это не ваша игра!", ephemeral=False)
             return
         
-        self.choice = "eagle"
-        await self._flip_coin(interaction)
+        await self._flip_coin(interaction, "eagle")
 
     @ui.button(label="🪙 Решка", style=discord.ButtonStyle.secondary)
     async def choose_tails(self, interaction: discord.Interaction, button: ui.Button):
@@ -2271,10 +2310,25 @@ class CoinflipView(ui.View):
             await interaction.response.send_message("❌ Это не ваша игра!", ephemeral=False)
             return
         
-        self.choice = "tails"
-        await self._flip_coin(interaction)
+        await self._flip_coin(interaction, "tails")
+
+    async def _flip_coin(self, interaction: discord.Interaction, choice: str):
+        # Повторное нажатие, пока монетка в воздухе, ставку не удваивает
+        if self.choice is not None:
+            await interaction.response.defer()
+            return
+        self.choice = choice
+        # Ставка списывается строго: при нехватке средств игра не начинается
+        if not await run_db(spend_bank, self.user.id, self.guild_id, self.bet, kind='coinflip'):
+            self.choice = None
+            await interaction.response.send_message("❌ Недостаточно средств в банке.", ephemeral=True)
+            return
+        # Итог и выплата фиксируются до анимации: сбой Discord не оставит ставку без расчёта
+        result = random.choice(["eagle", "tails"])
+        win = result == self.choice
+        if win:
+            await run_db(add_bank, self.user.id, self.guild_id, self.bet * 2, kind='coinflip')
 
-    async def _flip_coin(self, interaction: discord.Interaction):
         # Disable buttons
         for item in self.children:
             item.disabled = True
@@ -2305,22 +2359,17 @@ class CoinflipView(ui.View):
             await asyncio.sleep(0.6)
         
         # Final result
-        result = random.choice(["eagle", "tails"])
-        win = result == self.choice
-        
         result_emoji = "🦅" if result == "eagle" else "🪙"
         result_text = "**Орёл**" if result == "eagle" else "**Решка**"
         choice_text = "**Орёл**" if self.choice == "eagle" else "**Решка**"
         
         if win:
-            add_bank(self.user.id, self.guild_id, self.bet)
             embed = discord.Embed(
                 title="🎉 Победа!",
                 description=f"Результат: {result_emoji} {result_text}\nВаш выбор: {choice_text}\n\n✅ **Вы выиграли {self.bet}{MONEY}!**",
                 color=discord.Color.from_str("#45248e")
             )
         else:
-            add_bank(self.user.id, self.guild_id, -self.bet)
             embed = discord.Embed(
                 title="💔 Проигрыш",
                 description=f"Результат: {result_emoji} {result_text}\nВаш выбор: {choice_text}\n\n❌ **Вы проиграли {self.bet}{MONEY}**",
@@ -2348,7 +2397,7 @@ class CoinflipReplayView(ui.View):
             return
         
         # Проверяем баланс
-        acc = get_or_create_account(interaction.user.id, self.guild_id)
+        acc = await run_db(get_or_create_account, interaction.user.id, self.guild_id)
         bank = acc[1] or 0
         
         if bank < self.bet:
@@ -2373,84 +2422,84 @@ class TopView(ui.View):
         self.guild = guild
         self.requester = requester
 
+    def _pending_activity(self, metric: str) -> dict:
+        """
+        Ещё не записанные {user_id: (опыт, сообщения, секунды в войсе)} для наложения на топ:
+        буфер сообщений и открытые голосовые сессии читаются из памяти, без сброса в БД
+        """
+        if metric not in ("level", "messages", "voice"):
+            return {}
+        pending = {user_id: (xp, messages, 0) for user_id, (xp, messages) in activity_buffer.pending_guild(self.guild.id).items()}
+        if metric != "messages":
+            voice_xp = max(ExperienceService._get_xp_sources().get('voice_minute', 0.5), 0) / 60
+            for user_id, seconds in voice_sessions.pending_guild(self.guild.id).items():
+                xp, messages, _ = pending.get(user_id, (0.0, 0, 0))
+                pending[user_id] = (xp + voice_xp * seconds, messages, seconds)
+        return pending
+
+    async def _resolve_page(self, metric: str, pending: dict, size: int = 10) -> list:
+        """
+        Возвращает до size пар (участник, строка топа). Строки берутся с запасом,
+        участники резолвятся пачкой, ушедшие с сервера пропускаются
+        """
+        entries = []
+        offset = 0
+        batch = size * 2
+        while len(entries) < size:
+            rows = await leaderboards.top(self.guild.id, metric, batch, offset, pending, ExperienceService.apply_level_ups)
+            if not rows:
+                break
+            members = await member_resolver.resolve(self.guild, [row[0] for row in rows])
+            for row in rows:
+                member = members.get(row[0])
+                if member is not None:
+                    entries.append((member, row))
+                    if len(entries) >= size:
+                        break
+            if len(rows) < batch:
+                break
+            offset += batch
+        return entries
+
     async def build_embed(self, metric: str) -> discord.Embed:
+        # Топ учитывает ещё не записанные сообщения, опыт и время в войсе
+        pending = self._pending_activity(metric)
         if metric == "balance":
-            rows = get_top_by_balance(self.guild.id)
             title = "Топ по балансу"
             lines = []
-            current_idx = 1
-            for row in rows:
+            for current_idx, (member, row) in enumerate(await self._resolve_page(metric, pending), start=1):
                 user_id, total, cash, bank = row
-                try:
-                    member = self.guild.get_member(user_id) or await self.guild.fetch_member(user_id)
-                    lines.append(f"`{current_idx}` | {member.display_name}\nНаличка: {format_number(cash)}{MONEY} | В банке: {format_number(bank)}{MONEY}\nБаланс: {format_number(total)}{MONEY}")
-                    current_idx += 1
-                except:
-                    # Пропускаем пользователей, которых нет на сервере
-                    continue
+                lines.append(f"`{current_idx}` | {member.display_name}\nНаличка: {format_number(cash)}{MONEY} | В банке: {format_number(bank)}{MONEY}\nБаланс: {format_number(total)}{MONEY}")
         elif metric == "level":
-            rows = ExperienceService.get_top_by_level(self.guild.id)
             title = "Топ по уровню"
             lines = []
-            current_idx = 1
-            for row in rows:
+            for current_idx, (member, row) in enumerate(await self._resolve_page(metric, pending), start=1):
                 user_id, level, xp = row
-                try:
-                    member = self.guild.get_member(user_id) or await self.guild.fetch_member(user_id)
-                    # Get level info using service
-                    level_info = ExperienceService.get_user_level_info(user_id, self.guild.id)
-                    lines.append(f"`{current_idx}` | {member.display_name}\nУровень: **{level}** `[{xp}/{level_info['xp_to_next']}]`")
-                    current_idx += 1
-                except:
-                    # Пропускаем пользователей, которых нет на сервере
-                    continue
+                # Порог следующего уровня считается по конфигу, без запроса к БД
+                lines.append(f"`{current_idx}` | {member.display_name}\nУровень: **{level}** `[{xp}/{ExperienceService.xp_to_next_level(level)}]`")
         elif metric == "messages":
-            rows = MessageCounterService.get_top_by_messages(self.guild.id)
             title = "Топ по отправленным сообщениям"
             lines = []
-            current_idx = 1
-            for row in rows:
+            for current_idx, (member, row) in enumerate(await self._resolve_page(metric, pending), start=1):
                 user_id, messages = row
-                try:
-                    member = self.guild.get_member(user_id) or await self.guild.fetch_member(user_id)
-                    lines.append(f"`{current_idx}` | {member.display_name}\nОтправленных сообщений: **{format_number(messages)}**")
-                    current_idx += 1
-                except:
-                    # Пропускаем пользователей, которых нет на сервере
-                    continue
+                lines.append(f"`{current_idx}` | {member.display_name}\nОтправленных сообщений: **{format_number(messages)}**")
         elif metric == "voice":
-            rows = get_top_by_voice(self.guild.id)
             title = "Топ по войсу"
             lines = []
-            current_idx = 1
-            for row in rows:
+            for current_idx, (member, row) in enumerate(await self._resolve_page(metric, pending), start=1):
                 user_id, voice_seconds = row
                 hours = int(voice_seconds // 3600)
                 minutes = int((voice_seconds % 3600) // 60)
                 seconds = int(voice_seconds % 60)
-                try:
-                    member = self.guild.get_member(user_id) or await self.guild.fetch_member(user_id)
-                    lines.append(f"`{current_idx}` | {member.display_name}\nВремя в войсе: **{hours:02d}:{minutes:02d}:{seconds:02d}**")
-                    current_idx += 1
-                except:
-                    # Пропускаем пользователей, которых нет на сервере
-                    continue
+                lines.append(f"`{current_idx}` | {member.display_name}\nВремя в войсе: **{hours:02d}:{minutes:02d}:{seconds:02d}**")
         elif metric == "robberies":
-            rows = get_top_by_robberies(self.guild.id)
             title = "Топ по ограблениям"
             lines = []
-            current_idx = 1
-            for row in rows:
+            for current_idx, (member, row) in enumerate(await self._resolve_page(metric, pending), start=1):
                 user_id, success, fail = row
-                try:
-                    member = self.guild.get_member(user_id) or await self.guild.fetch_member(user_id)
-                    lines.append(f"`{current_idx}` | {member.display_name}\nУспешных ограблений: **{format_number(success)}**")
-                    current_idx += 1
-                except:
-                    # Пропускаем пользователей, которых нет на сервере
-                    continue
+                lines.append(f"`{current_idx}` | {member.display_name}\nУспешных ограблений: **{format_number(success)}**")
         elif metric == "clans":
-            rows = get_top_clans_by_members(10)
+            rows = await run_db(get_top_clans_by_members, 10)
             title = "Топ кланов по участникам"
             lines = []
             current_idx = 1
@@ -2459,7 +2508,7 @@ class TopView(ui.View):
                 current_idx += 1
 
         # Get user's rank
-        user_rank = self._get_user_rank(metric)
+        user_rank = await self._get_user_rank(metric, pending)
         
         if metric == "clans":
             embed = discord.Embed(
@@ -2491,17 +2540,10 @@ class TopView(ui.View):
         embed.set_thumbnail(url=self.guild.icon.url if self.guild.icon else None)
         return embed
 
-    def _get_user_rank(self, metric: str) -> int:
-        if metric == "balance":
-            return get_rank_by_balance(self.requester.id, self.guild.id)
-        elif metric == "level":
-            return ExperienceService.get_rank_by_level(self.requester.id, self.guild.id)
-        elif metric == "messages":
-            return MessageCounterService.get_rank_by_messages(self.requester.id, self.guild.id)
-        elif metric == "voice":
-            return get_rank_by_voice(self.requester.id, self.guild.id)
-        elif metric == "robberies":
-            return get_rank_by_robberies(self.requester.id, self.guild.id)
+    async def _get_user_rank(self, metric: str, pending: dict) -> int:
+        if metric in ("balance", "level", "messages", "voice", "robberies"):
+            # Ранг из таблицы лидеров в памяти, без запроса к БД
+            return await leaderboards.rank(self.guild.id, metric, self.requester.id, pending, ExperienceService.apply_level_ups)
         elif metric == "clans":
             # Для кланов возвращаем 0, так как это не индивидуальный рейтинг
             return 0
@@ -2620,10 +2662,20 @@ class BlackjackView(ui.View):
         self.dealer = [self._draw(), self._draw()]
         self.finished = False
         self.dealer_turn = False
+        self.settled = False
 
     def _draw(self) -> str:
         return self.deck.pop()
 
+    async def _settle(self, outcome: str) -> None:
+        """Выплата по итогу игры: ставка списана при старте, проигрыш и таймаут ничего не возвращают"""
+        if self.settled:
+            return
+        self.settled = True
+        payout = {'blackjack': self.bet + int(self.bet * 1.5), 'win': self.bet * 2, 'push': self.bet}.get(outcome, 0)
+        if payout:
+            await run_db(add_bank, self.user.id, self.guild_id, payout, kind='blackjack')
+
     def _format_card(self, card: str) -> str:
         """Format card with custom emoji"""
         return CARD_EMOJIS.get(card, f"`{card}`")
@@ -2698,14 +2750,13 @@ class BlackjackView(ui.View):
                 outcome = 'push'
         
         # Settle bet
+        await self._settle(outcome)
         if outcome == 'blackjack':
-            add_bank(self.user.id, self.guild_id, int(self.bet * 1.5))
             result_emoji = "🎉"
             result_title = "Блекджек!"
             result_text = f"Натуральный блекджек! Выигрыш: **+{int(self.bet*1.5)}{MONEY}**"
             color = discord.Color.from_str("#45248e")
         elif outcome == 'win':
-            add_bank(self.user.id, self.guild_id, self.bet)
             result_emoji = "✅"
             result_title = "Победа!"
             result_text = f"Вы выиграли: **+{self.bet}{MONEY}**"
@@ -2716,7 +2767,6 @@ class BlackjackView(ui.View):
             result_text = "Ставка возвращена"
             color = discord.Color.from_str("#45248e")
         else:
-            add_bank(self.user.id, self.guild_id, -self.bet)
             result_emoji = "❌"
             result_title = "Поражение"
             result_text = f"Вы проиграли: **-{self.bet}{MONEY}**"
@@ -2755,30 +2805,32 @@ class BlackjackView(ui.View):
 
     async def on_timeout(self):
         """Handle timeout - player loses"""
-        if not self.finished:
-            self.finished = True
-            add_bank(self.user.id, self.guild_id, -self.bet)
-            
-            embed = discord.Embed(
-                title="⏰ Время вышло",
-                description=f"Вы не ответили в течение минуты и автоматически проиграли.\n\nПотеря: **-{self.bet}{MONEY}**",
-                color=discord.Color.from_str("#45248e")
-            )
-            embed.set_thumbnail(url=self.user.display_avatar.url)
-            
-            # Remove from active games
-            if hasattr(self.cog, '_active_blackjack_games'):
-                self.cog._active_blackjack_games.discard(self.user.id)
-            
+        if self.finished:
+            return
+        # Ставка уже списана при старте игры — она просто не возвращается
+        self.finished = True
+        self.settled = True
+        
+        embed = discord.Embed(
+            title="⏰ Время вышло",
+            description=f"Вы не ответили в течение минуты и автоматически проиграли.\n\nПотеря: **-{self.bet}{MONEY}**",
+            color=discord.Color.from_str("#45248e")
+        )
+        embed.set_thumbnail(url=self.user.display_avatar.url)
+        
+        # Remove from active games
+        if hasattr(self.cog, '_active_blackjack_games'):
+            self.cog._active_blackjack_games.discard(self.user.id)
+        
         for child in self.children:
             if isinstance(child, ui.Button):
                 child.disabled = True
-            
-            # Try to edit message
-            try:
-                await self.message.edit(embed=embed, view=self)
-            except:
-                pass
+        
+        # Try to edit message
+        try:
+            await self.message.edit(embed=embed, view=self)
+        except:
+            pass
 
     @ui.button(label="Взять карту", style=discord.ButtonStyle.primary)
     async def hit(self, interaction: discord.Interaction, button: ui.Button):
@@ -2870,14 +2922,13 @@ class BlackjackView(ui.View):
                 outcome = 'push'
         
         # Settle bet
+        await self._settle(outcome)
         if outcome == 'blackjack':
-            add_bank(self.user.id, self.guild_id, int(self.bet * 1.5))
             result_emoji = "🎉"
             result_title = "Блекджек!"
             result_text = f"Натуральный блекджек! Выигрыш: **+{int(self.bet*1.5)}{MONEY}**"
             color = discord.Color.from_str("#45248e")
         elif outcome == 'win':
-            add_bank(self.user.id, self.guild_id, self.bet)
             result_emoji = "✅"
             result_title = "Победа!"
             result_text = f"Вы выиграли: **+{self.bet}{MONEY}**"
@@ -2888,7 +2939,6 @@ class BlackjackView(ui.View):
             result_text = "Ставка возвращена"
             color = discord.Color.from_str("#45248e")
         else:
-            add_bank(self.user.id, self.guild_id, -self.bet)
             result_emoji = "❌"
             result_title = "Поражение"
             result_text = f"Вы проиграли: **-{self.bet}{MONEY}**"
@@ -2939,16 +2989,15 @@ class BlackjackReplayView(ui.View):
             await interaction.response.send_message("❌ Это не ваша игра!", ephemeral=True)
             return
         
-        # Проверяем баланс
-        acc = get_or_create_account(interaction.user.id, self.guild_id)
-        bank = acc[1] or 0
-        
-        if bank < self.bet:
+        # Списываем ставку новой игры
+        if not await run_db(spend_bank, interaction.user.id, self.guild_id, self.bet, kind='blackjack'):
+            bank = (await run_db(get_or_create_account, interaction.user.id, self.guild_id))[1] or 0
             await interaction.response.send_message(f"❌ Недостаточно средств! Нужно {self.bet}{MONEY}, у вас {bank}{MONEY}", ephemeral=True)
             return
         
         # Создаем новую игру
         view = BlackjackView(self.user, self.guild_id, self.bet, self.cog)
+        view.message = interaction.message
         embed = view.build_embed()
         embed.title = "🃏 Блекджек"
         embed.description = f"Ставка: **{self.bet}{MONEY}**\nВыберите действие:"
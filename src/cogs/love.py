@@ -10,10 +10,11 @@ from typing import Optional
 from src.core.config import settings
 from src.utils.embed import create_embed, EmbedColors
 from src.database.love import (
-    init_love_db,
     create_couple,
     get_couple_by_user,
     get_couple_by_id,
+    get_coupled_user_ids,
+    is_coupled,
     update_couple_description,
     delete_couple,
     start_voice_session,
@@ -21,17 +22,33 @@ from src.database.love import (
     get_total_voice_time,
     get_active_session,
     cleanup_expired_sessions,
+    clear_active_sessions,
     has_love_room_access,
     get_love_room_access_expiry,
     add_love_room_access,
-    remove_expired_access,
+    get_all_love_room_access,
+    remove_love_room_access,
 )
 from src.database.economy import (
     get_or_create_account,
     add_cash,
+    spend_cash,
     transfer_cash_to_bank
 )
-from src.database.connection import get_connection
+from src.database.connection import get_connection, DB_PATH
+from src.database.engine import run_db
+from src.database.migrations import ensure_schema
+from src.servies.voice_router import CHANNEL_CHANGES, VoiceTransition, voice_router
+from src.servies.scheduler import scheduler
+from src.utils.members import member_resolver
+
+
+async def _schedule_love_access(user_id: int, expires_at: Optional[str] = None):
+    """Ставит продление/снятие доступа к love комнатам на момент его истечения"""
+    expires_at = expires_at or await run_db(get_love_room_access_expiry, user_id)
+    if expires_at:
+        # expires_at хранится в локальном времени (datetime.now().isoformat())
+        scheduler.schedule("love_access", user_id, datetime.fromisoformat(expires_at).timestamp())
 
 class MarryConfirmationView(discord.ui.View):
     def __init__(self, proposer: discord.Member, target: discord.Member, timeout: float = 60.0):
@@ -47,10 +64,11 @@ class MarryConfirmationView(discord.ui.View):
             return
         
         # Проверяем баланс инициатора
-        proposer_account = get_or_create_account(self.proposer.id, settings.TEST_GUILD_ID)
+        proposer_account = await run_db(get_or_create_account, self.proposer.id, settings.TEST_GUILD_ID)
         marry_cost = settings.LOVE_MARRY_COST
         
-        if proposer_account[0] < marry_cost:  # cash - первый элемент tuple
+        # Проверка и списание — один условный UPDATE
+        if proposer_account[0] < marry_cost or not await run_db(spend_cash, self.proposer.id, settings.TEST_GUILD_ID, marry_cost, kind='love'):
             embed = create_embed(
                 title="❌ Недостаточно средств",
                 description=f"У {self.proposer.display_name} недостаточно средств для создания пары.\n"
@@ -61,14 +79,11 @@ class MarryConfirmationView(discord.ui.View):
             await interaction.response.edit_message(embed=embed, view=None)
             return
         
-        # Списываем средства
-        add_cash(self.proposer.id, settings.TEST_GUILD_ID, -marry_cost)
-        
         self.confirmed = True
         self.stop()
         
         # Создаем пару
-        success = create_couple(self.proposer.id, self.target.id)
+        success = await run_db(create_couple, self.proposer.id, self.target.id)
         
         if success:
             embed = create_embed(
@@ -81,7 +96,7 @@ class MarryConfirmationView(discord.ui.View):
             await interaction.response.edit_message(embed=embed, view=None)
         else:
             # Возвращаем деньги при ошибке
-            add_cash(self.proposer.id, settings.TEST_GUILD_ID, marry_cost)
+            await run_db(add_cash, self.proposer.id, settings.TEST_GUILD_ID, marry_cost, kind='love')
             embed = create_embed(
                 title="❌ Ошибка",
                 description="Не удалось создать пару. Деньги возвращены.",
@@ -151,10 +166,10 @@ class LoveRoomAccessView(discord.ui.View):
             return
         
         # Проверяем баланс
-        user_account = get_or_create_account(self.user.id, settings.TEST_GUILD_ID)
+        user_account = await run_db(get_or_create_account, self.user.id, settings.TEST_GUILD_ID)
         room_cost = settings.LOVE_ROOM_ACCESS_COST
         
-        if user_account[0] < room_cost:  # cash - первый элемент tuple
+        if user_account[0] < room_cost or not await run_db(spend_cash, self.user.id, settings.TEST_GUILD_ID, room_cost, kind='love'):
             embed = create_embed(
                 title="❌ Недостаточно средств",
                 description=f"У вас недостаточно средств для покупки доступа к Love комнатам.\n"
@@ -165,18 +180,16 @@ class LoveRoomAccessView(discord.ui.View):
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
         
-        # Списываем средства
-        add_cash(self.user.id, settings.TEST_GUILD_ID, -room_cost)
-        
         # Добавляем доступ
-        success = add_love_room_access(self.user.id, 1)
+        success = await run_db(add_love_room_access, self.user.id, 1)
         
         if success:
-            expiry_date = get_love_room_access_expiry(self.user.id)
+            expiry_date = await run_db(get_love_room_access_expiry, self.user.id)
+            await _schedule_love_access(self.user.id, expiry_date)
             expiry_str = datetime.fromisoformat(expiry_date).strftime('%d.%m.%Y')
             
             # Получаем информацию о паре для обновления embed
-            couple = get_couple_by_user(self.user.id)
+            couple = await run_db(get_couple_by_user, self.user.id)
             if couple:
                 # Получаем информацию о партнере
                 partner_id = couple['user2_id'] if couple['user1_id'] == self.user.id else couple['user1_id']
@@ -184,7 +197,7 @@ class LoveRoomAccessView(discord.ui.View):
                 
                 if partner:
                     # Получаем общее время в голосовых каналах
-                    total_time = get_total_voice_time(couple['id'])
+                    total_time = await run_db(get_total_voice_time, couple['id'])
                     time_str = self.format_time(total_time)
                     
                     # Получаем количество дней вместе
@@ -261,7 +274,7 @@ class LoveRoomAccessView(discord.ui.View):
             await interaction.response.edit_message(embed=embed, view=self)
         else:
             # Возвращаем деньги при ошибке
-            add_cash(self.user.id, settings.TEST_GUILD_ID, room_cost)
+            await run_db(add_cash, self.user.id, settings.TEST_GUILD_ID, room_cost, kind='love')
             embed = create_embed(
                 title="❌ Ошибка",
                 description="Не удалось купить доступ. Деньги возвращены.",
@@ -277,131 +290,108 @@ class LoveCog(commands.Cog):
         
     async def cog_load(self):
         """Инициализация при загрузке кога"""
-        init_love_db()
+        ensure_schema(DB_PATH)
         
-        # Очищаем активные сессии при запуске
-        conn = get_connection()
-        cursor = conn.cursor()
+        # Очищаем активные сессии при запуске (до первых голосовых событий, но вне цикла событий)
         try:
-            cursor.execute("DELETE FROM active_sessions")
-            conn.commit()
+            await run_db(clear_active_sessions)
             logging.info("🧹 Очищены активные сессии при запуске")
         except Exception as e:
             logging.error(f"Ошибка при очистке активных сессий: {e}")
-        finally:
-            conn.close()
+        
+        # Множество пар в памяти: голосовые события без пары не трогают БД
+        await run_db(get_coupled_user_ids)
+        voice_router.subscribe("love", self._on_voice_transition, kinds=CHANNEL_CHANGES,
+                               predicate=self._is_love_transition)
         
         logging.info("💕 Love cog загружен")
         
+        # Ежемесячная оплата — задача планировщика на момент истечения доступа каждого пользователя
+        scheduler.register("love_access", self._renew_love_access)
+        scheduler.schedule_many(
+            "love_access",
+            [(row['user_id'], datetime.fromisoformat(row['expires_at']).timestamp(), None)
+             for row in await run_db(get_all_love_room_access)],
+            replace=False,
+        )
+        
         # Запускаем задачи
         self.cleanup_task.start()
-        self.monthly_payment_task.start()
     
     async def cog_unload(self):
         """Очистка при выгрузке кога"""
+        voice_router.unsubscribe("love")
+        scheduler.unregister("love_access")
         self.cleanup_task.cancel()
-        self.monthly_payment_task.cancel()
         self.periodic_save_task.cancel()
         logging.info("💕 Love cog выгружен")
     
     @tasks.loop(hours=1)
     async def cleanup_task(self):
-        """Периодическая очистка устаревших сессий и доступов"""
+        """Периодическая очистка устаревших сессий (истечение доступов — в планировщике)"""
         try:
-            cleaned = cleanup_expired_sessions()
+            cleaned = await run_db(cleanup_expired_sessions)
             if cleaned > 0:
                 logging.info(f"🧹 Очищено {cleaned} устаревших сессий")
-            
-            # Очищаем истекшие доступы к love комнатам
-            expired_access = remove_expired_access()
-            if expired_access > 0:
-                logging.info(f"🧹 Удалено {expired_access} истекших доступов к Love комнатам")
         except Exception as e:
             logging.error(f"Ошибка при очистке: {e}")
     
-    @tasks.loop(hours=24)  # Проверяем каждый день
-    async def monthly_payment_task(self):
-        """Ежемесячное списание за love комнаты"""
-        try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Получаем всех пользователей с активным доступом, у которых прошло 30 дней с последнего платежа
-            cursor.execute("""
-                SELECT user_id, created_at FROM love_room_access 
-                WHERE expires_at > datetime('now')
-                AND date(created_at) <= date('now', '-30 days')
-            """)
-            
-            users_with_access = cursor.fetchall()
-            conn.close()
+    async def _renew_love_access(self, key: str, payload):
+        """Ежемесячное списание за love комнаты — вызывается планировщиком в момент истечения доступа"""
+        user_id = int(key)
+        monthly_cost = settings.LOVE_ROOM_ACCESS_COST
+        
+        # Получаем аккаунт пользователя
+        account = await run_db(get_or_create_account, user_id, settings.TEST_GUILD_ID)
+        
+        # Списываем средства, только если их хватает
+        if account[0] >= monthly_cost and await run_db(spend_cash, user_id, settings.TEST_GUILD_ID, monthly_cost, kind='love'):
+            logging.info(f"💳 Ежемесячная оплата Love комнат: {user_id} - {monthly_cost}")
             
-            if not users_with_access:
-                logging.info("💳 Нет пользователей для ежемесячного списания")
-                return
+            # Продлеваем доступ на месяц от даты истечения и ставим следующее списание
+            await run_db(add_love_room_access, user_id, 1)
+            await _schedule_love_access(user_id)
             
-            monthly_cost = settings.LOVE_ROOM_ACCESS_COST
-            successful_payments = 0
-            failed_payments = 0
+            # Отправляем уведомление пользователю
+            try:
+                user = self.bot.get_user(user_id)
+                if user:
+                    embed = create_embed(
+                        title="💳 Ежемесячная оплата Love комнат",
+                        description=f"С вашего счета списано {monthly_cost} {settings.ECONOMY_SYMBOL} за доступ к Love комнатам.\n"
+                                   f"Доступ продлен на 30 дней.",
+                        color=EmbedColors.SUCCESS
+                    )
+                    await user.send(embed=embed)
+            except Exception as e:
+                logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
+        else:
+            # Удаляем доступ, если нет средств
+            await run_db(remove_love_room_access, user_id)
+            logging.info(f"❌ Недостаточно средств для Love комнат: {user_id}")
             
-            for user_row in users_with_access:
-                user_id = user_row['user_id']
-                
-                # Получаем аккаунт пользователя
-                account = get_or_create_account(user_id, settings.TEST_GUILD_ID)
-                
-                if account[0] >= monthly_cost:  # cash - первый элемент tuple
-                    # Списываем средства
-                    add_cash(user_id, settings.TEST_GUILD_ID, -monthly_cost)
-                    successful_payments += 1
-                    logging.info(f"💳 Ежемесячная оплата Love комнат: {user_id} - {monthly_cost}")
-                    
-                    # Обновляем дату создания доступа (это будет дата последнего платежа)
-                    add_love_room_access(user_id, 1)  # Продлеваем на месяц
-                    
-                    # Отправляем уведомление пользователю
-                    try:
-                        user = self.bot.get_user(user_id)
-                        if user:
-                            embed = create_embed(
-                                title="💳 Ежемесячная оплата Love комнат",
-                                description=f"С вашего счета списано {monthly_cost} {settings.ECONOMY_SYMBOL} за доступ к Love комнатам.\n"
-                                           f"Доступ продлен на 30 дней.",
-                                color=EmbedColors.SUCCESS
-                            )
-                            await user.send(embed=embed)
-                    except Exception as e:
-                        logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
-                else:
-                    # Удаляем доступ, если нет средств
-                    remove_expired_access()  # Это удалит истекшие доступы
-                    failed_payments += 1
-                    logging.info(f"❌ Недостаточно средств для Love комнат: {user_id}")
-                    
-                    # Отправляем уведомление о недостатке средств
-                    try:
-                        user = self.bot.get_user(user_id)
-                        if user:
-                            embed = create_embed(
-                                title="❌ Недостаточно средств",
-                                description=f"У вас недостаточно средств для оплаты Love комнат.\n"
-                                           f"Требуется: {monthly_cost} {settings.ECONOMY_SYMBOL}\n"
-                                           f"Доступ к Love комнатам приостановлен.",
-                                color=EmbedColors.ERROR
-                            )
-                            await user.send(embed=embed)
-                    except Exception as e:
-                        logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
-            
-            if successful_payments > 0 or failed_payments > 0:
-                logging.info(f"💳 Ежемесячная оплата Love комнат: успешно {successful_payments}, неудачно {failed_payments}")
-                
-        except Exception as e:
-            logging.error(f"Ошибка при ежемесячном списании: {e}")
+            # Отправляем уведомление о недостатке средств
+            try:
+                user = self.bot.get_user(user_id)
+                if user:
+                    embed = create_embed(
+                        title="❌ Недостаточно средств",
+                        description=f"У вас недостаточно средств для оплаты Love комнат.\n"
+                                   f"Требуется: {monthly_cost} {settings.ECONOMY_SYMBOL}\n"
+                                   f"Доступ к Love комнатам приостановлен.",
+                        color=EmbedColors.ERROR
+                    )
+                    await user.send(embed=embed)
+            except Exception as e:
+                logging.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
     
     @tasks.loop(minutes=5)  # Каждые 5 минут
     async def periodic_save_task(self):
         """Периодическое сохранение активных сессий"""
+        await run_db(self._save_active_sessions)
+
+    def _save_active_sessions(self):
+        """Сохраняет промежуточную длительность активных сессий; выполняется в потоке БД"""
         try:
             conn = get_connection()
             cursor = conn.cursor()
@@ -477,7 +467,7 @@ class LoveCog(commands.Cog):
         """Команда для показа профиля пары"""
         try:
             # Получаем информацию о паре
-            couple = get_couple_by_user(interaction.user.id)
+            couple = await run_db(get_couple_by_user, interaction.user.id)
             
             if not couple:
                 embed = create_embed(
@@ -504,15 +494,15 @@ class LoveCog(commands.Cog):
                 return
             
             # Получаем общее время в голосовых каналах
-            total_time = get_total_voice_time(couple['id'])
+            total_time = await run_db(get_total_voice_time, couple['id'])
             time_str = self.format_time(total_time)
             
             # Получаем количество дней вместе
             days_together = self.get_days_together(couple['created_at'])
             
             # Проверяем доступ к love комнатам
-            has_access = has_love_room_access(interaction.user.id)
-            access_expiry = get_love_room_access_expiry(interaction.user.id)
+            has_access = await run_db(has_love_room_access, interaction.user.id)
+            access_expiry = await run_db(get_love_room_access_expiry, interaction.user.id)
             
             # Создаем embed
             embed = create_embed(
@@ -595,7 +585,7 @@ class LoveCog(commands.Cog):
                 return
             
             # Проверяем, что пользователь не состоит уже в паре
-            existing_couple = get_couple_by_user(interaction.user.id)
+            existing_couple = await run_db(get_couple_by_user, interaction.user.id)
             if existing_couple:
                 embed = create_embed(
                     title="❌ Уже в паре",
@@ -607,7 +597,7 @@ class LoveCog(commands.Cog):
                 return
             
             # Проверяем, что целевой пользователь не состоит в паре
-            target_couple = get_couple_by_user(user.id)
+            target_couple = await run_db(get_couple_by_user, user.id)
             if target_couple:
                 embed = create_embed(
                     title="❌ Пользователь уже в паре",
@@ -645,7 +635,7 @@ class LoveCog(commands.Cog):
         """Команда для расторжения пары"""
         try:
             # Получаем информацию о паре
-            couple = get_couple_by_user(interaction.user.id)
+            couple = await run_db(get_couple_by_user, interaction.user.id)
             
             if not couple:
                 embed = create_embed(
@@ -658,7 +648,7 @@ class LoveCog(commands.Cog):
                 return
             
             # Расторгаем пару
-            success = delete_couple(couple['id'])
+            success = await run_db(delete_couple, couple['id'])
             
             if success:
                 embed = create_embed(
@@ -749,11 +739,16 @@ class LoveCog(commands.Cog):
         except Exception as e:
             logging.error(f"Ошибка при кике пользователя {member.display_name} из лаврумы: {e}")
     
-    @commands.Cog.listener()
-    async def on_voice_state_update(self, member, before, after):
+    def _is_love_transition(self, transition: VoiceTransition) -> bool:
+        """Событие касается лаврумы или одной из активных love комнат"""
+        return any(channel_id == settings.LOVE_VOICE_CHANNEL_ID or channel_id in self.active_rooms
+                   for channel_id in transition.channel_ids)
+
+    async def _on_voice_transition(self, transition: VoiceTransition):
         """Обработка событий голосовых каналов"""
+        member, before, after = transition.member, transition.before, transition.after
         try:
-            logging.info(f"Voice state update: {member.display_name} - {before.channel} -> {after.channel}")
+            logging.debug(f"Voice state update: {member.display_name} - {before.channel} -> {after.channel}")
             
             # Проверка при входе в лавруму (голосовой канал для создания love комнат)
             if (after.channel and 
@@ -761,14 +756,13 @@ class LoveCog(commands.Cog):
                 not before.channel):
                 
                 # Проверяем, что пользователь состоит в паре
-                couple = get_couple_by_user(member.id)
-                if not couple:
+                if not await run_db(is_coupled, member.id):
                     logging.info(f"Пользователь {member.display_name} зашел в лавруму без пары")
                     await self._kick_from_love_room(member, "У вас нет пары для создания love комнаты")
                     return
                 
                 # Проверяем доступ к love комнатам
-                if not has_love_room_access(member.id):
+                if not await run_db(has_love_room_access, member.id):
                     logging.info(f"У пользователя {member.display_name} нет доступа к love комнатам")
                     await self._kick_from_love_room(member, "У вас нет доступа к love комнатам. Купите доступ в магазине!")
                     return
@@ -777,12 +771,14 @@ class LoveCog(commands.Cog):
                 logging.info(f"Пользователь {member.display_name} прошел все проверки для лаврумы")
             
             # Проверяем, что пользователь состоит в паре (для остальной логики)
-            couple = get_couple_by_user(member.id)
+            if not await run_db(is_coupled, member.id):
+                logging.debug(f"Пользователь {member.display_name} не состоит в паре")
+                return
+            couple = await run_db(get_couple_by_user, member.id)
             if not couple:
-                logging.info(f"Пользователь {member.display_name} не состоит в паре")
                 return
             
-            logging.info(f"Пользователь {member.display_name} состоит в паре {couple['id']}")
+            logging.debug(f"Пользователь {member.display_name} состоит в паре {couple['id']}")
             
             # Если пользователь зашел в специальный канал для создания love комнат
             if (after.channel and 
@@ -792,7 +788,7 @@ class LoveCog(commands.Cog):
                 logging.info(f"Пользователь {member.display_name} зашел в канал создания love комнат")
                 
                 # Проверяем, есть ли уже активная сессия
-                active_session = get_active_session(couple['id'])
+                active_session = await run_db(get_active_session, couple['id'])
                 if active_session:
                     logging.info(f"У пары {couple['id']} уже есть активная сессия")
                     return
@@ -807,7 +803,7 @@ class LoveCog(commands.Cog):
                 
                 # Получаем информацию о партнере
                 partner_id = couple['user2_id'] if couple['user1_id'] == member.id else couple['user1_id']
-                partner = guild.get_member(partner_id)
+                partner = await member_resolver.get(guild, partner_id)
                 
                 if not partner:
                     logging.error(f"Партнер {partner_id} не найден в гильдии")
@@ -846,7 +842,7 @@ class LoveCog(commands.Cog):
                   after.channel.id in self.active_rooms):
                 
                 couple_id = self.active_rooms[after.channel.id]
-                couple = get_couple_by_id(couple_id)
+                couple = await run_db(get_couple_by_id, couple_id)
                 
                 if couple:
                     guild = member.guild
@@ -858,9 +854,9 @@ class LoveCog(commands.Cog):
                         user2 and user2.voice and user2.voice.channel.id == after.channel.id):
                         
                         # Оба пользователя в комнате, начинаем отслеживание времени
-                        active_session = get_active_session(couple_id)
+                        active_session = await run_db(get_active_session, couple_id)
                         if not active_session:
-                            start_voice_session(couple_id, after.channel.id)
+                            await run_db(start_voice_session, couple_id, after.channel.id)
                             logging.info(f"Начато отслеживание времени для пары {couple_id}")
             
             # Если пользователь покинул love комнату
@@ -869,7 +865,7 @@ class LoveCog(commands.Cog):
                   not after.channel):
                 
                 couple_id = self.active_rooms[before.channel.id]
-                couple = get_couple_by_id(couple_id)
+                couple = await run_db(get_couple_by_id, couple_id)
                 
                 if couple:
                     guild = member.guild
@@ -886,7 +882,7 @@ class LoveCog(commands.Cog):
                     
                     if not someone_in_room:
                         # Никого из пары не осталось в комнате, завершаем сессию и удаляем канал
-                        duration = end_voice_session(couple_id)
+                        duration = await run_db(end_voice_session, couple_id)
                         
                         if duration:
                             logging.info(f"Сессия завершена для пары {couple_id}, продолжительность: {duration} секунд")
@@ -901,7 +897,7 @@ class LoveCog(commands.Cog):
                         del self.active_rooms[before.channel.id]
                     else:
                         # Кто-то из пары остался в комнате, просто завершаем сессию
-                        duration = end_voice_session(couple_id)
+                        duration = await run_db(end_voice_session, couple_id)
                         if duration:
                             logging.info(f"Сессия завершена для пары {couple_id}, продолжительность: {duration} секунд")
             
@@ -912,7 +908,7 @@ class LoveCog(commands.Cog):
                   after.channel.id != before.channel.id):
                 
                 couple_id = self.active_rooms[before.channel.id]
-                couple = get_couple_by_id(couple_id)
+                couple = await run_db(get_couple_by_id, couple_id)
                 
                 if couple:
                     guild = member.guild
@@ -929,7 +925,7 @@ class LoveCog(commands.Cog):
                     
                     if not someone_in_room:
                         # Никого из пары не осталось в комнате, завершаем сессию и удаляем канал
-                        duration = end_voice_session(couple_id)
+                        duration = await run_db(end_voice_session, couple_id)
                         
                         if duration:
                             logging.info(f"Сессия завершена для пары {couple_id}, продолжительность: {duration} секунд")
@@ -944,7 +940,7 @@ class LoveCog(commands.Cog):
                         del self.active_rooms[before.channel.id]
                     else:
                         # Кто-то из пары остался в комнате, просто завершаем сессию
-                        duration = end_voice_session(couple_id)
+                        duration = await run_db(end_voice_session, couple_id)
                         if duration:
                             logging.info(f"Сессия завершена для пары {couple_id}, продолжительность: {duration} секунд")
                 
@@ -1,8 +1,8 @@
+import time
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands, ui
 from datetime import timedelta, datetime
-import sqlite3
 from src.core.config import settings
 from src.database.discipline import (
     add_warning,
@@ -18,40 +18,44 @@ from src.database.discipline import (
 )
 from src.utils.embed import create_embed, EmbedColors
 from src.database.discipline import add_punishment_history
-
-
-DB_PATH = "src/database/mutes.db"
+from src.database.engine import run_db
+from src.database.mutes import DB_PATH, get_connection
+from src.database.migrations import ensure_schema
+from src.servies.scheduler import scheduler, utc_naive_to_epoch
+from src.utils.members import member_resolver
 
 
 class ModerationCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.init_db()
-        self.check_mutes.start()
+        # Снятие мутов и банов — отдельная задача планировщика на каждый срок
+        scheduler.register("mute", self._expire_mute)
+        scheduler.schedule_many(
+            "mute",
+            [(self._mute_key(user_id, guild_id, mute_type), utc_naive_to_epoch(end_time), None)
+             for user_id, guild_id, mute_type, end_time in self.get_all_mutes()],
+            replace=False,
+        )
         self.cleanup_discipline.start()
 
+    def cog_unload(self):
+        scheduler.unregister("mute")
+        self.cleanup_discipline.cancel()
+
     def init_db(self):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mutes (
-                user_id INTEGER,
-                guild_id INTEGER,
-                type TEXT,
-                end_time REAL,
-                PRIMARY KEY (user_id, guild_id, type)
-            )
-        """)
-        # punishments_history теперь хранится в discipline.db
-        conn.commit()
-        conn.close()
+        ensure_schema(DB_PATH)
+
+    @staticmethod
+    def _mute_key(user_id: int, guild_id: int, mute_type: str) -> str:
+        return f"{guild_id}:{user_id}:{mute_type}"
 
-    def log_punishment(self, user_id: int, guild_id: int, moderator_id: int, ptype: str, reason: str):
+    async def log_punishment(self, user_id: int, guild_id: int, moderator_id: int, ptype: str, reason: str):
         # Записываем в discipline.db, чтобы история учитывала все виды наказаний
-        add_punishment_history(user_id, guild_id, moderator_id, ptype, reason, datetime.utcnow().timestamp())
+        await run_db(add_punishment_history, user_id, guild_id, moderator_id, ptype, reason, datetime.utcnow().timestamp())
 
     def count_total_punishments(self, user_id: int, guild_id: int) -> int:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "SELECT COUNT(*) FROM punishments_history WHERE user_id = ? AND guild_id = ?",
@@ -61,10 +65,22 @@ class ModerationCog(commands.Cog):
         conn.close()
         return result
 
+    def get_active_mutes(self, user_id: int, guild_id: int) -> list:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT type FROM mutes WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+        rows = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return rows
 
-    def save_mute(self, user_id: int, guild_id: int, mute_type: str, duration: timedelta):
+    async def save_mute(self, user_id: int, guild_id: int, mute_type: str, duration: timedelta):
+        # Запись — в потоке БД, постановка снятия — в loop: планировщик не потокобезопасен
         end_time = (datetime.utcnow() + duration).timestamp()
-        conn = sqlite3.connect(DB_PATH)
+        await run_db(self._save_mute, user_id, guild_id, mute_type, end_time)
+        scheduler.schedule("mute", self._mute_key(user_id, guild_id, mute_type), time.time() + duration.total_seconds())
+
+    def _save_mute(self, user_id: int, guild_id: int, mute_type: str, end_time: float):
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "REPLACE INTO mutes (user_id, guild_id, type, end_time) VALUES (?, ?, ?, ?)",
@@ -73,8 +89,12 @@ class ModerationCog(commands.Cog):
         conn.commit()
         conn.close()
 
-    def remove_mute(self, user_id: int, guild_id: int, mute_type: str):
-        conn = sqlite3.connect(DB_PATH)
+    async def remove_mute(self, user_id: int, guild_id: int, mute_type: str):
+        await run_db(self._delete_mute, user_id, guild_id, mute_type)
+        scheduler.cancel("mute", self._mute_key(user_id, guild_id, mute_type))
+
+    def _delete_mute(self, user_id: int, guild_id: int, mute_type: str):
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "DELETE FROM mutes WHERE user_id = ? AND guild_id = ? AND type = ?",
@@ -84,7 +104,7 @@ class ModerationCog(commands.Cog):
         conn.close()
 
     def get_all_mutes(self):
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT user_id, guild_id, type, end_time FROM mutes")
         rows = cursor.fetchall()
@@ -92,52 +112,40 @@ class ModerationCog(commands.Cog):
         return rows
 
     # ========== TASK ==========
-    @tasks.loop(minutes=1)
-    async def check_mutes(self):
-        """Проверяет истёкшие мюты"""
-        now = datetime.utcnow().timestamp()
-        expired = []
-
-        for user_id, guild_id, mute_type, end_time in self.get_all_mutes():
-            if end_time <= now:
-                expired.append((user_id, guild_id, mute_type))
-
-        for user_id, guild_id, mute_type in expired:
-            guild = self.bot.get_guild(guild_id)
-            if not guild:
-                continue
-
-            member = guild.get_member(user_id)
-            if not member:
-                continue
-
-            try:
-                if mute_type == "text":
-                    mute_role = guild.get_role(settings.TEXT_MUTE_ROLE_ID)
-                    if mute_role and mute_role in member.roles:
-                        await member.remove_roles(mute_role, reason="Истёк срок мута")
-                elif mute_type == "voice":
-                    mute_role = guild.get_role(settings.VOICE_MUTE_ROLE_ID)
-                    if mute_role and mute_role in member.roles:
-                        await member.remove_roles(mute_role, reason="Истёк срок мута")
-                elif mute_type == "ban":
-                    try:
-                        await guild.unban(discord.Object(id=user_id), reason="Истёк срок бана")
-                    except discord.NotFound:
-                        pass
-            except Exception as e:
-                print(f"⚠️ Ошибка при снятии мута с {member}: {e}")
-
-            self.remove_mute(user_id, guild_id, mute_type)
-
-    @check_mutes.before_loop
-    async def before_check_mutes(self):
-        await self.bot.wait_until_ready()
+    async def _expire_mute(self, key: str, payload):
+        """Снимает истёкший мут или бан (вызывается планировщиком точно в срок)"""
+        guild_id, user_id, mute_type = key.split(":")
+        guild_id, user_id = int(guild_id), int(user_id)
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            # Сервер ещё недоступен — планировщик повторит попытку
+            raise RuntimeError(f"сервер {guild_id} недоступен")
+
+        member = await member_resolver.get(guild, user_id)
+        try:
+            if mute_type == "text" and member:
+                mute_role = guild.get_role(settings.TEXT_MUTE_ROLE_ID)
+                if mute_role and mute_role in member.roles:
+                    await member.remove_roles(mute_role, reason="Истёк срок мута")
+            elif mute_type == "voice" and member:
+                mute_role = guild.get_role(settings.VOICE_MUTE_ROLE_ID)
+                if mute_role and mute_role in member.roles:
+                    await member.remove_roles(mute_role, reason="Истёк срок мута")
+            elif mute_type == "ban":
+                # Забаненного нет среди участников, поэтому снимаем бан по ID
+                try:
+                    await guild.unban(discord.Object(id=user_id), reason="Истёк срок бана")
+                except discord.NotFound:
+                    pass
+        except Exception as e:
+            print(f"⚠️ Ошибка при снятии мута с {member or user_id}: {e}")
+
+        await run_db(self._delete_mute, user_id, guild_id, mute_type)
 
     # Очистка просроченных выговоров/страйков
     @tasks.loop(minutes=30)
     async def cleanup_discipline(self):
-        cleanup_expired()
+        await run_db(cleanup_expired)
 
     @cleanup_discipline.before_loop
     async def before_cleanup_discipline(self):
@@ -238,16 +246,9 @@ class ModerationCog(commands.Cog):
             
         await interaction.response.defer(ephemeral=False, thinking=True)
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # активные наказания
-        cursor.execute("SELECT type FROM mutes WHERE user_id = ? AND guild_id = ?", (member.id, interaction.guild.id))
-        active_mutes = [row[0] for row in cursor.fetchall()]
-
-        # общее количество наказаний
-        cursor.execute("SELECT COUNT(*) FROM punishments_history WHERE user_id = ? AND guild_id = ?", (member.id, interaction.guild.id))
-        total_punishments = cursor.fetchone()[0] or 0
-        conn.close()
+        # активные наказания и общее количество наказаний
+        active_mutes = await run_db(self.get_active_mutes, member.id, interaction.guild.id)
+        total_punishments = await run_db(self.count_total_punishments, member.id, interaction.guild.id) or 0
 
         # роли
         roles = [role.mention for role in member.roles if role.name != "@everyone"]
@@ -278,7 +279,7 @@ class ModerationCog(commands.Cog):
         if not (any(r in settings.moderator_command_warn for r in roles) or interaction.user.guild_permissions.administrator):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
-        add_warning(member.id, interaction.guild.id, interaction.user.id, reason)
+        await run_db(add_warning, member.id, interaction.guild.id, interaction.user.id, reason)
         await interaction.response.send_message(f"✅ {member.mention}: предупреждение выдано.", ephemeral=False)
         await self._log_moderation_action(interaction.guild, interaction.user, member, "Предупреждение (команда)", reason)
 
@@ -289,7 +290,7 @@ class ModerationCog(commands.Cog):
         if not (any(r in settings.moderator_command_warn_remove for r in roles) or interaction.user.guild_permissions.administrator):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
-        ok = remove_one_warning(member.id, interaction.guild.id)
+        ok = await run_db(remove_one_warning, member.id, interaction.guild.id)
         if ok:
             await interaction.response.send_message(f"✅ {member.mention}: предупреждение снято.", ephemeral=False)
             await self._log_moderation_action(interaction.guild, interaction.user, member, "Снятие предупреждения (команда)", "Снято 1 предупреждение")
@@ -303,7 +304,7 @@ class ModerationCog(commands.Cog):
         if not (any(r in settings.moderator_command_strike for r in roles) or interaction.user.guild_permissions.administrator):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
-        add_strike(member.id, interaction.guild.id, interaction.user.id, reason)
+        await run_db(add_strike, member.id, interaction.guild.id, interaction.user.id, reason)
         await interaction.response.send_message(f"✅ {member.mention}: страйк выдан.", ephemeral=False)
         await self._log_moderation_action(interaction.guild, interaction.user, member, "Страйк (команда)", reason)
 
@@ -314,7 +315,7 @@ class ModerationCog(commands.Cog):
         if not (any(r in settings.moderator_command_praise for r in roles) or interaction.user.guild_permissions.administrator):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
-        add_praise(member.id, interaction.guild.id, interaction.user.id, reason)
+        await run_db(add_praise, member.id, interaction.guild.id, interaction.user.id, reason)
         await interaction.response.send_message(f"✅ {member.mention}: похвала выдана.", ephemeral=False)
         await self._log_moderation_action(interaction.guild, interaction.user, member, "Похвала (команда)", reason)
 
@@ -326,10 +327,10 @@ class ModerationCog(commands.Cog):
             await interaction.response.send_message("❌ Нет доступа.", ephemeral=False)
             return
         # cleanup first to avoid showing expired
-        cleanup_expired()
-        w = count_warnings(member.id, interaction.guild.id)
-        s = count_strikes(member.id, interaction.guild.id)
-        p = count_praises(member.id, interaction.guild.id)
+        await run_db(cleanup_expired)
+        w = await run_db(count_warnings, member.id, interaction.guild.id)
+        s = await run_db(count_strikes, member.id, interaction.guild.id)
+        p = await run_db(count_praises, member.id, interaction.guild.id)
         embed = create_embed(
             title=f"Дисциплина: {member.display_name}",
             description=(
@@ -380,8 +381,8 @@ class PunishmentModal(ui.Modal, title="Назначение наказания")
                     # refresh member to avoid stale roles cache
                     self.target = await interaction.guild.fetch_member(self.target.id)
                     await self.target.add_roles(mute_role, reason=reason)
-                    cog.save_mute(self.target.id, interaction.guild.id, "text", duration)
-                    cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "text", reason)
+                    await cog.save_mute(self.target.id, interaction.guild.id, "text", duration)
+                    await cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "text", reason)
                     await cog._log_moderation_action(
                         interaction.guild,
                         self.moderator,
@@ -395,8 +396,8 @@ class PunishmentModal(ui.Modal, title="Назначение наказания")
                 if mute_role:
                     self.target = await interaction.guild.fetch_member(self.target.id)
                     await self.target.add_roles(mute_role, reason=reason)
-                    cog.save_mute(self.target.id, interaction.guild.id, "voice", duration)
-                    cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "voice", reason)
+                    await cog.save_mute(self.target.id, interaction.guild.id, "voice", duration)
+                    await cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "voice", reason)
                     await cog._log_moderation_action(
                         interaction.guild,
                         self.moderator,
@@ -407,8 +408,8 @@ class PunishmentModal(ui.Modal, title="Назначение наказания")
                     )
             elif self.action == "ban":
                 await self.target.ban(reason=reason, delete_message_days=0)
-                cog.save_mute(self.target.id, interaction.guild.id, "ban", duration)
-                cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "ban", reason)
+                await cog.save_mute(self.target.id, interaction.guild.id, "ban", duration)
+                await cog.log_punishment(self.target.id, interaction.guild.id, self.moderator.id, "ban", reason)
                 await cog._log_moderation_action(
                     interaction.guild,
                     self.moderator,
@@ -426,13 +427,8 @@ class PunishmentModal(ui.Modal, title="Назначение наказания")
             return
 
         # Пересобираем данные панели
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT type FROM mutes WHERE user_id = ? AND guild_id = ?", (self.target.id, interaction.guild.id))
-        active_mutes = [row[0] for row in cursor.fetchall()]
-        conn.close()
-
-        total_punishments = cog.count_total_punishments(self.target.id, interaction.guild.id)
+        active_mutes = await run_db(cog.get_active_mutes, self.target.id, interaction.guild.id)
+        total_punishments = await run_db(cog.count_total_punishments, self.target.id, interaction.guild.id)
 
         # refresh member before reading roles for accurate state
         self.target = await interaction.guild.fetch_member(self.target.id)
@@ -538,7 +534,7 @@ class WarningModal(ui.Modal, title="Выдать предупреждение"):
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=False, thinking=True)
-        add_warning(self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
+        await run_db(add_warning, self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
         # normalize may add strike; reflect in logs
         await interaction.followup.send(content="✅ Предупреждение выдано.", ephemeral=False)
         cog: ModerationCog = self.bot.get_cog("ModerationCog")
@@ -556,7 +552,7 @@ class PraiseModal(ui.Modal, title="Выдать похвалу"):
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=False, thinking=True)
-        add_praise(self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
+        await run_db(add_praise, self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
         await interaction.followup.send(content="✅ Похвала выдана.", ephemeral=False)
         cog: ModerationCog = self.bot.get_cog("ModerationCog")
         await cog._log_moderation_action(interaction.guild, self.moderator, self.target, "Похвала", self.reason.value)
@@ -573,7 +569,7 @@ class StrikeModal(ui.Modal, title="Выдать страйк"):
 
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=False, thinking=True)
-        add_strike(self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
+        await run_db(add_strike, self.target.id, interaction.guild.id, self.moderator.id, self.reason.value)
         await interaction.followup.send(content="✅ Страйк выдан.", ephemeral=False)
         cog: ModerationCog = self.bot.get_cog("ModerationCog")
         await cog._log_moderation_action(interaction.guild, self.moderator, self.target, "Страйк", self.reason.value)
@@ -633,7 +629,7 @@ class HistoryButton(ui.Button):
             await interaction.response.send_message("❌ Только инициатор может использовать это меню.", ephemeral=False)
             return
         view = HistoryView(self.bot, self.target, self.moderator)
-        embed = view.build_embed(interaction.guild)
+        embed = await view.build_embed(interaction.guild)
         await interaction.response.edit_message(embed=embed, view=view)
 
 
@@ -646,15 +642,15 @@ class HistoryView(ui.View):
         self.page = page
         self.page_size = page_size
 
-    def build_embed(self, guild: discord.Guild) -> discord.Embed:
+    async def build_embed(self, guild: discord.Guild) -> discord.Embed:
         offset = self.page * self.page_size
-        rows = get_history(self.target.id, guild.id, limit=self.page_size, offset=offset)
+        rows = await run_db(get_history, self.target.id, guild.id, limit=self.page_size, offset=offset)
 
         # if empty page but not first, step back one page
         if not rows and self.page > 0:
             self.page -= 1
             offset = self.page * self.page_size
-            rows = get_history(self.target.id, guild.id, limit=self.page_size, offset=offset)
+            rows = await run_db(get_history, self.target.id, guild.id, limit=self.page_size, offset=offset)
 
         lines = []
         for type_, mod_id, reason, created_at, expire_at in rows:
@@ -686,7 +682,7 @@ class HistoryView(ui.View):
             return
         if self.page > 0:
             self.page -= 1
-        embed = self.build_embed(interaction.guild)
+        embed = await self.build_embed(interaction.guild)
         await interaction.response.edit_message(embed=embed, view=self)
 
     @ui.button(label="➡️", style=discord.ButtonStyle.secondary)
@@ -695,7 +691,7 @@ class HistoryView(ui.View):
             await interaction.response.send_message("❌ Только инициатор может использовать это меню.", ephemeral=False)
             return
         self.page += 1
-        embed = self.build_embed(interaction.guild)
+        embed = await self.build_embed(interaction.guild)
         await interaction.response.edit_message(embed=embed, view=self)
 
 def _format_moderator_with_role(guild: discord.Guild, moderator_id: int) -> str:
@@ -763,11 +759,7 @@ class RemovePunishmentSelect(ui.Select):
 
         if self.values[0] == "back":
             # Обновляем список активных наказаний перед возвратом
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT type FROM mutes WHERE user_id = ? AND guild_id = ?", (self.target.id, interaction.guild.id))
-            active_mutes = [row[0] for row in cursor.fetchall()]
-            conn.close()
+            active_mutes = await run_db(cog.get_active_mutes, self.target.id, interaction.guild.id)
 
             view = ModerationView(self.bot, self.target, self.moderator, active_mutes)
             await interaction.followup.edit_message(interaction.message.id, view=view)
@@ -790,7 +782,7 @@ class RemovePunishmentSelect(ui.Select):
             elif action == "ban":
                 await interaction.guild.unban(discord.Object(id=self.target.id), reason="Снятие наказания модератором")
 
-            cog.remove_mute(self.target.id, interaction.guild.id, action)
+            await cog.remove_mute(self.target.id, interaction.guild.id, action)
 
             action_type_map = {
                 "text": "Снятие текстового мута",
@@ -807,13 +799,8 @@ class RemovePunishmentSelect(ui.Select):
             )
 
             # Пересобираем данные
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT type FROM mutes WHERE user_id = ? AND guild_id = ?", (self.target.id, interaction.guild.id))
-            active_mutes = [row[0] for row in cursor.fetchall()]
-            conn.close()
-
-            total_punishments = cog.count_total_punishments(self.target.id, interaction.guild.id)
+            active_mutes = await run_db(cog.get_active_mutes, self.target.id, interaction.guild.id)
+            total_punishments = await run_db(cog.count_total_punishments, self.target.id, interaction.guild.id)
             # refresh member to reflect updated roles in UI
             self.target = await interaction.guild.fetch_member(self.target.id)
             roles = [role.mention for role in self.target.roles if role.name != "@everyone"]
@@ -3,7 +3,10 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from src.core.config import settings
+from src.database.engine import run_db
 from src.database.tickets import ticket_db
+from src.database.migrations import ensure_schema
+from src.utils.members import member_resolver
 import asyncio
 import random
 import string
@@ -15,13 +18,14 @@ class TicketSystem(commands.Cog):
 
     async def cog_load(self):
         """Загружаем persistent views при загрузке кога"""
+        ensure_schema(ticket_db.db_path)
         self.bot.add_view(StaffApplicationView())
         self.bot.add_view(SupportTicketView())
         self.bot.add_view(CloseTicketView())
 
-    def generate_ticket_id(self) -> str:
+    async def generate_ticket_id(self) -> str:
         """Генерирует уникальный ID для тикета из базы данных"""
-        return ticket_db.get_next_ticket_number()
+        return await run_db(ticket_db.get_next_ticket_number)
 
     @commands.command(name="ticket")
     async def ticket_command(self, ctx, action: str = None):
@@ -82,10 +86,10 @@ class TicketSystem(commands.Cog):
         user = interaction.user
         
         # Генерируем ID тикета из базы данных
-        ticket_id = self.generate_ticket_id()
+        ticket_id = await self.generate_ticket_id()
         
         # Сохраняем информацию в базу данных
-        ticket_db.create_ticket(ticket_id, user.id, ticket_type, description, position)
+        await run_db(ticket_db.create_ticket, ticket_id, user.id, ticket_type, description, position)
         
         # Создаем приватную ветку
         thread_name = f"{ticket_id.lower()}-{user.name.lower()}"
@@ -110,10 +114,11 @@ class TicketSystem(commands.Cog):
             roles_to_add = settings.TICKET_TECH_SUPPORT_ROLES
         
         # Добавляем пользователей с ролями в ветку
+        guild_members = await member_resolver.all_members(interaction.guild) if roles_to_add else []
         for role_id in roles_to_add:
             role = interaction.guild.get_role(role_id)
             if role:
-                for member in role.members:
+                for member in (m for m in guild_members if role in m.roles):
                     try:
                         await ticket_thread.add_user(member)
                     except:
@@ -353,7 +358,7 @@ class ConfirmCloseView(discord.ui.View):
         ticket_number = thread_name.split('-')[0].upper() + '-' + thread_name.split('-')[1]
         
         # Обновляем статус в базе данных
-        ticket_db.close_ticket(ticket_number)
+        await run_db(ticket_db.close_ticket, ticket_number)
         
         # Находим пользователя, создавшего тикет (первый пользователь в списке участников ветки)
         ticket_creator = None
@@ -1,46 +1,171 @@
 # src/core/bot.py
 import discord
+from discord import app_commands
 from discord.ext import commands
+from src.core.cache_profile import client_options, get_profile
 from src.core.config import settings
+from src.database.account_cache import account_cache
+from src.database.bot_state import get_state, set_state
+from src.database.engine import engine, run_db
+from src.database.repository import configure_activity_repository, get_activity_repository
+from src.servies import (
+    activity_buffer, command_tree_hash, loop_monitor, metrics, scheduler, startup, tracer, voice_router, voice_sessions,
+    xp_limiter,
+)
+from src.servies.metrics import command_latency, db_latency, events
+from src.utils.members import member_resolver
 import logging
 import asyncio
+import math
+import time
+
+
+def _observe_command(interaction: discord.Interaction, status: str) -> None:
+    started = interaction.extras.pop("started_at", None)
+    if started is not None and interaction.command is not None:
+        command_latency.observe(time.perf_counter() - started, command=interaction.command.qualified_name, status=status)
+    span = interaction.extras.pop("span", None)
+    if span is not None:
+        span.end(status)
+
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """Дерево слэш-команд, замеряющее время выполнения каждой команды и открывающее её трассу"""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started_at"] = time.perf_counter()
+        if interaction.command is not None:
+            # Проверка выполняется в той же задаче, что и сама команда: трасса становится текущей для неё
+            span = tracer.start_root(f"/{interaction.command.qualified_name}",
+                                     guild_id=interaction.guild_id, user_id=interaction.user.id)
+            if span is not None:
+                interaction.extras["span"] = span
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        _observe_command(interaction, "error")
+        await super().on_error(interaction, error)
 
 
 class NaeratusBot(commands.Bot):
     def __init__(self):
-        intents = discord.Intents.all()
+        profile = get_profile(getattr(settings, 'BOT_CACHE_PROFILE', None))
+        options = client_options(profile, settings.EXTENSIONS, getattr(settings, 'BOT_MAX_MESSAGES', None))
+        member_resolver.configure(cache_chunks=profile.cache_on_demand)
+        logging.info(f"🧩 Профиль кэша {profile.name}: интенты {options['intents'].value}, "
+                     f"сообщений в кэше {options['max_messages'] or 0}")
+        tracer.configure(getattr(settings, 'TRACE_EXPORT', ""), getattr(settings, 'TRACE_SAMPLE_RATE', 1.0))
+        if tracer.enabled:
+            # Запросы к REST API и БД — вложенные отрезки трассы команды
+            options["http_trace"] = tracer.http_trace_config()
+            tracer.instrument_views()
+            engine.set_tracer(tracer)
         super().__init__(
             command_prefix=commands.when_mentioned_or(settings.PREFIX),
-            intents=intents,
+            # Статус уходит вместе с IDENTIFY, без отдельного запроса после on_ready
+            activity=discord.Game(name="/help"),
+            status=discord.Status.online,
+            tree_cls=InstrumentedCommandTree,
+            **options,
         )
+        self._sync_task = None
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        """Показатели, которые считываются при запросе /metrics"""
+        engine.add_observer(lambda name, seconds, ok: db_latency.observe(seconds, call=name, status="ok" if ok else "error"))
+        metrics.gauge("bot_gateway_latency_seconds", "Задержка heartbeat gateway",
+                      callback=lambda: self.latency if math.isfinite(self.latency) else -1.0)
+        metrics.gauge("bot_guilds", "Серверов в кэше", callback=lambda: len(self.guilds))
+        metrics.gauge("bot_voice_sessions_open", "Открытые голосовые сессии", callback=lambda: len(voice_sessions))
+        metrics.gauge("bot_scheduled_timers", "Задачи планировщика в памяти", callback=lambda: len(scheduler))
+        metrics.gauge("bot_activity_buffer_pending", "Пользователи с незаписанной активностью",
+                      callback=lambda: len(activity_buffer))
+        metrics.counter("bot_account_cache_requests_total", "Обращения к кэшу счетов", ("result",),
+                        callback=lambda: {("hit",): account_cache.hits, ("miss",): account_cache.misses})
+        metrics.gauge("bot_account_cache_entries", "Записей в кэше счетов", callback=lambda: len(account_cache))
+        metrics.counter("bot_xp_messages_total", "Решения ограничителя опыта за сообщения", ("result",),
+                        callback=lambda: {("allowed",): xp_limiter.allowed, ("rejected",): xp_limiter.rejected})
+        metrics.gauge("bot_db_connections_open", "Открытые соединения SQLite", ("db",),
+                      callback=lambda: {(path,): s["open"] for path, s in engine.stats().items()})
 
     async def setup_hook(self):
-        """Автоматически загружаем коги и синхронизируем слэш-команды"""
-        for ext in settings.EXTENSIONS:
-            try:
-                await self.load_extension(ext)
-                logging.info(f"✅ Ког загружен: {ext}")
-            except Exception as e:
-                logging.error(f"❌ Ошибка при загрузке {ext}: {e}")
+        """Загружаем коги (параллельно, с учётом зависимостей) и синхронизируем слэш-команды"""
+        startup.mark("login")
+        # Замер задержки цикла — с самого старта: блокировки при загрузке тоже интересны
+        loop_monitor.start(getattr(settings, 'LOOP_STALL_THRESHOLD', 0.25))
+        with startup.phase("storage"):
+            account_cache.configure(int(getattr(settings, 'ECONOMY_ACCOUNT_CACHE_MAX_MB', 8.0) * 1024 * 1024))
+            await configure_activity_repository(settings.DATABASE_URL, getattr(settings, 'DATABASE_POOL_SIZE', 10))
 
-        logging.info("🧠 Все коги успешно загружены.")
+        with startup.phase("extensions"):
+            loaded = await startup.run_in_waves(
+                settings.EXTENSIONS, getattr(settings, 'EXTENSION_DEPENDENCIES', {}), self._load_extension_safe,
+            )
+        logging.info(f"🧠 Загружено когов: {len(loaded)}/{len(settings.EXTENSIONS)}")
 
         if settings.TEST_GUILD_ID:
             guild = discord.Object(id=settings.TEST_GUILD_ID)
             self.tree.copy_global_to(guild=guild)
-            await self.tree.sync(guild=guild)
-            logging.info(f"✅ Слэш-команды синхронизированы для гильдии {guild.id}")
+            # Синхронизация — HTTP-запрос, gateway её не ждёт
+            self._sync_task = asyncio.create_task(self._sync_tree(guild))
+        startup.mark("setup_hook")
+
+    async def _load_extension_safe(self, ext: str) -> bool:
+        try:
+            await self.load_extension(ext)
+            logging.info(f"✅ Ког загружен: {ext}")
+            return True
+        except Exception as e:
+            logging.error(f"❌ Ошибка при загрузке {ext}: {e}")
+            return False
+
+    async def _sync_tree(self, guild: discord.abc.Snowflake) -> None:
+        """Синхронизирует слэш-команды, только если дерево изменилось с прошлой синхронизации"""
+        with startup.phase("tree_sync"):
+            key = f"command_tree:{guild.id}"
+            digest = command_tree_hash(self.tree, guild)
+            try:
+                if not getattr(settings, 'BOT_FORCE_SYNC', False) and await run_db(get_state, key) == digest:
+                    logging.info(f"✅ Слэш-команды не изменились, синхронизация для гильдии {guild.id} пропущена")
+                    return
+                await self.tree.sync(guild=guild)
+                await run_db(set_state, key, digest)
+                logging.info(f"✅ Слэш-команды синхронизированы для гильдии {guild.id}")
+            except Exception as e:
+                logging.error(f"❌ Ошибка синхронизации слэш-команд: {e}")
 
     async def on_ready(self):
         logging.info(f"🤖 Бот запущен как {self.user} (ID: {self.user.id})")
-        await self.change_presence(
-            activity=discord.Game(name="/help"),
-            status=discord.Status.online,
-        )
+        # Обработчики сроков зарегистрированы когами в setup_hook; кэш серверов уже готов
+        scheduler.start()
+        # Отложенный прогрев когов и отчёт о времени запуска
+        startup.ready()
+
+    async def on_message(self, message: discord.Message):
+        events.inc(event="message")
+        await self.process_commands(message)
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        _observe_command(interaction, "ok")
+
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        """Единая точка входа голосовых событий: коги подписываются через voice_router"""
+        events.inc(event="voice_state")
+        await voice_router.dispatch(member, before, after)
 
     async def close(self):
         """Корректное завершение работы"""
         logging.info("⏳ Отключение бота...")
+        await scheduler.stop()
+        await loop_monitor.stop()
+        await tracer.close()
+        if self._sync_task and not self._sync_task.done():
+            self._sync_task.cancel()
         await super().close()
         await asyncio.sleep(0.2)
+        await activity_buffer.flush()
+        await voice_sessions.checkpoint()
+        await get_activity_repository().close()
+        engine.close()
         logging.info("✅ Бот корректно остановлен.")
@@ -0,0 +1,225 @@
+# src/database/account_cache.py
+"""
+Кэш аккаунтов экономики перед таблицей accounts.
+
+Чтение get_or_create_account / get_cooldowns — поиск в словаре. Запись сквозная:
+TEMP-триггеры на соединениях economy.db передают новые значения строки, а в кэш
+они попадают только после commit (при rollback отбрасываются), поэтому любой
+писатель — ledger, ExperienceService, MessageCounterService — держит кэш актуальным
+"""
+import functools
+import logging
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Колонки accounts в порядке кортежа get_or_create_account
+ACCOUNT_COLUMNS = (
+    "cash", "bank", "xp", "level", "voice_seconds", "arrest_until",
+    "daily_cd", "work_cd", "weekly_cd", "rob_cd",
+    "robberies_total", "robberies_success", "robberies_fail", "robberies_arrest",
+)
+ACCOUNT_SELECT = ", ".join(ACCOUNT_COLUMNS)
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+Key = Tuple[int, int]
+
+
+class AccountRecord:
+    """Компактная запись аккаунта (без __dict__)"""
+
+    __slots__ = ACCOUNT_COLUMNS
+
+    def __init__(self, *values):
+        for name, value in zip(ACCOUNT_COLUMNS, values):
+            setattr(self, name, value)
+
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in ACCOUNT_COLUMNS)
+
+    def cooldowns(self) -> tuple:
+        """Формат get_cooldowns: (daily_cd, work_cd, weekly_cd, rob_cd, arrest_until)"""
+        return self.daily_cd, self.work_cd, self.weekly_cd, self.rob_cd, self.arrest_until
+
+
+def _entry_size() -> int:
+    # Запись, её значения (int/float вне кэша малых чисел), ключ и узел OrderedDict
+    record = AccountRecord(*range(10**6, 10**6 + len(ACCOUNT_COLUMNS)))
+    values = sum(sys.getsizeof(v) for v in record.as_tuple())
+    key = sys.getsizeof((10**12, 10**12)) + 2 * sys.getsizeof(10**12)
+    return sys.getsizeof(record) + values + key + 100
+
+
+class AccountCache:
+    """LRU-кэш {(guild_id, user_id): AccountRecord}, ограниченный по памяти"""
+
+    ENTRY_BYTES = _entry_size()
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._entries: "OrderedDict[Key, AccountRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max(1, int(max_bytes) // self.ENTRY_BYTES)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # {id(соединения): {key: значения или None}} — изменения ещё не завершённых транзакций
+        self._pending: Dict[int, Dict[Key, Optional[tuple]]] = {}
+        # Загрузки из БД в процессе: {key: число загрузок}; {key: номер записи} — что записано за это время
+        self._loading: Dict[Key, int] = {}
+        self._written: Dict[Key, int] = {}
+        self._seq = 0
+        self._pool = None
+        # Соединения, открытые до создания accounts (миграции): триггеров на них ещё нет
+        self._untracked: set = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def configure(self, max_bytes: int) -> None:
+        """Меняет лимит памяти; лишние записи вытесняются сразу"""
+        with self._lock:
+            self.max_entries = max(1, int(max_bytes) // self.ENTRY_BYTES)
+            self._evict()
+
+    def bind(self, pool) -> None:
+        """Подключает кэш к пулу соединений economy.db (новый пул — кэш сбрасывается)"""
+        if pool is self._pool:
+            return
+        with self._lock:
+            if pool is self._pool:
+                return
+            self._entries.clear()
+            self._pending.clear()
+            self._untracked.clear()
+            self._pool = pool
+        pool.add_transaction_hook(self._on_transaction_end)
+        pool.add_connect_hook(self._install_triggers)
+
+    def _install_triggers(self, conn: sqlite3.Connection) -> None:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='accounts'").fetchone():
+            self._untracked.add(id(conn))
+            return
+        self._untracked.discard(id(conn))
+        conn.create_function("account_cache_changed", 3 + len(ACCOUNT_COLUMNS),
+                             functools.partial(self._on_account_changed, id(conn)))
+        new_values = ", ".join(f"NEW.{col}" for col in ACCOUNT_COLUMNS)
+        old_values = ", ".join("NULL" for _ in ACCOUNT_COLUMNS)
+        conn.executescript(f"""
+            CREATE TEMP TRIGGER IF NOT EXISTS account_cache_insert AFTER INSERT ON main.accounts
+            BEGIN SELECT account_cache_changed(0, NEW.guild_id, NEW.user_id, {new_values}); END;
+            CREATE TEMP TRIGGER IF NOT EXISTS account_cache_update
+            AFTER UPDATE OF {ACCOUNT_SELECT} ON main.accounts
+            BEGIN SELECT account_cache_changed(0, NEW.guild_id, NEW.user_id, {new_values}); END;
+            CREATE TEMP TRIGGER IF NOT EXISTS account_cache_delete AFTER DELETE ON main.accounts
+            BEGIN SELECT account_cache_changed(1, OLD.guild_id, OLD.user_id, {old_values}); END;
+        """)
+
+    def _on_account_changed(self, conn_id: int, deleted, guild_id, user_id, *values) -> None:
+        # Вызывается из триггера: исключение здесь сорвало бы сам UPDATE
+        try:
+            with self._lock:
+                self._pending.setdefault(conn_id, {})[(guild_id, user_id)] = None if deleted else values
+        except Exception as e:
+            logging.error(f"❌ Ошибка при обновлении кэша аккаунтов: {e}")
+
+    def _on_transaction_end(self, conn: sqlite3.Connection, committed: bool) -> None:
+        if id(conn) in self._untracked:
+            # Изменения такого соединения не видны — кэш сбрасывается, триггеры ставятся, как только есть таблица
+            if committed:
+                self.invalidate()
+            self._install_triggers(conn)
+            return
+        with self._lock:
+            changes = self._pending.pop(id(conn), None)
+            if not changes or not committed:
+                return
+            self._seq += 1
+            for key, values in changes.items():
+                if key in self._loading:
+                    self._written[key] = self._seq
+                if values is None:
+                    self._entries.pop(key, None)
+                    continue
+                record = self._entries.get(key)
+                if record is not None:
+                    for name, value in zip(ACCOUNT_COLUMNS, values):
+                        setattr(record, name, value)
+
+    def get(self, guild_id: int, user_id: int) -> Optional[AccountRecord]:
+        key = (guild_id, user_id)
+        with self._lock:
+            record = self._entries.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def begin_load(self, guild_id: int, user_id: int) -> int:
+        """
+        Отмечает начало чтения строки из БД
+
+        Returns:
+            Токен для put(): запись, прочитанная после него, ещё не устарела
+        """
+        key = (guild_id, user_id)
+        with self._lock:
+            self._loading[key] = self._loading.get(key, 0) + 1
+            return self._seq
+
+    def token(self) -> int:
+        """Текущий токен — для повторного чтения после собственной записи"""
+        return self._seq
+
+    def put(self, guild_id: int, user_id: int, row: Optional[tuple], token: int) -> None:
+        """Кладёт прочитанную строку в кэш, если с момента begin_load её никто не изменил"""
+        key = (guild_id, user_id)
+        with self._lock:
+            left = self._loading.get(key, 1) - 1
+            stale = self._written.get(key, -1) > token
+            if left > 0:
+                self._loading[key] = left
+            else:
+                self._loading.pop(key, None)
+                self._written.pop(key, None)
+            if row is None or stale:
+                return
+            self._entries[key] = AccountRecord(*row)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
+        """Сбрасывает запись, все записи сервера или весь кэш"""
+        with self._lock:
+            if guild_id is None:
+                self._entries.clear()
+            elif user_id is not None:
+                self._entries.pop((guild_id, user_id), None)
+            else:
+                for key in [k for k in self._entries if k[0] == guild_id]:
+                    del self._entries[key]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": len(self._entries) * self.ENTRY_BYTES,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+account_cache = AccountCache()
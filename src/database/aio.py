@@ -0,0 +1,26 @@
+# src/database/aio.py
+"""
+Асинхронные эквиваленты функций БД.
+
+Каждая функция модулей economy, clans, love, discipline и tickets доступна
+через одноимённый атрибут и выполняется в потоке движка хранилища:
+
+    from src.database import aio
+    acc = await aio.economy.get_or_create_account(user_id, guild_id)
+"""
+from src.database import economy as _economy
+from src.database import clans as _clans
+from src.database import love as _love
+from src.database import discipline as _discipline
+from src.database import connection as _connection
+from src.database.tickets import ticket_db as _ticket_db
+from src.database.engine import AsyncFacade, engine, run_db
+
+economy = AsyncFacade(_economy)
+clans = AsyncFacade(_clans)
+love = AsyncFacade(_love)
+discipline = AsyncFacade(_discipline)
+connection = AsyncFacade(_connection)
+tickets = AsyncFacade(_ticket_db)
+
+__all__ = ['economy', 'clans', 'love', 'discipline', 'connection', 'tickets', 'engine', 'run_db']
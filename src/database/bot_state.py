@@ -0,0 +1,31 @@
+# src/database/bot_state.py
+"""
+Служебные значения бота между перезапусками (таблица bot_state в main.db),
+например хэш синхронизированного дерева слэш-команд. Схема создаётся миграцией main.db v5
+"""
+import time
+from typing import Optional
+
+from src.database.connection import get_connection
+
+
+def get_state(key: str) -> Optional[str]:
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT value FROM bot_state WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def set_state(key: str, value: str) -> None:
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at",
+            (key, value, time.time()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
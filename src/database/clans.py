@@ -26,9 +26,11 @@ def _build_clan_dict(data: Dict) -> Dict:
     }
 
 
-def init_clans_db():
+def init_clans_db(conn=None):
     """Инициализация таблиц для системы кланов"""
-    conn = get_connection()
+    own = conn is None
+    if own:
+        conn = get_connection()
     cursor = conn.cursor()
     
     # Таблица кланов
@@ -91,8 +93,9 @@ def init_clans_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
     logging.info("📦 База данных кланов инициализирована")
 
 def create_clan(name: str, description: str, color: int, owner_id: int, role_id: int,
@@ -349,6 +352,21 @@ def update_clan_max_members(clan_id: int, max_members: int) -> bool:
     
     return affected > 0
 
+def update_clan_owner(clan_id: int, owner_id: int) -> bool:
+    """Смена владельца клана"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        UPDATE clans SET owner_id = ? WHERE id = ?
+    """, (owner_id, clan_id))
+    
+    affected = cursor.rowcount
+    conn.commit()
+    conn.close()
+    
+    return affected > 0
+
 def add_clan_voice_channel(clan_id: int, channel_id: int) -> bool:
     """Добавление голосового канала клана"""
     conn = get_connection()
@@ -407,9 +425,11 @@ def get_all_clans() -> List[Dict]:
         clans.append(_build_clan_dict(data))
     return clans
 
-def update_clan_payment(clan_id: int) -> bool:
-    """Обновление времени последней оплаты"""
-    conn = get_connection()
+def update_clan_payment(clan_id: int, conn=None) -> bool:
+    """Обновление времени последней оплаты (conn — соединение общей транзакции engine.transaction)"""
+    own = conn is None
+    if own:
+        conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute("""
@@ -417,8 +437,9 @@ def update_clan_payment(clan_id: int) -> bool:
     """, (clan_id,))
     
     affected = cursor.rowcount
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
     
     return affected > 0
 
@@ -2,6 +2,7 @@
 import sqlite3
 import os
 import logging
+from src.database.engine import get_pool
 
 BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 os.makedirs(BASE_DIR, exist_ok=True)
@@ -12,12 +13,12 @@ if not os.access(BASE_DIR, os.W_OK):
     raise PermissionError(f"❌ Нет прав на запись в {BASE_DIR}")
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_pool(DB_PATH, sqlite3.Row).connect()
 
-def init_db():
-    conn = get_connection()
+def init_db(conn=None):
+    own = conn is None
+    if own:
+        conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -29,6 +30,7 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
     logging.info(f"📦 База данных инициализирована: {DB_PATH}")
@@ -0,0 +1,109 @@
+# src/database/consolidate.py
+"""
+Офлайн-перенос всех файлов БД в один (режим DATABASE_SINGLE_FILE).
+
+Каждый исходный файл подключается через ATTACH DATABASE, его таблицы, индексы и данные
+копируются в общий файл одной транзакцией; schema_version переносится в
+schema_version_<имя файла>, поэтому миграции продолжаются с той же версии.
+Запускать при остановленном боте:
+
+    python -m src.database.consolidate [путь к общему файлу]
+"""
+import logging
+import os
+import sqlite3
+import sys
+from typing import Dict, Iterable, Optional
+
+from src.database.engine import DATABASE_DIR
+from src.database.migrations import _registry, version_table
+
+DEFAULT_TARGET = os.path.join(DATABASE_DIR, "bot.db")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def merge_databases(target: str = DEFAULT_TARGET, sources: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """
+    Копирует схемы и данные исходных файлов БД в общий файл
+
+    Args:
+        target: Общий файл (должен быть пустым или отсутствовать)
+        sources: Исходные файлы; по умолчанию все файлы из реестра миграций
+
+    Returns:
+        Количество перенесённых строк: {"economy.accounts": ...}
+    """
+    if not os.path.isabs(target):
+        target = os.path.join(DATABASE_DIR, target)
+    sources = [os.path.abspath(path) for path in (sources if sources is not None else _registry())]
+
+    conn = sqlite3.connect(target, isolation_level=None)
+    copied: Dict[str, int] = {}
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchone():
+            raise FileExistsError(f"{target} уже содержит таблицы")
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        for path in sources:
+            if not os.path.exists(path) or path == os.path.abspath(target):
+                continue
+            stem = os.path.splitext(os.path.basename(path))[0]
+            conn.execute("ATTACH DATABASE ? AS src", (path,))
+            try:
+                # Сначала таблицы, затем индексы и триггеры, которые на них ссылаются
+                objects = conn.execute("""
+                    SELECT type, name, sql FROM src.sqlite_master
+                    WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                    ORDER BY type != 'table'
+                """).fetchall()
+                conn.execute("BEGIN")
+                for kind, name, sql in objects:
+                    if kind != 'table':
+                        conn.execute(sql)
+                        continue
+                    dest = version_table(path, single_file=True) if name == "schema_version" else name
+                    if conn.execute("SELECT 1 FROM main.sqlite_master WHERE name=?", (dest,)).fetchone():
+                        raise ValueError(f"Таблица {dest} из {stem} уже есть в общем файле")
+                    if name == "schema_version":
+                        conn.execute(f"CREATE TABLE {_quote(dest)} (version INTEGER PRIMARY KEY, name TEXT, applied_at REAL)")
+                    else:
+                        conn.execute(sql)
+                    # Генерируемые колонки (hidden != 0) не вставляются — они вычисляются заново
+                    columns = [row[1] for row in conn.execute(f"PRAGMA src.table_xinfo({_quote(name)})") if row[6] == 0]
+                    column_list = ", ".join(_quote(col) for col in columns)
+                    cur = conn.execute(
+                        f"INSERT INTO main.{_quote(dest)} ({column_list}) SELECT {column_list} FROM src.{_quote(name)}"
+                    )
+                    copied[f"{stem}.{name}"] = cur.rowcount
+                # Счётчики AUTOINCREMENT — после таблиц (main.sqlite_sequence создаётся вместе с ними):
+                # без них ID удалённых строк выдавались бы заново
+                if conn.execute("SELECT 1 FROM src.sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+                    for name, seq in conn.execute("SELECT name, seq FROM src.sqlite_sequence").fetchall():
+                        cur = conn.execute("UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq, name))
+                        if cur.rowcount == 0:
+                            conn.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)", (name, seq))
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.execute("DETACH DATABASE src")
+            logging.info(f"📦 {os.path.basename(path)} перенесена в {os.path.basename(target)}")
+
+        conn.execute("ANALYZE")
+        return copied
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    target_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TARGET
+    result = merge_databases(target_path)
+    for table, rows in sorted(result.items()):
+        print(f"{table}: {rows}")
+    print(f"Готово. Укажите DATABASE_SINGLE_FILE={target_path} в .env, исходные файлы можно оставить как резервную копию")
@@ -1,18 +1,19 @@
-import sqlite3
 import os
 from datetime import datetime, timedelta
+from src.database.engine import get_pool
 
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "strike.db")
 
 
 def get_connection():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    return get_pool(DB_PATH).connect()
 
 
-def init_discipline_db():
-    conn = get_connection()
+def init_discipline_db(conn=None):
+    own = conn is None
+    if own:
+        conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute(
@@ -69,8 +70,9 @@ def init_discipline_db():
         """
     )
 
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
 
 
 def cleanup_expired(now_ts: float | None = None):
@@ -1,19 +1,31 @@
+import functools
+import json
 import os
 import sqlite3
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from typing import Callable, Dict, Optional, Tuple, List
+from src.database.account_cache import ACCOUNT_SELECT, account_cache
+from src.database.engine import get_pool
+from src.database.ledger import InsufficientFunds, Leg, apply_legs, begin_immediate, transfer
 
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "economy.db")
 
 
 def get_connection():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    pool = get_pool(DB_PATH)
+    account_cache.bind(pool)
+    return pool.connect()
 
 
-def init_economy_db():
-    conn = get_connection()
+def init_economy_db(conn=None):
+    own = conn is None
+    if own:
+        conn = get_connection()
+    else:
+        # Соединение раннера миграций: кэш счетов всё равно подключается к пулу файла (и сбрасывается)
+        account_cache.bind(get_pool(DB_PATH))
     c = conn.cursor()
     c.execute(
         """
@@ -171,157 +183,204 @@ def init_economy_db():
     )
     
     # Commit all changes
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
+
+
+# Счётчики, которые можно прибавлять через upsert_account (у всех DEFAULT 0)
+UPSERT_COLUMNS = frozenset({
+    "xp", "voice_seconds", "messages_sent",
+    "robberies_total", "robberies_success", "robberies_fail", "robberies_arrest",
+})
+
+
+@functools.lru_cache(maxsize=None)
+def _upsert_sql(columns: Tuple[str, ...], returning: Optional[str]) -> str:
+    unknown = set(columns) - UPSERT_COLUMNS
+    if unknown:
+        raise ValueError(f"upsert_account: недопустимые колонки {sorted(unknown)}")
+    insert_cols = ", ".join(("user_id", "guild_id") + columns)
+    values = ", ".join(["?", "?"] + ["MAX(0, ?)"] * len(columns))
+    # Без приращений всё равно нужен DO UPDATE: DO NOTHING при конфликте не вернул бы строку
+    updates = ", ".join(f"{col} = MAX(0, {col} + excluded.{col})" for col in columns) or "user_id = excluded.user_id"
+    sql = f"INSERT INTO accounts ({insert_cols}) VALUES ({values}) ON CONFLICT (user_id, guild_id) DO UPDATE SET {updates}"
+    if returning:
+        sql += f" RETURNING {returning}"
+    return sql
+
+
+def upsert_account(c, user_id: int, guild_id: int, returning: Optional[str] = ACCOUNT_SELECT, **deltas) -> Optional[tuple]:
+    """
+    Создаёт аккаунт, если его нет, и прибавляет приращения к счётчикам одним запросом
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING (commit — на вызывающем)
+
+    Args:
+        c: Курсор соединения с economy.db
+        user_id: ID пользователя
+        guild_id: ID сервера
+        returning: Колонки для RETURNING (None — ничего не возвращать)
+        **deltas: Приращения колонок из UPSERT_COLUMNS
+
+    Returns:
+        Строка returning после изменения
+    """
+    columns = tuple(sorted(deltas))
+    c.execute(_upsert_sql(columns, returning), (user_id, guild_id, *(deltas[col] for col in columns)))
+    return c.fetchone() if returning else None
+
+
+def upsert_accounts(c, columns: Tuple[str, ...], rows: List[tuple]) -> None:
+    """Пакетный upsert_account без RETURNING: rows — [(user_id, guild_id, *приращения по columns)]"""
+    c.executemany(_upsert_sql(tuple(columns), None), rows)
 
 
 def get_or_create_account(user_id: int, guild_id: int) -> Tuple[int, int, int, int, int, Optional[float], Optional[float], Optional[float], Optional[float]]:
+    record = account_cache.get(guild_id, user_id)
+    if record is not None:
+        return record.as_tuple()  # type: ignore
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT cash, bank, xp, level, voice_seconds, arrest_until, daily_cd, work_cd, weekly_cd, rob_cd, robberies_total, robberies_success, robberies_fail, robberies_arrest FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+    token = account_cache.begin_load(guild_id, user_id)
+    c.execute(f"SELECT {ACCOUNT_SELECT} FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
     row = c.fetchone()
     if not row:
-        c.execute("""
-            INSERT INTO accounts (user_id, guild_id, cash, bank, xp, level, voice_seconds, 
-                                arrest_until, daily_cd, work_cd, weekly_cd, rob_cd, 
-                                robberies_total, robberies_success, robberies_fail, 
-                                robberies_arrest, messages_sent, temp_roles_json)
-            VALUES (?, ?, 0, 0, 0, 1, 0, NULL, NULL, NULL, NULL, NULL, 0, 0, 0, 0, 0, NULL)
-        """, (user_id, guild_id))
+        # Новый аккаунт: строка возвращается тем же запросом, что её создал
+        row = upsert_account(c, user_id, guild_id)
         conn.commit()
-        c.execute("SELECT cash, bank, xp, level, voice_seconds, arrest_until, daily_cd, work_cd, weekly_cd, rob_cd, robberies_total, robberies_success, robberies_fail, robberies_arrest FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-        row = c.fetchone()
+        token = account_cache.token()
     conn.close()
+    account_cache.put(guild_id, user_id, row, token)
     return row  # type: ignore
 
 
 def set_money(user_id: int, guild_id: int, cash: Optional[int] = None, bank: Optional[int] = None):
+    # Установка баланса проводится в журнал как разница с текущим значением
     conn = get_connection()
     c = conn.cursor()
-    if cash is not None:
-        if cash < 0:
-            cash = 0
-        c.execute("UPDATE accounts SET cash=? WHERE user_id=? AND guild_id=?", (cash, user_id, guild_id))
-    if bank is not None:
-        if bank < 0:
-            bank = 0
-        c.execute("UPDATE accounts SET bank=? WHERE user_id=? AND guild_id=?", (bank, user_id, guild_id))
-    conn.commit()
-    conn.close()
+    try:
+        begin_immediate(conn)
+        c.execute("SELECT cash, bank FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        row = c.fetchone()
+        if row:
+            cash_delta = max(0, cash) - (row[0] or 0) if cash is not None else 0
+            bank_delta = max(0, bank) - (row[1] or 0) if bank is not None else 0
+            apply_legs(c, guild_id, "set", [Leg(user_id, cash_delta, bank_delta)], clamp=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 
 def add_xp(user_id: int, guild_id: int, amount: int):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE accounts SET xp = MAX(0, xp + ?) WHERE user_id=? AND guild_id=?", (amount, user_id, guild_id))
+    upsert_account(c, user_id, guild_id, returning=None, xp=amount)
     conn.commit()
     conn.close()
 
 
 def set_temp_role(user_id: int, guild_id: int, role_id: int, until_ts: float):
-    import json
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT temp_roles_json FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    row = c.fetchone()
-    temp = {}
-    if row and row[0]:
-        try:
-            temp = json.loads(row[0])
-        except Exception:
-            temp = {}
-    temp[str(role_id)] = until_ts
-    c.execute("UPDATE accounts SET temp_roles_json=? WHERE user_id=? AND guild_id=?", (json.dumps(temp), user_id, guild_id))
+    c.execute(
+        "INSERT OR REPLACE INTO temp_roles (guild_id, user_id, role_id, expires_at) VALUES (?, ?, ?, ?)",
+        (guild_id, user_id, role_id, until_ts),
+    )
     conn.commit()
     conn.close()
 
 
 def get_expired_temp_roles(guild_id: int, now_ts: float):
-    import json
+    # Диапазон по idx_temp_roles_expires: читаются только истёкшие строки
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT user_id, temp_roles_json FROM accounts WHERE guild_id=?", (guild_id,))
+    c.execute(
+        "SELECT user_id, role_id FROM temp_roles WHERE expires_at <= ? AND guild_id=?",
+        (now_ts, guild_id),
+    )
     rows = c.fetchall()
     conn.close()
-    results = []
-    for user_id, blob in rows:
-        if not blob:
-            continue
-        try:
-            data = json.loads(blob)
-        except Exception:
-            continue
-        expired = [int(rid) for rid, until in data.items() if until and until <= now_ts]
-        if expired:
-            results.append((user_id, expired))
-    return results
+    expired: dict = {}
+    for user_id, role_id in rows:
+        expired.setdefault(user_id, []).append(role_id)
+    return list(expired.items())
 
 
-def remove_temp_roles(user_id: int, guild_id: int, role_ids: list[int]):
-    import json
+def get_temp_roles(guild_id: int) -> List[Tuple[int, int, float]]:
+    """Все временные роли сервера: [(user_id, role_id, until_ts)]"""
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT temp_roles_json FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    row = c.fetchone()
-    temp = {}
-    if row and row[0]:
-        try:
-            temp = json.loads(row[0])
-        except Exception:
-            temp = {}
-    for rid in role_ids:
-        temp.pop(str(rid), None)
-    c.execute("UPDATE accounts SET temp_roles_json=? WHERE user_id=? AND guild_id=?", (json.dumps(temp), user_id, guild_id))
-    conn.commit()
+    c.execute("SELECT user_id, role_id, expires_at FROM temp_roles WHERE guild_id=?", (guild_id,))
+    rows = c.fetchall()
     conn.close()
+    return rows
 
 
-def add_cash(user_id: int, guild_id: int, amount: int):
+def remove_temp_roles(user_id: int, guild_id: int, role_ids: list[int]):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE accounts SET cash = MAX(0, cash + ?) WHERE user_id=? AND guild_id=?", (amount, user_id, guild_id))
+    c.executemany(
+        "DELETE FROM temp_roles WHERE guild_id=? AND user_id=? AND role_id=?",
+        [(guild_id, user_id, rid) for rid in role_ids],
+    )
     conn.commit()
     conn.close()
 
 
-def add_bank(user_id: int, guild_id: int, amount: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE accounts SET bank = MAX(0, bank + ?) WHERE user_id=? AND guild_id=?", (amount, user_id, guild_id))
-    conn.commit()
-    conn.close()
+def migrate_temp_roles_json(conn) -> int:
+    """Переносит временные роли из accounts.temp_roles_json в таблицу temp_roles (однократно)"""
+    import json
+    rows = conn.execute(
+        "SELECT user_id, guild_id, temp_roles_json FROM accounts WHERE temp_roles_json IS NOT NULL"
+    ).fetchall()
+    moved = []
+    for user_id, guild_id, blob in rows:
+        try:
+            data = json.loads(blob)
+        except Exception:
+            continue
+        moved.extend((guild_id, user_id, int(rid), until) for rid, until in data.items() if until)
+    conn.executemany(
+        "INSERT OR REPLACE INTO temp_roles (guild_id, user_id, role_id, expires_at) VALUES (?, ?, ?, ?)",
+        moved,
+    )
+    # Колонка больше не читается; очищаем, чтобы данные не жили в двух местах
+    conn.execute("UPDATE accounts SET temp_roles_json = NULL WHERE temp_roles_json IS NOT NULL")
+    return len(moved)
+
+
+def add_cash(user_id: int, guild_id: int, amount: int, kind: str = "adjust", ref: Optional[str] = None):
+    # Начисление/списание с обрезкой по нулю; для списаний «всё или ничего» — spend_cash
+    transfer(guild_id, kind, [Leg(user_id, cash=amount)], ref, clamp=True)
+
+
+def add_bank(user_id: int, guild_id: int, amount: int, kind: str = "adjust", ref: Optional[str] = None):
+    transfer(guild_id, kind, [Leg(user_id, bank=amount)], ref, clamp=True)
+
+
+def spend_cash(user_id: int, guild_id: int, amount: int, kind: str, ref: Optional[str] = None, conn=None) -> bool:
+    """Списывает наличные, только если их хватает (проверка и списание — один UPDATE; conn — см. ledger.transfer)"""
+    return transfer(guild_id, kind, [Leg(user_id, cash=-amount)], ref, conn=conn)
+
+
+def spend_bank(user_id: int, guild_id: int, amount: int, kind: str, ref: Optional[str] = None) -> bool:
+    """Списывает деньги с банка, только если их хватает"""
+    return transfer(guild_id, kind, [Leg(user_id, bank=-amount)], ref)
 
 
 def transfer_cash_to_bank(user_id: int, guild_id: int, amount: int) -> bool:
     if amount <= 0:
         return False
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT cash FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    row = c.fetchone()
-    if not row or row[0] < amount:
-        conn.close()
-        return False
-    c.execute("UPDATE accounts SET cash=cash-?, bank=bank+? WHERE user_id=? AND guild_id=?", (amount, amount, user_id, guild_id))
-    conn.commit()
-    conn.close()
-    return True
+    return transfer(guild_id, "deposit", [Leg(user_id, cash=-amount, bank=amount)])
 
 
 def transfer_bank_to_cash(user_id: int, guild_id: int, amount: int) -> bool:
     if amount <= 0:
         return False
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT bank FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    row = c.fetchone()
-    if not row or row[0] < amount:
-        conn.close()
-        return False
-    c.execute("UPDATE accounts SET bank=bank-?, cash=cash+? WHERE user_id=? AND guild_id=?", (amount, amount, user_id, guild_id))
-    conn.commit()
-    conn.close()
-    return True
+    return transfer(guild_id, "withdraw", [Leg(user_id, cash=amount, bank=-amount)])
 
 
 def set_cooldown(user_id: int, guild_id: int, field: str, next_ts: float):
@@ -335,12 +394,19 @@ def set_cooldown(user_id: int, guild_id: int, field: str, next_ts: float):
 
 
 def get_cooldowns(user_id: int, guild_id: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT daily_cd, work_cd, weekly_cd, rob_cd, arrest_until FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    row = c.fetchone()
-    conn.close()
-    return row
+    record = account_cache.get(guild_id, user_id)
+    if record is None:
+        conn = get_connection()
+        c = conn.cursor()
+        token = account_cache.begin_load(guild_id, user_id)
+        c.execute(f"SELECT {ACCOUNT_SELECT} FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        row = c.fetchone()
+        conn.close()
+        account_cache.put(guild_id, user_id, row, token)
+        if row is None:
+            return None
+        return row[6], row[7], row[8], row[9], row[5]
+    return record.cooldowns()
 
 
 def add_voice_seconds(user_id: int, guild_id: int, seconds: int):
@@ -348,11 +414,171 @@ def add_voice_seconds(user_id: int, guild_id: int, seconds: int):
         return
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE accounts SET voice_seconds = voice_seconds + ? WHERE user_id=? AND guild_id=?", (seconds, user_id, guild_id))
+    upsert_account(c, user_id, guild_id, returning=None, voice_seconds=seconds)
     conn.commit()
     conn.close()
 
 
+def get_voice_checkpoints(guild_id: int) -> Dict[int, Tuple[int, bool, float]]:
+    """Снимок открытых голосовых сессий сервера: {user_id: (channel_id, earning, checkpoint_ts)}"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT user_id, channel_id, earning, checkpoint_ts FROM voice_checkpoints WHERE guild_id=?", (guild_id,))
+    rows = c.fetchall()
+    conn.close()
+    return {user_id: (channel_id, bool(earning), checkpoint_ts) for user_id, channel_id, earning, checkpoint_ts in rows}
+
+
+def _apply_level_ups(c, keys, level_up: Callable[[int, float], Tuple[int, float]]) -> None:
+    """Повышает уровень затронутым аккаунтам (level_up — LevelCurve.apply)"""
+    for guild_id, user_id in keys:
+        c.execute("SELECT level, xp FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        row = c.fetchone()
+        if not row:
+            continue
+        level, xp = level_up(row[0], row[1])
+        if level != row[0]:
+            c.execute("UPDATE accounts SET level = ?, xp = ? WHERE user_id=? AND guild_id=?", (level, xp, user_id, guild_id))
+
+
+def apply_activity_batch(deltas: Dict[Tuple[int, int], Tuple[float, int]], level_up: Callable[[int, float], Tuple[int, float]]) -> None:
+    """
+    Записывает накопленный опыт и сообщения одной транзакцией
+
+    Args:
+        deltas: Словарь {(guild_id, user_id): (опыт, сообщения)}
+        level_up: Функция (уровень, опыт) -> (новый_уровень, остаток_опыта)
+    """
+    if not deltas:
+        return
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        upsert_accounts(c, ("xp", "messages_sent"),
+                        [(user_id, guild_id, xp, messages) for (guild_id, user_id), (xp, messages) in deltas.items()])
+        # Повышение уровня только для тех, кому начислен опыт
+        _apply_level_ups(c, [key for key, (xp, _) in deltas.items() if xp > 0], level_up)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def apply_voice_batch(credits: Dict[Tuple[int, int], int], xp_per_minute: float,
+                      level_up: Callable[[int, float], Tuple[int, float]], sessions: Optional[List[tuple]] = None) -> None:
+    """
+    Начисляет время в войсе и опыт за него одной транзакцией и сохраняет снимок открытых сессий
+
+    Args:
+        credits: Словарь {(guild_id, user_id): секунды}
+        xp_per_minute: Опыт за минуту в войсе
+        level_up: Функция (уровень, опыт) -> (новый_уровень, остаток_опыта)
+        sessions: Открытые сессии [(guild_id, user_id, channel_id, earning, checkpoint_ts)];
+            None — снимок не трогать. Заменяется снимок только серверов из пачки
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        if credits:
+            upsert_accounts(c, ("voice_seconds", "xp"),
+                            [(user_id, guild_id, seconds, max(xp_per_minute, 0) * seconds / 60)
+                             for (guild_id, user_id), seconds in credits.items()])
+            if xp_per_minute > 0:
+                _apply_level_ups(c, list(credits), level_up)
+
+        if sessions is not None:
+            # Снимок сервера, который ещё восстанавливается, не в пачке и остаётся нетронутым
+            guilds = sorted({s[0] for s in sessions} | {key[0] for key in credits})
+            if guilds:
+                c.execute(f"DELETE FROM voice_checkpoints WHERE guild_id IN ({','.join('?' * len(guilds))})", guilds)
+            c.executemany("""
+                INSERT INTO voice_checkpoints (guild_id, user_id, channel_id, earning, checkpoint_ts)
+                VALUES (?, ?, ?, ?, ?)
+            """, sessions)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def get_activity(user_id: int, guild_id: int) -> Optional[Tuple[float, int, int, int]]:
+    """Счётчики активности аккаунта: (xp, level, voice_seconds, messages_sent)"""
+    conn = get_connection()
+    try:
+        return conn.execute(
+            "SELECT xp, level, voice_seconds, messages_sent FROM accounts WHERE user_id=? AND guild_id=?",
+            (user_id, guild_id),
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def get_activity_rows(guild_id: Optional[int] = None) -> List[Tuple[int, int, float, int, int, int]]:
+    """Счётчики активности сервера (или всех серверов): [(guild_id, user_id, xp, level, voice_seconds, messages_sent)]"""
+    conn = get_connection()
+    try:
+        sql = "SELECT guild_id, user_id, COALESCE(xp, 0), COALESCE(level, 1), COALESCE(voice_seconds, 0), COALESCE(messages_sent, 0) FROM accounts"
+        if guild_id is None:
+            return conn.execute(sql).fetchall()
+        return conn.execute(sql + " WHERE guild_id=?", (guild_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def get_level_curve() -> Optional[str]:
+    """Сохранённая кривая уровней (JSON требований опыта), по которой записаны level/xp в accounts"""
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT thresholds FROM level_curve WHERE id = 1").fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def rebase_levels(thresholds: str, rebase: Callable[[str], Callable[[int, float], Tuple[int, float]]]) -> int:
+    """
+    Сохраняет кривую уровней и, если сохранённая отличается, в той же транзакции
+    пересчитывает level/xp всех аккаунтов
+
+    Args:
+        thresholds: JSON требований опыта новой кривой
+        rebase: По JSON сохранённой кривой возвращает функцию (уровень, опыт) -> (новый_уровень, остаток_опыта)
+
+    Returns:
+        Количество аккаунтов, у которых изменились уровень или опыт
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    changed = 0
+    try:
+        c.execute("SELECT thresholds FROM level_curve WHERE id = 1")
+        row = c.fetchone()
+        if row is not None and json.loads(row[0]) != json.loads(thresholds):
+            convert = rebase(row[0])
+            # Один UPDATE на все аккаунты: пару (level, xp) пересчитывает функция кривой
+            conn.create_function("curve_level", 2, lambda level, xp: convert(level, xp)[0], deterministic=True)
+            conn.create_function("curve_xp", 2, lambda level, xp: convert(level, xp)[1], deterministic=True)
+            c.execute("""
+                UPDATE accounts 
+                SET level = curve_level(level, xp), xp = curve_xp(level, xp) 
+                WHERE curve_level(level, xp) != level OR curve_xp(level, xp) != xp
+            """)
+            changed = c.rowcount
+        c.execute("REPLACE INTO level_curve (id, thresholds, updated_at) VALUES (1, ?, ?)", (thresholds, time.time()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return changed
+
+
 def set_arrest(user_id: int, guild_id: int, until_ts: Optional[float]):
     conn = get_connection()
     c = conn.cursor()
@@ -364,13 +590,14 @@ def set_arrest(user_id: int, guild_id: int, until_ts: Optional[float]):
 def inc_robbery_stat(user_id: int, guild_id: int, success: Optional[bool] = None, arrest: bool = False):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE accounts SET robberies_total = robberies_total + 1 WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+    deltas = {"robberies_total": 1}
     if success is True:
-        c.execute("UPDATE accounts SET robberies_success = robberies_success + 1 WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        deltas["robberies_success"] = 1
     elif success is False:
-        c.execute("UPDATE accounts SET robberies_fail = robberies_fail + 1 WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        deltas["robberies_fail"] = 1
     if arrest:
-        c.execute("UPDATE accounts SET robberies_arrest = robberies_arrest + 1 WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+        deltas["robberies_arrest"] = 1
+    upsert_account(c, user_id, guild_id, returning=None, **deltas)
     conn.commit()
     conn.close()
 
@@ -384,10 +611,52 @@ def get_rob_stats(user_id: int, guild_id: int):
     return row or (0, 0, 0, 0)
 
 
+def rob_success(user_id: int, target_id: int, guild_id: int, loot: int, next_rob: float) -> bool:
+    """
+    Удачное ограбление одной транзакцией: перевод наличных, статистика и кулдаун rob_cd
+
+    Returns:
+        False — у жертвы уже нет столько наличных (ничего не изменено)
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        begin_immediate(conn)
+        apply_legs(c, guild_id, 'rob', [Leg(target_id, cash=-loot), Leg(user_id, cash=loot)], ref=str(target_id))
+        upsert_account(c, user_id, guild_id, returning=None, robberies_total=1, robberies_success=1)
+        c.execute("UPDATE accounts SET rob_cd=? WHERE user_id=? AND guild_id=?", (next_rob, user_id, guild_id))
+        conn.commit()
+        return True
+    except InsufficientFunds:
+        conn.rollback()
+        return False
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def rob_fail(user_id: int, guild_id: int, arrest_until: Optional[float], next_rob: Optional[float]):
+    """Неудачное ограбление одной транзакцией: статистика и арест либо кулдаун rob_cd"""
+    conn = get_connection()
+    c = conn.cursor()
+    deltas = {"robberies_total": 1, "robberies_fail": 1}
+    if arrest_until:
+        deltas["robberies_arrest"] = 1
+    upsert_account(c, user_id, guild_id, returning=None, **deltas)
+    if arrest_until:
+        c.execute("UPDATE accounts SET arrest_until=? WHERE user_id=? AND guild_id=?", (arrest_until, user_id, guild_id))
+    else:
+        c.execute("UPDATE accounts SET rob_cd=? WHERE user_id=? AND guild_id=?", (next_rob, user_id, guild_id))
+    conn.commit()
+    conn.close()
+
+
 def get_top_by_balance(guild_id: int, limit: int = 10):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT user_id, (cash + bank) AS total, cash, bank FROM accounts WHERE guild_id=? ORDER BY total DESC LIMIT ?", (guild_id, limit))
+    c.execute("SELECT user_id, balance_total AS total, cash, bank FROM accounts WHERE guild_id=? ORDER BY balance_total DESC LIMIT ?", (guild_id, limit))
     rows = c.fetchall()
     conn.close()
     return rows
@@ -414,7 +683,7 @@ def get_top_by_voice(guild_id: int, limit: int = 10):
 def get_rank_by_balance(user_id: int, guild_id: int) -> int:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT COUNT(*) + 1 FROM accounts a WHERE a.guild_id = ? AND (a.cash + a.bank) > (SELECT cash + bank FROM accounts WHERE user_id=? AND guild_id=?)", (guild_id, user_id, guild_id))
+    c.execute("SELECT COUNT(*) + 1 FROM accounts a WHERE a.guild_id = ? AND a.balance_total > (SELECT balance_total FROM accounts WHERE user_id=? AND guild_id=?)", (guild_id, user_id, guild_id))
     rank = c.fetchone()[0]
     conn.close()
     return int(rank)
@@ -490,31 +759,7 @@ def get_shop_items(guild_id: int, order: str = 'price_desc', limit: int = 5, off
 
 
 def purchase_shop_item(guild_id: int, user_id: int, item_id: int) -> tuple[bool, str, int, int]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT role_id, price, stock FROM shop_roles WHERE id=? AND guild_id=?", (item_id, guild_id))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return False, "Товар не найден.", 0, 0
-    role_id, price, stock = row
-    # check bank funds
-    c.execute("SELECT bank FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-    bank_row = c.fetchone()
-    if not bank_row or bank_row[0] < price:
-        conn.close()
-        return False, "Недостаточно средств в банке.", role_id, price
-    # update stock
-    if stock is not None:
-        if stock <= 0:
-            conn.close()
-            return False, "Нет в наличии.", role_id, price
-        c.execute("UPDATE shop_roles SET stock = stock - 1 WHERE id=?", (item_id,))
-    # deduct
-    c.execute("UPDATE accounts SET bank = bank - ? WHERE user_id=? AND guild_id=?", (price, user_id, guild_id))
-    conn.commit()
-    conn.close()
-    return True, "Покупка успешна.", role_id, price
+    return purchase_market_item(guild_id, user_id, 'shop', item_id)
 
 
 # Unified market (shop + user listings)
@@ -559,56 +804,58 @@ def get_market_items(guild_id: int, order: str = 'price_desc', limit: int = 5, o
 
 
 def purchase_market_item(guild_id: int, buyer_user_id: int, kind: str, id_or_role: int) -> tuple[bool, str, int, int]:
+    # Остаток товара, списание и зачисление продавцу — одна транзакция под блокировкой записи:
+    # два одновременных покупателя не продадут последний экземпляр дважды
     conn = get_connection()
     c = conn.cursor()
-    if kind == 'shop':
-        c.execute("SELECT role_id, price, stock FROM shop_roles WHERE id=? AND guild_id=?", (id_or_role, guild_id))
-        row = c.fetchone()
-        if not row:
-            conn.close()
-            return False, "Товар не найден.", 0, 0
-        role_id, price, stock = row
-        # funds
-        c.execute("SELECT bank FROM accounts WHERE user_id=? AND guild_id=?", (buyer_user_id, guild_id))
-        bank_row = c.fetchone()
-        if not bank_row or bank_row[0] < price:
-            conn.close()
+    try:
+        begin_immediate(conn)
+        if kind == 'shop':
+            c.execute("SELECT role_id, price, stock FROM shop_roles WHERE id=? AND guild_id=?", (id_or_role, guild_id))
+            row = c.fetchone()
+            if not row:
+                conn.rollback()
+                return False, "Товар не найден.", 0, 0
+            role_id, price, stock = row
+            legs = [Leg(buyer_user_id, bank=-price)]
+            c.execute(
+                "UPDATE shop_roles SET stock = stock - 1 WHERE id=? AND stock IS NOT NULL AND stock > 0",
+                (id_or_role,),
+            )
+            if stock is not None and c.rowcount == 0:
+                conn.rollback()
+                return False, "Нет в наличии.", role_id, price
+        else:
+            # listing: id_or_role is role_id key
+            c.execute("SELECT seller_user_id, price, max_sales, sales_done FROM role_listings WHERE role_id=? AND guild_id=?", (id_or_role, guild_id))
+            row = c.fetchone()
+            if not row:
+                conn.rollback()
+                return False, "Лот не найден.", 0, 0
+            seller_user_id, price, max_sales, sales_done = row
+            role_id = id_or_role
+            c.execute(
+                "UPDATE role_listings SET sales_done = sales_done + 1 WHERE role_id=? AND guild_id=? AND (max_sales IS NULL OR sales_done < max_sales)",
+                (id_or_role, guild_id),
+            )
+            if c.rowcount == 0:
+                conn.rollback()
+                return False, "Лимит продаж достигнут.", role_id, price
+            # У продавца может не быть аккаунта — создаём, чтобы деньги не пропали
+            upsert_account(c, seller_user_id, guild_id, returning=None)
+            legs = [Leg(buyer_user_id, bank=-price), Leg(seller_user_id, bank=price)]
+        try:
+            apply_legs(c, guild_id, 'market', legs, ref=f"{kind}:{id_or_role}")
+        except InsufficientFunds:
+            conn.rollback()
             return False, "Недостаточно средств в банке.", role_id, price
-        if stock is not None and stock <= 0:
-            conn.close()
-            return False, "Нет в наличии.", role_id, price
-        if stock is not None:
-            c.execute("UPDATE shop_roles SET stock = stock - 1 WHERE id=?", (id_or_role,))
-        c.execute("UPDATE accounts SET bank = bank - ? WHERE user_id=? AND guild_id=?", (price, buyer_user_id, guild_id))
         conn.commit()
-        conn.close()
         return True, "Покупка успешна.", role_id, price
-    else:
-        # listing: id_or_role is role_id key
-        c.execute("SELECT seller_user_id, price, max_sales, sales_done FROM role_listings WHERE role_id=? AND guild_id=?", (id_or_role, guild_id))
-        row = c.fetchone()
-        if not row:
-            conn.close()
-            return False, "Лот не найден.", 0, 0
-        seller_user_id, price, max_sales, sales_done = row
-        # funds buyer
-        c.execute("SELECT bank FROM accounts WHERE user_id=? AND guild_id=?", (buyer_user_id, guild_id))
-        bank_row = c.fetchone()
-        if not bank_row or bank_row[0] < price:
-            conn.close()
-            return False, "Недостаточно средств в банке.", id_or_role, price
-        # stock check
-        if max_sales is not None and sales_done >= max_sales:
-            conn.close()
-            return False, "Лимит продаж достигнут.", id_or_role, price
-        # transfer funds
-        c.execute("UPDATE accounts SET bank = bank - ? WHERE user_id=? AND guild_id=?", (price, buyer_user_id, guild_id))
-        c.execute("UPDATE accounts SET bank = bank + ? WHERE user_id=? AND guild_id=?", (price, seller_user_id, guild_id))
-        # increment sales
-        c.execute("UPDATE role_listings SET sales_done = sales_done + 1 WHERE role_id=? AND guild_id=?", (id_or_role, guild_id))
-        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        return True, "Покупка успешна.", id_or_role, price
 
 
 # Custom roles
@@ -660,6 +907,14 @@ def add_owned_custom_role(user_id: int, guild_id: int, role_id: int):
     conn.close()
 
 
+def remove_owned_custom_role(user_id: int, guild_id: int, role_id: int):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM owned_custom_roles WHERE user_id=? AND guild_id=? AND role_id=?", (user_id, guild_id, role_id))
+    conn.commit()
+    conn.close()
+
+
 def get_owned_custom_roles(user_id: int, guild_id: int):
     conn = get_connection()
     c = conn.cursor()
@@ -689,6 +944,16 @@ def get_owned_custom_roles_with_info(user_id: int, guild_id: int):
     return rows
 
 
+def get_role_listing(guild_id: int, role_id: int):
+    """(price, description) листинга роли или None"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT price, description FROM role_listings WHERE role_id=? AND guild_id=?", (role_id, guild_id))
+    row = c.fetchone()
+    conn.close()
+    return row
+
+
 def create_role_listing(guild_id: int, role_id: int, seller_user_id: int, price: int, max_sales: int | None, description: str = ''):
     conn = get_connection()
     c = conn.cursor()
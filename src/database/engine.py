@@ -0,0 +1,465 @@
+# src/database/engine.py
+"""
+Общий движок хранилища: пул соединений на каждый файл БД
+и выполнение синхронных запросов в отдельном потоке, чтобы не блокировать event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DATABASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_WORKERS = 4
+DEFAULT_BUSY_TIMEOUT = 30.0
+# Ожидание блокировки файла и свободного соединения для вызовов прямо из event loop:
+# поток loop нельзя держать десятки секунд, лучше быстро получить ошибку
+LOOP_BUSY_TIMEOUT = 0.25
+
+# Применяются к каждому новому соединению. WAL позволяет читать параллельно с записью,
+# а synchronous=NORMAL в режиме WAL не делает fsync на каждый commit
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+)
+
+
+# Число соединений, удерживаемых текущим потоком (во всех пулах)
+_held = threading.local()
+
+
+def _on_event_loop() -> bool:
+    """Вызывается ли код из потока с работающим event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class PooledConnection:
+    """Обёртка над sqlite3.Connection: close() возвращает соединение в пул, а не закрывает его"""
+
+    __slots__ = ("_conn", "_pool", "_released", "_span")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool", span: Any = None):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_released", False)
+        # Отрезок трассы на время удержания соединения
+        object.__setattr__(self, "_span", span)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._conn, name, value)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Как у sqlite3: commit при успехе, rollback при ошибке; дополнительно отдаём соединение в пул
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+
+    def commit(self) -> None:
+        self._conn.commit()
+        self._pool.end_transaction(self._conn, True)
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+        self._pool.end_transaction(self._conn, False)
+
+    def close(self) -> None:
+        if self._released:
+            return
+        object.__setattr__(self, "_released", True)
+        self._pool.release(self._conn)
+        if self._span is not None:
+            self._span.end()
+
+
+class ConnectionPool:
+    """Ограниченный пул sqlite3-соединений для одного файла БД"""
+
+    def __init__(self, db_path: str, size: int = DEFAULT_POOL_SIZE, row_factory: Optional[Callable] = None):
+        self.db_path = os.path.abspath(db_path)
+        self.size = max(1, size)
+        self.row_factory = row_factory
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=self.size)
+        self._lock = threading.Lock()
+        # Сигнал о возврате или закрытии соединения для потоков, ждущих свободного места
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        self._closed = False
+        self._hooks: List[Callable[[sqlite3.Connection], None]] = []
+        self._tx_hooks: List[Callable[[sqlite3.Connection, bool], None]] = []
+        self._generation = 0
+        self._conn_generation: Dict[int, int] = {}
+        # Текущий busy_timeout каждого соединения: у вызовов из event loop он короче
+        self._conn_busy: Dict[int, float] = {}
+        # Трассировщик движка (StorageEngine.set_tracer)
+        self.tracer: Any = None
+
+    def _open(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=DEFAULT_BUSY_TIMEOUT, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        for hook in self._hooks:
+            hook(conn)
+        conn.row_factory = self.row_factory
+        self._conn_generation[id(conn)] = self._generation
+        self._conn_busy[id(conn)] = DEFAULT_BUSY_TIMEOUT
+        return conn
+
+    def add_connect_hook(self, hook: Callable[[sqlite3.Connection], None]) -> None:
+        """
+        Регистрирует функцию настройки соединения (SQL-функции, TEMP-триггеры).
+        Уже открытые соединения пересоздаются, чтобы хук применился ко всем
+        """
+        with self._lock:
+            self._hooks.append(hook)
+            self._generation += 1
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def add_transaction_hook(self, hook: Callable[[sqlite3.Connection, bool], None]) -> None:
+        """
+        Регистрирует функцию hook(conn, committed), вызываемую после commit/rollback
+        через PooledConnection и при возврате соединения в пул
+        """
+        with self._lock:
+            self._tx_hooks.append(hook)
+
+    def end_transaction(self, conn: sqlite3.Connection, committed: bool) -> None:
+        for hook in self._tx_hooks:
+            try:
+                hook(conn, committed)
+            except Exception as e:
+                logging.error(f"❌ Ошибка в обработчике завершения транзакции: {e}")
+
+    def connect(self) -> PooledConnection:
+        """
+        Берёт свободное соединение из пула или открывает новое, пока их меньше size.
+        Когда заняты все, ждёт возврата соединения не дольше busy timeout и бросает
+        sqlite3.OperationalError. Поток, который уже держит соединение, получает
+        дополнительное сразу: вложенный вызов иначе мог бы ждать сам себя
+        """
+        on_loop = _on_event_loop()
+        timeout = LOOP_BUSY_TIMEOUT if on_loop else DEFAULT_BUSY_TIMEOUT
+        nested = getattr(_held, "count", 0) > 0
+        deadline = time.monotonic() + timeout
+        conn = None
+        with self._available:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                    break
+                except queue.Empty:
+                    pass
+                if self._created < self.size or nested:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"Нет свободного соединения с {os.path.basename(self.db_path)}: заняты все {self.size}"
+                    )
+                self._available.wait(remaining)
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._available:
+                    self._created -= 1
+                    self._available.notify()
+                raise
+        if self._conn_busy.get(id(conn)) != timeout:
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+            self._conn_busy[id(conn)] = timeout
+        _held.count = getattr(_held, "count", 0) + 1
+        if self.tracer is None:
+            return PooledConnection(conn, self)
+        return PooledConnection(conn, self, self.tracer.start_span(f"sqlite {os.path.basename(self.db_path)}"))
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Возвращает соединение в пул; незавершённая транзакция откатывается"""
+        _held.count = max(0, getattr(_held, "count", 0) - 1)
+        try:
+            # Изменения вне явной транзакции уже записаны, незавершённая транзакция откатывается
+            committed = not conn.in_transaction
+            if not committed:
+                conn.rollback()
+            conn.row_factory = self.row_factory
+        except sqlite3.Error:
+            self.end_transaction(conn, False)
+            self._discard(conn)
+            return
+        self.end_transaction(conn, committed)
+        if self._closed or self._conn_generation.get(id(conn)) != self._generation:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+            return
+        with self._available:
+            self._available.notify()
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        self._conn_generation.pop(id(conn), None)
+        self._conn_busy.pop(id(conn), None)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def close(self) -> None:
+        """Закрывает все простаивающие соединения"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize()}
+
+
+class StorageEngine:
+    """
+    Единая точка доступа к файлам БД: пулы соединений и пул потоков для асинхронных вызовов.
+
+    Модули обращаются к логическим БД (main.db, economy.db, ...). В режиме одного файла
+    все они отображаются на один физический файл: таблицы не пересекаются по именам,
+    и транзакция может атомарно затронуть таблицы разных доменов
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, workers: int = DEFAULT_WORKERS):
+        self.pool_size = pool_size
+        self.workers = workers
+        # Ключ — (физический файл, row_factory): у main.db строки sqlite3.Row, у остальных кортежи
+        self._pools: Dict[Tuple[str, Optional[Callable]], ConnectionPool] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._single_file: Optional[str] = None
+        self._directory: Optional[str] = None
+        self._observers: List[Callable[[str, float, bool], None]] = []
+        self.tracer: Any = None
+
+    @property
+    def single_file(self) -> Optional[str]:
+        return self._single_file
+
+    def use_single_file(self, path: Optional[str]) -> None:
+        """
+        Включает режим одного файла (None — отдельный файл на каждую логическую БД).
+        Вызывается при старте до первого обращения к БД
+
+        Args:
+            path: Путь к общему файлу; относительный — от каталога src/database
+        """
+        if self._pools:
+            raise RuntimeError("Режим хранения меняется только до открытия соединений")
+        if path and not os.path.isabs(path):
+            path = os.path.join(DATABASE_DIR, path)
+        self._single_file = os.path.abspath(path) if path else None
+        if self._single_file:
+            logging.info(f"📦 Все базы данных в одном файле: {self._single_file}")
+
+    @property
+    def directory(self) -> Optional[str]:
+        return self._directory
+
+    def use_directory(self, path: Optional[str]) -> None:
+        """
+        Размещает файлы логических БД в другом каталоге под теми же именами
+        (None — рядом с модулями). Нужен инструментам, которые собирают копию хранилища,
+        не трогая рабочие файлы. Вызывается до первого обращения к БД
+        """
+        if self._pools:
+            raise RuntimeError("Режим хранения меняется только до открытия соединений")
+        self._directory = os.path.abspath(path) if path else None
+
+    def resolve(self, db_path: str) -> str:
+        """Физический файл логической БД"""
+        if self._single_file:
+            return self._single_file
+        if self._directory:
+            return os.path.join(self._directory, os.path.basename(db_path))
+        return os.path.abspath(db_path)
+
+    def get_pool(self, db_path: str, row_factory: Optional[Callable] = None) -> ConnectionPool:
+        """Возвращает (создавая при необходимости) пул для файла БД"""
+        key = (self.resolve(db_path), row_factory)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(key[0], self.pool_size, row_factory)
+                    pool.tracer = self.tracer
+                    self._pools[key] = pool
+        return pool
+
+    def connect(self, db_path: str, row_factory: Optional[Callable] = None) -> PooledConnection:
+        return self.get_pool(db_path, row_factory).connect()
+
+    def shares_file(self, *db_paths: str) -> bool:
+        """True, если логические БД лежат в одном физическом файле и доступна общая транзакция"""
+        return len({self.resolve(path) for path in db_paths}) == 1
+
+    def transaction(self, db_path: str, *others: str, row_factory: Optional[Callable] = None) -> PooledConnection:
+        """
+        Одна транзакция (BEGIN IMMEDIATE) над таблицами нескольких логических БД в режиме одного файла.
+        Соединение передаётся функциям модулей параметром conn — тогда они не делают commit сами:
+
+            with engine.transaction(economy.DB_PATH, connection.DB_PATH) as conn:
+                ...
+
+        commit при выходе без ошибки, rollback при исключении. Соединение берётся из пула db_path,
+        поэтому его хуки (кэш счетов economy.db) видят все изменения — первой указывается БД,
+        чьи таблицы отслеживаются
+
+        Raises:
+            RuntimeError: БД лежат в разных файлах
+        """
+        if not self.shares_file(db_path, *others):
+            raise RuntimeError("Общая транзакция доступна только для БД в одном файле (DATABASE_SINGLE_FILE)")
+        conn = self.connect(db_path, row_factory)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+        return self._executor
+
+    def add_observer(self, observer: Callable[[str, float, bool], None]) -> None:
+        """
+        Регистрирует observer(имя вызова, секунды, успех) для каждого вызова через run
+        (метрики; слой БД не зависит от сервисов)
+        """
+        self._observers.append(observer)
+
+    def set_tracer(self, tracer: Any) -> None:
+        """
+        Включает трассировку: tracer.span(имя) — контекстный менеджер вложенного отрезка,
+        tracer.start_span(имя) — отрезок с end(); оба ничего не делают вне трассы (src/servies/tracing.py)
+        """
+        self.tracer = tracer
+        for pool in self._pools.values():
+            pool.tracer = tracer
+
+    def observe(self, name: str, seconds: float, ok: bool = True) -> None:
+        for observer in self._observers:
+            try:
+                observer(name, seconds, ok)
+            except Exception as e:
+                logging.debug(f"Ошибка наблюдателя вызовов БД: {e}")
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполняет синхронную функцию БД в потоке движка и возвращает её результат"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        name = getattr(func, "__name__", type(func).__name__)
+        if self.tracer is not None and self.tracer.current() is not None:
+            with self.tracer.span(f"db {name}"):
+                # run_in_executor не передаёт contextvars в поток: без копии контекста
+                # соединения, взятые внутри func, не попали бы в трассу
+                return await self._execute(loop, name, functools.partial(contextvars.copy_context().run, call))
+        return await self._execute(loop, name, call)
+
+    async def _execute(self, loop: asyncio.AbstractEventLoop, name: str, call: Callable) -> Any:
+        if not self._observers:
+            return await loop.run_in_executor(self._get_executor(), call)
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await loop.run_in_executor(self._get_executor(), call)
+            ok = True
+            return result
+        finally:
+            self.observe(name, time.perf_counter() - start, ok)
+
+    def close(self) -> None:
+        """Останавливает пул потоков и закрывает все соединения"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for pool in list(self._pools.values()):
+            pool.close()
+        self._pools.clear()
+        logging.info("📦 Хранилище закрыто")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            path if row_factory is None else f"{path} ({row_factory.__name__})": pool.stats()
+            for (path, row_factory), pool in self._pools.items()
+        }
+
+
+class AsyncFacade:
+    """Асинхронный фасад: любой вызываемый атрибут цели выполняется через engine.run"""
+
+    def __init__(self, target: Any, storage: Optional[StorageEngine] = None):
+        self._target = target
+        self._storage = storage
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await (self._storage or engine).run(attr, *args, **kwargs)
+
+        setattr(self, name, wrapper)
+        return wrapper
+
+
+engine = StorageEngine()
+
+
+def get_pool(db_path: str, row_factory: Optional[Callable] = None) -> ConnectionPool:
+    return engine.get_pool(db_path, row_factory)
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """Короткая запись для engine.run"""
+    return await engine.run(func, *args, **kwargs)
@@ -0,0 +1,193 @@
+# src/database/ledger.py
+"""
+Журнал денежных операций.
+
+Каждое движение денег (ограбление, покупка, оплата клана, кейс, выплата в блэкджеке)
+применяется одной транзакцией BEGIN IMMEDIATE: условные UPDATE по всем участникам
+и одна запись в transactions с проводками в transaction_entries. По журналу можно
+сверить и восстановить балансы accounts
+"""
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Leg(NamedTuple):
+    """Изменение баланса одного участника операции"""
+    user_id: int
+    cash: int = 0
+    bank: int = 0
+
+
+class InsufficientFunds(Exception):
+    """У одного из участников не хватает средств — операция целиком откатывается"""
+
+
+def get_connection():
+    # economy.py сам импортирует ledger, поэтому соединение берём при вызове
+    from src.database.economy import get_connection as economy_connection
+    return economy_connection()
+
+
+def begin_immediate(conn) -> None:
+    """Сразу берёт блокировку записи: параллельные операции ждут, а не читают устаревший баланс"""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+
+def apply_legs(c, guild_id: int, kind: str, legs: Iterable[Leg], ref: Optional[str] = None, clamp: bool = False) -> int:
+    """
+    Применяет проводки внутри уже открытой транзакции (без commit)
+
+    Args:
+        c: Курсор соединения с economy.db
+        guild_id: ID сервера
+        kind: Тип операции (rob, case, market, clan, blackjack, ...)
+        legs: Изменения балансов по участникам, применяются по порядку
+        ref: Произвольная ссылка на объект операции (ID товара, клана и т.п.)
+        clamp: True — баланс не уходит ниже нуля (как старые add_cash/add_bank),
+            False — списание без достаточных средств отменяет всю операцию
+
+    Returns:
+        ID записи в transactions (0, если ни один баланс не изменился)
+
+    Raises:
+        InsufficientFunds: при clamp=False и нехватке средств у участника
+    """
+    entries: List[Tuple[int, int, int]] = []
+    for leg in legs:
+        if not leg.cash and not leg.bank:
+            continue
+        if clamp:
+            # Фактическое изменение с учётом обрезки по нулю — под блокировкой записи
+            c.execute("SELECT cash, bank FROM accounts WHERE user_id=? AND guild_id=?", (leg.user_id, guild_id))
+            row = c.fetchone()
+            if not row:
+                continue
+            cash_delta = max(0, (row[0] or 0) + leg.cash) - (row[0] or 0)
+            bank_delta = max(0, (row[1] or 0) + leg.bank) - (row[1] or 0)
+            if not cash_delta and not bank_delta:
+                continue
+            c.execute(
+                "UPDATE accounts SET cash = cash + ?, bank = bank + ? WHERE user_id=? AND guild_id=?",
+                (cash_delta, bank_delta, leg.user_id, guild_id),
+            )
+        else:
+            c.execute(
+                """
+                UPDATE accounts SET cash = cash + ?, bank = bank + ?
+                WHERE user_id=? AND guild_id=? AND cash + ? >= 0 AND bank + ? >= 0
+                """,
+                (leg.cash, leg.bank, leg.user_id, guild_id, leg.cash, leg.bank),
+            )
+            if c.rowcount == 0:
+                raise InsufficientFunds(f"{kind}: недостаточно средств у {leg.user_id}")
+            cash_delta, bank_delta = leg.cash, leg.bank
+        entries.append((leg.user_id, cash_delta, bank_delta))
+
+    if not entries:
+        return 0
+    c.execute(
+        "INSERT INTO transactions (guild_id, kind, ref, created_at) VALUES (?, ?, ?, ?)",
+        (guild_id, kind, ref, time.time()),
+    )
+    tx_id = c.lastrowid
+    c.executemany(
+        "INSERT INTO transaction_entries (transaction_id, guild_id, user_id, cash_delta, bank_delta) VALUES (?, ?, ?, ?, ?)",
+        [(tx_id, guild_id, user_id, cash_delta, bank_delta) for user_id, cash_delta, bank_delta in entries],
+    )
+    return tx_id
+
+
+def transfer(guild_id: int, kind: str, legs: Iterable[Leg], ref: Optional[str] = None, clamp: bool = False,
+             conn=None) -> bool:
+    """
+    Атомарно применяет денежную операцию одним commit
+
+    Args:
+        conn: Соединение общей транзакции (engine.transaction): commit делает она, а нехватка
+            средств бросает InsufficientFunds и откатывает всю транзакцию
+
+    Returns:
+        True, если операция проведена; False — не хватило средств (ничего не изменено)
+    """
+    if conn is not None:
+        apply_legs(conn.cursor(), guild_id, kind, legs, ref, clamp)
+        return True
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        begin_immediate(conn)
+        apply_legs(c, guild_id, kind, legs, ref, clamp)
+        conn.commit()
+        return True
+    except InsufficientFunds:
+        conn.rollback()
+        return False
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def audit_balances(guild_id: int) -> List[Tuple[int, int, int, int, int]]:
+    """
+    Сверяет балансы с журналом
+
+    Returns:
+        Расхождения [(user_id, cash, bank, cash_по_журналу, bank_по_журналу)]
+    """
+    conn = get_connection()
+    try:
+        return conn.execute(
+            """
+            SELECT a.user_id, a.cash, a.bank, COALESCE(l.cash, 0), COALESCE(l.bank, 0)
+            FROM accounts a
+            LEFT JOIN (
+                SELECT user_id, SUM(cash_delta) AS cash, SUM(bank_delta) AS bank
+                FROM transaction_entries WHERE guild_id=? GROUP BY user_id
+            ) l ON l.user_id = a.user_id
+            WHERE a.guild_id=? AND (a.cash != COALESCE(l.cash, 0) OR a.bank != COALESCE(l.bank, 0))
+            """,
+            (guild_id, guild_id),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def rebuild_balances(guild_id: int) -> int:
+    """
+    Восстанавливает cash и bank сервера из журнала
+
+    Returns:
+        Количество исправленных аккаунтов
+    """
+    conn = get_connection()
+    try:
+        begin_immediate(conn)
+        cur = conn.execute(
+            """
+            UPDATE accounts SET
+                cash = COALESCE((SELECT SUM(cash_delta) FROM transaction_entries e
+                                 WHERE e.guild_id = accounts.guild_id AND e.user_id = accounts.user_id), 0),
+                bank = COALESCE((SELECT SUM(bank_delta) FROM transaction_entries e
+                                 WHERE e.guild_id = accounts.guild_id AND e.user_id = accounts.user_id), 0)
+            WHERE guild_id=? AND user_id IN (
+                SELECT a.user_id FROM accounts a
+                LEFT JOIN (
+                    SELECT user_id, SUM(cash_delta) AS cash, SUM(bank_delta) AS bank
+                    FROM transaction_entries WHERE guild_id=? GROUP BY user_id
+                ) l ON l.user_id = a.user_id
+                WHERE a.guild_id=? AND (a.cash != COALESCE(l.cash, 0) OR a.bank != COALESCE(l.bank, 0))
+            )
+            """,
+            (guild_id, guild_id, guild_id),
+        )
+        conn.commit()
+        return cur.rowcount
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
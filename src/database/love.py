@@ -5,9 +5,15 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 from src.database.connection import get_connection
 
-def init_love_db():
+# ID всех пользователей, состоящих в паре; загружается один раз и
+# поддерживается create_couple/delete_couple, чтобы не ходить в БД на каждое событие
+_coupled_users: Optional[set] = None
+
+def init_love_db(conn=None):
     """Инициализация базы данных для love системы"""
-    conn = get_connection()
+    own = conn is None
+    if own:
+        conn = get_connection()
     cursor = conn.cursor()
 
     # Таблица для пар
@@ -83,8 +89,9 @@ def init_love_db():
     except Exception as e:
         logging.warning(f"Предупреждение при обновлении схемы: {e}")
 
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
     logging.info("💕 Love база данных инициализирована")
 
 
@@ -110,6 +117,8 @@ def create_couple(user1_id: int, user2_id: int, description: str = None) -> bool
         """, (user1_id, user2_id, description or '💕 Любовь - это когда два сердца бьются в унисон 💕'))
         
         conn.commit()
+        if _coupled_users is not None:
+            _coupled_users.update((user1_id, user2_id))
         return True
     except Exception as e:
         logging.error(f"Ошибка при создании пары: {e}")
@@ -135,6 +144,23 @@ def get_couple_by_user(user_id: int) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
+def get_coupled_user_ids() -> set:
+    """Множество ID пользователей, состоящих в паре (из памяти после первой загрузки)"""
+    global _coupled_users
+    if _coupled_users is None:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT user1_id, user2_id FROM couples")
+            _coupled_users = {user_id for row in cursor.fetchall() for user_id in row}
+        finally:
+            conn.close()
+    return _coupled_users
+
+def is_coupled(user_id: int) -> bool:
+    """Состоит ли пользователь в паре — без обращения к БД после первой загрузки"""
+    return user_id in get_coupled_user_ids()
+
 def get_couple_by_id(couple_id: int) -> Optional[Dict[str, Any]]:
     """Получить пару по ID пары"""
     conn = get_connection()
@@ -179,10 +205,15 @@ def delete_couple(couple_id: int) -> bool:
         # Удаляем историю сессий
         cursor.execute("DELETE FROM voice_sessions WHERE couple_id = ?", (couple_id,))
         
+        cursor.execute("SELECT user1_id, user2_id FROM couples WHERE id = ?", (couple_id,))
+        members = cursor.fetchone()
+        
         # Удаляем пару
         cursor.execute("DELETE FROM couples WHERE id = ?", (couple_id,))
         
         conn.commit()
+        if members and _coupled_users is not None:
+            _coupled_users.difference_update((members[0], members[1]))
         return cursor.rowcount > 0
     except Exception as e:
         logging.error(f"Ошибка при удалении пары: {e}")
@@ -296,6 +327,16 @@ def get_active_session(couple_id: int) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
+def clear_active_sessions() -> int:
+    """Удаляет все активные сессии (при запуске: отслеживание начинается заново)"""
+    conn = get_connection()
+    try:
+        cursor = conn.execute("DELETE FROM active_sessions")
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
 def cleanup_expired_sessions():
     """Очистка устаревших активных сессий (если канал был удален)"""
     conn = get_connection()
@@ -354,17 +395,17 @@ def add_love_room_access(user_id: int, months: int = 1) -> bool:
     cursor = conn.cursor()
     
     try:
-        # Проверяем, есть ли уже активный доступ
+        # Проверяем, есть ли уже доступ (в том числе только что истёкший — продление в срок)
         cursor.execute("""
             SELECT expires_at FROM love_room_access 
-            WHERE user_id = ? AND expires_at > datetime('now')
+            WHERE user_id = ?
         """, (user_id,))
         
         existing = cursor.fetchone()
         
         if existing:
             # Продлеваем существующий доступ
-            current_expiry = datetime.fromisoformat(existing['expires_at'])
+            current_expiry = max(datetime.fromisoformat(existing['expires_at']), datetime.now())
             new_expiry = current_expiry + timedelta(days=30 * months)
             
             cursor.execute("""
@@ -389,6 +430,32 @@ def add_love_room_access(user_id: int, months: int = 1) -> bool:
     finally:
         conn.close()
 
+def get_all_love_room_access() -> List[Dict[str, Any]]:
+    """Все записи доступа к love комнатам (user_id, expires_at)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT user_id, expires_at FROM love_room_access")
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def remove_love_room_access(user_id: int) -> bool:
+    """Удалить доступ пользователя к love комнатам"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("DELETE FROM love_room_access WHERE user_id = ?", (user_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        logging.error(f"Ошибка при удалении доступа к love комнатам: {e}")
+        return False
+    finally:
+        conn.close()
+
 def remove_expired_access():
     """Удалить истекшие доступы к love комнатам"""
     conn = get_connection()
@@ -0,0 +1,252 @@
+# src/database/migrations.py
+"""
+Версионные миграции схем всех файлов БД.
+
+Для каждого файла хранится таблица schema_version; run_migrations() при старте
+применяет только ещё не выполненные шаги. Шаг версии 1 — исходные init_* функции,
+поэтому уже существующие базы принимаются как есть; как и остальные шаги, они
+выполняются на соединении миграции и фиксируются вместе с записью о версии. В режиме одного файла у каждой
+логической БД своя таблица версий: schema_version_<имя файла>.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Union
+
+from src.database import clans, connection, discipline, economy, love, mutes
+from src.database.engine import engine
+from src.database.tickets import ticket_db
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    # SQL-скрипт или функция, принимающая соединение
+    apply: Union[str, Callable]
+
+
+# Покрывающие индексы для топов и рангов: каждый ORDER BY / COUNT(*) по метрике
+# идёт диапазоном по индексу без полного скана и временного B-tree.
+# STORED-колонку нельзя добавить через ALTER TABLE, поэтому баланс — VIRTUAL,
+# а его значение хранится в самом индексе
+ECONOMY_LEADERBOARD_INDEXES = """
+ALTER TABLE accounts ADD COLUMN balance_total INTEGER GENERATED ALWAYS AS (cash + bank) VIRTUAL;
+CREATE INDEX IF NOT EXISTS idx_accounts_balance ON accounts (guild_id, balance_total, cash, bank, user_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_level ON accounts (guild_id, level, xp, user_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_voice ON accounts (guild_id, voice_seconds, user_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_messages ON accounts (guild_id, messages_sent, user_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_robberies ON accounts (guild_id, robberies_success, robberies_fail, user_id);
+ANALYZE accounts;
+"""
+
+
+# Журнал денежных операций. Текущие балансы заносятся одной проводкой "opening",
+# чтобы сумма журнала по каждому аккаунту сразу совпадала с accounts
+ECONOMY_LEDGER = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    ref TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transaction_entries (
+    transaction_id INTEGER NOT NULL REFERENCES transactions (id),
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    cash_delta INTEGER NOT NULL DEFAULT 0,
+    bank_delta INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_transaction_entries_user ON transaction_entries (guild_id, user_id);
+INSERT INTO transactions (guild_id, kind, created_at)
+    SELECT DISTINCT guild_id, 'opening', CAST(strftime('%s', 'now') AS REAL) FROM accounts;
+INSERT INTO transaction_entries (transaction_id, guild_id, user_id, cash_delta, bank_delta)
+    SELECT t.id, a.guild_id, a.user_id, COALESCE(a.cash, 0), COALESCE(a.bank, 0)
+    FROM accounts a JOIN transactions t ON t.guild_id = a.guild_id AND t.kind = 'opening'
+    WHERE COALESCE(a.cash, 0) != 0 OR COALESCE(a.bank, 0) != 0;
+"""
+
+
+def _execute_script(conn, script: str) -> None:
+    """
+    Выполняет SQL-скрипт по одному запросу. executescript() сам делает COMMIT,
+    поэтому внутри транзакции миграции его использовать нельзя
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _migrate_temp_roles(conn) -> None:
+    """Временные роли — отдельная таблица с индексом по сроку вместо JSON в accounts"""
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS temp_roles (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (guild_id, user_id, role_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_temp_roles_expires ON temp_roles (guild_id, expires_at);
+    """)
+    economy.migrate_temp_roles_json(conn)
+
+
+def _registry() -> Dict[str, List[Migration]]:
+    """Список миграций для каждого файла БД, строго по возрастанию версий"""
+    return {
+        connection.DB_PATH: [
+            Migration(1, "users", connection.init_db),
+            Migration(2, "clans", clans.init_clans_db),
+            Migration(3, "love", love.init_love_db),
+            Migration(4, "scheduled_tasks", """
+                CREATE TABLE IF NOT EXISTS scheduled_tasks (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    due_at REAL NOT NULL,
+                    payload TEXT,
+                    PRIMARY KEY (kind, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_due ON scheduled_tasks (due_at);
+            """),
+            Migration(5, "bot_state", """
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+            """),
+        ],
+        economy.DB_PATH: [
+            Migration(1, "economy", economy.init_economy_db),
+            Migration(2, "leaderboard_indexes", ECONOMY_LEADERBOARD_INDEXES),
+            Migration(3, "level_curve", """
+                CREATE TABLE IF NOT EXISTS level_curve (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    thresholds TEXT NOT NULL,
+                    updated_at REAL
+                );
+            """),
+            Migration(4, "voice_checkpoints", """
+                CREATE TABLE IF NOT EXISTS voice_checkpoints (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    earning INTEGER NOT NULL DEFAULT 1,
+                    checkpoint_ts REAL NOT NULL,
+                    PRIMARY KEY (guild_id, user_id)
+                );
+            """),
+            Migration(5, "temp_roles_table", _migrate_temp_roles),
+            Migration(6, "ledger", ECONOMY_LEDGER),
+        ],
+        discipline.DB_PATH: [
+            Migration(1, "discipline", discipline.init_discipline_db),
+        ],
+        mutes.DB_PATH: [
+            Migration(1, "mutes", mutes.init_mutes_db),
+        ],
+        ticket_db.db_path: [
+            Migration(1, "tickets", ticket_db.init_database),
+        ],
+    }
+
+
+_migrated: set = set()
+_lock = threading.Lock()
+
+
+def version_table(db_path: str, single_file: bool = False) -> str:
+    """Имя таблицы версий логической БД: в общем файле — с суффиксом по имени исходного файла"""
+    if not single_file:
+        return "schema_version"
+    return "schema_version_" + os.path.splitext(os.path.basename(db_path))[0]
+
+
+def _version_table(db_path: str) -> str:
+    return version_table(db_path, engine.single_file is not None)
+
+
+def get_schema_version(db_path: str) -> int:
+    """Текущая версия схемы файла БД (0 — миграции ещё не применялись)"""
+    table = _version_table(db_path)
+    conn = engine.connect(db_path)
+    try:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at REAL
+            )
+        """)
+        conn.commit()
+        row = conn.execute(f"SELECT MAX(version) FROM {table}").fetchone()
+        return int(row[0] or 0)
+    finally:
+        conn.close()
+
+
+def migrate(db_path: str, steps: List[Migration]) -> int:
+    """
+    Применяет к файлу БД недостающие миграции
+
+    Returns:
+        Количество применённых шагов
+    """
+    current = get_schema_version(db_path)
+    applied = 0
+    for step in steps:
+        if step.version <= current:
+            continue
+        conn = engine.connect(db_path)
+        try:
+            # Шаг и запись о его версии — одна транзакция: при ошибке не остаётся
+            # ни частично применённой схемы, ни отметки о выполненном шаге
+            conn.execute("BEGIN")
+            try:
+                if isinstance(step.apply, str):
+                    _execute_script(conn, step.apply)
+                else:
+                    step.apply(conn)
+                conn.execute(
+                    f"INSERT INTO {_version_table(db_path)} (version, name, applied_at) VALUES (?, ?, ?)",
+                    (step.version, step.name, time.time()),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            conn.close()
+        applied += 1
+        logging.info(f"📦 Миграция {os.path.basename(db_path)} v{step.version} ({step.name}) применена")
+    return applied
+
+
+def ensure_schema(db_path: str) -> None:
+    """Приводит схему файла БД к актуальной версии; после первого вызова ничего не делает"""
+    key = os.path.abspath(db_path)
+    if key in _migrated:
+        return
+    with _lock:
+        if key in _migrated:
+            return
+        for path, steps in _registry().items():
+            if os.path.abspath(path) == key:
+                migrate(path, steps)
+                break
+        _migrated.add(key)
+
+
+def run_migrations() -> None:
+    """Применяет миграции ко всем файлам БД. Вызывается один раз при старте"""
+    for path in _registry():
+        ensure_schema(path)
+    logging.info("📦 Схемы баз данных актуальны")
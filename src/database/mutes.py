@@ -0,0 +1,31 @@
+# src/database/mutes.py
+import os
+
+from src.database.engine import get_pool
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mutes.db")
+
+
+def get_connection():
+    return get_pool(DB_PATH).connect()
+
+
+def init_mutes_db(conn=None):
+    """Инициализация таблицы активных мутов и банов"""
+    own = conn is None
+    if own:
+        conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mutes (
+            user_id INTEGER,
+            guild_id INTEGER,
+            type TEXT,
+            end_time REAL,
+            PRIMARY KEY (user_id, guild_id, type)
+        )
+    """)
+    # punishments_history теперь хранится в discipline.db
+    if own:
+        conn.commit()
+        conn.close()
@@ -0,0 +1,399 @@
+# src/database/repository.py
+"""
+Хранилище счётчиков активности: опыт, уровень, время в войсе, сообщения.
+
+Это самый частый путь записи (каждое сообщение и каждая минута в войсе), поэтому
+он вынесен за интерфейс ActivityRepository с двумя реализациями:
+
+- SqliteActivityRepository — колонки accounts в economy.db (по умолчанию);
+- PostgresActivityRepository — таблица account_activity в PostgreSQL (DATABASE_URL=postgresql://...),
+  общая для нескольких процессов бота, с пулом соединений asyncpg.
+
+Балансы, магазин, кланы и остальные данные по-прежнему хранятся в SQLite
+"""
+import functools
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.database import economy
+from src.database.engine import engine, run_db
+from src.database.migrations import ensure_schema
+
+LevelUp = Callable[[int, float], Tuple[int, float]]
+# (guild_id, user_id, xp, level, voice_seconds, messages_sent)
+ActivityRow = Tuple[int, int, float, int, int, int]
+
+DEFAULT_PG_POOL_SIZE = 10
+
+
+class ActivityRepository:
+    """Интерфейс хранилища счётчиков активности"""
+
+    name = "base"
+    # True — данные общие для нескольких процессов и хранятся вне economy.db:
+    # TEMP-триггеры SQLite их изменений не видят
+    shared = False
+
+    async def start(self) -> None:
+        """Подготавливает хранилище (пул соединений, схема)"""
+
+    async def close(self) -> None:
+        """Закрывает соединения"""
+
+    async def apply_activity(self, deltas: Dict[Tuple[int, int], Tuple[float, int]], level_up: LevelUp) -> List[ActivityRow]:
+        """
+        Прибавляет опыт и сообщения пачкой и повышает уровни
+
+        Args:
+            deltas: Словарь {(guild_id, user_id): (опыт, сообщения)}
+            level_up: Функция (уровень, опыт) -> (новый_уровень, остаток_опыта)
+
+        Returns:
+            Новые значения затронутых аккаунтов (пусто, если их разошлют триггеры SQLite)
+        """
+        raise NotImplementedError
+
+    async def apply_voice(self, credits: Dict[Tuple[int, int], int], xp_per_minute: float, level_up: LevelUp,
+                          sessions: Optional[List[tuple]] = None) -> List[ActivityRow]:
+        """
+        Начисляет время в войсе и опыт за него и сохраняет снимок открытых сессий
+
+        Args:
+            credits: Словарь {(guild_id, user_id): секунды}
+            xp_per_minute: Опыт за минуту в войсе
+            level_up: Функция (уровень, опыт) -> (новый_уровень, остаток_опыта)
+            sessions: Открытые сессии [(guild_id, user_id, channel_id, earning, checkpoint_ts)];
+                None — снимок не трогать
+        """
+        raise NotImplementedError
+
+    async def get_voice_checkpoints(self, guild_id: int) -> Dict[int, Tuple[int, bool, float]]:
+        """Снимок открытых голосовых сессий сервера: {user_id: (channel_id, earning, checkpoint_ts)}"""
+        raise NotImplementedError
+
+    async def get_activity(self, user_id: int, guild_id: int) -> Optional[Tuple[float, int, int, int]]:
+        """Счётчики аккаунта: (xp, level, voice_seconds, messages_sent)"""
+        raise NotImplementedError
+
+    async def load_activity(self, guild_id: int) -> List[ActivityRow]:
+        """Счётчики всех аккаунтов сервера"""
+        raise NotImplementedError
+
+    async def rebase_levels(self, thresholds: str, rebase: Callable[[str], LevelUp]) -> int:
+        """
+        Сохраняет кривую уровней рядом со счётчиками и, если сохранённая отличается,
+        в той же транзакции пересчитывает уровень и опыт всех аккаунтов
+
+        Args:
+            thresholds: JSON требований опыта новой кривой
+            rebase: По JSON сохранённой кривой возвращает функцию (уровень, опыт) -> (новый_уровень, остаток_опыта)
+
+        Returns:
+            Количество аккаунтов, у которых изменились уровень или опыт
+        """
+        raise NotImplementedError
+
+
+def _economy(func: Callable) -> Callable:
+    """Функция economy, которая сначала приводит схему к актуальной версии (имя сохраняется для метрик)"""
+    @functools.wraps(func)
+    def call(*args):
+        ensure_schema(economy.DB_PATH)
+        return func(*args)
+    return call
+
+
+class SqliteActivityRepository(ActivityRepository):
+    """Счётчики в accounts economy.db; запросы выполняются в потоке движка хранилища"""
+
+    name = "sqlite"
+
+    async def apply_activity(self, deltas, level_up):
+        await run_db(_economy(economy.apply_activity_batch), deltas, level_up)
+        return []
+
+    async def apply_voice(self, credits, xp_per_minute, level_up, sessions=None):
+        await run_db(_economy(economy.apply_voice_batch), credits, xp_per_minute, level_up, sessions)
+        return []
+
+    async def get_voice_checkpoints(self, guild_id):
+        return await run_db(_economy(economy.get_voice_checkpoints), guild_id)
+
+    async def get_activity(self, user_id, guild_id):
+        return await run_db(_economy(economy.get_activity), user_id, guild_id)
+
+    async def load_activity(self, guild_id):
+        return await run_db(_economy(economy.get_activity_rows), guild_id)
+
+    async def rebase_levels(self, thresholds, rebase):
+        return await run_db(_economy(economy.rebase_levels), thresholds, rebase)
+
+
+# Все запросы принимают массивы через unnest: текст запроса не зависит от размера пачки,
+# поэтому каждый готовится на соединении один раз и дальше берётся из кэша
+# подготовленных выражений asyncpg
+PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS account_activity (
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    xp DOUBLE PRECISION NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 1,
+    voice_seconds BIGINT NOT NULL DEFAULT 0,
+    messages_sent BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS voice_checkpoints (
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    earning BOOLEAN NOT NULL DEFAULT TRUE,
+    checkpoint_ts DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS level_curve (
+    id SMALLINT PRIMARY KEY,
+    thresholds TEXT NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+);
+"""
+
+PG_UPSERT_ACTIVITY = """
+INSERT INTO account_activity AS a (guild_id, user_id, xp, voice_seconds, messages_sent)
+SELECT g, u, GREATEST(x, 0), GREATEST(v, 0), GREATEST(m, 0)
+FROM unnest($1::bigint[], $2::bigint[], $3::float8[], $4::bigint[], $5::bigint[]) AS t (g, u, x, v, m)
+ON CONFLICT (guild_id, user_id) DO UPDATE SET
+    xp = GREATEST(0, a.xp + excluded.xp),
+    voice_seconds = GREATEST(0, a.voice_seconds + excluded.voice_seconds),
+    messages_sent = GREATEST(0, a.messages_sent + excluded.messages_sent)
+RETURNING guild_id, user_id, xp, level, voice_seconds, messages_sent
+"""
+
+PG_SET_LEVELS = """
+UPDATE account_activity AS a SET level = t.level, xp = t.xp
+FROM unnest($1::bigint[], $2::bigint[], $3::int[], $4::float8[]) AS t (g, u, level, xp)
+WHERE a.guild_id = t.g AND a.user_id = t.u
+"""
+
+PG_SAVE_CURVE = """
+INSERT INTO level_curve (id, thresholds, updated_at) VALUES (1, $1, $2)
+ON CONFLICT (id) DO UPDATE SET thresholds = excluded.thresholds, updated_at = excluded.updated_at
+"""
+
+PG_DELETE_CHECKPOINTS = "DELETE FROM voice_checkpoints WHERE guild_id = ANY($1::bigint[])"
+
+PG_INSERT_CHECKPOINTS = """
+INSERT INTO voice_checkpoints (guild_id, user_id, channel_id, earning, checkpoint_ts)
+SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::bool[], $5::float8[])
+"""
+
+# Ключ pg_advisory_xact_lock: схему и перенос данных из SQLite выполняет только один процесс
+PG_SCHEMA_LOCK = 0x4E41455241
+
+
+def _observed(func: Callable) -> Callable:
+    """Передаёт время запроса к PostgreSQL наблюдателям движка (метрики) под именем pg.<метод>"""
+    name = f"pg.{func.__name__}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            engine.observe(name, time.perf_counter() - start, ok)
+    return wrapper
+
+
+class PostgresActivityRepository(ActivityRepository):
+    """
+    Счётчики в PostgreSQL: пачка пишется одним upsert с RETURNING, повышения уровня —
+    одним UPDATE в той же транзакции. Несколько процессов бота пишут в одну таблицу,
+    блокировки берутся построчно, а не на весь файл
+    """
+
+    name = "postgresql"
+    shared = True
+
+    def __init__(self, dsn: str, pool_size: int = DEFAULT_PG_POOL_SIZE, seed_from_sqlite: bool = True):
+        self.dsn = dsn
+        self.pool_size = max(1, pool_size)
+        self.seed_from_sqlite = seed_from_sqlite
+        self._pool = None
+
+    async def start(self) -> None:
+        try:
+            import asyncpg
+        except ImportError as e:
+            raise RuntimeError("Для DATABASE_URL=postgresql://... нужен пакет asyncpg") from e
+
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size, command_timeout=30)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PG_SCHEMA_LOCK)
+                await conn.execute(PG_SCHEMA)
+                empty = await conn.fetchval("SELECT NOT EXISTS (SELECT 1 FROM account_activity)")
+                if empty and self.seed_from_sqlite:
+                    # Первый запуск: накопленные счётчики переносятся из economy.db
+                    rows = [(guild_id, user_id, float(xp), int(level), int(voice_seconds), int(messages))
+                            for guild_id, user_id, xp, level, voice_seconds, messages in await run_db(economy.get_activity_rows)]
+                    if rows:
+                        await conn.copy_records_to_table(
+                            "account_activity", records=rows,
+                            columns=["guild_id", "user_id", "xp", "level", "voice_seconds", "messages_sent"],
+                        )
+                        logging.info(f"📦 Счётчики активности перенесены в PostgreSQL: {len(rows)}")
+                if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM level_curve)"):
+                    # Перенесённые из economy.db счётчики записаны по её кривой — от неё и пересчитывать
+                    stored = await run_db(economy.get_level_curve)
+                    if stored is not None:
+                        await conn.execute(PG_SAVE_CURVE, stored, time.time())
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @staticmethod
+    async def _upsert(conn, rows: List[Tuple[int, int, float, int, int]], level_up: LevelUp, check_levels: bool) -> List[ActivityRow]:
+        # Порядок ключей одинаков во всех процессах — встречные пачки не взаимоблокируются
+        rows.sort()
+        columns = list(zip(*rows))
+        updated = [tuple(r) for r in await conn.fetch(PG_UPSERT_ACTIVITY, *map(list, columns))]
+        if not check_levels:
+            return updated
+
+        changed = []
+        for i, (guild_id, user_id, xp, level, voice_seconds, messages) in enumerate(updated):
+            new_level, new_xp = level_up(level, xp)
+            if new_level != level:
+                changed.append((guild_id, user_id, new_level, new_xp))
+                updated[i] = (guild_id, user_id, new_xp, new_level, voice_seconds, messages)
+        if changed:
+            await conn.execute(PG_SET_LEVELS, *map(list, zip(*changed)))
+        return updated
+
+    @_observed
+    async def apply_activity(self, deltas, level_up):
+        if not deltas:
+            return []
+        rows = [(guild_id, user_id, float(xp), 0, int(messages)) for (guild_id, user_id), (xp, messages) in deltas.items()]
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                return await self._upsert(conn, rows, level_up, any(xp > 0 for xp, _ in deltas.values()))
+
+    @_observed
+    async def apply_voice(self, credits, xp_per_minute, level_up, sessions=None):
+        xp_per_minute = max(xp_per_minute, 0)
+        rows = [(guild_id, user_id, xp_per_minute * seconds / 60, int(seconds), 0)
+                for (guild_id, user_id), seconds in credits.items()]
+        updated: List[ActivityRow] = []
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if rows:
+                    updated = await self._upsert(conn, rows, level_up, xp_per_minute > 0)
+                if sessions is not None:
+                    # Таблица общая: процесс заменяет снимок только своих серверов. Строки сервера,
+                    # где сессий не осталось, безвредны — при восстановлении действует recovery_grace
+                    guilds = sorted({s[0] for s in sessions} | {key[0] for key in credits})
+                    await conn.execute(PG_DELETE_CHECKPOINTS, guilds)
+                    if sessions:
+                        columns = list(zip(*sorted(sessions)))
+                        columns[3] = [bool(earning) for earning in columns[3]]
+                        await conn.execute(PG_INSERT_CHECKPOINTS, *map(list, columns))
+        return updated
+
+    @_observed
+    async def get_voice_checkpoints(self, guild_id):
+        rows = await self._pool.fetch(
+            "SELECT user_id, channel_id, earning, checkpoint_ts FROM voice_checkpoints WHERE guild_id = $1", guild_id
+        )
+        return {r["user_id"]: (r["channel_id"], r["earning"], r["checkpoint_ts"]) for r in rows}
+
+    @_observed
+    async def get_activity(self, user_id, guild_id):
+        row = await self._pool.fetchrow(
+            "SELECT xp, level, voice_seconds, messages_sent FROM account_activity WHERE guild_id = $1 AND user_id = $2",
+            guild_id, user_id,
+        )
+        return tuple(row) if row else None
+
+    @_observed
+    async def load_activity(self, guild_id):
+        rows = await self._pool.fetch(
+            "SELECT guild_id, user_id, xp, level, voice_seconds, messages_sent FROM account_activity WHERE guild_id = $1",
+            guild_id,
+        )
+        return [tuple(r) for r in rows]
+
+    @_observed
+    async def rebase_levels(self, thresholds, rebase):
+        changed = []
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Кривую сверяет один процесс; остальные после него увидят уже новую
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PG_SCHEMA_LOCK)
+                stored = await conn.fetchval("SELECT thresholds FROM level_curve WHERE id = 1")
+                if stored is not None and json.loads(stored) != json.loads(thresholds):
+                    convert = rebase(stored)
+                    # FOR UPDATE: начисления других процессов ждут пересчёта, а не теряются в нём
+                    rows = await conn.fetch(
+                        "SELECT guild_id, user_id, level, xp FROM account_activity ORDER BY guild_id, user_id FOR UPDATE"
+                    )
+                    for guild_id, user_id, level, xp in rows:
+                        new_level, new_xp = convert(level, xp)
+                        if new_level != level or new_xp != xp:
+                            changed.append((guild_id, user_id, new_level, new_xp))
+                    if changed:
+                        await conn.execute(PG_SET_LEVELS, *map(list, zip(*changed)))
+                await conn.execute(PG_SAVE_CURVE, thresholds, time.time())
+        return len(changed)
+
+
+def create_activity_repository(url: Optional[str] = None, pool_size: int = DEFAULT_PG_POOL_SIZE) -> ActivityRepository:
+    """
+    Выбирает реализацию по DATABASE_URL
+
+    Args:
+        url: Пусто или sqlite:// — economy.db; postgresql:// или postgres:// — PostgreSQL
+        pool_size: Максимум соединений пула PostgreSQL
+    """
+    if not url or url.startswith("sqlite"):
+        return SqliteActivityRepository()
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresActivityRepository(url, pool_size)
+    raise ValueError(f"Неподдерживаемый DATABASE_URL: {url.split('://', 1)[0]}://...")
+
+
+_repository: ActivityRepository = SqliteActivityRepository()
+
+
+def get_activity_repository() -> ActivityRepository:
+    return _repository
+
+
+async def configure_activity_repository(url: Optional[str] = None, pool_size: int = DEFAULT_PG_POOL_SIZE) -> ActivityRepository:
+    """Создаёт и запускает хранилище по DATABASE_URL. Вызывается один раз при старте бота"""
+    global _repository
+    repository = create_activity_repository(url, pool_size)
+    await repository.start()
+    previous, _repository = _repository, repository
+    await previous.close()
+    logging.info(f"📦 Хранилище активности: {repository.name}")
+    return repository
+
+
+async def overlay_activity(user_id: int, guild_id: int, acc: tuple) -> tuple:
+    """
+    Подставляет в кортеж get_or_create_account опыт, уровень и время в войсе
+    из общего хранилища (для SQLite кортеж уже актуален)
+    """
+    repository = _repository
+    if not repository.shared or not acc:
+        return acc
+    xp, level, voice_seconds, _ = await repository.get_activity(user_id, guild_id) or (0, 1, 0, 0)
+    return acc[:2] + (xp, level, voice_seconds) + acc[5:]
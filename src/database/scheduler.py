@@ -0,0 +1,49 @@
+# src/database/scheduler.py
+"""
+Хранилище отложенных задач планировщика (таблица scheduled_tasks в main.db).
+Схема создаётся миграцией main.db v4
+"""
+from typing import Iterable, List, Optional, Tuple
+
+from src.database.connection import get_connection
+
+
+def apply_task_writes(upserts: Iterable[Tuple[str, str, float, Optional[str]]],
+                      kept: Iterable[Tuple[str, str, float, Optional[str]]],
+                      deletes: Iterable[Tuple[str, str, Optional[float]]]) -> None:
+    """
+    Записывает накопленные изменения задач одной транзакцией
+
+    Args:
+        upserts: Задачи (kind, key, due_at, payload) с перезаписью срока
+        kept: Задачи, которые не трогают уже существующие ключи
+        deletes: Удаления (kind, key, due_at); due_at=None — без проверки срока
+    """
+    conn = get_connection()
+    try:
+        conn.executemany("INSERT OR REPLACE INTO scheduled_tasks (kind, key, due_at, payload) VALUES (?, ?, ?, ?)", list(upserts))
+        conn.executemany("INSERT OR IGNORE INTO scheduled_tasks (kind, key, due_at, payload) VALUES (?, ?, ?, ?)", list(kept))
+        conn.executemany("DELETE FROM scheduled_tasks WHERE kind=? AND key=? AND (? IS NULL OR due_at=?)",
+                         [(kind, key, due_at, due_at) for kind, key, due_at in deletes])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_tasks_due(after: Optional[float], until: float) -> List[Tuple[str, str, float, Optional[str]]]:
+    """Задачи со сроком в (after, until]; after=None — включая все просроченные"""
+    conn = get_connection()
+    try:
+        if after is None:
+            rows = conn.execute(
+                "SELECT kind, key, due_at, payload FROM scheduled_tasks WHERE due_at <= ? ORDER BY due_at",
+                (until,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT kind, key, due_at, payload FROM scheduled_tasks WHERE due_at > ? AND due_at <= ? ORDER BY due_at",
+                (after, until),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+    finally:
+        conn.close()
@@ -2,51 +2,56 @@
 import sqlite3
 import os
 from typing import Optional, Dict, Any
+from src.database.engine import get_pool
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tickets.db")
+
 
 class TicketDatabase:
-    def __init__(self, db_path: str = "src/database/tickets.db"):
+    def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
-        self.init_database()
 
-    def init_database(self):
-        """Инициализация базы данных"""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+    def init_database(self, conn=None):
+        """Инициализация базы данных (вызывается раннером миграций с его соединением)"""
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with get_pool(self.db_path).connect() as conn:
+                self.init_database(conn)
+                conn.commit()
+            return
+
+        cursor = conn.cursor()
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Создаем таблицу для хранения счетчика обращений
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ticket_counter (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    current_number INTEGER DEFAULT 0
-                )
-            ''')
-            
-            # Создаем таблицу для хранения информации об обращениях
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ticket_number TEXT UNIQUE NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    ticket_type TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    position TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'open'
-                )
-            ''')
-            
-            # Инициализируем счетчик, если его нет
-            cursor.execute('SELECT COUNT(*) FROM ticket_counter')
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('INSERT INTO ticket_counter (current_number) VALUES (0)')
-            
-            conn.commit()
+        # Создаем таблицу для хранения счетчика обращений
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ticket_counter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                current_number INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # Создаем таблицу для хранения информации об обращениях
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tickets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket_number TEXT UNIQUE NOT NULL,
+                user_id INTEGER NOT NULL,
+                ticket_type TEXT NOT NULL,
+                description TEXT NOT NULL,
+                position TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'open'
+            )
+        ''')
+        
+        # Инициализируем счетчик, если его нет
+        cursor.execute('SELECT COUNT(*) FROM ticket_counter')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('INSERT INTO ticket_counter (current_number) VALUES (0)')
 
     def get_next_ticket_number(self) -> str:
         """Получает следующий номер обращения"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_pool(self.db_path).connect() as conn:
             cursor = conn.cursor()
             
             # Получаем текущий номер
@@ -71,7 +76,7 @@ class TicketDatabase:
     def create_ticket(self, ticket_number: str, user_id: int, ticket_type: str, description: str, position: str = None) -> bool:
         """Создает запись об обращении"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_pool(self.db_path).connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO tickets (ticket_number, user_id, ticket_type, description, position)
@@ -84,7 +89,7 @@ class TicketDatabase:
 
     def get_ticket_info(self, ticket_number: str) -> Optional[Dict[str, Any]]:
         """Получает информацию об обращении"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_pool(self.db_path).connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT ticket_number, user_id, ticket_type, description, position, created_at, status
@@ -106,7 +111,7 @@ class TicketDatabase:
 
     def close_ticket(self, ticket_number: str) -> bool:
         """Закрывает обращение"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_pool(self.db_path).connect() as conn:
             cursor = conn.cursor()
             cursor.execute('UPDATE tickets SET status = ? WHERE ticket_number = ?', ('closed', ticket_number))
             conn.commit()
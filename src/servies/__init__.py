@@ -4,5 +4,18 @@
 
 from .message_counter import MessageCounterService
 from .experience_service import ExperienceService
+from .activity_buffer import ActivityBuffer, activity_buffer
+from .leaderboard import LeaderboardService, leaderboards
+from .voice_sessions import VoiceSessionEngine, voice_sessions
+from .voice_router import VoiceRouter, VoiceTransition, voice_router
+from .scheduler import Scheduler, scheduler
+from .xp_limiter import XpRateLimiter, xp_limiter
+from .startup import StartupPipeline, command_tree_hash, startup
+from .metrics import MetricsRegistry, metrics
+from .loop_monitor import LoopLagMonitor, loop_monitor
+from .tracing import Tracer, tracer
 
-__all__ = ['MessageCounterService', 'ExperienceService']
+__all__ = ['MessageCounterService', 'ExperienceService', 'ActivityBuffer', 'activity_buffer', 'LeaderboardService', 'leaderboards', 'VoiceSessionEngine', 'voice_sessions',
+           'VoiceRouter', 'VoiceTransition', 'voice_router', 'Scheduler', 'scheduler', 'XpRateLimiter', 'xp_limiter',
+           'StartupPipeline', 'command_tree_hash', 'startup', 'MetricsRegistry', 'metrics', 'LoopLagMonitor', 'loop_monitor',
+           'Tracer', 'tracer']
@@ -0,0 +1,119 @@
+"""
+Буфер отложенной записи опыта и счётчика сообщений
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from src.core.config import settings
+from src.database.repository import get_activity_repository
+from src.servies.experience_service import ExperienceService
+from src.servies.leaderboard import leaderboards
+
+
+class ActivityBuffer:
+    """
+    Накапливает опыт и сообщения по ключу (guild_id, user_id) в памяти
+    и сбрасывает их в БД одной транзакцией по таймеру или по размеру
+    """
+
+    def __init__(self, flush_size: Optional[int] = None):
+        self._pending: Dict[Tuple[int, int], list] = {}
+        self._flush_size = flush_size or getattr(settings, 'ECONOMY_ACTIVITY_FLUSH_SIZE', 500)
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add_message(self, user_id: int, guild_id: int, xp: Optional[float] = None) -> None:
+        """
+        Учитывает одно сообщение пользователя
+
+        Args:
+            user_id: ID пользователя
+            guild_id: ID сервера
+            xp: Опыт за сообщение (по умолчанию из ECONOMY_XP_SOURCES)
+        """
+        if xp is None:
+            xp = ExperienceService._get_xp_sources().get('message', 0.5)
+        self._add(user_id, guild_id, xp, 1)
+
+    def add_xp(self, user_id: int, guild_id: int, xp: float) -> None:
+        """Начисляет опыт без учёта сообщения (награды кейсов и т.п.)"""
+        self._add(user_id, guild_id, xp, 0)
+
+    def _add(self, user_id: int, guild_id: int, xp: float, messages: int) -> None:
+        entry = self._pending.get((guild_id, user_id))
+        if entry is None:
+            entry = self._pending[(guild_id, user_id)] = [0.0, 0]
+        entry[0] += max(xp, 0)
+        entry[1] += messages
+
+        if len(self._pending) >= self._flush_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def pending(self, user_id: int, guild_id: int) -> Tuple[float, int]:
+        """Возвращает ещё не записанные (опыт, сообщения) пользователя"""
+        entry = self._pending.get((guild_id, user_id))
+        return (entry[0], entry[1]) if entry else (0.0, 0)
+
+    def pending_guild(self, guild_id: int) -> Dict[int, Tuple[float, int]]:
+        """Ещё не записанные {user_id: (опыт, сообщения)} участников сервера"""
+        return {user_id: (entry[0], entry[1]) for (gid, user_id), entry in self._pending.items() if gid == guild_id}
+
+    def merge_account(self, user_id: int, guild_id: int, acc: tuple) -> tuple:
+        """
+        Накладывает ожидающие записи на кортеж из get_or_create_account
+
+        Returns:
+            Кортеж аккаунта с учётом ещё не записанного опыта и повышений уровня
+        """
+        xp, _ = self.pending(user_id, guild_id)
+        if not xp or not acc:
+            return acc
+        level, new_xp = ExperienceService.apply_level_ups(acc[3] or 1, (acc[2] or 0) + xp)
+        return acc[:2] + (new_xp, level) + acc[4:]
+
+    def _take(self, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> Dict[Tuple[int, int], tuple]:
+        if guild_id is None:
+            taken, self._pending = self._pending, {}
+        else:
+            keys = [k for k in self._pending if k[0] == guild_id and (user_id is None or k[1] == user_id)]
+            taken = {k: self._pending.pop(k) for k in keys}
+        return {k: (v[0], v[1]) for k, v in taken.items()}
+
+    def _restore(self, batch: Dict[Tuple[int, int], tuple]) -> None:
+        for key, (xp, messages) in batch.items():
+            entry = self._pending.setdefault(key, [0.0, 0])
+            entry[0] += xp
+            entry[1] += messages
+
+    async def flush(self, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> int:
+        """
+        Записывает накопленные данные в БД
+
+        Args:
+            guild_id: Сбросить только этот сервер (по умолчанию все)
+            user_id: Сбросить только этого пользователя сервера
+
+        Returns:
+            Количество записанных аккаунтов
+        """
+        async with self._flush_lock:
+            batch = self._take(guild_id, user_id)
+            if not batch:
+                return 0
+            try:
+                rows = await get_activity_repository().apply_activity(batch, ExperienceService.apply_level_ups)
+            except Exception as e:
+                # Возвращаем данные в буфер, чтобы не потерять их
+                self._restore(batch)
+                logging.error(f"❌ Ошибка при записи буфера активности: {e}")
+                return 0
+            # Общее хранилище не вызывает триггеры SQLite — новые значения передаются в топы явно
+            leaderboards.update_activity(rows)
+            return len(batch)
+
+
+activity_buffer = ActivityBuffer()
@@ -1,20 +1,30 @@
 """
 Сервис для подсчета опыта пользователей
 """
+import json
+import logging
 import sqlite3
-from typing import Optional, Dict, Any
-from src.database.economy import init_economy_db, get_connection
+from typing import Optional, Dict, Any, List
+from src.database import economy
+from src.database.economy import DB_PATH, get_connection, upsert_account
+from src.database.migrations import ensure_schema
+from src.database.repository import get_activity_repository
 from src.core.config import settings
+from src.servies.level_curve import LevelCurve
 
 
 class ExperienceService:
     """Сервис для управления опытом пользователей"""
+
+    # (исходный объект конфига, скомпилированное значение); пересобирается при замене конфига
+    _curve_cache: Optional[tuple] = None
+    _sources_cache: Optional[tuple] = None
     
     @staticmethod
     def _ensure_db_initialized() -> None:
-        """Убеждается, что база данных инициализирована"""
+        """Убеждается, что база данных инициализирована (после первой миграции — без обращения к БД)"""
         try:
-            init_economy_db()
+            ensure_schema(DB_PATH)
         except Exception as e:
             print(f"Ошибка при инициализации базы данных: {e}")
     
@@ -45,15 +55,39 @@ class ExperienceService:
         """
         # Получаем настройки из конфига
         xp_sources = getattr(settings, 'ECONOMY_XP_SOURCES', {})
+        cache = ExperienceService._sources_cache
+        if cache is not None and cache[0] is xp_sources:
+            return cache[1]
         
         # Если конфиг пустой, используем стандартные значения
-        if not xp_sources:
-            return {
-                'message': 0.5,      # За сообщение
-                'voice_minute': 0.5,  # За минуту в войсе
-            }
-        
-        return xp_sources
+        compiled = xp_sources or {
+            'message': 0.5,      # За сообщение
+            'voice_minute': 0.5,  # За минуту в войсе
+            'message_burst': 3,  # Антиспам: сообщений с опытом подряд
+            'message_interval': 10,  # Антиспам: секунд на восстановление одного сообщения
+            'message_duplicate_window': 60,  # Антиспам: окно, в котором повтор текста не даёт опыта
+        }
+        ExperienceService._sources_cache = (xp_sources, compiled)
+        return compiled
+
+    @staticmethod
+    def get_level_curve() -> LevelCurve:
+        """
+        Возвращает скомпилированную кривую уровней.
+        Пересобирается, только если объект ECONOMY_XP_PER_LEVEL в настройках заменён
+        """
+        source = getattr(settings, 'ECONOMY_XP_PER_LEVEL', {})
+        cache = ExperienceService._curve_cache
+        if cache is None or cache[0] is not source:
+            cache = (source, LevelCurve(ExperienceService._get_xp_per_level()))
+            ExperienceService._curve_cache = cache
+        return cache[1]
+
+    @staticmethod
+    def reload_config() -> None:
+        """Сбрасывает кэш кривой и источников опыта (после изменения конфига на месте)"""
+        ExperienceService._curve_cache = None
+        ExperienceService._sources_cache = None
     
     @staticmethod
     def add_xp_from_message(user_id: int, guild_id: int) -> None:
@@ -76,15 +110,11 @@ class ExperienceService:
         c = conn.cursor()
         
         try:
-            # Добавляем опыт
-            c.execute("""
-                UPDATE accounts 
-                SET xp = xp + ? 
-                WHERE user_id=? AND guild_id=?
-            """, (xp_amount, user_id, guild_id))
+            # Добавляем опыт (аккаунт создаётся тем же запросом — опыт за первое сообщение не теряется)
+            current = upsert_account(c, user_id, guild_id, returning="level, xp", xp=xp_amount)
             
             # Проверяем повышение уровня
-            ExperienceService._check_level_up(user_id, guild_id, conn, c)
+            ExperienceService._check_level_up(user_id, guild_id, conn, c, current)
             
             conn.commit()
             
@@ -118,14 +148,10 @@ class ExperienceService:
         
         try:
             # Добавляем опыт
-            c.execute("""
-                UPDATE accounts 
-                SET xp = xp + ? 
-                WHERE user_id=? AND guild_id=?
-            """, (xp_amount, user_id, guild_id))
+            current = upsert_account(c, user_id, guild_id, returning="level, xp", xp=xp_amount)
             
             # Проверяем повышение уровня
-            ExperienceService._check_level_up(user_id, guild_id, conn, c)
+            ExperienceService._check_level_up(user_id, guild_id, conn, c, current)
             
             conn.commit()
             
@@ -135,7 +161,50 @@ class ExperienceService:
             conn.close()
     
     @staticmethod
-    def _check_level_up(user_id: int, guild_id: int, conn: sqlite3.Connection, c) -> None:
+    def apply_level_ups(level: int, xp: float) -> tuple:
+        """
+        Применяет повышения уровня к паре (уровень, опыт) без обращения к БД
+
+        Args:
+            level: Текущий уровень
+            xp: Текущий опыт
+
+        Returns:
+            Кортеж (новый_уровень, оставшийся_опыт)
+        """
+        return ExperienceService.get_level_curve().apply(level, xp)
+
+    @staticmethod
+    def apply_activity_batch(deltas: Dict[tuple, tuple]) -> None:
+        """
+        Записывает накопленный опыт и сообщения одной транзакцией
+
+        Args:
+            deltas: Словарь {(guild_id, user_id): (опыт, сообщения)}
+        """
+        if not deltas:
+            return
+
+        ExperienceService._ensure_db_initialized()
+        economy.apply_activity_batch(deltas, ExperienceService.apply_level_ups)
+
+    @staticmethod
+    def apply_voice_batch(credits: Dict[tuple, int], sessions: Optional[List[tuple]] = None) -> None:
+        """
+        Начисляет время в войсе и опыт за него одной транзакцией и сохраняет снимок открытых сессий
+
+        Args:
+            credits: Словарь {(guild_id, user_id): секунды}
+            sessions: Открытые сессии [(guild_id, user_id, channel_id, earning, checkpoint_ts)];
+                None — снимок не трогать
+        """
+        ExperienceService._ensure_db_initialized()
+
+        xp_per_minute = ExperienceService._get_xp_sources().get('voice_minute', 0.5)
+        economy.apply_voice_batch(credits, xp_per_minute, ExperienceService.apply_level_ups, sessions)
+
+    @staticmethod
+    def _check_level_up(user_id: int, guild_id: int, conn: sqlite3.Connection, c, current: Optional[tuple] = None) -> None:
         """
         Проверяет и обрабатывает повышение уровня
         
@@ -144,33 +213,43 @@ class ExperienceService:
             guild_id: ID сервера
             conn: Соединение с БД
             c: Курсор БД
+            current: (уровень, опыт), если уже известны из RETURNING
         """
         try:
             # Получаем текущий уровень и опыт
-            c.execute("SELECT level, xp FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-            result = c.fetchone()
+            result = current
+            if result is None:
+                c.execute("SELECT level, xp FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+                result = c.fetchone()
             
             if not result:
                 return
             
             current_level, current_xp = result
-            xp_per_level = ExperienceService._get_xp_per_level()
-            
-            # Проверяем, нужно ли повысить уровень
-            while current_level in xp_per_level and current_xp >= xp_per_level[current_level]:
-                current_level += 1
-                current_xp -= xp_per_level[current_level - 1]
+            new_level, new_xp = ExperienceService.get_level_curve().apply(current_level, current_xp)
+            if new_level == current_level:
+                return
             
             # Обновляем уровень и опыт
             c.execute("""
                 UPDATE accounts 
                 SET level = ?, xp = ? 
                 WHERE user_id=? AND guild_id=?
-            """, (current_level, current_xp, user_id, guild_id))
+            """, (new_level, new_xp, user_id, guild_id))
             
         except Exception as e:
             print(f"Ошибка при проверке повышения уровня: {e}")
     
+    @staticmethod
+    def xp_to_next_level(level: int) -> int:
+        """
+        Опыт, необходимый для следующего уровня (без обращения к БД)
+
+        Args:
+            level: Текущий уровень
+        """
+        return ExperienceService.get_level_curve().xp_to_next(level)
+
     @staticmethod
     def get_user_level_info(user_id: int, guild_id: int) -> Dict[str, Any]:
         """
@@ -201,14 +280,11 @@ class ExperienceService:
                 }
             
             level, xp = result
-            xp_per_level = ExperienceService._get_xp_per_level()
-            
-            # Получаем необходимый опыт для следующего уровня
-            next_level = level + 1
-            xp_needed = xp_per_level.get(next_level, next_level * 100)
+            curve = ExperienceService.get_level_curve()
             
-            # Прогресс до следующего уровня
-            progress = (xp / xp_needed) * 100 if xp_needed > 0 else 0
+            # Необходимый опыт и прогресс до следующего уровня
+            xp_needed = curve.xp_to_next(level)
+            progress = curve.progress(level, xp)
             
             return {
                 'level': level,
@@ -279,21 +355,16 @@ class ExperienceService:
         c = conn.cursor()
         
         try:
+            # Сравнение пар (level, xp) идёт диапазоном по индексу idx_accounts_level
             c.execute("""
                 SELECT COUNT(*) + 1 
                 FROM accounts a 
                 WHERE a.guild_id = ? 
-                AND (a.level > (
-                    SELECT level FROM accounts 
-                    WHERE user_id=? AND guild_id=?
-                ) OR (a.level = (
-                    SELECT level FROM accounts 
-                    WHERE user_id=? AND guild_id=?
-                ) AND a.xp > (
-                    SELECT xp FROM accounts 
+                AND (a.level, a.xp) > (
+                    SELECT level, xp FROM accounts 
                     WHERE user_id=? AND guild_id=?
-                )))
-            """, (guild_id, user_id, guild_id, user_id, guild_id, user_id, guild_id))
+                )
+            """, (guild_id, user_id, guild_id))
             
             result = c.fetchone()
             return int(result[0]) if result else 1
@@ -355,34 +426,15 @@ class ExperienceService:
         level_ups = 0
         
         try:
-            # Получаем всех пользователей сервера
+            curve = ExperienceService.get_level_curve()
+            # Один UPDATE на весь сервер: новый уровень и остаток считает кривая
+            ExperienceService._register_curve_functions(conn, curve, curve)
             c.execute("""
-                SELECT user_id, level, xp 
-                FROM accounts 
-                WHERE guild_id=?
+                UPDATE accounts 
+                SET level = curve_level(level, xp), xp = curve_xp(level, xp) 
+                WHERE guild_id=? AND curve_level(level, xp) != level
             """, (guild_id,))
-            
-            users = c.fetchall()
-            xp_per_level = ExperienceService._get_xp_per_level()
-            
-            for user_id, current_level, current_xp in users:
-                new_level = current_level
-                remaining_xp = current_xp
-                
-                # Проверяем, нужно ли повысить уровень
-                while new_level in xp_per_level and remaining_xp >= xp_per_level[new_level]:
-                    remaining_xp -= xp_per_level[new_level]
-                    new_level += 1
-                
-                # Если уровень изменился, обновляем в БД
-                if new_level != current_level:
-                    c.execute("""
-                        UPDATE accounts 
-                        SET level = ?, xp = ? 
-                        WHERE user_id=? AND guild_id=?
-                    """, (new_level, remaining_xp, user_id, guild_id))
-                    level_ups += 1
-            
+            level_ups = c.rowcount
             conn.commit()
             
         except Exception as e:
@@ -391,6 +443,46 @@ class ExperienceService:
             conn.close()
         
         return level_ups
+
+    @staticmethod
+    def _register_curve_functions(conn: sqlite3.Connection, old: LevelCurve, new: LevelCurve) -> None:
+        """
+        Регистрирует SQL-функции curve_level/curve_xp: пара (level, xp) по старой кривой
+        переводится в суммарный опыт и раскладывается по новой
+        """
+        def convert(level, xp):
+            if old is new:
+                return new.apply(level or 1, xp or 0)
+            return new.split(old.total_xp(level or 1, xp or 0))
+
+        conn.create_function("curve_level", 2, lambda level, xp: convert(level, xp)[0], deterministic=True)
+        conn.create_function("curve_xp", 2, lambda level, xp: convert(level, xp)[1], deterministic=True)
+
+    @staticmethod
+    async def sync_level_curve() -> int:
+        """
+        Сверяет кривую из конфига с сохранённой в хранилище активности. Если кривая изменилась,
+        уровни всех пользователей пересчитываются так, чтобы сохранить суммарный опыт
+
+        Returns:
+            Количество аккаунтов, у которых изменились уровень или опыт
+        """
+        curve = ExperienceService.get_level_curve()
+
+        def rebase(stored: str):
+            old = LevelCurve({i: xp for i, xp in enumerate(json.loads(stored), start=1)})
+            return lambda level, xp: curve.split(old.total_xp(level or 1, xp or 0))
+
+        repository = get_activity_repository()
+        try:
+            changed = await repository.rebase_levels(json.dumps(curve.requirements), rebase)
+        except Exception as e:
+            print(f"Ошибка при синхронизации кривой уровней: {e}")
+            return 0
+
+        if changed:
+            logging.info(f"📈 Кривая уровней изменилась, пересчитано аккаунтов ({repository.name}): {changed}")
+        return changed
     
     @staticmethod
     def check_user_level_up(user_id: int, guild_id: int) -> bool:
@@ -424,15 +516,7 @@ class ExperienceService:
                 return False
             
             current_level, current_xp = result
-            xp_per_level = ExperienceService._get_xp_per_level()
-            
-            new_level = current_level
-            remaining_xp = current_xp
-            
-            # Проверяем, нужно ли повысить уровень
-            while new_level in xp_per_level and remaining_xp >= xp_per_level[new_level]:
-                remaining_xp -= xp_per_level[new_level]
-                new_level += 1
+            new_level, remaining_xp = ExperienceService.get_level_curve().apply(current_level, current_xp)
             
             # Если уровень изменился, обновляем в БД
             if new_level != current_level:
@@ -0,0 +1,384 @@
+"""
+Сервис таблиц лидеров в памяти
+"""
+import functools
+import logging
+import random
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.database import economy
+from src.database.engine import get_pool, run_db
+from src.database.repository import LevelUp, get_activity_repository
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.width: List[int] = [1] * level
+
+
+class IndexableSkipList:
+    """
+    Упорядоченное множество ключей со статистикой порядка:
+    вставка, удаление, позиция ключа и доступ по индексу за O(log n)
+    """
+
+    MAX_LEVEL = 32
+
+    def __init__(self):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _find(self, key) -> Tuple[List[_Node], List[int]]:
+        """Для каждого уровня — последний узел с ключом < key и его позиция"""
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        steps = [0] * self.MAX_LEVEL
+        node, pos = self._head, 0
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            steps[i] = pos
+        return update, steps
+
+    def insert(self, key) -> None:
+        update, steps = self._find(key)
+        pos = steps[0]
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        node = _Node(key, level)
+        for i in range(self.MAX_LEVEL):
+            prev = update[i]
+            if i < level:
+                node.next[i] = prev.next[i]
+                prev.next[i] = node
+                node.width[i] = steps[i] + prev.width[i] - pos
+                prev.width[i] = pos + 1 - steps[i]
+            else:
+                prev.width[i] += 1
+        self._size += 1
+
+    def remove(self, key) -> bool:
+        update, _ = self._find(key)
+        target = update[0].next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(self.MAX_LEVEL):
+            prev = update[i]
+            if prev.next[i] is target:
+                prev.width[i] += target.width[i] - 1
+                prev.next[i] = target.next[i]
+            else:
+                prev.width[i] -= 1
+        self._size -= 1
+        return True
+
+    def count_less(self, key) -> int:
+        """Количество ключей строго меньше key"""
+        return self._find(key)[1][0]
+
+    def iter_from(self, index: int) -> Iterator:
+        """Ключи начиная с позиции index (с нуля) по возрастанию"""
+        if index >= self._size:
+            return
+        node, pos, target = self._head, 0, index + 1
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.next[i] is not None and pos + node.width[i] <= target:
+                pos += node.width[i]
+                node = node.next[i]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+# Колонки строки в памяти: cash, bank, level, xp, voice_seconds, messages_sent, robberies_success, robberies_fail
+_COLUMNS = "cash, bank, level, xp, voice_seconds, messages_sent, robberies_success, robberies_fail"
+
+# Ключ сортировки (по возрастанию = лучшие первыми) и формат строки как у get_top_by_* в БД
+METRICS = {
+    'balance': (lambda r: (-(r[0] + r[1]),), lambda uid, r: (uid, r[0] + r[1], r[0], r[1])),
+    'level': (lambda r: (-r[2], -r[3]), lambda uid, r: (uid, r[2], r[3])),
+    'voice': (lambda r: (-r[4],), lambda uid, r: (uid, r[4])),
+    'messages': (lambda r: (-r[5],), lambda uid, r: (uid, r[5])),
+    'robberies': (lambda r: (-r[6],), lambda uid, r: (uid, r[6], r[7])),
+}
+
+
+class GuildLeaderboard:
+    """Таблицы лидеров одного сервера по всем метрикам"""
+
+    def __init__(self):
+        self.rows: Dict[int, tuple] = {}
+        self.lists: Dict[str, IndexableSkipList] = {metric: IndexableSkipList() for metric in METRICS}
+
+    def update(self, user_id: int, row: Optional[tuple]) -> None:
+        """Заменяет значения пользователя (row=None — удаление)"""
+        old = self.rows.pop(user_id, None)
+        if row is not None:
+            self.rows[user_id] = row
+        for metric, (sort_key, _) in METRICS.items():
+            old_key = sort_key(old) + (user_id,) if old is not None else None
+            new_key = sort_key(row) + (user_id,) if row is not None else None
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                self.lists[metric].remove(old_key)
+            if new_key is not None:
+                self.lists[metric].insert(new_key)
+
+    def top(self, metric: str, limit: int = 10, offset: int = 0, overlay: Optional[Dict[int, tuple]] = None) -> List[tuple]:
+        sort_key, fmt = METRICS[metric]
+        if overlay:
+            # Строки с наложением могут подняться на любую позицию: берём голову списка с запасом
+            # на их число и сортируем вместе с ними — остальные участники сохраняют порядок
+            head = islice(self.lists[metric].iter_from(0), offset + limit + len(overlay))
+            rows = {key[-1]: self.rows[key[-1]] for key in head if key[-1] not in overlay}
+            rows.update(overlay)
+            ordered = sorted(rows, key=lambda uid: sort_key(rows[uid]) + (uid,))[offset:]
+        else:
+            rows = self.rows
+            ordered = (key[-1] for key in self.lists[metric].iter_from(offset))
+        result = []
+        for user_id in ordered:
+            row = rows[user_id]
+            if metric == 'messages' and not row[5]:
+                break
+            result.append(fmt(user_id, row))
+            if len(result) >= limit:
+                break
+        return result
+
+    def rank(self, metric: str, user_id: int, overlay: Optional[Dict[int, tuple]] = None) -> int:
+        overlay = overlay or {}
+        row = overlay.get(user_id, self.rows.get(user_id))
+        if row is None:
+            return 1
+        sort_key, _ = METRICS[metric]
+        key = sort_key(row)
+        # Ранг = число строго лучших + 1, как у COUNT(*) + 1 в БД
+        better = self.lists[metric].count_less(key)
+        for other, new in overlay.items():
+            old = self.rows.get(other)
+            if old is not None and sort_key(old) < key:
+                better -= 1
+            if other != user_id and sort_key(new) < key:
+                better += 1
+        return better + 1
+
+    def overlay(self, pending: Dict[int, tuple], level_up: LevelUp) -> Dict[int, tuple]:
+        """
+        Строки с ещё не записанной активностью
+
+        Args:
+            pending: {user_id: (опыт, сообщения, секунды в войсе)}
+            level_up: Функция (уровень, опыт) -> (новый_уровень, остаток_опыта)
+        """
+        result = {}
+        for user_id, (xp, messages, voice_seconds) in pending.items():
+            row = self.rows.get(user_id) or (0, 0, 1, 0, 0, 0, 0, 0)
+            level, new_xp = level_up(row[2] or 1, row[3] + xp) if xp else row[2:4]
+            result[user_id] = row[:2] + (level, new_xp, row[4] + voice_seconds, row[5] + messages) + row[6:]
+        return result
+
+
+def _normalize(values) -> tuple:
+    return tuple(v or 0 for v in values)
+
+
+def _with_activity(row: Optional[tuple], xp, level, voice_seconds, messages_sent) -> tuple:
+    """Строка таблицы с опытом, уровнем, войсом и сообщениями из хранилища активности"""
+    row = row or (0,) * 8
+    return row[:2] + _normalize((level, xp, voice_seconds, messages_sent)) + row[6:]
+
+
+class LeaderboardService:
+    """
+    Загружает таблицы лидеров из accounts один раз на сервер и поддерживает их
+    инкрементально через TEMP-триггеры на соединениях economy.db. Как и в кэше
+    аккаунтов, изменения копятся по соединению и применяются только после commit.
+
+    Если счётчики активности в общем хранилище (PostgreSQL), они приходят из
+    update_activity после записи пачки, а изменения других процессов подхватываются
+    перезагрузкой таблицы раз в SHARED_RELOAD_SECONDS
+    """
+
+    SHARED_RELOAD_SECONDS = 300.0
+
+    def __init__(self):
+        self._guilds: Dict[int, GuildLeaderboard] = {}
+        self._loading: Dict[int, List[Tuple[int, Optional[tuple]]]] = {}
+        self._loaded_at: Dict[int, float] = {}
+        self._lock = threading.RLock()
+        # {id(соединения): {(guild_id, user_id): строка или None}} — изменения незавершённых транзакций
+        self._pending: Dict[int, Dict[Tuple[int, int], Optional[tuple]]] = {}
+        self._pool = None
+
+    @staticmethod
+    def _merge(board: GuildLeaderboard, user_id: int, row: Optional[tuple]) -> None:
+        if row is not None and get_activity_repository().shared:
+            # Колонки активности в accounts не обновляются — остаются значения из общего хранилища
+            old = board.rows.get(user_id)
+            row = row[:2] + (old[2:6] if old else (1, 0, 0, 0)) + row[6:]
+        board.update(user_id, row)
+
+    def _on_account_changed(self, conn_id: int, deleted, guild_id, user_id, *values) -> None:
+        # Вызывается из триггера: исключение здесь сорвало бы сам UPDATE
+        try:
+            with self._lock:
+                self._pending.setdefault(conn_id, {})[(guild_id, user_id)] = None if deleted else _normalize(values)
+        except Exception as e:
+            logging.error(f"❌ Ошибка при обновлении таблицы лидеров: {e}")
+            self.invalidate(guild_id)
+
+    def _on_transaction_end(self, conn: sqlite3.Connection, committed: bool) -> None:
+        with self._lock:
+            changes = self._pending.pop(id(conn), None)
+            if not changes or not committed:
+                return
+            for (guild_id, user_id), row in changes.items():
+                try:
+                    board = self._guilds.get(guild_id)
+                    if board is not None:
+                        self._merge(board, user_id, row)
+                    elif guild_id in self._loading:
+                        self._loading[guild_id].append((user_id, row))
+                except Exception as e:
+                    logging.error(f"❌ Ошибка при обновлении таблицы лидеров: {e}")
+                    self.invalidate(guild_id)
+
+    def _bind(self) -> None:
+        """Подключается к пулу economy.db (новый пул — таблицы сбрасываются)"""
+        pool = get_pool(economy.DB_PATH)
+        if pool is self._pool:
+            return
+        with self._lock:
+            if pool is self._pool:
+                return
+            self._guilds.clear()
+            self._loaded_at.clear()
+            self._pending.clear()
+            self._pool = pool
+        pool.add_transaction_hook(self._on_transaction_end)
+        pool.add_connect_hook(self._install_triggers)
+
+    def _install_triggers(self, conn: sqlite3.Connection) -> None:
+        conn.create_function("leaderboard_account_changed", 11, functools.partial(self._on_account_changed, id(conn)))
+        new_values = ", ".join(f"NEW.{col.strip()}" for col in _COLUMNS.split(","))
+        conn.executescript(f"""
+            CREATE TEMP TRIGGER IF NOT EXISTS leaderboard_accounts_insert AFTER INSERT ON main.accounts
+            BEGIN SELECT leaderboard_account_changed(0, NEW.guild_id, NEW.user_id, {new_values}); END;
+            CREATE TEMP TRIGGER IF NOT EXISTS leaderboard_accounts_update
+            AFTER UPDATE OF {_COLUMNS} ON main.accounts
+            BEGIN SELECT leaderboard_account_changed(0, NEW.guild_id, NEW.user_id, {new_values}); END;
+            CREATE TEMP TRIGGER IF NOT EXISTS leaderboard_accounts_delete AFTER DELETE ON main.accounts
+            BEGIN SELECT leaderboard_account_changed(1, OLD.guild_id, OLD.user_id, 0, 0, 0, 0, 0, 0, 0, 0); END;
+        """)
+
+    def _load(self, guild_id: int, activity: Optional[list] = None) -> None:
+        self._bind()
+        with self._lock:
+            if guild_id in self._guilds or guild_id in self._loading:
+                return
+            self._loading[guild_id] = []
+
+        conn = economy.get_connection()
+        try:
+            rows = conn.execute(f"SELECT user_id, {_COLUMNS} FROM accounts WHERE guild_id=?", (guild_id,)).fetchall()
+        finally:
+            conn.close()
+
+        board = GuildLeaderboard()
+        for user_id, *values in rows:
+            row = _normalize(values)
+            if activity is not None:
+                # Колонки активности в accounts устарели — источник только общее хранилище
+                row = _with_activity(row, 0, 1, 0, 0)
+            board.update(user_id, row)
+        for _, user_id, xp, level, voice_seconds, messages_sent in activity or ():
+            board.update(user_id, _with_activity(board.rows.get(user_id), xp, level, voice_seconds, messages_sent))
+        with self._lock:
+            # Изменения, пришедшие во время загрузки, новее снимка
+            for user_id, row in self._loading.pop(guild_id, []):
+                self._merge(board, user_id, row)
+            self._guilds[guild_id] = board
+            self._loaded_at[guild_id] = time.monotonic()
+
+    async def ensure_loaded(self, guild_id: int) -> None:
+        repository = get_activity_repository()
+        if repository.shared and time.monotonic() - self._loaded_at.get(guild_id, 0.0) > self.SHARED_RELOAD_SECONDS:
+            self.invalidate(guild_id)
+        if guild_id not in self._guilds:
+            activity = await repository.load_activity(guild_id) if repository.shared else None
+            await run_db(self._load, guild_id, activity)
+
+    def update_activity(self, rows: List[tuple]) -> None:
+        """
+        Применяет новые значения счётчиков активности из общего хранилища
+
+        Args:
+            rows: [(guild_id, user_id, xp, level, voice_seconds, messages_sent)]
+        """
+        if not rows:
+            return
+        with self._lock:
+            for guild_id, user_id, xp, level, voice_seconds, messages_sent in rows:
+                board = self._guilds.get(guild_id)
+                if board is not None:
+                    board.update(user_id, _with_activity(board.rows.get(user_id), xp, level, voice_seconds, messages_sent))
+
+    async def top(self, guild_id: int, metric: str, limit: int = 10, offset: int = 0,
+                  pending: Optional[Dict[int, tuple]] = None, level_up: Optional[LevelUp] = None) -> List[tuple]:
+        """
+        Топ сервера по метрике
+
+        Args:
+            guild_id: ID сервера
+            metric: balance, level, voice, messages или robberies
+            limit: Количество записей
+            offset: Смещение от начала топа
+            pending: Ещё не записанная активность {user_id: (опыт, сообщения, секунды в войсе)},
+                которая накладывается на строки без сброса буферов
+            level_up: Функция повышения уровня для опыта из pending
+
+        Returns:
+            Список строк в том же формате, что и get_top_by_* из БД
+        """
+        await self.ensure_loaded(guild_id)
+        with self._lock:
+            board = self._guilds[guild_id]
+            overlay = board.overlay(pending, level_up) if pending else None
+            return board.top(metric, limit, offset, overlay)
+
+    async def rank(self, guild_id: int, metric: str, user_id: int,
+                   pending: Optional[Dict[int, tuple]] = None, level_up: Optional[LevelUp] = None) -> int:
+        """Позиция пользователя в топе (начиная с 1); pending и level_up — как в top"""
+        await self.ensure_loaded(guild_id)
+        with self._lock:
+            board = self._guilds[guild_id]
+            overlay = board.overlay(pending, level_up) if pending else None
+            return board.rank(metric, user_id, overlay)
+
+    def invalidate(self, guild_id: Optional[int] = None) -> None:
+        """Сбрасывает загруженные таблицы; следующий запрос перечитает их из БД"""
+        with self._lock:
+            if guild_id is None:
+                self._guilds.clear()
+                self._loaded_at.clear()
+            else:
+                self._guilds.pop(guild_id, None)
+                self._loaded_at.pop(guild_id, None)
+
+
+leaderboards = LeaderboardService()
@@ -0,0 +1,61 @@
+"""
+Скомпилированная кривая уровней
+"""
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+
+class LevelCurve:
+    """
+    Кривая опыта в виде префиксных сумм.
+
+    В accounts хранится пара (level, xp), где xp — остаток внутри уровня.
+    Для перехода с уровня L нужно requirements[L - 1] опыта; cumulative[L - 1] —
+    суммарный опыт, с которого начинается уровень L. Уровни после последнего
+    непрерывно заданного в конфиге не повышаются, как и раньше
+    """
+
+    __slots__ = ("requirements", "cumulative", "max_level")
+
+    def __init__(self, xp_per_level: Dict[int, int]):
+        requirements: List[float] = []
+        level = 1
+        while level in xp_per_level:
+            requirements.append(xp_per_level[level])
+            level += 1
+        self.requirements = requirements
+        self.cumulative = [0] + list(accumulate(requirements))
+        self.max_level = len(requirements) + 1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LevelCurve) and self.requirements == other.requirements
+
+    def total_xp(self, level: int, xp: float) -> float:
+        """Суммарный опыт для пары (уровень, остаток)"""
+        level = min(max(level, 1), self.max_level)
+        return self.cumulative[level - 1] + xp
+
+    def split(self, total: float) -> Tuple[int, float]:
+        """Уровень и остаток по суммарному опыту — бинарный поиск по префиксным суммам"""
+        index = bisect_right(self.cumulative, total) - 1
+        if index < 0:
+            return 1, total
+        return index + 1, total - self.cumulative[index]
+
+    def apply(self, level: int, xp: float) -> Tuple[int, float]:
+        """Применяет все положенные повышения уровня к паре (уровень, остаток)"""
+        if level < 1 or level >= self.max_level or xp < self.requirements[level - 1]:
+            return level, xp
+        return self.split(self.cumulative[level - 1] + xp)
+
+    def xp_to_next(self, level: int) -> float:
+        """Опыт, нужный для перехода с уровня level на следующий"""
+        if 1 <= level < self.max_level:
+            return self.requirements[level - 1]
+        return level * 100
+
+    def progress(self, level: int, xp: float) -> float:
+        """Прогресс до следующего уровня в процентах — O(1)"""
+        needed = self.xp_to_next(level)
+        return (xp / needed) * 100 if needed > 0 else 0.0
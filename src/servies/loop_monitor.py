@@ -0,0 +1,204 @@
+"""
+Замер задержки цикла событий (event loop lag) и поиск мест, которые его блокируют
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.servies.metrics import metrics
+
+loop_lag = metrics.histogram(
+    "bot_event_loop_lag_seconds", "Опоздание пробуждения цикла событий относительно заданного интервала",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+stall_duration = metrics.histogram(
+    "bot_event_loop_stall_seconds", "Длительность блокировок цикла событий дольше порога",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# Файлы проекта: место блокировки — самый глубокий кадр из них, а не из discord.py или sqlite3
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Offender:
+    __slots__ = ("site", "task", "stalls", "samples", "total", "max", "stack")
+
+    def __init__(self, site: str):
+        self.site = site
+        self.task = ""
+        self.stalls = 0
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = ""
+
+
+class LoopLagMonitor:
+    """
+    Цикл событий каждые interval секунд отмечает, что он жив, и измеряет опоздание пробуждения.
+
+    Сторожевой поток раз в check_interval секунд сравнивает время последней отметки с текущим:
+    если цикл не отвечает дольше stall_threshold, поток снимает стек потока цикла
+    (sys._current_frames) и имя выполнявшейся задачи. После блокировки снимки передаются
+    в цикл через call_soon_threadsafe и сводятся в топ мест по суммарному времени блокировки.
+    Без блокировок поток только читает одно число — это можно держать включённым всегда
+    """
+
+    # Сколько кадров стека хранить и сколько снимков снимать за одну блокировку
+    STACK_DEPTH = 12
+    MAX_SAMPLES = 20
+
+    def __init__(self, interval: float = 0.1, window: int = 100, stall_threshold: float = 0.25,
+                 check_interval: float = 0.1, max_sites: int = 50):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.check_interval = check_interval
+        self.max_sites = max_sites
+        # Последние замеры: /healthz смотрит на максимум за ~interval * window секунд
+        self._recent: Deque[float] = collections.deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = time.perf_counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._offenders: Dict[str, _Offender] = {}
+        self.stalls = 0
+
+    @property
+    def last(self) -> float:
+        return self._recent[-1] if self._recent else 0.0
+
+    @property
+    def recent_max(self) -> float:
+        return max(self._recent, default=0.0)
+
+    def start(self, stall_threshold: Optional[float] = None) -> None:
+        """Запускает замер в текущем цикле событий и сторожевой поток"""
+        if stall_threshold is not None:
+            self.stall_threshold = stall_threshold
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - start - self.interval)
+            self._recent.append(lag)
+            loop_lag.observe(lag)
+            # Отметка — после записи замера: сторожевой поток берёт длительность блокировки из last
+            self._beat = now
+
+    # === Сторожевой поток ===
+
+    def _watch(self) -> None:
+        samples: List[Tuple[str, str, str]] = []
+        stalled_beat: Optional[float] = None
+        while not self._stopping.wait(self.check_interval):
+            beat = self._beat
+            if stalled_beat is not None and beat != stalled_beat:
+                # Цикл ожил: длительность — опоздание, которое он только что измерил сам
+                self._loop.call_soon_threadsafe(self._record_stall, self.last, samples)
+                samples, stalled_beat = [], None
+            if time.perf_counter() - beat - self.interval > self.stall_threshold:
+                stalled_beat = beat
+                if len(samples) < self.MAX_SAMPLES:
+                    sample = self._sample()
+                    if sample is not None:
+                        samples.append(sample)
+
+    def _sample(self) -> Optional[Tuple[str, str, str]]:
+        """(место, имя задачи, стек) для потока цикла событий"""
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame, limit=self.STACK_DEPTH)
+        site_frame = next((f for f in reversed(stack) if f.filename.startswith(_PROJECT_ROOT)), stack[-1])
+        site = f"{os.path.relpath(site_frame.filename, os.path.dirname(_PROJECT_ROOT))}:{site_frame.lineno} {site_frame.name}"
+        try:
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_name() if task is not None else ""
+        except RuntimeError:
+            task_name = ""
+        return site, task_name, "".join(traceback.format_list(stack))
+
+    # === Сводка (в цикле событий) ===
+
+    def _record_stall(self, duration: float, samples: List[Tuple[str, str, str]]) -> None:
+        self.stalls += 1
+        stall_duration.observe(duration)
+        if not samples:
+            return
+        counts = collections.Counter(site for site, _, _ in samples)
+        site = counts.most_common(1)[0][0]
+        task_name, stack = next((t, s) for st, t, s in reversed(samples) if st == site)
+
+        offender = self._offenders.get(site)
+        if offender is None:
+            if len(self._offenders) >= self.max_sites:
+                # Вытесняется место с наименьшим суммарным временем
+                del self._offenders[min(self._offenders.values(), key=lambda o: o.total).site]
+            offender = self._offenders[site] = _Offender(site)
+        offender.stalls += 1
+        offender.samples += len(samples)
+        offender.total += duration
+        offender.max = max(offender.max, duration)
+        offender.task, offender.stack = task_name, stack
+        message = f"⚠️ Цикл событий заблокирован на {duration:.2f} с: {site} (задача {task_name or '?'})"
+        # Полный стек — только при первой блокировке в этом месте
+        logging.warning(f"{message}\n{stack}" if offender.stalls == 1 else message)
+
+    def top_offenders(self, limit: int = 10) -> List[_Offender]:
+        return sorted(self._offenders.values(), key=lambda o: o.total, reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self._offenders.clear()
+        self.stalls = 0
+
+    def report(self, limit: int = 10) -> str:
+        offenders = self.top_offenders(limit)
+        if not offenders:
+            return "Блокировок цикла событий не зафиксировано"
+        lines = [f"Блокировок: {self.stalls}, порог {self.stall_threshold:.2f} с"]
+        for o in offenders:
+            lines.append(f"{o.total:7.2f} с | {o.stalls:4d} раз | макс {o.max:5.2f} с | {o.site} ({o.task or '?'})")
+        return "\n".join(lines)
+
+    def stats(self) -> Dict[str, float]:
+        return {"last": self.last, "recent_max": self.recent_max, "stalls": self.stalls}
+
+
+loop_monitor = LoopLagMonitor()
+
+metrics.counter("bot_event_loop_stall_seconds_by_site_total", "Суммарное время блокировок цикла по месту в коде", ("site",),
+                callback=lambda: {(o.site,): o.total for o in loop_monitor.top_offenders(loop_monitor.max_sites)})
+metrics.counter("bot_event_loop_stalls_by_site_total", "Количество блокировок цикла по месту в коде", ("site",),
+                callback=lambda: {(o.site,): o.stalls for o in loop_monitor.top_offenders(loop_monitor.max_sites)})
@@ -3,7 +3,8 @@
 """
 import sqlite3
 from typing import Optional
-from src.database.economy import init_economy_db, get_connection
+from src.database.economy import DB_PATH, get_connection, upsert_account
+from src.database.migrations import ensure_schema
 
 
 class MessageCounterService:
@@ -11,9 +12,9 @@ class MessageCounterService:
     
     @staticmethod
     def _ensure_db_initialized() -> None:
-        """Убеждается, что база данных инициализирована"""
+        """Убеждается, что база данных инициализирована (после первой миграции — без обращения к БД)"""
         try:
-            init_economy_db()
+            ensure_schema(DB_PATH)
         except Exception as e:
             print(f"Ошибка при инициализации базы данных: {e}")
     
@@ -31,25 +32,8 @@ class MessageCounterService:
         c = conn.cursor()
         
         try:
-            # Проверяем, существует ли аккаунт
-            c.execute("SELECT user_id FROM accounts WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-            if not c.fetchone():
-                # Создаем аккаунт если не существует
-                c.execute("""
-                    INSERT INTO accounts (user_id, guild_id, cash, bank, xp, level, voice_seconds, 
-                                        arrest_until, daily_cd, work_cd, weekly_cd, rob_cd, 
-                                        robberies_total, robberies_success, robberies_fail, 
-                                        robberies_arrest, messages_sent, temp_roles_json)
-                    VALUES (?, ?, 0, 0, 0, 1, 0, NULL, NULL, NULL, NULL, NULL, 0, 0, 0, 0, 0, NULL)
-                """, (user_id, guild_id))
-            
-            # Увеличиваем счетчик сообщений
-            c.execute("""
-                UPDATE accounts 
-                SET messages_sent = messages_sent + 1 
-                WHERE user_id=? AND guild_id=?
-            """, (user_id, guild_id))
-            
+            # Создание аккаунта и увеличение счетчика — один запрос
+            upsert_account(c, user_id, guild_id, returning=None, messages_sent=1)
             conn.commit()
             
         except Exception as e:
@@ -0,0 +1,181 @@
+"""
+Метрики бота в текстовом формате Prometheus (GET /metrics на веб-сервере main.py)
+"""
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+# Значение для метрики без меток или {значения меток: значение}
+CallbackResult = Union[float, Dict[LabelValues, float]]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], CallbackResult]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Значение вычисляется при каждом чтении /metrics
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """(имя серии, имена меток, значения меток, значение)"""
+        values = self._values
+        if self.callback is not None:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        for key, value in values.items():
+            yield self.name, self.labels, key, value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # {значения меток: [счётчики по корзинам (последняя — +Inf), сумма]}
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                yield f"{self.name}_bucket", names, key + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", self.labels, key, series[-1]
+            yield f"{self.name}_count", self.labels, key, cumulative
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса. Повторная регистрация имени возвращает уже созданную метрику,
+    поэтому коги и модули могут объявлять метрики независимо друг от друга.
+    Запись — без блокировок: метрики обновляются из цикла событий
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = (),
+                callback: Optional[Callable[[], CallbackResult]] = None) -> Counter:
+        return self._register(Counter, name, documentation, labels, callback)
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], CallbackResult]] = None) -> Gauge:
+        return self._register(Gauge, name, documentation, labels, callback)
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате экспозиции Prometheus 0.0.4"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name}: ошибка сбора: {_escape(str(e))}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for series, names, values, value in samples:
+                lines.append(f"{series}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Общие метрики, которые пишут бот, коги и слой БД
+command_latency = metrics.histogram(
+    "bot_command_duration_seconds", "Время выполнения слэш-команд", ("command", "status"),
+)
+db_latency = metrics.histogram(
+    "bot_db_call_duration_seconds", "Время вызовов БД через движок хранилища (с ожиданием потока)", ("call", "status"),
+)
+events = metrics.counter("bot_events_total", "Обработанные события gateway", ("event",))
@@ -0,0 +1,280 @@
+"""
+Постоянный планировщик отложенных задач
+"""
+import asyncio
+import heapq
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.database.engine import run_db
+from src.database.scheduler import apply_task_writes, get_tasks_due
+
+Handler = Callable[[str, Any], Awaitable[None]]
+
+
+def utc_naive_to_epoch(ts: float) -> float:
+    """
+    Переводит значение datetime.utcnow().timestamp(), в котором хранятся сроки мутов
+    и временных ролей, в настоящее unix-время (они расходятся на смещение часового пояса)
+    """
+    return ts + (time.time() - datetime.utcnow().timestamp())
+
+
+class Scheduler:
+    """
+    Срабатывает каждую задачу точно в её срок без периодического опроса.
+
+    Задачи хранятся в scheduled_tasks (индекс по due_at); в памяти — куча только
+    на ближайший горизонт, которая дозагружается диапазонным запросом. Между сроками
+    цикл спит, поэтому в простое работы нет.
+
+    schedule и cancel меняют память сразу, а запись в БД копится и уходит одной
+    транзакцией в потоке движка хранилища. Задачи, чей срок наступил, запускаются
+    параллельно, а задачи без обработчика ждут его регистрации
+    """
+
+    # На сколько секунд вперёд задачи держатся в памяти
+    HORIZON = 3600.0
+    # Через сколько повторить задачу, обработчик которой упал
+    RETRY_DELAY = 60.0
+
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+        self._heap: List[Tuple[float, str, str]] = []
+        # {(kind, key): (due_at, payload)} — актуальные сроки задач в памяти
+        self._due: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._loaded_until: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # {(kind, key): ("upsert", due_at, payload, replace) | ("delete", due_at)} — ещё не записанные изменения
+        self._writes: Dict[Tuple[str, str], tuple] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # {kind: {key}} — наступившие задачи, для которых обработчик ещё не зарегистрирован
+        self._waiting: Dict[str, set] = {}
+        self._running: set = set()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """
+        Регистрирует обработчик задач вида kind
+
+        Args:
+            kind: Вид задачи, например "mute"
+            handler: Корутина handler(key, payload)
+        """
+        self._handlers[kind] = handler
+        # Задачи, дождавшиеся обработчика, срабатывают со своим исходным сроком
+        for key in self._waiting.pop(kind, ()):
+            current = self._due.get((kind, key))
+            if current is not None:
+                heapq.heappush(self._heap, (current[0], kind, key))
+        self._wake()
+
+    def unregister(self, kind: str) -> None:
+        self._handlers.pop(kind, None)
+
+    def _push(self, kind: str, key: str, due_at: float, payload: Any) -> None:
+        self._due[(kind, key)] = (due_at, payload)
+        heapq.heappush(self._heap, (due_at, kind, key))
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def schedule(self, kind: str, key, due_at: float, payload: Any = None) -> None:
+        """
+        Ставит (или переносит) задачу на момент due_at (unix-время)
+
+        Args:
+            kind: Вид задачи
+            key: Ключ задачи внутри вида; повторный вызов с тем же ключом переносит срок
+            due_at: Срок срабатывания
+            payload: Данные для обработчика (сериализуются в JSON)
+        """
+        self.schedule_many(kind, [(key, due_at, payload)])
+
+    def schedule_many(self, kind: str, items: Iterable[Tuple[Any, float, Any]], replace: bool = True) -> None:
+        """
+        Ставит пачку задач одной транзакцией
+
+        Args:
+            kind: Вид задач
+            items: Кортежи (key, due_at, payload)
+            replace: False — не трогать уже запланированные ключи (для восстановления при старте)
+        """
+        items = [(str(key), float(due_at), payload) for key, due_at, payload in items]
+        if not items:
+            return
+        for key, due_at, payload in items:
+            self._queue(kind, key, ("upsert", due_at, json.dumps(payload) if payload is not None else None, replace))
+            if not replace and (kind, key) in self._due:
+                continue
+            if self._loaded_until is not None and due_at <= self._loaded_until:
+                self._push(kind, key, due_at, payload)
+            else:
+                # Срок за горизонтом: задача подгрузится из БД, старый срок в памяти недействителен
+                self._due.pop((kind, key), None)
+        self._wake()
+
+    def cancel(self, kind: str, key) -> None:
+        """Отменяет задачу"""
+        key = str(key)
+        self._queue(kind, key, ("delete", None))
+        self._due.pop((kind, key), None)
+
+    def _queue(self, kind: str, key: str, op: tuple) -> None:
+        previous = self._writes.get((kind, key))
+        if previous is not None:
+            if op[0] == "upsert" and previous[0] == "upsert" and not op[3]:
+                # Ключ уже записывается — replace=False его не трогает
+                return
+            if op[0] == "upsert" and previous[0] == "delete":
+                # Строка будет удалена, поэтому вставка без перезаписи равна обычной
+                op = op[:3] + (True,)
+            if op[0] == "delete" and op[1] is not None and previous[0] == "upsert" and previous[1] != op[1]:
+                # Обработчик сам перенёс задачу — запись с новым сроком не трогаем
+                return
+        self._writes[(kind, key)] = op
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                # Вне цикла событий (скрипты, миграции) — записываем сразу
+                apply_task_writes(*self._take_writes())
+
+    def _take_writes(self) -> Tuple[list, list, list]:
+        writes, self._writes = self._writes, {}
+        upserts, kept, deletes = [], [], []
+        for (kind, key), op in writes.items():
+            if op[0] == "delete":
+                deletes.append((kind, key, op[1]))
+            else:
+                (upserts if op[3] else kept).append((kind, key, op[1], op[2]))
+        return upserts, kept, deletes
+
+    async def flush(self) -> bool:
+        """
+        Записывает накопленные изменения задач одной транзакцией
+
+        Returns:
+            False, если запись не удалась (изменения остаются в очереди)
+        """
+        async with self._flush_lock:
+            if not self._writes:
+                return True
+            pending = dict(self._writes)
+            try:
+                await run_db(apply_task_writes, *self._take_writes())
+            except Exception as e:
+                # Возвращаем в очередь то, что не успели заменить более новые изменения
+                for item, op in pending.items():
+                    self._writes.setdefault(item, op)
+                logging.error(f"❌ Ошибка при записи задач планировщика: {e}")
+                return False
+            return True
+
+    async def _flush_loop(self) -> None:
+        # Изменения, пришедшие за один проход цикла событий, попадают в одну транзакцию
+        await asyncio.sleep(0)
+        while self._writes:
+            if not await self.flush():
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _refill(self) -> None:
+        # Сначала записываем накопленное: запрос не должен вернуть отменённые задачи или пропустить новые
+        await self.flush()
+        after = self._loaded_until
+        until = time.time() + self.HORIZON
+        # Горизонт сдвигается до запроса: задачи, поставленные во время чтения, сразу идут в память
+        self._loaded_until = until
+        rows = await run_db(get_tasks_due, after, until)
+        for kind, key, due_at, payload in rows:
+            # Для ключей с ещё не записанными изменениями верно состояние в памяти
+            if (kind, key) in self._due or (kind, key) in self._writes:
+                continue
+            self._push(kind, key, due_at, json.loads(payload) if payload else None)
+
+    async def _fire(self, handler: Handler, kind: str, key: str, due_at: float, payload: Any) -> None:
+        try:
+            await handler(key, payload)
+        except Exception as e:
+            logging.error(f"❌ Ошибка при выполнении задачи {kind}:{key}: {e}")
+            self.schedule(kind, key, time.time() + self.RETRY_DELAY, payload)
+            return
+        # Обработчик мог сам перенести задачу — тогда запись с новым сроком не трогаем
+        self._queue(kind, key, ("delete", due_at))
+
+    def _dispatch(self, kind: str, key: str, due_at: float, payload: Any) -> None:
+        handler = self._handlers.get(kind)
+        if handler is None:
+            # Ког с обработчиком ещё не загружен: задача ждёт в памяти и в БД до register
+            if key not in self._waiting.setdefault(kind, set()):
+                logging.warning(f"⚠️ Нет обработчика для задачи {kind}:{key}, ожидает регистрации")
+                self._waiting[kind].add(key)
+            return
+        del self._due[(kind, key)]
+        # Медленный обработчик не задерживает остальные задачи
+        task = asyncio.create_task(self._fire(handler, kind, key, due_at, payload))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                now = time.time()
+                if self._loaded_until is None or now + self.HORIZON / 2 >= self._loaded_until:
+                    await self._refill()
+
+                while self._heap and self._heap[0][0] <= time.time():
+                    due_at, kind, key = heapq.heappop(self._heap)
+                    current = self._due.get((kind, key))
+                    # Отменённые и перенесённые задачи остаются в куче до своего старого срока
+                    if current is None or current[0] != due_at:
+                        continue
+                    self._dispatch(kind, key, due_at, current[1])
+
+                wake_at = self._loaded_until - self.HORIZON / 2
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(wake_at - time.time(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ Ошибка в цикле планировщика: {e}")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    def start(self) -> None:
+        """Запускает цикл планировщика (повторный вызов ничего не делает)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logging.info("⏰ Планировщик запущен")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Запущенные обработчики доводятся до конца, их изменения записываются
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+
+
+scheduler = Scheduler()
@@ -0,0 +1,152 @@
+"""
+Конвейер запуска бота: замер фаз, параллельная загрузка расширений и
+отложенный прогрев после on_ready
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import discord
+from discord import app_commands
+
+
+def command_tree_hash(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """
+    Хэш того, что tree.sync отправил бы в Discord для guild (None — глобальные команды)
+
+    Порядок команд не влияет на хэш: при параллельной загрузке когов он не постоянен
+    """
+    payload = sorted((cmd.to_dict(tree) for cmd in tree.get_commands(guild=guild)),
+                     key=lambda c: (c.get("type", 1), c["name"]))
+    raw = json.dumps([tree.client.application_id, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StartupPipeline:
+    """
+    Отметки времени запуска и прогрев, который не должен задерживать готовность бота.
+
+    Фазы (phase) — отрезки с длительностью, отметки (mark) — время от begin().
+    Задачи, переданные в defer до on_ready, запускаются параллельно после него;
+    переданные позже — сразу
+    """
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._phases: Dict[str, float] = {}
+        self._marks: Dict[str, float] = {}
+        self._deferred: List[Tuple[str, Callable[[], Awaitable[None]]]] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self._ready = False
+
+    def begin(self) -> None:
+        """Начало отсчёта (запуск процесса)"""
+        self._started = time.perf_counter()
+        self._phases.clear()
+        self._marks.clear()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name] = time.perf_counter() - start
+
+    def mark(self, name: str) -> None:
+        # Повторные отметки (переподключение) не перезаписывают первую
+        self._marks.setdefault(name, self.elapsed())
+
+    async def run_in_waves(self, names: Iterable[str], dependencies: Mapping[str, Iterable[str]],
+                           load: Callable[[str], Awaitable[bool]]) -> List[str]:
+        """
+        Выполняет load для всех имён: параллельно внутри волны, волна ждёт свои зависимости
+
+        Args:
+            names: Имена в порядке конфигурации
+            dependencies: {имя: имена, которые должны быть загружены раньше}; отсутствующие в names не учитываются
+            load: Корутина загрузки, возвращает успех
+
+        Returns:
+            Имена, загруженные успешно
+        """
+        pending = list(dict.fromkeys(names))
+        known = set(pending)
+        done: Set[str] = set()
+        loaded: List[str] = []
+        while pending:
+            wave = [n for n in pending if all(d in done or d not in known for d in dependencies.get(n, ()))]
+            if not wave:
+                logging.warning(f"⚠️ Циклические зависимости расширений: {', '.join(pending)}; загружаются по порядку")
+                wave = pending[:1]
+            results = await asyncio.gather(*(self._timed_load(n, load) for n in wave))
+            loaded.extend(n for n, ok in zip(wave, results) if ok)
+            done.update(wave)
+            pending = [n for n in pending if n not in done]
+        return loaded
+
+    async def _timed_load(self, name: str, load: Callable[[str], Awaitable[bool]]) -> bool:
+        with self.phase(f"load {name}"):
+            return await load(name)
+
+    def defer(self, name: str, func: Callable[[], Awaitable[None]]) -> None:
+        """
+        Откладывает прогрев до готовности бота (кэш серверов и участников уже загружен)
+
+        Args:
+            name: Имя для журнала и замера
+            func: Корутинная функция без аргументов
+        """
+        if self._ready:
+            self._spawn(name, func)
+        else:
+            self._deferred.append((name, func))
+
+    def ready(self) -> None:
+        """Вызывается из on_ready: отметка готовности и запуск отложенного прогрева"""
+        self.mark("ready")
+        if self._ready:
+            return
+        self._ready = True
+        deferred, self._deferred = self._deferred, []
+        for name, func in deferred:
+            self._spawn(name, func)
+        logging.info(self.report())
+
+    def _spawn(self, name: str, func: Callable[[], Awaitable[None]]) -> None:
+        task = asyncio.create_task(self._warmup(name, func), name=f"warmup:{name}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _warmup(self, name: str, func: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        try:
+            await func()
+        except Exception as e:
+            logging.error(f"❌ Ошибка прогрева {name}: {e}")
+        finally:
+            self._phases[f"warmup {name}"] = time.perf_counter() - start
+            logging.info(f"🔥 Прогрев {name}: {time.perf_counter() - start:.2f} с")
+
+    async def wait_warmups(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {"phases": dict(self._phases), "marks": dict(self._marks)}
+
+    def report(self) -> str:
+        lines = [f"⏱️ Запуск: {self._marks.get('ready', self.elapsed()):.2f} с до готовности"]
+        lines += [f"   {name:<32} {t:7.3f} с (отметка)" for name, t in self._marks.items() if name != "ready"]
+        lines += [f"   {name:<32} {t:7.3f} с" for name, t in self._phases.items()]
+        return "\n".join(lines)
+
+
+startup = StartupPipeline()
@@ -0,0 +1,345 @@
+"""
+Трассировка команд: дерево отрезков (span) от взаимодействия до запросов к БД и REST API Discord.
+
+Корневой отрезок открывается на слэш-команду (InstrumentedCommandTree в bot.py), кнопку или
+выпадающий список (ui.View) и отправку модального окна; вложенные — на вызовы run_db,
+удержание соединений SQLite и HTTP-запросы discord.py (aiohttp TraceConfig). Контекст
+передаётся через contextvars, в том числе в потоки движка хранилища.
+
+Готовые трассы пишутся в JSONL-файл (TRACE_EXPORT=jsonl:traces.jsonl) или отправляются
+в формате OTLP/HTTP JSON (TRACE_EXPORT=http://collector:4318/v1/traces). Сводка по файлу:
+
+    python -m src.servies.tracing traces.jsonl
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+# Числовые ID в путях REST API заменяются, чтобы имена отрезков не зависели от объекта
+_SNOWFLAKE = re.compile(r"/\d{5,}")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attrs", "start", "start_unix", "duration",
+                 "status", "_trace", "_tracer")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span_id = random.getrandbits(64)
+        if parent is None:
+            self.trace_id = random.getrandbits(128)
+            self.parent_id = None
+            self._trace: List[Span] = []
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self._trace = parent._trace
+        self.start = time.perf_counter()
+        self.start_unix = time.time()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+
+    def end(self, status: str = "ok", **attrs) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        self.status = status
+        if attrs:
+            self.attrs.update(attrs)
+        self._trace.append(self)
+        if self.parent_id is None:
+            self._tracer._export(self)
+
+    def to_dict(self, root_start: float) -> Dict[str, Any]:
+        return {
+            "id": f"{self.span_id:016x}",
+            "parent": f"{self.parent_id:016x}" if self.parent_id is not None else None,
+            "name": self.name,
+            "offset": round(self.start - root_start, 6),
+            "duration": round(self.duration, 6),
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+class _NullSpan:
+    """Заглушка без трассировки: end() ничего не делает"""
+
+    def end(self, status: str = "ok", **attrs) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Выключен по умолчанию: без configure() корневые отрезки не создаются,
+    а вложенные вызовы сводятся к одной проверке contextvar
+    """
+
+    # Сколько готовых трасс копить до записи и как часто записывать
+    BATCH_SIZE = 200
+    FLUSH_SECONDS = 5.0
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.export_target = ""
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.exported = 0
+        self.dropped = 0
+
+    def configure(self, export_target: str, sample_rate: float = 1.0) -> None:
+        """
+        Args:
+            export_target: jsonl:<путь>, http(s)://... (OTLP/HTTP JSON) или пусто — выключено
+            sample_rate: Доля трассируемых взаимодействий
+        """
+        self.export_target = export_target or ""
+        self.enabled = bool(self.export_target)
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if self.enabled:
+            logging.info(f"🔭 Трассировка включена: {self.export_target} (доля {self.sample_rate:.0%})")
+
+    # === Отрезки ===
+
+    def start_root(self, name: str, **attrs) -> Optional[Span]:
+        """Начинает трассу и делает её текущей в контексте задачи (None — трасса не пишется)"""
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return None
+        span = Span(self, name, None, attrs)
+        _current_span.set(span)
+        return span
+
+    @contextmanager
+    def root_span(self, name: str, **attrs) -> Iterator[Optional[Span]]:
+        span = self.start_root(name, **attrs)
+        if span is None:
+            yield None
+            return
+        try:
+            yield span
+        except BaseException:
+            span.end("error")
+            raise
+        else:
+            span.end()
+
+    def start_span(self, name: str, **attrs):
+        """Вложенный отрезок без активации (листовой); вне трассы — NULL_SPAN"""
+        parent = _current_span.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(self, name, parent, attrs)
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        """Вложенный отрезок, который становится текущим для вложенных вызовов"""
+        parent = _current_span.get()
+        if parent is None:
+            yield
+            return
+        span = Span(self, name, parent, attrs)
+        token = _current_span.set(span)
+        try:
+            yield
+        except BaseException:
+            span.end("error")
+            raise
+        else:
+            span.end()
+        finally:
+            _current_span.reset(token)
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    # === discord.py ===
+
+    def http_trace_config(self) -> aiohttp.TraceConfig:
+        """TraceConfig для discord.Client(http_trace=...): HTTP-запросы — вложенные отрезки"""
+        config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.span = self.start_span(f"http {params.method} {_SNOWFLAKE.sub('/{id}', params.url.path)}")
+
+        async def on_request_end(session, ctx, params):
+            ctx.span.end("ok" if params.response.status < 400 else "error", http_status=params.response.status)
+
+        async def on_request_exception(session, ctx, params):
+            ctx.span.end("error", error=type(params.exception).__name__)
+
+        config.on_request_start.append(on_request_start)
+        config.on_request_end.append(on_request_end)
+        config.on_request_exception.append(on_request_exception)
+        return config
+
+    def instrument_views(self) -> None:
+        """
+        Оборачивает обработку кнопок/меню (ui.View) и модальных окон в корневой отрезок.
+        Точка входа discord.ui одна на все View, поэтому классы когов менять не нужно
+        """
+        import discord
+
+        view_task = discord.ui.View._scheduled_task
+        modal_task = discord.ui.Modal._scheduled_task
+        if getattr(view_task, "_traced", False):
+            return
+
+        async def traced_view_task(view, item, interaction):
+            callback = getattr(item.callback, "callback", item.callback)
+            name = f"view {type(view).__name__}.{getattr(callback, '__name__', type(item).__name__)}"
+            with self.root_span(name, guild_id=interaction.guild_id, user_id=interaction.user.id):
+                return await view_task(view, item, interaction)
+
+        async def traced_modal_task(modal, interaction, components):
+            with self.root_span(f"modal {type(modal).__name__}", guild_id=interaction.guild_id, user_id=interaction.user.id):
+                return await modal_task(modal, interaction, components)
+
+        traced_view_task._traced = True
+        discord.ui.View._scheduled_task = traced_view_task
+        discord.ui.Modal._scheduled_task = traced_modal_task
+
+    # === Экспорт ===
+
+    def _export(self, root: Span) -> None:
+        spans = sorted(root._trace, key=lambda s: s.start)
+        self._pending.append({
+            "trace_id": f"{root.trace_id:032x}",
+            "name": root.name,
+            "start": root.start_unix,
+            "duration": round(root.duration, 6),
+            "status": root.status,
+            "spans": [s.to_dict(root.start) for s in spans],
+        })
+        if len(self._pending) > self.BATCH_SIZE * 10:
+            # Экспорт не успевает — старые трассы отбрасываются, а не копятся в памяти
+            self.dropped += len(self._pending) - self.BATCH_SIZE * 10
+            del self._pending[:-self.BATCH_SIZE * 10]
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(0 if len(self._pending) >= self.BATCH_SIZE else self.FLUSH_SECONDS)
+        await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            if self.export_target.startswith("jsonl:"):
+                await asyncio.to_thread(_append_jsonl, self.export_target[len("jsonl:"):], batch)
+            else:
+                await self._post_otlp(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logging.error(f"❌ Ошибка экспорта трасс: {e}")
+
+    async def _post_otlp(self, batch: List[Dict[str, Any]]) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        async with self._session.post(self.export_target, json=to_otlp(batch)) as resp:
+            resp.raise_for_status()
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _append_jsonl(path: str, batch: List[Dict[str, Any]]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        for trace in batch:
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+
+
+def to_otlp(batch: List[Dict[str, Any]], service: str = "naeratus-bot") -> Dict[str, Any]:
+    """Трассы в формате OTLP/HTTP JSON (ExportTraceServiceRequest)"""
+    spans = []
+    for trace in batch:
+        start_ns = int(trace["start"] * 1e9)
+        for s in trace["spans"]:
+            begin = start_ns + int(s["offset"] * 1e9)
+            spans.append({
+                "traceId": trace["trace_id"],
+                "spanId": s["id"],
+                **({"parentSpanId": s["parent"]} if s["parent"] else {}),
+                "name": s["name"],
+                "startTimeUnixNano": str(begin),
+                "endTimeUnixNano": str(begin + int(s["duration"] * 1e9)),
+                "status": {"code": 2 if s["status"] == "error" else 1},
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in s["attrs"].items()],
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": "src.servies.tracing"}, "spans": spans}],
+    }]}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(traces: List[Dict[str, Any]], limit: int = 20) -> str:
+    """
+    Команды по p99 и вложенный отрезок с наибольшей долей времени.
+    «своё время» — время корня вне вложенных отрезков (код кога, asyncio.sleep, ожидание лимитов)
+    """
+    by_name: Dict[str, List[Dict[str, Any]]] = {}
+    for trace in traces:
+        by_name.setdefault(trace["name"], []).append(trace)
+
+    rows = []
+    for name, group in by_name.items():
+        durations = [t["duration"] for t in group]
+        shares: Dict[str, float] = {}
+        for t in group:
+            root_id = next(s["id"] for s in t["spans"] if s["parent"] is None)
+            direct = sum(s["duration"] for s in t["spans"] if s["parent"] == root_id)
+            shares["своё время"] = shares.get("своё время", 0.0) + max(0.0, t["duration"] - direct)
+            for s in t["spans"]:
+                if s["parent"] is not None:
+                    shares[s["name"]] = shares.get(s["name"], 0.0) + s["duration"]
+        top, top_time = max(shares.items(), key=lambda kv: kv[1])
+        rows.append((_percentile(durations, 0.99), name, len(group), _percentile(durations, 0.5), top,
+                     top_time / max(sum(durations), 1e-9)))
+
+    rows.sort(reverse=True)
+    lines = [f"{'p99, с':>8} {'p50, с':>8} {'кол-во':>7}  {'команда':<40} основной отрезок"]
+    for p99, name, count, p50, top, share in rows[:limit]:
+        lines.append(f"{p99:8.3f} {p50:8.3f} {count:7d}  {name:<40} {top} ({share:.0%})")
+    return "\n".join(lines)
+
+
+tracer = Tracer()
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "traces.jsonl"
+    if not os.path.exists(path):
+        sys.exit(f"Файл {path} не найден")
+    with open(path, encoding="utf-8") as f:
+        print(summarize([json.loads(line) for line in f if line.strip()]))
@@ -0,0 +1,103 @@
+"""
+Единый маршрутизатор голосовых событий
+"""
+import logging
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, NamedTuple, Optional
+
+import discord
+
+
+JOIN = "join"
+LEAVE = "leave"
+MOVE = "move"
+MUTE = "mute"
+STREAM = "stream"
+
+# Переходы, при которых меняется канал участника
+CHANNEL_CHANGES = frozenset({JOIN, LEAVE, MOVE})
+
+
+class VoiceTransition(NamedTuple):
+    member: discord.Member
+    before: discord.VoiceState
+    after: discord.VoiceState
+    kinds: FrozenSet[str]
+
+    @property
+    def channel_ids(self) -> tuple:
+        """ID каналов до и после перехода (без None)"""
+        return tuple(ch.id for ch in (self.before.channel, self.after.channel) if ch is not None)
+
+
+def classify(before: discord.VoiceState, after: discord.VoiceState) -> FrozenSet[str]:
+    """Определяет типы перехода: join/leave/move/mute/stream (может быть несколько сразу)"""
+    kinds = set()
+    if before.channel is None and after.channel is not None:
+        kinds.add(JOIN)
+    elif before.channel is not None and after.channel is None:
+        kinds.add(LEAVE)
+    elif before.channel is not None and after.channel is not None and before.channel.id != after.channel.id:
+        kinds.add(MOVE)
+    if (before.self_mute != after.self_mute or before.self_deaf != after.self_deaf
+            or before.mute != after.mute or before.deaf != after.deaf):
+        kinds.add(MUTE)
+    if before.self_stream != after.self_stream or before.self_video != after.self_video:
+        kinds.add(STREAM)
+    return frozenset(kinds)
+
+
+class _Subscriber(NamedTuple):
+    handler: Callable[[VoiceTransition], Awaitable[None]]
+    kinds: Optional[FrozenSet[str]]
+    predicate: Optional[Callable[[VoiceTransition], bool]]
+
+
+class VoiceRouter:
+    """
+    Принимает on_voice_state_update один раз на всего бота, классифицирует переход
+    и вызывает только тех подписчиков, чьи типы событий и предикат совпали
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, _Subscriber] = {}
+
+    def subscribe(self, name: str, handler: Callable[[VoiceTransition], Awaitable[None]],
+                  kinds: Optional[Iterable[str]] = None,
+                  predicate: Optional[Callable[[VoiceTransition], bool]] = None) -> None:
+        """
+        Регистрирует обработчик (повторная регистрация с тем же именем заменяет прежнюю)
+
+        Args:
+            name: Имя подписчика, обычно имя кога
+            handler: Корутина, принимающая VoiceTransition
+            kinds: Типы переходов, на которые реагировать (по умолчанию все)
+            predicate: Дешёвая синхронная проверка без обращения к БД
+        """
+        self._subscribers[name] = _Subscriber(handler, frozenset(kinds) if kinds is not None else None, predicate)
+
+    def unsubscribe(self, name: str) -> None:
+        self._subscribers.pop(name, None)
+
+    async def dispatch(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> int:
+        """
+        Рассылает событие подходящим подписчикам
+
+        Returns:
+            Количество вызванных обработчиков
+        """
+        transition = VoiceTransition(member, before, after, classify(before, after))
+        called = 0
+        for name, sub in list(self._subscribers.items()):
+            if sub.kinds is not None and not (sub.kinds & transition.kinds):
+                continue
+            try:
+                if sub.predicate is not None and not sub.predicate(transition):
+                    continue
+                called += 1
+                await sub.handler(transition)
+            except Exception as e:
+                logging.error(f"❌ Ошибка в обработчике голосовых событий {name}: {e}")
+        return called
+
+
+voice_router = VoiceRouter()
@@ -0,0 +1,224 @@
+"""
+Учёт времени в голосовых каналах с периодическим сохранением
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import discord
+
+from src.core.config import settings
+from src.database.repository import get_activity_repository
+from src.servies.experience_service import ExperienceService
+from src.servies.leaderboard import leaderboards
+
+
+class VoiceSessionEngine:
+    """
+    Держит открытые голосовые сессии в памяти и начисляет время инкрементально.
+
+    События войса только переносят прошедшее время в буфер начислений; в БД оно
+    попадает пачкой на контрольной точке вместе со снимком открытых сессий,
+    по которому после перезапуска восстанавливается незаписанное время
+    """
+
+    def __init__(self, non_earning: Optional[Iterable[str]] = None, recovery_grace: Optional[float] = None):
+        # {(guild_id, user_id): [channel_id, earning, since]}
+        self._sessions: Dict[Tuple[int, int], list] = {}
+        # {(guild_id, user_id): секунды}, ещё не записанные в БД
+        self._credits: Dict[Tuple[int, int], float] = {}
+        self._non_earning = set(non_earning if non_earning is not None
+                                else getattr(settings, 'ECONOMY_VOICE_NON_EARNING', ["afk"]))
+        self._recovery_grace = (recovery_grace if recovery_grace is not None
+                                else getattr(settings, 'ECONOMY_VOICE_RECOVERY_GRACE_SECONDS', 300.0))
+        self._restored: set = set()
+        # Серверы, чей снимок ещё не прочитан: их время и сессии не уходят в БД
+        self._restoring: set = set()
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def is_earning(self, state: discord.VoiceState) -> bool:
+        """Начисляется ли время в этом состоянии войса"""
+        if state.channel is None:
+            return False
+        flags = self._non_earning
+        if state.self_mute and 'self_mute' in flags:
+            return False
+        if state.self_deaf and 'self_deaf' in flags:
+            return False
+        if state.mute and 'mute' in flags:
+            return False
+        if state.deaf and 'deaf' in flags:
+            return False
+        if 'afk' in flags:
+            afk = state.channel.guild.afk_channel
+            if afk is not None and state.channel.id == afk.id:
+                return False
+        return True
+
+    def _accrue(self, key: Tuple[int, int], now: float) -> None:
+        session = self._sessions.get(key)
+        if session is None:
+            return
+        if session[1] and now > session[2]:
+            self._credits[key] = self._credits.get(key, 0.0) + (now - session[2])
+        session[2] = now
+
+    def update(self, member: discord.Member, after: discord.VoiceState) -> None:
+        """
+        Учитывает изменение голосового состояния участника без обращения к БД
+
+        Args:
+            member: Участник
+            after: Новое голосовое состояние
+        """
+        key = (member.guild.id, member.id)
+        now = time.time()
+        self._accrue(key, now)
+        if after.channel is None:
+            self._sessions.pop(key, None)
+        else:
+            self._sessions[key] = [after.channel.id, self.is_earning(after), now]
+
+    def hold(self, guild_ids: Iterable[int]) -> None:
+        """
+        Откладывает запись серверов до их restore: вызывается перед обходом серверов в on_ready,
+        чтобы контрольная точка не затёрла снимок, который ещё не прочитан
+        """
+        self._restoring.update(guild_ids)
+
+    async def restore(self, guild: discord.Guild) -> int:
+        """
+        Восстанавливает сессии по голосовым состояниям каналов (старт бота или переподключение)
+
+        При первом вызове для сервера читает снимок из БД: если участник остался в том же
+        канале и с контрольной точки прошло не больше recovery_grace, время простоя засчитывается.
+
+        Returns:
+            Количество открытых сессий сервера
+        """
+        self._restoring.add(guild.id)
+        try:
+            return await self._restore(guild)
+        finally:
+            self._restoring.discard(guild.id)
+
+    async def _restore(self, guild: discord.Guild) -> int:
+        snapshot = {}
+        if guild.id not in self._restored:
+            try:
+                snapshot = await get_activity_repository().get_voice_checkpoints(guild.id)
+            except Exception as e:
+                logging.error(f"❌ Ошибка при чтении снимка голосовых сессий: {e}")
+            self._restored.add(guild.id)
+
+        now = time.time()
+        in_voice = set()
+        states = [item for channel in (*guild.voice_channels, *guild.stage_channels)
+                  for item in channel.voice_states.items()]
+        for user_id, state in states:
+            member = guild.get_member(user_id)
+            if state.channel is None or (member is not None and member.bot):
+                continue
+            key = (guild.id, user_id)
+            in_voice.add(key)
+            session = self._sessions.get(key)
+            if session is not None and session[0] == state.channel.id:
+                # Сессия уже отслеживается, обновляем только признак начисления
+                self._accrue(key, now)
+                session[1] = self.is_earning(state)
+                continue
+            self._accrue(key, now)
+            since = now
+            saved = snapshot.get(user_id)
+            if saved is not None and saved[0] == state.channel.id and saved[1] and 0 <= now - saved[2] <= self._recovery_grace:
+                since = saved[2]
+            self._sessions[key] = [state.channel.id, self.is_earning(state), since]
+
+        # Вышедшие, пока бот не получал события
+        for key in [k for k in self._sessions if k[0] == guild.id and k not in in_voice]:
+            self._accrue(key, now)
+            del self._sessions[key]
+
+        return len(in_voice)
+
+    def pending(self, user_id: int, guild_id: int) -> float:
+        """Ещё не записанные секунды пользователя, включая текущую сессию"""
+        key = (guild_id, user_id)
+        seconds = self._credits.get(key, 0.0)
+        session = self._sessions.get(key)
+        if session is not None and session[1]:
+            seconds += max(time.time() - session[2], 0.0)
+        return seconds
+
+    def pending_guild(self, guild_id: int) -> Dict[int, int]:
+        """Ещё не записанные целые секунды {user_id: секунды} участников сервера, включая текущие сессии"""
+        now = time.time()
+        seconds: Dict[int, float] = {user_id: value for (gid, user_id), value in self._credits.items() if gid == guild_id}
+        for (gid, user_id), session in self._sessions.items():
+            if gid == guild_id and session[1]:
+                seconds[user_id] = seconds.get(user_id, 0.0) + max(now - session[2], 0.0)
+        return {user_id: int(value) for user_id, value in seconds.items() if int(value) > 0}
+
+    def merge_account(self, user_id: int, guild_id: int, acc: tuple) -> tuple:
+        """
+        Накладывает незаписанное время в войсе на кортеж из get_or_create_account
+
+        Returns:
+            Кортеж аккаунта с учётом времени, опыта за него и повышений уровня
+        """
+        seconds = int(self.pending(user_id, guild_id))
+        if not seconds or not acc:
+            return acc
+        xp = max(ExperienceService._get_xp_sources().get('voice_minute', 0.5), 0) * seconds / 60
+        level, new_xp = ExperienceService.apply_level_ups(acc[3] or 1, (acc[2] or 0) + xp)
+        return acc[:2] + (new_xp, level, (acc[4] or 0) + seconds) + acc[5:]
+
+    async def checkpoint(self) -> int:
+        """
+        Начисляет прошедшее время всех сессий одной транзакцией и сохраняет снимок
+
+        Returns:
+            Количество аккаунтов, которым начислено время
+        """
+        async with self._lock:
+            now = time.time()
+            for key in list(self._sessions):
+                self._accrue(key, now)
+
+            # В БД уходят целые секунды, дробный остаток копится дальше.
+            # Серверы, которые ещё восстанавливаются, ждут следующей контрольной точки
+            held = set(self._restoring)
+            batch = {}
+            for key, seconds in self._credits.items():
+                if key[0] in held:
+                    continue
+                whole = int(seconds)
+                if whole > 0:
+                    batch[key] = whole
+            for key, whole in batch.items():
+                rest = self._credits[key] - whole
+                if rest > 0:
+                    self._credits[key] = rest
+                else:
+                    del self._credits[key]
+
+            sessions = [(guild_id, user_id, s[0], int(s[1]), now)
+                        for (guild_id, user_id), s in self._sessions.items() if guild_id not in held]
+            try:
+                xp_per_minute = ExperienceService._get_xp_sources().get('voice_minute', 0.5)
+                rows = await get_activity_repository().apply_voice(batch, xp_per_minute, ExperienceService.apply_level_ups, sessions)
+            except Exception as e:
+                # Возвращаем время в буфер, чтобы не потерять его
+                for key, whole in batch.items():
+                    self._credits[key] = self._credits.get(key, 0.0) + whole
+                logging.error(f"❌ Ошибка при сохранении голосовых сессий: {e}")
+                return 0
+            leaderboards.update_activity(rows)
+            return len(batch)
+
+
+voice_sessions = VoiceSessionEngine()
@@ -0,0 +1,127 @@
+"""
+Ограничитель начисления опыта за сообщения (антиспам)
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+from src.servies.experience_service import ExperienceService
+
+# Значения по умолчанию для ключей ECONOMY_XP_SOURCES
+DEFAULT_BURST = 3
+DEFAULT_INTERVAL = 10.0
+DEFAULT_DUPLICATE_WINDOW = 60.0
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "last_hash", "last_hash_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.last_hash = 0
+        self.last_hash_at = float("-inf")
+
+
+class XpRateLimiter:
+    """
+    Корзина токенов на (guild_id, user_id): подряд опыт дают message_burst сообщений,
+    дальше — одно в message_interval секунд. Повтор того же текста в течение
+    message_duplicate_window секунд опыта не даёт.
+
+    Решение принимается в памяти, без обращения к БД; отклонённое сообщение
+    по-прежнему попадает в счётчик сообщений через буфер активности
+    """
+
+    # Как часто удалять записи, которые уже ничем не отличаются от отсутствующих
+    SWEEP_SECONDS = 300.0
+
+    def __init__(self, burst: Optional[int] = None, interval: Optional[float] = None,
+                 duplicate_window: Optional[float] = None):
+        self._burst = burst
+        self._interval = interval
+        self._duplicate_window = duplicate_window
+        self._buckets: Dict[Tuple[int, int], _Bucket] = {}
+        self._last_sweep = time.monotonic()
+        self.allowed = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _limits(self) -> Tuple[float, float, float]:
+        sources = ExperienceService._get_xp_sources()
+        burst = self._burst if self._burst is not None else sources.get('message_burst', DEFAULT_BURST)
+        interval = self._interval if self._interval is not None else sources.get('message_interval', DEFAULT_INTERVAL)
+        window = (self._duplicate_window if self._duplicate_window is not None
+                  else sources.get('message_duplicate_window', DEFAULT_DUPLICATE_WINDOW))
+        return max(float(burst), 1.0), max(float(interval), 0.0), max(float(window), 0.0)
+
+    @staticmethod
+    def _content_hash(content: str) -> int:
+        # Регистр и повторяющиеся пробелы не делают сообщение новым
+        return hash(" ".join(content.casefold().split()))
+
+    def allow(self, guild_id: int, user_id: int, content: str = "", now: Optional[float] = None) -> bool:
+        """
+        Решает, начислять ли опыт за сообщение, и расходует токен
+
+        Args:
+            guild_id: ID сервера
+            user_id: ID пользователя
+            content: Текст сообщения (пустой — без проверки на повтор)
+            now: Текущее время по time.monotonic()
+
+        Returns:
+            True, если за сообщение положен опыт
+        """
+        if now is None:
+            now = time.monotonic()
+        burst, interval, window = self._limits()
+        if now - self._last_sweep >= self.SWEEP_SECONDS:
+            self._sweep(now, burst, interval, window)
+
+        key = (guild_id, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        elif interval > 0:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) / interval)
+            bucket.updated = now
+        else:
+            bucket.tokens = burst
+
+        if content and window > 0:
+            digest = self._content_hash(content)
+            if digest == bucket.last_hash and now - bucket.last_hash_at < window:
+                self.rejected += 1
+                return False
+            # Хэш запоминается только у сообщений, не отклонённых как повтор: окно отсчитывается от оригинала
+            bucket.last_hash, bucket.last_hash_at = digest, now
+
+        if bucket.tokens < 1:
+            self.rejected += 1
+            return False
+        bucket.tokens -= 1
+        self.allowed += 1
+        return True
+
+    def _sweep(self, now: float, burst: float, interval: float, window: float) -> None:
+        # Запись без эффекта: корзина уже наполнилась бы заново и окно повтора истекло
+        idle = max(burst * interval, window)
+        self._buckets = {key: b for key, b in self._buckets.items() if now - max(b.updated, b.last_hash_at) < idle}
+        self._last_sweep = now
+
+    def reset(self, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
+        """Сбрасывает ограничения пользователя, сервера или всех"""
+        if guild_id is None:
+            self._buckets.clear()
+        elif user_id is not None:
+            self._buckets.pop((guild_id, user_id), None)
+        else:
+            self._buckets = {key: b for key, b in self._buckets.items() if key[0] != guild_id}
+
+    def stats(self) -> Dict[str, int]:
+        return {"tracked": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected}
+
+
+xp_limiter = XpRateLimiter()
@@ -0,0 +1,48 @@
+"""
+Общие фикстуры тестов: временные базы вместо рабочих файлов src/database
+"""
+import pytest
+
+from src.database import economy
+from src.database.engine import ConnectionPool, engine, get_pool
+from src.database.migrations import _registry, migrate
+
+GUILD_ID = 1
+USER_ID = 42
+
+
+@pytest.fixture
+def traced_db(tmp_path, monkeypatch):
+    """Временная economy.db со всеми миграциями и журналом выполненных SELECT"""
+    statements = []
+    original_open = ConnectionPool._open
+
+    def traced_open(self):
+        conn = original_open(self)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(economy, "DB_PATH", str(tmp_path / "economy.db"))
+    monkeypatch.setattr(ConnectionPool, "_open", traced_open)
+    migrate(economy.DB_PATH, _registry()[economy.DB_PATH])
+    economy.get_or_create_account(USER_ID, GUILD_ID)
+    statements.clear()
+    yield statements
+    engine.close()
+
+
+def assert_index_driven(db_path: str, statements: list, index_prefix: str = "idx_accounts_") -> None:
+    selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert selects, "запросы не были выполнены"
+    conn = get_pool(db_path).connect()
+    try:
+        for sql in selects:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+            details = " | ".join(plan)
+            assert "TEMP B-TREE" not in details, f"сортировка без индекса: {sql}\n{details}"
+            for step in plan:
+                assert not step.startswith("SCAN"), f"полный скан: {sql}\n{details}"
+            assert any(index_prefix in step for step in plan), f"индекс не используется: {sql}\n{details}"
+    finally:
+        conn.close()
+
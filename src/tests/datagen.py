@@ -0,0 +1,415 @@
+# src/tests/datagen.py
+"""
+Генератор синтетических данных масштаба сервера: economy.db, main.db (кланы, пары, войс-сессии пар,
+доступ к love-комнатам), strike.db и tickets.db с правдоподобными распределениями.
+
+- активность участников — по Ципфу: немногие пишут и сидят в войсе постоянно, большинство — изредка;
+  опыт и уровень выводятся из сообщений и минут в войсе (по 0.5 опыта, уровень стоит level * 100);
+- балансы с длинным хвостом: наличные — логнормальные, банк — Парето;
+- размеры кланов — Парето с потолком CLAN_MAX_MEMBER_SLOTS; у пар число войс-сессий тоже
+  с тяжёлым хвостом — у самых активных пар их тысячи;
+- нарушения, поощрения и история наказаний сосредоточены у небольшой части участников.
+
+Схема создаётся обычными миграциями, вставка — executemany одной транзакцией на файл,
+вторичные индексы перестраиваются после вставки. Одинаковые --seed и --now дают одинаковые данные.
+Таблицы должны быть пустыми: генератор не дописывает в существующие базы.
+
+    python -m src.tests.datagen --out /tmp/guild --accounts 100000
+    python -m src.tests.datagen --single-file /tmp/guild.db --accounts 1000000 --seed 7
+"""
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from src.database import connection, discipline, economy
+from src.database.engine import DATABASE_DIR, engine
+from src.database.migrations import run_migrations
+from src.database.tickets import ticket_db
+
+GUILD_ID = 1327946537061453896
+USER_BASE = 10 ** 17
+# Синтетические ID ролей и каналов: не пересекаются с пользователями
+SNOWFLAKE_BASE = 10 ** 16
+
+DAY = 86400
+# Показатель распределения Ципфа для активности участников и потолок активности относительно средней:
+# без него на миллионе аккаунтов у первого по рангу выходили бы миллионы сообщений
+ZIPF_EXPONENT = 1.1
+ACTIVITY_CAP = 500
+# Средние значения на аккаунт: сообщения и секунды в войсе
+MEAN_MESSAGES = 150
+MEAN_VOICE_SECONDS = 4 * 3600
+# Потолок войс-сессий одной пары
+MAX_COUPLE_SESSIONS = 5000
+CLAN_MAX_MEMBERS = 50
+TICKET_TYPES = ("server", "moderation", "tech_support", "staff")
+
+
+def _sql_time(ts: float) -> str:
+    """Время в формате CURRENT_TIMESTAMP (UTC)"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def _iso_time(ts: float) -> str:
+    """Время в формате datetime.isoformat() с точностью до секунды, как его пишет love.py"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts))
+
+
+class _Bulk:
+    """
+    Соединения с физическими файлами: по одной транзакции на файл.
+    Вторичные индексы заполняемых таблиц снимаются до вставки и строятся заново после —
+    сортированная сборка индекса заметно быстрее поштучного обновления на миллионе строк
+    """
+
+    def __init__(self):
+        self._conns: Dict[str, sqlite3.Connection] = {}
+        self._indexes: Dict[str, List[str]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def conn(self, db_path: str) -> sqlite3.Connection:
+        path = engine.resolve(db_path)
+        conn = self._conns.get(path)
+        if conn is None:
+            conn = self._conns[path] = sqlite3.connect(path, isolation_level=None)
+            # Файл только что создан миграциями и больше никем не открыт: журнал на время загрузки
+            # не нужен, при сбое базу проще сгенерировать заново. WAL включается обратно в commit
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA cache_size=-262144")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("BEGIN")
+            self._indexes[path] = []
+        return conn
+
+    def prepare(self, db_path: str, tables: Sequence[str]) -> None:
+        conn = self.conn(db_path)
+        for table in tables:
+            if table != "ticket_counter" and conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                raise RuntimeError(f"Таблица {table} в {engine.resolve(db_path)} не пуста: генератор пишет только в новые базы")
+        marks = ",".join("?" * len(tables))
+        for name, sql in conn.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({marks})",
+            tuple(tables),
+        ).fetchall():
+            conn.execute(f'DROP INDEX "{name}"')
+            self._indexes[engine.resolve(db_path)].append(sql)
+
+    def insert(self, db_path: str, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> None:
+        conn = self.conn(db_path)
+        before = conn.total_changes
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+        )
+        self._count(db_path, table, conn.total_changes - before)
+
+    def execute(self, db_path: str, table: str, sql: str, params: tuple = ()) -> None:
+        """Вставка одним запросом INSERT ... SELECT"""
+        conn = self.conn(db_path)
+        before = conn.total_changes
+        conn.execute(sql, params)
+        self._count(db_path, table, conn.total_changes - before)
+
+    def _count(self, db_path: str, table: str, rows: int) -> None:
+        key = f"{os.path.splitext(os.path.basename(db_path))[0]}.{table}"
+        self.counts[key] = self.counts.get(key, 0) + rows
+
+    def commit(self) -> None:
+        for path, conn in self._conns.items():
+            for sql in self._indexes[path]:
+                conn.execute(sql)
+            conn.execute("COMMIT")
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Статистика планировщика по выборке строк: на миллионах строк полный ANALYZE дольше самой вставки
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+            conn.close()
+        self._conns.clear()
+
+    def rollback(self) -> None:
+        for conn in self._conns.values():
+            conn.execute("ROLLBACK")
+            conn.close()
+        self._conns.clear()
+
+
+def _check_target() -> None:
+    """Генератор пишет только в перенаправленное хранилище, рабочие базы бота не трогает"""
+    directory = os.path.dirname(engine.single_file) if engine.single_file else engine.directory
+    if directory is None or os.path.normcase(directory) == os.path.normcase(DATABASE_DIR):
+        raise RuntimeError("Рабочий каталог баз бота не подходит: укажите отдельный каталог или файл")
+
+
+def generate(accounts: int, seed: int = 1, now: Optional[float] = None, guild_id: int = GUILD_ID,
+             clan_max_members: int = CLAN_MAX_MEMBERS) -> Dict[str, int]:
+    """
+    Создаёт схемы (миграции) и заполняет базы, на которые сейчас указывает engine
+
+    Args:
+        accounts: Число аккаунтов на сервере
+        seed: Зерно генератора случайных чисел
+        now: «Текущее» время для сроков и дат (unix); по умолчанию — сейчас
+        guild_id: ID сервера
+        clan_max_members: Потолок размера клана (CLAN_MAX_MEMBER_SLOTS)
+
+    Returns:
+        Количество вставленных строк: {"economy.accounts": ...}
+    """
+    _check_target()
+    now = time.time() if now is None else now
+    run_migrations()
+    # Пулы движка больше не нужны: запись идёт своими соединениями
+    engine.close()
+
+    rng = random.Random(seed)
+    users = [USER_BASE + i for i in range(accounts)]
+    # Ранг активности: by_rank[0] — самый активный участник
+    by_rank = users[:]
+    rng.shuffle(by_rank)
+    # Относительная активность (в среднем 1) по индексу в users
+    norm = accounts / sum(r ** -ZIPF_EXPONENT for r in range(1, accounts + 1))
+    activity = [0.0] * accounts
+    for rank, user_id in enumerate(by_rank, 1):
+        activity[user_id - USER_BASE] = min(ACTIVITY_CAP, norm * rank ** -ZIPF_EXPONENT)
+    moderators = by_rank[:15]
+
+    bulk = _Bulk()
+    try:
+        _economy(bulk, rng, users, by_rank, activity, guild_id, now)
+        _clans(bulk, rng, by_rank, clan_max_members, now)
+        _love(bulk, rng, by_rank, now)
+        _discipline(bulk, rng, users, by_rank, moderators, guild_id, now)
+        _tickets(bulk, rng, users, now)
+    except BaseException:
+        bulk.rollback()
+        raise
+    bulk.commit()
+    return bulk.counts
+
+
+def _economy(bulk: _Bulk, rng: random.Random, users: List[int], by_rank: List[int],
+             activity: List[float], guild_id: int, now: float) -> None:
+    db = economy.DB_PATH
+    bulk.prepare(db, ("accounts", "transactions", "transaction_entries", "shop_roles", "owned_custom_roles",
+                      "role_listings", "custom_role_requests", "role_edit_requests", "temp_roles", "voice_checkpoints"))
+
+    def accounts():
+        # Самый горячий цикл генератора: логнормальные величины — exp(gauss), уровень — без вызова функции
+        gauss, pareto, uniform, exp, sqrt = rng.gauss, rng.paretovariate, rng.random, math.exp, math.sqrt
+        for user_id, a in zip(users, activity):
+            messages = int(MEAN_MESSAGES * a * exp(gauss(0, 0.5)))
+            voice = int(MEAN_VOICE_SECONDS * a * exp(gauss(0, 0.8)))
+            total_xp = messages * 0.5 + voice / 120
+            level = int((1 + sqrt(1 + total_xp / 12.5)) / 2)
+            xp = int(total_xp - 50 * level * (level - 1))
+            if messages or voice:
+                cash = int(exp(gauss(5, 1.5)))
+                bank = int(min(10 ** 9, 100 * (pareto(1.16) - 1) * (1 + a)))
+            else:
+                cash = bank = 0
+            robberies = messages // 300
+            success = robberies * 45 // 100
+            yield (user_id, guild_id, cash, bank, xp, level, voice, messages,
+                   robberies, success, robberies - success, (robberies - success) // 3, int(uniform() < 0.9))
+
+    bulk.insert(db, "accounts", ("user_id", "guild_id", "cash", "bank", "xp", "level", "voice_seconds", "messages_sent",
+                                 "robberies_total", "robberies_success", "robberies_fail", "robberies_arrest",
+                                 "notifications_enabled"), accounts())
+    # Журнал: текущие балансы — одной проводкой opening, как при миграции журнала
+    bulk.insert(db, "transactions", ("guild_id", "kind", "created_at"), [(guild_id, "opening", now)])
+    bulk.execute(db, "transaction_entries", """
+        INSERT INTO transaction_entries (transaction_id, guild_id, user_id, cash_delta, bank_delta)
+        SELECT last_insert_rowid(), guild_id, user_id, cash, bank FROM accounts WHERE cash != 0 OR bank != 0
+    """)
+
+    roles = (SNOWFLAKE_BASE + i for i in itertools.count())
+    bulk.insert(db, "shop_roles", ("guild_id", "role_id", "price", "stock"),
+                [(guild_id, next(roles), 100 * int(rng.paretovariate(1.0) * 10), None if rng.random() < 0.7 else rng.randint(1, 100))
+                 for _ in range(30)])
+
+    # Личные роли — у активных участников; половина выставлена на рынок
+    holders = rng.sample(by_rank[:max(1, len(by_rank) // 10)], max(1, len(by_rank) // 500))
+    owned = [(user_id, next(roles)) for user_id in holders]
+    bulk.insert(db, "owned_custom_roles", ("user_id", "guild_id", "role_id", "created_at"),
+                [(user_id, guild_id, role_id, 2440587.5 + (now - rng.uniform(0, 365 * DAY)) / DAY) for user_id, role_id in owned])
+    bulk.insert(db, "role_listings", ("role_id", "guild_id", "seller_user_id", "price", "max_sales", "sales_done", "description"),
+                [(role_id, guild_id, user_id, 1000 * rng.randint(1, 50), rng.choice((None, 5, 10)), rng.randint(0, 5), "")
+                 for user_id, role_id in owned[::2]])
+    statuses = ("pending", "approved", "approved", "rejected")
+    bulk.insert(db, "custom_role_requests", ("user_id", "guild_id", "name", "color", "image_url", "status", "created_at"),
+                [(user_id, guild_id, f"Роль {i}", f"#{rng.randrange(1 << 24):06x}", "", rng.choice(statuses),
+                  now - rng.uniform(0, 365 * DAY)) for i, user_id in enumerate(rng.sample(by_rank, max(1, len(by_rank) // 1000)))])
+    bulk.insert(db, "role_edit_requests", ("user_id", "guild_id", "role_id", "new_name", "new_color", "status", "created_at"),
+                [(user_id, guild_id, role_id, "Новое имя", f"#{rng.randrange(1 << 24):06x}", rng.choice(statuses),
+                  now - rng.uniform(0, 90 * DAY)) for user_id, role_id in owned[::4]])
+    # Временные роли из кейсов: часть уже истекла и ждёт снятия
+    case_roles = [next(roles) for _ in range(3)]
+    bulk.insert(db, "temp_roles", ("guild_id", "user_id", "role_id", "expires_at"),
+                [(guild_id, user_id, rng.choice(case_roles), now + rng.uniform(-DAY, 7 * DAY))
+                 for user_id in sorted(rng.sample(users, max(1, len(users) // 30)))])
+    # Сейчас в войсе — самые активные участники
+    in_voice = by_rank[:max(1, len(by_rank) // 200)]
+    bulk.insert(db, "voice_checkpoints", ("guild_id", "user_id", "channel_id", "earning", "checkpoint_ts"),
+                [(guild_id, user_id, SNOWFLAKE_BASE // 10 + rng.randrange(8), int(rng.random() < 0.95), now - rng.uniform(0, 60))
+                 for user_id in in_voice])
+
+
+def _clans(bulk: _Bulk, rng: random.Random, by_rank: List[int], max_members: int, now: float) -> None:
+    db = connection.DB_PATH
+    bulk.prepare(db, ("clans", "clan_members", "clan_voice_channels"))
+    count = max(1, len(by_rank) // 150)
+    sizes = [min(max_members, int(rng.paretovariate(1.0) * 3) - 2) for _ in range(count)]
+    # Участники кланов — из более активной половины, каждый не больше чем в одном клане
+    pool = by_rank[:max(sum(sizes), len(by_rank) // 2)]
+    members = rng.sample(pool, min(len(pool), sum(sizes)))
+    channels = (SNOWFLAKE_BASE * 2 + i for i in itertools.count())
+
+    clan_rows, member_rows, voice_rows = [], [], []
+    start = 0
+    for clan_id, size in enumerate(sizes, 1):
+        team = members[start:start + size]
+        start += size
+        if not team:
+            break
+        voice_count = 1 + (size > 20) + (size > 40)
+        created = now - rng.uniform(0, 365 * DAY)
+        text_channel, voice_channel = next(channels), next(channels)
+        clan_rows.append((clan_id, f"Клан {clan_id}", "Описание клана", rng.randrange(1 << 24), team[0],
+                          next(channels), text_channel, voice_channel,
+                          min(max_members, max(10, size + rng.randint(0, 5))), voice_count, _sql_time(created),
+                          _sql_time(now - rng.uniform(0, 40 * DAY)), int(rng.random() < 0.95)))
+        for i, user_id in enumerate(team):
+            role = "owner" if i == 0 else "deputy" if i == 1 and size >= 5 else "member"
+            member_rows.append((clan_id, user_id, role, _sql_time(created + rng.uniform(0, now - created))))
+        voice_rows.append((clan_id, voice_channel, _sql_time(created)))
+        voice_rows.extend((clan_id, next(channels), _sql_time(created + rng.uniform(0, now - created)))
+                          for _ in range(voice_count - 1))
+
+    bulk.insert(db, "clans", ("id", "name", "description", "color", "owner_id", "role_id", "text_channel_id",
+                              "voice_channel_id", "max_members", "voice_channels_count", "created_at", "last_payment",
+                              "is_active"), clan_rows)
+    bulk.insert(db, "clan_members", ("clan_id", "user_id", "role", "joined_at"), member_rows)
+    bulk.insert(db, "clan_voice_channels", ("clan_id", "channel_id", "created_at"), voice_rows)
+
+
+def _love(bulk: _Bulk, rng: random.Random, by_rank: List[int], now: float) -> None:
+    db = connection.DB_PATH
+    bulk.prepare(db, ("couples", "voice_sessions", "love_room_access"))
+    count = max(1, len(by_rank) // 40)
+    partners = rng.sample(by_rank[:max(2 * count, len(by_rank) // 3)], 2 * count)
+    couples = [(couple_id, partners[2 * couple_id - 2], partners[2 * couple_id - 1], now - rng.uniform(DAY, 365 * DAY))
+               for couple_id in range(1, count + 1)]
+    bulk.insert(db, "couples", ("id", "user1_id", "user2_id", "created_at"),
+                [(couple_id, user1, user2, _sql_time(created)) for couple_id, user1, user2, created in couples])
+
+    channel = SNOWFLAKE_BASE * 3
+
+    def sessions():
+        for couple_id, _, _, created in couples:
+            # Тяжёлый хвост: у большинства пар единицы сессий, у самых активных — тысячи
+            total = min(MAX_COUPLE_SESSIONS, int(rng.paretovariate(0.8)))
+            step = (now - created) / total
+            for i in range(total):
+                started = created + i * step + rng.uniform(0, step / 2)
+                duration = min(int(rng.lognormvariate(7, 1)) + 1, int(step / 2) + 1)
+                yield (couple_id, channel, _iso_time(started), _iso_time(started + duration), duration, 1, 1)
+
+    bulk.insert(db, "voice_sessions", ("couple_id", "channel_id", "started_at", "ended_at", "duration_seconds",
+                                       "user1_present", "user2_present"), sessions())
+    bulk.insert(db, "love_room_access", ("user_id", "expires_at", "created_at"),
+                [(user1, _iso_time(now + rng.uniform(-30 * DAY, 60 * DAY)), _sql_time(created))
+                 for _, user1, _, created in couples if rng.random() < 0.3])
+
+
+def _discipline(bulk: _Bulk, rng: random.Random, users: List[int], by_rank: List[int], moderators: List[int],
+                guild_id: int, now: float) -> None:
+    db = discipline.DB_PATH
+    bulk.prepare(db, ("warnings", "strikes", "praises", "punishments_history"))
+
+    def records(share: int, repeat: Callable[[], int], ttl: Optional[float], horizon: float):
+        for user_id in sorted(rng.sample(users, max(1, len(users) // share))):
+            for _ in range(repeat()):
+                created = now - rng.uniform(0, horizon)
+                yield (user_id, guild_id, rng.choice(moderators), "Нарушение правил", created) + \
+                    ((created + ttl,) if ttl else ())
+
+    columns = ("user_id", "guild_id", "moderator_id", "reason", "created_at")
+    # Предупреждения живут 30 дней, страйки — 90: за полгода большая часть уже истекла
+    bulk.insert(db, "warnings", columns + ("expire_at",), records(20, lambda: 1 + int(rng.expovariate(1.0)), 30 * DAY, 180 * DAY))
+    bulk.insert(db, "strikes", columns + ("expire_at",), records(100, lambda: 1 + int(rng.expovariate(1.5)), 90 * DAY, 180 * DAY))
+    bulk.insert(db, "praises", columns, records(30, lambda: 1 + int(rng.expovariate(1.0)), None, 365 * DAY))
+
+    types = ("text", "voice", "ban", "warn", "strike")
+    weights = list(itertools.accumulate((40, 25, 5, 20, 10)))
+
+    def history():
+        # Наказания чаще у активных участников: выборка по рангу, а не равномерно
+        for user_id in sorted(rng.sample(by_rank[:max(1, len(by_rank) // 3)], max(1, len(by_rank) // 10))):
+            for _ in range(min(50, int(rng.paretovariate(1.5)))):
+                ptype = types[bisect.bisect(weights, rng.random() * weights[-1])]
+                yield (user_id, guild_id, rng.choice(moderators), ptype, "Нарушение правил", now - rng.uniform(0, 365 * DAY))
+
+    bulk.insert(db, "punishments_history", ("user_id", "guild_id", "moderator_id", "type", "reason", "date"), history())
+
+
+def _tickets(bulk: _Bulk, rng: random.Random, users: List[int], now: float) -> None:
+    db = ticket_db.db_path
+    bulk.prepare(db, ("tickets", "ticket_counter"))
+    count = max(1, len(users) // 20)
+    start = now - 365 * DAY
+    bulk.insert(db, "tickets", ("ticket_number", "user_id", "ticket_type", "description", "position", "created_at", "status"),
+                [(f"TICKET-{n:04d}", rng.choice(users), ticket_type, "Описание обращения",
+                  "Модератор" if ticket_type == "staff" else None, _sql_time(start + (now - start) * n / count),
+                  "open" if n > count * 0.95 else "closed")
+                 for n, ticket_type in ((n, rng.choice(TICKET_TYPES)) for n in range(1, count + 1))])
+    bulk.conn(db).execute("UPDATE ticket_counter SET current_number = ? WHERE id = 1", (count,))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Синтетические базы данных бота для бенчмарков и оценки ёмкости")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="каталог для economy.db, main.db, strike.db, tickets.db, mutes.db")
+    target.add_argument("--single-file", help="один файл для всех баз (режим DATABASE_SINGLE_FILE)")
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--now", type=float, help="опорное время (unix) для дат и сроков; по умолчанию — сейчас")
+    parser.add_argument("--guild-id", type=int, default=GUILD_ID)
+    parser.add_argument("--clan-max-members", type=int,
+                        help="потолок размера клана; по умолчанию CLAN_MAX_MEMBER_SLOTS из настроек")
+    args = parser.parse_args()
+
+    if args.out:
+        engine.use_directory(args.out)
+    else:
+        engine.use_single_file(os.path.abspath(args.single_file))
+    try:
+        _check_target()
+    except RuntimeError as e:
+        parser.error(str(e))
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    clan_max_members = args.clan_max_members
+    if clan_max_members is None:
+        # Настройки читаются только ради лимита клана: токен бота здесь не нужен
+        os.environ.setdefault("TOKEN", "datagen")
+        from src.core.config import settings
+        clan_max_members = settings.CLAN_MAX_MEMBER_SLOTS
+
+    started = time.perf_counter()
+    counts = generate(args.accounts, args.seed, args.now, args.guild_id, clan_max_members)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for name, rows in counts.items():
+        print(f"{name:<36} {rows:>10}")
+    print(f"Всего {total} строк за {elapsed:.1f} с ({total / elapsed:.0f} строк/с)")
+
+
+if __name__ == "__main__":
+    main()
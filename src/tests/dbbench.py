@@ -0,0 +1,750 @@
+# src/tests/dbbench.py
+"""
+Микробенчмарки слоя БД: каждая публичная функция economy, clans, love и discipline
+на сгенерированных данных 1k / 100k / 1M аккаунтов, со сравнением с базовой линией.
+
+    python -m src.tests.dbbench                         # 1k и 100k, сравнение с базовой линией
+    python -m src.tests.dbbench --sizes 1k,100k,1m --threshold 30
+    python -m src.tests.dbbench --only get_rank,get_history
+    python -m src.tests.dbbench --save                  # записать новую базовую линию
+
+Данные строит генератор src/tests/datagen.py. Каждый размер выполняется в отдельном процессе
+на копии сгенерированного файла (кэш в каталоге --data-dir), все логические БД — в одном файле. Функция вызывается
+для разных пользователей по кругу, чтобы не мерить один горячий лист индекса и кэш счетов.
+Замер как у pytest-benchmark: калибровка числа вызовов на раунд, затем несколько раундов,
+чередующихся между функциями; сравнивается лучший раунд — он меньше всего зависит
+от соседних процессов и сброса WAL.
+
+Базовая линия — src/tests/dbbench_baseline.json. Регрессия — лучшее время больше базового
+на --threshold процентов и не меньше чем на --noise-floor мкс. Время зависит от машины:
+базовую линию пересохраняют на той машине, где идёт сравнение.
+"""
+import argparse
+import glob
+import inspect
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from src.database import clans, discipline, economy, love
+from src.database.engine import DATABASE_DIR, engine
+from src.database.migrations import run_migrations
+from src.tests import datagen
+from src.tests.datagen import GUILD_ID, USER_BASE
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbbench_baseline.json")
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+MODULES = {"economy": economy, "clans": clans, "love": love, "discipline": discipline}
+
+# Разница меньше этой (секунды) не считается регрессией: шум таймера, планировщика ОС и диска
+NOISE_FLOOR = 50e-6
+# Длительность раунда при калибровке и число раундов
+ROUND_SECONDS = 0.05
+ROUNDS = 7
+# Версия набора данных: меняется вместе с генератором — кэшированные наборы пересоздаются
+DATASET_VERSION = 3
+
+
+class Dataset:
+    """ID из сгенерированного файла для аргументов бенчмарков"""
+
+    def __init__(self, path: str, accounts: int, seed: int):
+        self.accounts = accounts
+        self.seed = seed
+        self.guild_id = GUILD_ID
+        self.users = [USER_BASE + i for i in range(accounts)]
+        # Аккаунт с большим балансом: покупки не упираются в нехватку денег
+        self.rich_user = USER_BASE + accounts
+        self.sample = random.Random(seed).sample(self.users, min(accounts, 10_000))
+        conn = sqlite3.connect(path)
+        try:
+            def column(sql: str) -> List[int]:
+                return [row[0] for row in conn.execute(sql)]
+
+            self.clan_owners = dict(conn.execute("SELECT id, owner_id FROM clans ORDER BY id"))
+            self.clan_ids = list(self.clan_owners)
+            couples = conn.execute("SELECT id, user1_id, user2_id FROM couples ORDER BY id").fetchall()
+            self.couple_ids = [couple_id for couple_id, _, _ in couples]
+            self.coupled_users = [user_id for _, user1, user2 in couples for user_id in (user1, user2)]
+            self.listing_sellers = dict(conn.execute("SELECT role_id, seller_user_id FROM role_listings ORDER BY role_id"))
+            self.listing_roles = list(self.listing_sellers)
+            self.shop_items = column(f"SELECT id FROM shop_roles WHERE guild_id = {GUILD_ID} ORDER BY id")
+            self.request_ids = column("SELECT id FROM custom_role_requests ORDER BY id")
+            self.edit_request_ids = column("SELECT id FROM role_edit_requests ORDER BY id")
+        finally:
+            conn.close()
+
+    def cycle(self, values: List[Any]) -> Iterator[Any]:
+        return itertools.cycle(values)
+
+
+def prepare(path: str, accounts: int, seed: int) -> None:
+    """
+    Набор данных генератора (src/tests/datagen.py) и поправки для бенчмарков покупок:
+    богатый покупатель, товары и лоты без лимитов — иначе после распродажи замеряется отказ, а не покупка
+    """
+    datagen.generate(accounts, seed, guild_id=GUILD_ID)
+    rich = (USER_BASE + accounts, GUILD_ID, 10 ** 12, 10 ** 12)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO accounts (user_id, guild_id, cash, bank) VALUES (?, ?, ?, ?)", rich)
+        conn.execute("""
+            INSERT INTO transaction_entries (transaction_id, user_id, guild_id, cash_delta, bank_delta)
+            SELECT id, ?, ?, ?, ? FROM transactions WHERE kind = 'opening'
+        """, rich)
+        conn.execute("UPDATE shop_roles SET stock = NULL")
+        conn.execute("UPDATE role_listings SET max_sales = NULL")
+    conn.close()
+
+
+# === Бенчмарки ===
+
+# {имя: (фабрика(набор) -> вызов без аргументов, функции, которые покрывает)}
+CASES: Dict[str, Tuple[Callable[[Dataset], Callable[[], Any]], Tuple[str, ...]]] = {}
+
+
+def case(name: str, *also: str):
+    """Регистрирует бенчмарк; also — функции, которые вызываются в нём вместе с основной (пары создание/удаление)"""
+    def decorator(factory):
+        CASES[name] = (factory, (name,) + also)
+        return factory
+    return decorator
+
+
+def _level_up(level: int, xp: float) -> Tuple[int, float]:
+    return level, xp
+
+
+def _counter(start: int) -> Iterator[int]:
+    return itertools.count(start)
+
+
+# economy
+
+@case("economy.get_connection")
+def _(d):
+    return lambda: economy.get_connection().close()
+
+
+@case("economy.init_economy_db")
+def _(d):
+    return economy.init_economy_db
+
+
+@case("economy.upsert_account")
+def _(d):
+    users = d.cycle(d.sample)
+
+    def call():
+        conn = economy.get_connection()
+        economy.upsert_account(conn.cursor(), next(users), d.guild_id, xp=1)
+        conn.commit()
+        conn.close()
+    return call
+
+
+@case("economy.upsert_accounts")
+def _(d):
+    batches = d.cycle([d.sample[i:i + 100] for i in range(0, len(d.sample), 100)])
+
+    def call():
+        conn = economy.get_connection()
+        economy.upsert_accounts(conn.cursor(), ("messages_sent", "xp"), [(u, d.guild_id, 1, 0.5) for u in next(batches)])
+        conn.commit()
+        conn.close()
+    return call
+
+
+def _per_user(func: Callable, *args, **kwargs) -> Callable[[Dataset], Callable[[], Any]]:
+    """Фабрика: func(user_id, guild_id, *args) для пользователей выборки по кругу"""
+    def factory(d):
+        users = d.cycle(d.sample)
+        return lambda: func(next(users), d.guild_id, *args, **kwargs)
+    return factory
+
+
+def _per_item(func: Callable, values: str) -> Callable[[Dataset], Callable[[], Any]]:
+    """Фабрика: func(значение) по кругу из атрибута набора данных values"""
+    def factory(d):
+        items = d.cycle(getattr(d, values))
+        return lambda: func(next(items))
+    return factory
+
+
+def _per_guild(func: Callable) -> Callable[[Dataset], Callable[[], Any]]:
+    return lambda d: lambda: func(d.guild_id)
+
+
+def _once(func: Callable) -> Callable[[Dataset], Callable[[], Any]]:
+    return lambda d: func
+
+
+for _name, _args, _kwargs in [
+    ("get_or_create_account", (), {}),
+    ("set_money", (), {"cash": 500}),
+    ("add_xp", (1,), {}),
+    ("add_cash", (10,), {}),
+    ("add_bank", (10,), {}),
+    ("spend_cash", (1, "bench"), {}),
+    ("spend_bank", (1, "bench"), {}),
+    ("transfer_cash_to_bank", (1,), {}),
+    ("transfer_bank_to_cash", (1,), {}),
+    ("set_cooldown", ("work_cd", 0.0), {}),
+    ("get_cooldowns", (), {}),
+    ("add_voice_seconds", (60,), {}),
+    ("get_activity", (), {}),
+    ("set_arrest", (None,), {}),
+    ("inc_robbery_stat", (), {"success": True}),
+    ("rob_fail", (None, 0.0), {}),
+    ("get_rob_stats", (), {}),
+    ("get_rank_by_balance", (), {}),
+    ("get_rank_by_level", (), {}),
+    ("get_rank_by_voice", (), {}),
+    ("get_rank_by_messages", (), {}),
+    ("get_rank_by_robberies", (), {}),
+    ("get_owned_custom_roles", (), {}),
+    ("get_owned_custom_roles_with_info", (), {}),
+    ("get_notifications_enabled", (), {}),
+    ("set_notifications_enabled", (True,), {}),
+]:
+    case(f"economy.{_name}")(_per_user(getattr(economy, _name), *_args, **_kwargs))
+
+for _name in ("get_top_by_balance", "get_top_by_level", "get_top_by_voice", "get_top_by_messages",
+               "get_top_by_robberies", "get_temp_roles", "get_voice_checkpoints", "get_activity_rows",
+               "get_shop_items", "get_market_items", "get_users_with_notifications_enabled"):
+    case(f"economy.{_name}")(_per_guild(getattr(economy, _name)))
+
+
+@case("economy.set_temp_role", "remove_temp_roles")
+def _(d):
+    users = d.cycle(d.sample)
+
+    def call():
+        user_id = next(users)
+        economy.set_temp_role(user_id, d.guild_id, 1, time.time() + 3600)
+        economy.remove_temp_roles(user_id, d.guild_id, [1])
+    return call
+
+
+@case("economy.get_expired_temp_roles")
+def _(d):
+    return lambda: economy.get_expired_temp_roles(d.guild_id, time.time())
+
+
+@case("economy.migrate_temp_roles_json")
+def _(d):
+    def call():
+        conn = economy.get_connection()
+        economy.migrate_temp_roles_json(conn)
+        conn.commit()
+        conn.close()
+    return call
+
+
+@case("economy.rebase_levels", "get_level_curve")
+def _(d):
+    curves = d.cycle(["[100, 200]", "[100, 300]"])
+
+    def call():
+        # Тождественный пересчёт: полный проход по accounts без изменений
+        economy.rebase_levels(next(curves), lambda stored: _level_up)
+        economy.get_level_curve()
+    return call
+
+
+@case("economy.apply_activity_batch")
+def _(d):
+    batches = d.cycle([d.sample[i:i + 100] for i in range(0, len(d.sample), 100)])
+    return lambda: economy.apply_activity_batch({(d.guild_id, u): (0.5, 1) for u in next(batches)}, _level_up)
+
+
+@case("economy.apply_voice_batch")
+def _(d):
+    batches = d.cycle([d.sample[i:i + 100] for i in range(0, len(d.sample), 100)])
+    sessions = [(d.guild_id, u, 1, 1, time.time()) for u in d.users[::200]]
+    return lambda: economy.apply_voice_batch({(d.guild_id, u): 60 for u in next(batches)}, 0.5, _level_up, sessions)
+
+
+@case("economy.purchase_shop_item")
+def _(d):
+    items = d.cycle(d.shop_items)
+    return lambda: economy.purchase_shop_item(d.guild_id, d.rich_user, next(items))
+
+
+@case("economy.purchase_market_item")
+def _(d):
+    roles = d.cycle(d.listing_roles)
+    return lambda: economy.purchase_market_item(d.guild_id, d.rich_user, "listing", next(roles))
+
+
+@case("economy.add_custom_role_request")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: economy.add_custom_role_request(next(users), d.guild_id, "роль", "#45248e", "")
+
+
+@case("economy.set_request_status")
+def _(d):
+    ids = d.cycle(d.request_ids)
+    return lambda: economy.set_request_status(next(ids), "pending", d.rich_user)
+
+
+@case("economy.get_request")
+def _(d):
+    ids = d.cycle(d.request_ids)
+    return lambda: economy.get_request(next(ids))
+
+
+@case("economy.rob_success")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: economy.rob_success(next(users), d.rich_user, d.guild_id, 1, 0.0)
+
+
+@case("economy.add_owned_custom_role")
+def _(d):
+    users, roles = d.cycle(d.sample), _counter(10 ** 9)
+    return lambda: economy.add_owned_custom_role(next(users), d.guild_id, next(roles))
+
+
+@case("economy.remove_owned_custom_role")
+def _(d):
+    users, roles = d.cycle(d.sample), _counter(3 * 10 ** 9)
+    return lambda: (economy.add_owned_custom_role(user := next(users), d.guild_id, role := next(roles)),
+                    economy.remove_owned_custom_role(user, d.guild_id, role))
+
+
+@case("economy.get_role_listing")
+def _(d):
+    roles = d.cycle(d.listing_roles)
+    return lambda: economy.get_role_listing(d.guild_id, next(roles))
+
+
+@case("economy.create_role_listing", "remove_role_listing")
+def _(d):
+    roles = _counter(2 * 10 ** 9)
+    return lambda: (economy.create_role_listing(d.guild_id, role := next(roles), d.rich_user, 1000, None),
+                    economy.remove_role_listing(d.guild_id, role))
+
+
+@case("economy.update_role_listing")
+def _(d):
+    roles = d.cycle(d.listing_roles)
+    return lambda: economy.update_role_listing(d.guild_id, next(roles), price=5000)
+
+
+@case("economy.add_role_edit_request")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: economy.add_role_edit_request(next(users), d.guild_id, 1, "роль", "#45248e")
+
+
+@case("economy.get_role_edit_request")
+def _(d):
+    ids = d.cycle(d.edit_request_ids)
+    return lambda: economy.get_role_edit_request(next(ids))
+
+
+@case("economy.set_role_edit_request_status")
+def _(d):
+    ids = d.cycle(d.edit_request_ids)
+    return lambda: economy.set_role_edit_request_status(next(ids), "pending", d.rich_user)
+
+
+@case("economy.cleanup_invalid_listings")
+def _(d):
+    owners: Dict[int, List[int]] = {}
+    for role, seller in d.listing_sellers.items():
+        owners.setdefault(seller, []).append(role)
+    # Все лоты действительны: замеряется проверка, данные не меняются
+    return lambda: economy.cleanup_invalid_listings(d.guild_id, owners)
+
+
+@case("economy.add_shop_role")
+def _(d):
+    roles = _counter(3 * 10 ** 9)
+    # Отдельный сервер, чтобы рост магазина не влиял на get_shop_items
+    return lambda: economy.add_shop_role(d.guild_id + 1, next(roles), 1000)
+
+
+# clans
+
+@case("clans.init_clans_db")
+def _(d):
+    return clans.init_clans_db
+
+
+@case("clans.create_clan")
+def _(d):
+    ids = _counter(1)
+    return lambda: clans.create_clan(f"Бенч {next(ids)}", "клан", 0, d.rich_user, 1, 1, 1)
+
+
+for _name in ("get_clan_by_id", "get_clan_members", "get_clan_voice_channels", "update_clan_payment"):
+    case(f"clans.{_name}")(_per_item(getattr(clans, _name), "clan_ids"))
+
+for _name in ("get_all_clans", "get_clans_for_payment", "get_top_clans_by_members"):
+    case(f"clans.{_name}")(_once(getattr(clans, _name)))
+
+
+@case("clans.get_clan_by_name")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.get_clan_by_name(f"Клан {next(ids)}")
+
+
+@case("clans.get_user_clan")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: clans.get_user_clan(next(users))
+
+
+@case("clans.add_clan_member", "remove_clan_member")
+def _(d):
+    users = _counter(USER_BASE + 2 * d.accounts)
+    return lambda: (clans.add_clan_member(d.clan_ids[0], user := next(users)), clans.remove_clan_member(d.clan_ids[0], user))
+
+
+@case("clans.update_clan_member_role")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.update_clan_member_role(cid := next(ids), d.clan_owners[cid], "owner")
+
+
+@case("clans.get_clan_member_role")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.get_clan_member_role(cid := next(ids), d.clan_owners[cid])
+
+
+@case("clans.update_clan_info")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.update_clan_info(next(ids), description="клан")
+
+
+@case("clans.update_clan_max_members")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.update_clan_max_members(next(ids), 20)
+
+
+@case("clans.update_clan_owner")
+def _(d):
+    ids = d.cycle(d.clan_ids)
+    return lambda: clans.update_clan_owner(next(ids), d.rich_user)
+
+
+@case("clans.add_clan_voice_channel")
+def _(d):
+    channels = _counter(10 ** 9)
+    return lambda: clans.add_clan_voice_channel(d.clan_ids[-1], next(channels))
+
+
+@case("clans.deactivate_clan")
+def _(d):
+    # Последний клан деактивируется повторно: остальные остаются в выборках активных
+    return lambda: clans.deactivate_clan(d.clan_ids[-1])
+
+
+# love
+
+@case("love.init_love_db")
+def _(d):
+    return love.init_love_db
+
+
+@case("love.create_couple", "delete_couple")
+def _(d):
+    users = _counter(USER_BASE + 3 * d.accounts)
+
+    def call():
+        user1, user2 = next(users), next(users)
+        love.create_couple(user1, user2)
+        couple = love.get_couple_by_user(user1)
+        love.delete_couple(couple["id"])
+    return call
+
+
+for _name in ("get_couple_by_user", "is_coupled", "has_love_room_access", "get_love_room_access_expiry"):
+    case(f"love.{_name}")(_per_item(getattr(love, _name), "coupled_users"))
+
+for _name in ("get_couple_by_id", "get_total_voice_time", "get_active_session"):
+    case(f"love.{_name}")(_per_item(getattr(love, _name), "couple_ids"))
+
+for _name in ("get_coupled_user_ids", "clear_active_sessions", "cleanup_expired_sessions",
+              "get_all_love_room_access", "remove_expired_access"):
+    case(f"love.{_name}")(_once(getattr(love, _name)))
+
+
+@case("love.update_couple_description")
+def _(d):
+    ids = d.cycle(d.couple_ids)
+    return lambda: love.update_couple_description(next(ids), "💕")
+
+
+@case("love.start_voice_session", "end_voice_session")
+def _(d):
+    ids = d.cycle(d.couple_ids)
+    return lambda: (love.start_voice_session(cid := next(ids), 1), love.end_voice_session(cid))
+
+
+@case("love.add_love_room_access", "remove_love_room_access")
+def _(d):
+    users = _counter(USER_BASE + 4 * d.accounts)
+    return lambda: (love.add_love_room_access(user := next(users)), love.remove_love_room_access(user))
+
+
+# discipline
+
+@case("discipline.get_connection")
+def _(d):
+    return lambda: discipline.get_connection().close()
+
+
+@case("discipline.init_discipline_db")
+def _(d):
+    return discipline.init_discipline_db
+
+
+@case("discipline.cleanup_expired")
+def _(d):
+    return discipline.cleanup_expired
+
+
+for _name in ("count_warnings", "count_strikes", "count_praises", "get_history"):
+    case(f"discipline.{_name}")(_per_user(getattr(discipline, _name)))
+
+
+@case("discipline.add_warning")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: discipline.add_warning(next(users), d.guild_id, d.rich_user, "бенч")
+
+
+@case("discipline.add_praise")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: discipline.add_praise(next(users), d.guild_id, d.rich_user, "бенч")
+
+
+@case("discipline.add_punishment_history")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: discipline.add_punishment_history(next(users), d.guild_id, d.rich_user, "text", "бенч")
+
+
+@case("discipline.add_strike", "remove_one_strike")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: (discipline.add_strike(user := next(users), d.guild_id, d.rich_user, "бенч"),
+                    discipline.remove_one_strike(user, d.guild_id))
+
+
+@case("discipline.remove_one_warning")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: discipline.remove_one_warning(next(users), d.guild_id)
+
+
+@case("discipline.normalize_counts")
+def _(d):
+    users = d.cycle(d.sample)
+    return lambda: discipline.normalize_counts(next(users), d.guild_id, d.rich_user)
+
+
+def public_functions() -> Dict[str, Callable]:
+    """Публичные функции модулей, объявленные в них самих (не импортированные)"""
+    return {
+        f"{prefix}.{name}": obj
+        for prefix, module in MODULES.items()
+        for name, obj in vars(module).items()
+        if inspect.isfunction(obj) and not name.startswith("_") and obj.__module__ == module.__name__
+    }
+
+
+def covered_functions() -> set:
+    return {f"{name.split('.')[0]}.{func}" if "." not in func else func
+            for name, (_, funcs) in CASES.items() for func in funcs}
+
+
+# === Замер ===
+
+def calibrate(call: Callable[[], Any], round_seconds: float = ROUND_SECONDS) -> int:
+    """Число вызовов, которое укладывается в один раунд"""
+    start = time.perf_counter()
+    call()
+    single = time.perf_counter() - start
+    return max(1, int(round_seconds / max(single, 1e-7)))
+
+
+def time_round(call: Callable[[], Any], number: int) -> float:
+    """Среднее время одного вызова за раунд"""
+    start = time.perf_counter()
+    for _ in range(number):
+        call()
+    return (time.perf_counter() - start) / number
+
+
+def summarize(per_call: List[float], number: int) -> Dict[str, float]:
+    return {"min": min(per_call), "median": statistics.median(per_call),
+            "stdev": statistics.stdev(per_call) if len(per_call) > 1 else 0.0, "number": number, "rounds": len(per_call)}
+
+
+def dataset_path(data_dir: str, size: str, seed: int) -> str:
+    # Сроки (временные роли, предупреждения, доступ к love-комнатам) отсчитываются от дня генерации,
+    # поэтому кэш действует до конца дня
+    return os.path.join(data_dir, f"dbbench-{size}-s{seed}-v{DATASET_VERSION}-{time.strftime('%Y%m%d')}.db")
+
+
+def run_size(size: str, seed: int, data_dir: str, only: List[str], rounds: int) -> Dict[str, Dict[str, float]]:
+    """Выполняется в отдельном процессе: движок хранилища переключается на копию набора данных"""
+    source = dataset_path(data_dir, size, seed)
+    with tempfile.TemporaryDirectory(prefix="dbbench-") as tmp:
+        work = os.path.join(tmp, "bench.db")
+        engine.use_single_file(work)
+        if not os.path.exists(source):
+            started = time.perf_counter()
+            prepare(work, SIZES[size], seed)
+            os.makedirs(data_dir, exist_ok=True)
+            for stale in glob.glob(os.path.join(data_dir, f"dbbench-{size}-s{seed}-*.db")):
+                os.remove(stale)
+            shutil.copyfile(work, source + ".tmp")
+            os.replace(source + ".tmp", source)
+            print(f"Набор {size} создан за {time.perf_counter() - started:.1f} с: {source}", file=sys.stderr)
+        else:
+            shutil.copyfile(source, work)
+        run_migrations()
+        ds = Dataset(work, SIZES[size], seed)
+
+        checkpoint = sqlite3.connect(work)
+        calls = {}
+        for name, (factory, _) in CASES.items():
+            if only and not any(part in name for part in only):
+                continue
+            call = factory(ds)
+            calls[name] = (call, calibrate(call))
+
+        # Раунды чередуются между функциями: если машину на несколько секунд притормозит
+        # соседний процесс, это заденет по одному раунду у многих функций, а не все раунды одной
+        timings: Dict[str, List[float]] = {name: [] for name in calls}
+        for _ in range(rounds):
+            for name, (call, number) in calls.items():
+                # WAL предыдущих записей сбрасывается заранее, а не внутри замера следующей функции
+                checkpoint.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                timings[name].append(time_round(call, number))
+        results = {name: summarize(timings[name], calls[name][1]) for name in calls}
+        checkpoint.close()
+        engine.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict[str, Any],
+            threshold: float, noise_floor: float = NOISE_FLOOR) -> Tuple[List[str], List[str]]:
+    """Строки отчёта и список регрессий"""
+    lines, regressions = [], []
+    for size, cases in results.items():
+        base = baseline.get("results", {}).get(size, {})
+        lines.append(f"\n== {size} ({SIZES[size]} аккаунтов)")
+        lines.append(f"{'функция':<48} {'лучшее, мкс':>12} {'база, мкс':>11} {'изменение':>10}")
+        for name, r in sorted(cases.items(), key=lambda kv: -kv[1]["min"]):
+            best, old = r["min"], base.get(name)
+            if old is None:
+                lines.append(f"{name:<48} {best * 1e6:>12.1f} {'—':>11} {'':>10}")
+                continue
+            change = (best - old) / old * 100 if old else 0.0
+            regressed = change > threshold and best - old > noise_floor
+            mark = "  ⚠️ РЕГРЕССИЯ" if regressed else ""
+            lines.append(f"{name:<48} {best * 1e6:>12.1f} {old * 1e6:>11.1f} {change:>+9.0f}%{mark}")
+            if regressed:
+                regressions.append(f"{size} {name}: {old * 1e6:.1f} → {best * 1e6:.1f} мкс ({change:+.0f}%)")
+    return lines, regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки функций БД с порогом регрессии")
+    parser.add_argument("--sizes", default="1k,100k", help=f"размеры наборов через запятую: {', '.join(SIZES)}")
+    parser.add_argument("--threshold", type=float, default=50.0, help="допустимое замедление, проценты")
+    parser.add_argument("--noise-floor", type=float, default=NOISE_FLOOR * 1e6,
+                        help="замедление меньше этого (мкс) не считается регрессией")
+    parser.add_argument("--only", default="", help="подстроки имён бенчмарков через запятую")
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "naeratus-dbbench"),
+                        help="кэш сгенерированных наборов данных")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="записать результаты в базовую линию")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    only = [part for part in args.only.split(",") if part]
+    if os.path.normcase(os.path.abspath(args.data_dir)) == os.path.normcase(DATABASE_DIR):
+        parser.error("рабочий каталог баз бота не подходит для кэша наборов: укажите отдельный каталог")
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker, args.seed, args.data_dir, only, args.rounds)))
+        return
+
+    sizes = [size.strip().lower() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+
+    results = {}
+    for size in sizes:
+        # Каждый размер — в своём процессе: движок хранилища и кэши модулей не смешиваются
+        out = subprocess.run(
+            [sys.executable, "-m", "src.tests.dbbench", "--worker", size, "--seed", str(args.seed),
+             "--data-dir", args.data_dir, "--only", args.only, "--rounds", str(args.rounds)],
+            stdout=subprocess.PIPE, text=True, check=True,
+        )
+        results[size] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        lines, _ = compare(results, baseline, args.threshold, args.noise_floor / 1e6)
+        print("\n".join(lines))
+
+    if args.save:
+        saved = baseline.get("results", {})
+        for size, cases in results.items():
+            saved.setdefault(size, {}).update({name: round(r["min"], 9) for name, r in cases.items()})
+        baseline = {
+            "machine": f"{platform.system()} {platform.machine()}, {platform.processor() or 'cpu'}",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "results": {size: dict(sorted(cases.items())) for size, cases in saved.items()},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nБазовая линия записана: {args.baseline}")
+        return
+
+    _, regressions = compare(results, baseline, args.threshold, args.noise_floor / 1e6)
+    if regressions:
+        print(f"\n❌ Регрессии больше {args.threshold:.0f}%:\n" + "\n".join(regressions),
+              file=sys.stderr if args.json else sys.stdout)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+# src/tests/loadtest.py
+"""
+Нагрузочный прогон без сети: NaeratusBot со всеми когами, поддельный gateway и поддельный REST API.
+
+Бот проходит обычный login/setup_hook, получает синтетический сервер (GUILD_CREATE) и READY,
+после чего через парсеры discord.py воспроизводится смесь MESSAGE_CREATE, VOICE_STATE_UPDATE
+и INTERACTION_CREATE (слэш-команды). Активность участников распределена по Ципфу: немногие
+пишут и заходят в войс часто, большинство — изредка. Все базы — во временном файле
+(режим одного файла), реальные данные не затрагиваются.
+
+Отчёт: пропускная способность, p50/p99 задержки каждого обработчика (от поступления события
+до завершения) и каждой команды, число пишущих SQL-запросов и транзакций, запросы к REST API.
+
+    python -m src.tests.loadtest --members 5000 --events 20000
+    python -m src.tests.loadtest --rate 500 --rest-latency 0.05 --json
+
+--rate 0 — события подаются без пауз (предельная пропускная способность);
+--rate N — N событий в секунду, как у живого gateway.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Настройки читаются при импорте бота: токен не нужен, внешние хранилища и трассировка выключены
+os.environ.setdefault("TOKEN", "loadtest")
+os.environ["DISCORD_NO_VOICE"] = "1"
+os.environ["DATABASE_URL"] = ""
+os.environ.setdefault("TRACE_EXPORT", "")
+
+import discord
+from discord.webhook import async_ as webhook_async
+
+from src.core.bot import NaeratusBot
+from src.core.config import settings
+from src.database.engine import engine, get_pool
+from src.database.migrations import run_migrations
+from src.servies import activity_buffer, startup, voice_sessions
+
+APPLICATION_ID = 10 ** 17 + 999_999
+USER_BASE = 10 ** 17
+TEXT_CHANNELS = 5
+VOICE_CHANNELS = 8
+
+# Доли событий по умолчанию и веса команд
+DEFAULT_MIX = {"message": 0.75, "voice": 0.15, "interaction": 0.10}
+COMMAND_MIX = {"balance": 40, "balance_member": 10, "top": 20, "love": 15, "help": 10, "coinflip": 5}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class FakeDiscord:
+    """Поддельный REST API: ответы по шаблону маршрута discord.py, без сети"""
+
+    def __init__(self, guild_id: int, latency: float = 0.0):
+        self.guild_id = guild_id
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.unhandled: Dict[str, int] = {}
+        self._ids = itertools.count(10 ** 18)
+
+    def bot_user(self) -> Dict[str, Any]:
+        return {"id": str(APPLICATION_ID), "username": "Naeratus", "discriminator": "0", "avatar": None, "bot": True}
+
+    def message(self, channel_id: Any, payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        payload = payload or {}
+        return {
+            "id": str(next(self._ids)), "channel_id": str(channel_id), "guild_id": str(self.guild_id),
+            "author": self.bot_user(), "content": payload.get("content") or "", "embeds": payload.get("embeds") or [],
+            "components": payload.get("components") or [], "timestamp": "2024-01-01T00:00:00+00:00",
+            "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "pinned": False, "type": 0, "flags": payload.get("flags", 0),
+        }
+
+    async def respond(self, route: discord.http.Route, payload: Optional[Dict[str, Any]] = None) -> Any:
+        key = f"{route.method} {route.path}"
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = route.path
+        if path == "/users/@me":
+            return self.bot_user()
+        if path == "/oauth2/applications/@me":
+            return {"id": str(APPLICATION_ID), "name": "Naeratus", "icon": None, "description": "", "rpc_origins": [],
+                    "bot_public": False, "bot_require_code_grant": False, "verify_key": "0" * 64,
+                    "owner": self.bot_user(), "flags": 0}
+        if path.endswith("/commands"):
+            return []
+        if path.endswith("/callback"):
+            return None
+        if route.method in ("POST", "PATCH") and ("/messages" in path or path.startswith("/webhooks/")):
+            return self.message(getattr(route, "channel_id", None) or 0, payload)
+        if route.method == "GET" and path.endswith("/messages"):
+            return []
+        if route.method == "DELETE" or route.method == "PUT":
+            return None
+        self.unhandled[key] = self.unhandled.get(key, 0) + 1
+        raise discord.NotFound(_FakeResponse(404), {"code": 0, "message": f"loadtest: {key}"})
+
+
+class _FakeResponse:
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = "Not Found"
+
+
+class _FakeWebhookAdapter(webhook_async.AsyncWebhookAdapter):
+    """Ответы на взаимодействия (interaction.response, followup) идут мимо HTTPClient — через адаптер вебхуков"""
+
+    def __init__(self, fake: FakeDiscord):
+        super().__init__()
+        self.fake = fake
+
+    async def request(self, route, session, *, payload=None, multipart=None, **kwargs):
+        if multipart:
+            payload = json.loads(multipart[0]["value"])
+        return await self.fake.respond(route, payload)
+
+
+class LoadTestBot(NaeratusBot):
+    """NaeratusBot, который засекает время каждого обработчика событий"""
+
+    def __init__(self, fake: FakeDiscord):
+        super().__init__()
+        self.fake = fake
+        # {"событие обработчик": [секунды]}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.outstanding = 0
+        self._command_started: Dict[int, float] = {}
+
+        async def request(route, *, files=None, form=None, **kwargs):
+            return await fake.respond(route, kwargs.get("json"))
+
+        async def static_login(token):
+            self.http.token = token
+            return fake.bot_user()
+
+        self.http.request = request
+        self.http.static_login = static_login
+
+        tree_call = self.tree._call
+
+        async def timed_call(interaction):
+            try:
+                await tree_call(interaction)
+            except Exception:
+                self._count_error(f"/{interaction.data.get('name')}")
+                raise
+            finally:
+                started = self._command_started.pop(interaction.id, None)
+                if started is not None:
+                    self._record(f"/{interaction.data.get('name')}", time.perf_counter() - started)
+
+        self.tree._call = timed_call
+
+    def _record(self, name: str, seconds: float) -> None:
+        self.latencies.setdefault(name, []).append(seconds)
+        self.outstanding -= 1
+
+    def _count_error(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        # Задача создаётся в момент разбора события: задержка включает ожидание в очереди цикла
+        queued = time.perf_counter()
+        name = f"{event_name} {getattr(coro, '__qualname__', coro)}"
+        self.outstanding += 1
+
+        async def timed(*a, **kw):
+            try:
+                await coro(*a, **kw)
+            except Exception:
+                self._count_error(name)
+                raise
+            finally:
+                self._record(name, time.perf_counter() - queued)
+
+        return super()._schedule_event(timed, event_name, *args, **kwargs)
+
+    def expect_command(self, interaction_id: int) -> None:
+        self._command_started[interaction_id] = time.perf_counter()
+        self.outstanding += 1
+
+
+class WriteCounter:
+    """Пишущие запросы и транзакции SQLite по всем соединениям пулов (trace callback)"""
+
+    def __init__(self):
+        # Запросы выполняются в потоках движка
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+
+    def install(self, conn: sqlite3.Connection) -> None:
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, statement: str) -> None:
+        head = statement.lstrip()[:7].upper()
+        if head.startswith(("INSERT", "UPDATE", "DELETE", "REPLACE")):
+            with self._lock:
+                self.writes += 1
+        elif head.startswith(("COMMIT", "END")):
+            with self._lock:
+                self.commits += 1
+
+    def snapshot(self) -> Tuple[int, int]:
+        with self._lock:
+            return self.writes, self.commits
+
+
+class GuildSimulation:
+    """Синтетический сервер и поток событий от его участников"""
+
+    def __init__(self, members: int, seed: int, zipf: float = 1.1):
+        self.rng = random.Random(seed)
+        self.members = members
+        self.guild_id = settings.TEST_GUILD_ID or 1
+        self.text_channels = [self.guild_id + 1 + i for i in range(TEXT_CHANNELS)]
+        self.voice_channels = [self.guild_id + 100 + i for i in range(VOICE_CHANNELS)]
+        self.roles = [self.guild_id + 1000 + i for i in range(10)]
+        # Вероятность активности участника с рангом r ~ 1 / r^zipf
+        self.weights = [1.0 / (r + 1) ** zipf for r in range(members)]
+        self.voice: Dict[int, Tuple[int, bool]] = {}
+        self._ids = itertools.count(10 ** 18 + 10 ** 15)
+
+    def user(self, i: int) -> Dict[str, Any]:
+        return {"id": str(USER_BASE + i), "username": f"user{i}", "discriminator": "0",
+                "global_name": f"Участник {i}", "avatar": None}
+
+    def member(self, i: int, with_user: bool = True) -> Dict[str, Any]:
+        data = {"roles": [str(self.roles[i % len(self.roles)])], "joined_at": "2024-01-01T00:00:00+00:00",
+                "deaf": False, "mute": False, "flags": 0}
+        if with_user:
+            data["user"] = self.user(i)
+        return data
+
+    def guild_create(self) -> Dict[str, Any]:
+        channels = [{"id": str(c), "type": 0, "name": f"chat-{n}", "position": n, "permission_overwrites": []}
+                    for n, c in enumerate(self.text_channels)]
+        channels += [{"id": str(c), "type": 2, "name": f"voice-{n}", "position": n, "permission_overwrites": [],
+                      "bitrate": 64000, "user_limit": 0} for n, c in enumerate(self.voice_channels)]
+        roles = [{"id": str(self.guild_id), "name": "@everyone", "permissions": "104324673", "position": 0,
+                  "color": 0, "hoist": False, "managed": False, "mentionable": False}]
+        roles += [{"id": str(r), "name": f"role-{n}", "permissions": "0", "position": n + 1, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False} for n, r in enumerate(self.roles)]
+        return {
+            "id": str(self.guild_id), "name": "loadtest", "owner_id": str(USER_BASE), "member_count": self.members + 1,
+            "roles": roles, "emojis": [], "stickers": [], "features": [], "channels": channels, "threads": [],
+            "voice_states": [], "presences": [],
+            "members": [self.member(i) for i in range(self.members)] + [
+                {"user": FakeDiscord(self.guild_id).bot_user(), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00",
+                 "deaf": False, "mute": False, "flags": 0}],
+        }
+
+    def pick(self) -> int:
+        return self.rng.choices(range(self.members), weights=self.weights)[0]
+
+    def message(self, i: int) -> Dict[str, Any]:
+        words = ("привет", "как дела", "го в войс", "кто играет", "ахах", "спасибо", "ок", "сегодня рейд")
+        return {
+            "id": str(next(self._ids)), "channel_id": str(self.rng.choice(self.text_channels)),
+            "guild_id": str(self.guild_id), "author": self.user(i), "member": self.member(i, with_user=False),
+            "content": " ".join(self.rng.choices(words, k=self.rng.randint(1, 6))),
+            "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "type": 0,
+        }
+
+    def voice_state(self, i: int) -> Dict[str, Any]:
+        current = self.voice.get(i)
+        roll = self.rng.random()
+        if current is None:
+            channel, muted = self.rng.choice(self.voice_channels), False
+        elif roll < 0.5:
+            channel, muted = None, False
+        elif roll < 0.8:
+            channel, muted = self.rng.choice(self.voice_channels), current[1]
+        else:
+            channel, muted = current[0], not current[1]
+        if channel is None:
+            self.voice.pop(i, None)
+        else:
+            self.voice[i] = (channel, muted)
+        return {"guild_id": str(self.guild_id), "channel_id": str(channel) if channel else None,
+                "user_id": str(USER_BASE + i), "session_id": f"s{i}", "deaf": False, "mute": False,
+                "self_deaf": False, "self_mute": muted, "self_video": False, "suppress": False,
+                "member": self.member(i)}
+
+    def interaction(self, i: int) -> Dict[str, Any]:
+        command = self.rng.choices(list(COMMAND_MIX), weights=list(COMMAND_MIX.values()))[0]
+        data: Dict[str, Any] = {"id": str(next(self._ids)), "name": command, "type": 1}
+        if command == "balance_member":
+            other = self.pick()
+            data.update(name="balance", options=[{"name": "member", "type": 6, "value": str(USER_BASE + other)}],
+                        resolved={"users": {str(USER_BASE + other): self.user(other)},
+                                  "members": {str(USER_BASE + other): self.member(other, with_user=False)}})
+        elif command == "coinflip":
+            data["options"] = [{"name": "bet", "type": 4, "value": 100}]
+        member = self.member(i)
+        member["permissions"] = "104324673"
+        return {
+            "id": str(next(self._ids)), "application_id": str(APPLICATION_ID), "type": 2, "data": data,
+            "guild_id": str(self.guild_id), "channel_id": str(self.rng.choice(self.text_channels)),
+            "member": member, "token": "loadtest", "version": 1, "locale": "ru", "guild_locale": "ru",
+            "app_permissions": "2147483647", "entitlements": [],
+        }
+
+    def events(self, count: int, mix: Dict[str, float]) -> List[Tuple[str, Dict[str, Any]]]:
+        kinds = self.rng.choices(list(mix), weights=list(mix.values()), k=count)
+        factories = {"message": ("MESSAGE_CREATE", self.message), "voice": ("VOICE_STATE_UPDATE", self.voice_state),
+                     "interaction": ("INTERACTION_CREATE", self.interaction)}
+        return [(factories[k][0], factories[k][1](self.pick())) for k in kinds]
+
+
+async def run(members: int, count: int, mix: Dict[str, float], rate: float, seed: int,
+              rest_latency: float, timeout: float) -> Dict[str, Any]:
+    sim = GuildSimulation(members, seed)
+    fake = FakeDiscord(sim.guild_id, rest_latency)
+    webhook_async.async_context.set(_FakeWebhookAdapter(fake))
+    counter = WriteCounter()
+    # Режим одного файла: два пула (кортежи и sqlite3.Row) обслуживают все логические БД
+    for row_factory in (None, sqlite3.Row):
+        get_pool("loadtest", row_factory).add_connect_hook(counter.install)
+
+    bot = LoadTestBot(fake)
+    boot_started = time.perf_counter()
+    await bot.login(os.environ["TOKEN"])
+    state = bot._connection
+    state._add_guild_from_data(sim.guild_create())
+    bot._ready.set()
+    state.dispatch("ready")
+    if bot._sync_task is not None:
+        await bot._sync_task
+    await startup.wait_warmups()
+    await asyncio.sleep(0)
+    boot_seconds = time.perf_counter() - boot_started
+
+    # Обработчики прогрева не входят в замер
+    bot.latencies.clear()
+    bot.errors.clear()
+    bot.outstanding = 0
+    fake.calls.clear()
+    writes_before, commits_before = counter.snapshot()
+
+    events = sim.events(count, mix)
+    parsers = state.parsers
+    started = time.perf_counter()
+    for n, (kind, data) in enumerate(events):
+        if kind == "INTERACTION_CREATE":
+            bot.expect_command(int(data["id"]))
+        parsers[kind](data)
+        if rate:
+            delay = started + (n + 1) / rate - time.perf_counter()
+            await asyncio.sleep(max(0.0, delay))
+        else:
+            await asyncio.sleep(0)
+    deadline = time.perf_counter() + timeout
+    while bot.outstanding > 0 and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    handled = time.perf_counter() - started
+    # Буферы активности и войса пишутся пачкой — запись входит в замер
+    await activity_buffer.flush()
+    await voice_sessions.checkpoint()
+    elapsed = time.perf_counter() - started
+    writes_after, commits_after = counter.snapshot()
+
+    result = {
+        "members": members, "events": count, "seed": seed, "rate": rate, "rest_latency": rest_latency,
+        "boot_seconds": round(boot_seconds, 3),
+        "handled_seconds": round(handled, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(count / handled, 1) if handled else 0.0,
+        "unfinished": bot.outstanding,
+        "handlers": {
+            name: {"count": len(v), "p50_ms": round(_percentile(v, 0.5) * 1000, 3),
+                   "p99_ms": round(_percentile(v, 0.99) * 1000, 3), "max_ms": round(max(v) * 1000, 3)}
+            for name, v in sorted(bot.latencies.items())
+        },
+        "errors": dict(bot.errors),
+        "db_writes": writes_after - writes_before,
+        "db_commits": commits_after - commits_before,
+        "rest_calls": dict(sorted(fake.calls.items())),
+        "rest_unhandled": dict(fake.unhandled),
+    }
+    await bot.close()
+    return result
+
+
+def format_report(r: Dict[str, Any]) -> str:
+    lines = [
+        f"Участников: {r['members']}, событий: {r['events']}, seed {r['seed']}, "
+        f"темп {'без пауз' if not r['rate'] else str(r['rate']) + '/с'}, задержка REST {r['rest_latency'] * 1000:.0f} мс",
+        f"Запуск: {r['boot_seconds']:.2f} с; обработка: {r['handled_seconds']:.2f} с "
+        f"({r['throughput']:.0f} событий/с); не завершено: {r['unfinished']}",
+        f"БД: {r['db_writes']} пишущих запросов, {r['db_commits']} транзакций "
+        f"({r['db_writes'] / max(r['events'], 1):.3f} запросов на событие)",
+        "",
+        f"{'обработчик':<58} {'кол-во':>7} {'p50, мс':>9} {'p99, мс':>9} {'макс, мс':>9}",
+    ]
+    for name, h in r["handlers"].items():
+        lines.append(f"{name[:58]:<58} {h['count']:>7} {h['p50_ms']:>9.2f} {h['p99_ms']:>9.2f} {h['max_ms']:>9.2f}")
+    if r["errors"]:
+        lines += ["", "Ошибки: " + ", ".join(f"{k}: {v}" for k, v in r["errors"].items())]
+    lines += ["", "REST: " + (", ".join(f"{k}: {v}" for k, v in r["rest_calls"].items()) or "нет запросов")]
+    if r["rest_unhandled"]:
+        lines.append("Маршруты без ответа (404): " + ", ".join(r["rest_unhandled"]))
+    return "\n".join(lines)
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, share = part.partition("=")
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"неизвестный тип события {kind}; допустимы {', '.join(DEFAULT_MIX)}")
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон когов на синтетическом сервере")
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX,
+                        help="доли событий, например message=0.75,voice=0.15,interaction=0.1")
+    parser.add_argument("--rate", type=float, default=0.0, help="событий в секунду; 0 — без пауз")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="задержка поддельного REST API, секунды")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать завершения обработчиков")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    parser.add_argument("--verbose", action="store_true", help="журнал бота в stderr")
+    args = parser.parse_args()
+
+    import logging
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, stream=sys.stderr)
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        engine.use_single_file(os.path.join(tmp, "loadtest.db"))
+        run_migrations()
+        result = asyncio.run(run(args.members, args.events, args.mix, args.rate, args.seed,
+                                 args.rest_latency, args.timeout))
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Пул соединений: ограничение размера, вложенные вызовы и короткое ожидание из event loop
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+
+from src.database import engine as engine_module
+from src.database.engine import LOOP_BUSY_TIMEOUT, ConnectionPool
+
+
+def _in_thread(func):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_pool_waits_at_size_and_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine_module, "DEFAULT_BUSY_TIMEOUT", 0.3)
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2)
+    held = []
+    for _ in range(2):
+        thread, result = _in_thread(pool.connect)
+        thread.join()
+        held.append(result["value"])
+
+    # Оба соединения заняты другими потоками — новый вызов ждёт и получает ошибку
+    started = time.monotonic()
+    thread, result = _in_thread(pool.connect)
+    thread.join()
+    assert isinstance(result.get("error"), sqlite3.OperationalError)
+    assert time.monotonic() - started >= 0.25
+    assert pool.stats()["open"] == 2
+
+    # Ожидающий поток получает соединение, как только другое возвращено в пул
+    thread, result = _in_thread(pool.connect)
+    time.sleep(0.05)
+    held.pop().close()
+    thread.join()
+    assert "value" in result and pool.stats()["open"] == 2
+    result["value"].close()
+    for conn in held:
+        conn.close()
+    pool.close()
+
+
+def test_nested_connect_on_same_thread_does_not_wait(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1)
+    outer = pool.connect()
+    inner = pool.connect()
+    assert pool.stats()["open"] == 2
+    inner.close()
+    outer.close()
+    # Лишнее соединение закрывается при возврате
+    assert pool.stats() == {"size": 1, "open": 1, "idle": 1}
+    pool.close()
+
+
+def test_event_loop_callers_get_short_busy_timeout(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1)
+
+    def busy_timeout():
+        conn = pool.connect()
+        try:
+            return conn.execute("PRAGMA busy_timeout").fetchone()[0]
+        finally:
+            conn.close()
+
+    async def from_loop():
+        return busy_timeout()
+
+    assert asyncio.run(from_loop()) == int(LOOP_BUSY_TIMEOUT * 1000)
+    assert busy_timeout() == int(engine_module.DEFAULT_BUSY_TIMEOUT * 1000)
+    pool.close()
@@ -0,0 +1,68 @@
+"""
+Регрессионный тест: все запросы топов и рангов по accounts идут по индексам
+"""
+import pytest
+
+from src.database import economy
+from src.tests.conftest import GUILD_ID, USER_ID, assert_index_driven
+
+
+@pytest.mark.parametrize("func", [
+    economy.get_top_by_balance,
+    economy.get_top_by_level,
+    economy.get_top_by_voice,
+    economy.get_top_by_messages,
+    economy.get_top_by_robberies,
+])
+def test_top_queries_use_index(traced_db, func):
+    func(GUILD_ID)
+    assert_index_driven(economy.DB_PATH, traced_db)
+
+
+@pytest.mark.parametrize("func", [
+    economy.get_rank_by_balance,
+    economy.get_rank_by_level,
+    economy.get_rank_by_voice,
+    economy.get_rank_by_messages,
+    economy.get_rank_by_robberies,
+])
+def test_rank_queries_use_index(traced_db, func):
+    func(USER_ID, GUILD_ID)
+    assert_index_driven(economy.DB_PATH, traced_db)
+
+
+def test_service_queries_use_index(traced_db, monkeypatch):
+    pytest.importorskip("pydantic_settings")
+    from src.servies import ExperienceService, MessageCounterService, experience_service, message_counter
+
+    # Проверка версии схемы сервисами — на временной БД и до начала трассировки
+    monkeypatch.setattr(experience_service, "DB_PATH", economy.DB_PATH)
+    monkeypatch.setattr(message_counter, "DB_PATH", economy.DB_PATH)
+    ExperienceService._ensure_db_initialized()
+    MessageCounterService._ensure_db_initialized()
+    traced_db.clear()
+
+    ExperienceService.get_top_by_level(GUILD_ID)
+    ExperienceService.get_rank_by_level(USER_ID, GUILD_ID)
+    MessageCounterService.get_top_by_messages(GUILD_ID)
+    MessageCounterService.get_rank_by_messages(USER_ID, GUILD_ID)
+    assert_index_driven(economy.DB_PATH, traced_db)
+
+
+def test_expired_temp_roles_use_index(traced_db):
+    economy.set_temp_role(USER_ID, GUILD_ID, 7, 100.0)
+    economy.set_temp_role(USER_ID, GUILD_ID, 8, 10.0 ** 10)
+    traced_db.clear()
+    assert economy.get_expired_temp_roles(GUILD_ID, 1000.0) == [(USER_ID, [7])]
+    assert_index_driven(economy.DB_PATH, traced_db, "idx_temp_roles_expires")
+
+
+def test_first_touch_upsert_is_single_statement(traced_db):
+    new_user = USER_ID + 100
+    economy.add_xp(new_user, GUILD_ID, 5)
+    # Программы триггеров трассируются повтором того же текста запроса
+    writes = {s for s in traced_db if s.lstrip().upper().startswith(("INSERT", "UPDATE"))}
+    assert len(writes) == 1 and "ON CONFLICT" in writes.pop()
+    economy.inc_robbery_stat(new_user, GUILD_ID, success=True)
+    acc = economy.get_or_create_account(new_user, GUILD_ID)
+    assert acc[2] == 5 and acc[3] == 1 and acc[10:12] == (1, 1)
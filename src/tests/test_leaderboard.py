@@ -0,0 +1,58 @@
+"""
+Таблицы лидеров в памяти: инкрементальное обновление через триггеры
+"""
+import asyncio
+
+import pytest
+
+from src.database import economy, ledger
+from src.tests.conftest import GUILD_ID, USER_ID
+
+
+def test_leaderboard_ignores_rolled_back_changes(traced_db):
+    pytest.importorskip("pydantic_settings")
+    from src.servies.leaderboard import LeaderboardService
+
+    boards = LeaderboardService()
+    economy.add_cash(USER_ID, GUILD_ID, 500)
+    assert asyncio.run(boards.top(GUILD_ID, "balance")) == [(USER_ID, 500, 500, 0)]
+
+    # Первая проводка применена триггером, вторая падает — таблица не должна увидеть откат
+    assert not ledger.transfer(GUILD_ID, "rob", [ledger.Leg(USER_ID, cash=1000), ledger.Leg(USER_ID + 1, cash=-1)])
+    assert asyncio.run(boards.top(GUILD_ID, "balance")) == [(USER_ID, 500, 500, 0)]
+
+    economy.get_or_create_account(USER_ID + 1, GUILD_ID)
+    economy.add_cash(USER_ID + 1, GUILD_ID, 700)
+    assert asyncio.run(boards.top(GUILD_ID, "balance")) == [(USER_ID + 1, 700, 700, 0), (USER_ID, 500, 500, 0)]
+    assert asyncio.run(boards.rank(GUILD_ID, "balance", USER_ID)) == 2
+
+
+def _level_up(level, xp):
+    return level + int(xp // 100), xp % 100
+
+
+def test_pending_overlay_matches_full_sort():
+    pytest.importorskip("pydantic_settings")
+    import random
+    from src.servies.leaderboard import METRICS, GuildLeaderboard
+
+    rng = random.Random(3)
+    board = GuildLeaderboard()
+    for user_id in range(200):
+        board.update(user_id, (0, 0, rng.randint(1, 5), rng.randint(0, 99), rng.randint(0, 50) * 60, rng.randint(0, 30), 0, 0))
+    # Часть ожидающих — новые участники, которых ещё нет в таблице
+    pending = {user_id: (rng.randint(0, 300), rng.randint(0, 20), rng.randint(0, 3000)) for user_id in rng.sample(range(250), 40)}
+    overlay = board.overlay(pending, _level_up)
+    rows = {**board.rows, **overlay}
+
+    for metric in ("level", "messages", "voice"):
+        sort_key, fmt = METRICS[metric]
+        expected = [fmt(uid, rows[uid]) for uid in sorted(rows, key=lambda uid: sort_key(rows[uid]) + (uid,))
+                    if metric != "messages" or rows[uid][5]]
+        for offset in (0, 10, 35):
+            assert board.top(metric, 10, offset, overlay) == expected[offset:offset + 10], (metric, offset)
+        for user_id in (0, 57, 249, next(iter(pending))):
+            row = rows.get(user_id)
+            better = sum(sort_key(other) < sort_key(row) for other in rows.values()) if row else 0
+            assert board.rank(metric, user_id, overlay) == better + 1, (metric, user_id)
+
@@ -0,0 +1,145 @@
+"""
+Журнал проводок и кэш счетов: атомарность переводов и откаты
+"""
+import asyncio
+
+import pytest
+
+from src.database import economy, ledger
+from src.database.account_cache import account_cache
+from src.database.engine import engine, get_pool
+from src.database.migrations import _registry, migrate
+from src.tests.conftest import GUILD_ID, USER_ID
+
+
+def test_ledger_opening_balances_and_atomic_transfer(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy, "DB_PATH", str(tmp_path / "economy.db"))
+    steps = _registry()[economy.DB_PATH]
+    migrate(economy.DB_PATH, [step for step in steps if step.name != "ledger"])
+    economy.get_or_create_account(USER_ID, GUILD_ID)
+    conn = get_pool(economy.DB_PATH).connect()
+    conn.execute("UPDATE accounts SET cash=500, bank=100 WHERE user_id=?", (USER_ID,))
+    conn.commit()
+    conn.close()
+    try:
+        migrate(economy.DB_PATH, steps)
+        assert ledger.audit_balances(GUILD_ID) == []
+
+        economy.get_or_create_account(USER_ID + 1, GUILD_ID)
+        # Списание больше баланса откатывает обе проводки
+        assert not ledger.transfer(GUILD_ID, "rob", [ledger.Leg(USER_ID, cash=-600), ledger.Leg(USER_ID + 1, cash=600)])
+        assert ledger.transfer(GUILD_ID, "rob", [ledger.Leg(USER_ID, cash=-300), ledger.Leg(USER_ID + 1, cash=300)])
+        economy.add_bank(USER_ID, GUILD_ID, -1000)
+        assert economy.get_or_create_account(USER_ID, GUILD_ID)[:2] == (200, 0)
+        assert economy.get_or_create_account(USER_ID + 1, GUILD_ID)[:2] == (300, 0)
+        assert ledger.audit_balances(GUILD_ID) == []
+    finally:
+        engine.close()
+
+
+def test_account_cache_write_through(traced_db):
+    economy.get_or_create_account(USER_ID, GUILD_ID)
+    traced_db.clear()
+    economy.add_cash(USER_ID, GUILD_ID, 500)
+    economy.set_cooldown(USER_ID, GUILD_ID, "daily_cd", 123.0)
+    # Первая проводка применена, вторая падает — откат не должен попасть в кэш
+    assert not ledger.transfer(GUILD_ID, "rob", [ledger.Leg(USER_ID, cash=100), ledger.Leg(USER_ID + 1, cash=-1)])
+    traced_db.clear()
+    assert economy.get_or_create_account(USER_ID, GUILD_ID)[:2] == (500, 0)
+    assert economy.get_cooldowns(USER_ID, GUILD_ID)[0] == 123.0
+    assert not [s for s in traced_db if "FROM accounts" in s]
+    account_cache.invalidate()
+    assert economy.get_or_create_account(USER_ID, GUILD_ID)[:2] == (500, 0)
+
+
+def test_blackjack_stake_is_taken_up_front_and_settled_once(traced_db):
+    pytest.importorskip("discord")
+    pytest.importorskip("pydantic_settings")
+    from types import SimpleNamespace
+    from src.cogs.economy import BlackjackView
+
+    economy.add_bank(USER_ID, GUILD_ID, 300)
+    user = SimpleNamespace(id=USER_ID)
+
+    async def play(outcome):
+        assert economy.spend_bank(USER_ID, GUILD_ID, 200, kind='blackjack')
+        view = BlackjackView(user, GUILD_ID, 200, cog=None)
+        await view._settle(outcome)
+        # Повторный расчёт (таймаут после конца игры, двойное нажатие) ничего не выплачивает
+        await view._settle('win')
+        return economy.get_or_create_account(USER_ID, GUILD_ID)[1]
+
+    assert asyncio.run(play('push')) == 300
+    assert asyncio.run(play('win')) == 500
+    assert asyncio.run(play('lose')) == 300
+    # Ставка больше баланса не списывается вовсе — без ухода в ноль, как при add_bank(-bet)
+    assert not economy.spend_bank(USER_ID, GUILD_ID, 400, kind='blackjack')
+    assert economy.get_or_create_account(USER_ID, GUILD_ID)[1] == 300
+    assert ledger.audit_balances(GUILD_ID) == []
+
+
+def test_rob_is_one_transaction(traced_db):
+    victim = USER_ID + 1
+    economy.get_or_create_account(victim, GUILD_ID)
+    economy.add_cash(victim, GUILD_ID, 500)
+    traced_db.clear()
+    assert economy.rob_success(USER_ID, victim, GUILD_ID, 300, 1000.0)
+    assert sum(s.strip().upper() == "COMMIT" for s in traced_db) == 1
+    acc = economy.get_or_create_account(USER_ID, GUILD_ID)
+    assert acc[0] == 300 and economy.get_cooldowns(USER_ID, GUILD_ID)[3] == 1000.0
+    assert economy.get_rob_stats(USER_ID, GUILD_ID)[:2] == (1, 1)
+
+    # Жертва уже потратила наличные: ни перевода, ни статистики, ни кулдауна
+    assert not economy.rob_success(USER_ID, victim, GUILD_ID, 300, 2000.0)
+    assert economy.get_or_create_account(victim, GUILD_ID)[0] == 200
+    assert economy.get_cooldowns(USER_ID, GUILD_ID)[3] == 1000.0
+    assert economy.get_rob_stats(USER_ID, GUILD_ID)[:2] == (1, 1)
+    assert ledger.audit_balances(GUILD_ID) == []
+
+
+def test_clan_payment_is_one_transaction_in_single_file(tmp_path, monkeypatch):
+    pytest.importorskip("discord")
+    pytest.importorskip("pydantic_settings")
+    from src.cogs.clans import Clans
+    from src.core.config import settings
+    from src.database import connection
+
+    monkeypatch.setattr(settings, "CLAN_MONTHLY_COST", 100)
+    engine.close()
+    engine.use_single_file(str(tmp_path / "bot.db"))
+    try:
+        registry = _registry()
+        migrate(economy.DB_PATH, registry[economy.DB_PATH])
+        migrate(connection.DB_PATH, registry[connection.DB_PATH])
+        economy.get_or_create_account(USER_ID, GUILD_ID)
+        economy.add_cash(USER_ID, GUILD_ID, 150)
+        conn = get_pool(connection.DB_PATH).connect()
+        clan_id = conn.execute(
+            "INSERT INTO clans (name, owner_id, last_payment) VALUES ('clan', ?, '2000-01-01 00:00:00')", (USER_ID,)
+        ).lastrowid
+        conn.commit()
+        conn.close()
+
+        def last_payment():
+            conn = get_pool(connection.DB_PATH).connect()
+            try:
+                return conn.execute("SELECT last_payment FROM clans WHERE id=?", (clan_id,)).fetchone()[0]
+            finally:
+                conn.close()
+
+        assert Clans._charge_clan_payment(clan_id, USER_ID, GUILD_ID)
+        assert economy.get_or_create_account(USER_ID, GUILD_ID)[0] == 50
+        assert last_payment() != '2000-01-01 00:00:00'
+
+        # Денег не хватает: откатывается и отметка об оплате
+        conn = get_pool(connection.DB_PATH).connect()
+        conn.execute("UPDATE clans SET last_payment = '2000-01-01 00:00:00' WHERE id=?", (clan_id,))
+        conn.commit()
+        conn.close()
+        assert not Clans._charge_clan_payment(clan_id, USER_ID, GUILD_ID)
+        assert economy.get_or_create_account(USER_ID, GUILD_ID)[0] == 50
+        assert last_payment() == '2000-01-01 00:00:00'
+        assert ledger.audit_balances(GUILD_ID) == []
+    finally:
+        engine.close()
+        engine.use_single_file(None)
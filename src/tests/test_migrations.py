@@ -0,0 +1,94 @@
+"""
+Миграции схемы: перенос данных из устаревших форматов
+"""
+import pytest
+
+from src.database import economy
+from src.database.engine import engine, get_pool
+from src.database.migrations import Migration, _registry, get_schema_version, migrate
+from src.tests.conftest import GUILD_ID, USER_ID
+
+
+def test_temp_roles_json_migrated(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy, "DB_PATH", str(tmp_path / "economy.db"))
+    steps = _registry()[economy.DB_PATH]
+    migrate(economy.DB_PATH, [step for step in steps if step.version < 5])
+    economy.get_or_create_account(USER_ID, GUILD_ID)
+    conn = get_pool(economy.DB_PATH).connect()
+    conn.execute("UPDATE accounts SET temp_roles_json=? WHERE user_id=?", ('{"7": 100.0, "8": 200.0}', USER_ID))
+    conn.commit()
+    conn.close()
+    try:
+        migrate(economy.DB_PATH, steps)
+        assert sorted(economy.get_temp_roles(GUILD_ID)) == [(USER_ID, 7, 100.0), (USER_ID, 8, 200.0)]
+        assert economy.get_expired_temp_roles(GUILD_ID, 150.0) == [(USER_ID, [7])]
+    finally:
+        engine.close()
+
+
+def test_failed_step_leaves_no_partial_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy, "DB_PATH", str(tmp_path / "economy.db"))
+    steps = _registry()[economy.DB_PATH]
+    migrate(economy.DB_PATH, [step for step in steps if step.version < 6])
+    economy.get_or_create_account(USER_ID, GUILD_ID)
+    conn = get_pool(economy.DB_PATH).connect()
+    conn.execute("UPDATE accounts SET cash=100 WHERE user_id=?", (USER_ID,))
+    conn.commit()
+    conn.close()
+    # Первые запросы шага выполняются, последний падает
+    broken = Migration(6, "ledger", steps[-1].apply + "INSERT INTO missing_table VALUES (1);")
+    try:
+        with pytest.raises(Exception):
+            migrate(economy.DB_PATH, [broken])
+        assert get_schema_version(economy.DB_PATH) == 5
+        conn = get_pool(economy.DB_PATH).connect()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        conn.close()
+        assert "transactions" not in tables
+
+        # Повтор исправленного шага проходит целиком, проводка "opening" — одна
+        assert migrate(economy.DB_PATH, steps) == 1
+        conn = get_pool(economy.DB_PATH).connect()
+        assert conn.execute("SELECT COUNT(*) FROM transactions WHERE kind='opening'").fetchone()[0] == 1
+        conn.close()
+    finally:
+        engine.close()
+
+
+def test_init_step_runs_in_migration_transaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy, "DB_PATH", str(tmp_path / "economy.db"))
+
+    def broken(conn):
+        economy.init_economy_db(conn)
+        raise RuntimeError("сбой после init")
+
+    try:
+        with pytest.raises(RuntimeError):
+            migrate(economy.DB_PATH, [Migration(1, "economy", broken)])
+        assert get_schema_version(economy.DB_PATH) == 0
+        conn = get_pool(economy.DB_PATH).connect()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        conn.close()
+        assert "accounts" not in tables
+    finally:
+        engine.close()
+
+
+def test_merge_keeps_autoincrement_counters(tmp_path):
+    import sqlite3
+    from src.database.consolidate import merge_databases
+
+    source = str(tmp_path / "tickets.db")
+    conn = sqlite3.connect(source)
+    conn.execute("CREATE TABLE tickets (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT)")
+    conn.executemany("INSERT INTO tickets (body) VALUES (?)", [("a",), ("b",), ("c",)])
+    conn.execute("DELETE FROM tickets WHERE id = 3")
+    conn.commit()
+    conn.close()
+
+    target = str(tmp_path / "bot.db")
+    assert merge_databases(target, [source]) == {"tickets.tickets": 2}
+    conn = sqlite3.connect(target)
+    # Удалённый ID 3 не выдаётся повторно
+    assert conn.execute("INSERT INTO tickets (body) VALUES ('d')").lastrowid == 4
+    conn.close()
@@ -0,0 +1,100 @@
+"""
+Наблюдаемость: метрики, монитор задержек цикла событий, трассировка команд
+"""
+import asyncio
+import json
+
+import pytest
+
+from src.database import economy
+from src.database.engine import engine, run_db
+from src.tests.conftest import GUILD_ID
+
+
+def test_metrics_exposition_and_db_observer(traced_db):
+    pytest.importorskip("pydantic_settings")
+    from src.servies import MetricsRegistry
+
+    registry = MetricsRegistry()
+    calls = registry.histogram("test_db_seconds", "Вызовы", ("call",), buckets=(0.1, 1.0))
+    registry.counter("test_events_total", "События", ("event",)).inc(event='a"b')
+    registry.gauge("test_size", "Размер", callback=lambda: 3)
+    engine.add_observer(lambda name, seconds, ok: calls.observe(seconds, call=name))
+    try:
+        asyncio.run(run_db(economy.get_top_by_level, GUILD_ID))
+    finally:
+        engine._observers.clear()
+
+    text = registry.render()
+    assert calls.count(call="get_top_by_level") == 1
+    assert 'test_db_seconds_bucket{call="get_top_by_level",le="+Inf"} 1' in text
+    assert 'test_db_seconds_count{call="get_top_by_level"} 1' in text
+    assert 'test_events_total{event="a\\"b"} 1' in text
+    assert "# TYPE test_size gauge\ntest_size 3\n" in text
+
+
+def _blocking_handler():
+    import time
+    time.sleep(0.4)
+
+
+def test_loop_monitor_captures_blocking_site():
+    pytest.importorskip("pydantic_settings")
+    from src.servies import LoopLagMonitor
+
+    monitor = LoopLagMonitor(interval=0.05, stall_threshold=0.1, check_interval=0.02)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        _blocking_handler()
+        await asyncio.sleep(0.2)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.stalls == 1
+    [offender] = monitor.top_offenders()
+    assert "test_observability.py" in offender.site and offender.site.endswith("_blocking_handler")
+    assert 0.3 < offender.total < 0.6
+    assert "time.sleep(0.4)" in offender.stack
+
+
+def test_trace_tree_spans_db_calls(traced_db, tmp_path):
+    pytest.importorskip("pydantic_settings")
+    from src.servies import Tracer
+    from src.servies.tracing import summarize, to_otlp
+
+    tracer = Tracer()
+    path = tmp_path / "traces.jsonl"
+    tracer.configure(f"jsonl:{path}")
+    engine.set_tracer(tracer)
+
+    async def scenario():
+        for _ in range(3):
+            with tracer.root_span("/top", guild_id=GUILD_ID):
+                await run_db(economy.get_top_by_level, GUILD_ID)
+                with tracer.span("render"):
+                    await asyncio.sleep(0.01)
+        # Вне трассы отрезки не создаются
+        await run_db(economy.get_top_by_level, GUILD_ID)
+        await tracer.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        engine.set_tracer(None)
+
+    traces = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(traces) == 3 and tracer.exported == 3
+    spans = {s["name"]: s for s in traces[0]["spans"]}
+    root, call = spans["/top"], spans["db get_top_by_level"]
+    assert root["parent"] is None and root["attrs"]["guild_id"] == GUILD_ID
+    assert call["parent"] == root["id"] and spans["render"]["parent"] == root["id"]
+    # Соединение взято в потоке движка, но отрезок вложен в вызов run_db
+    [hold] = [s for name, s in spans.items() if name.startswith("sqlite ")]
+    assert hold["parent"] == call["id"] and hold["duration"] <= call["duration"]
+
+    report = summarize(traces)
+    assert "/top" in report.splitlines()[1] and "render" in report
+    otlp_spans = to_otlp(traces)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(otlp_spans) == 3 * len(spans) and all(len(s["traceId"]) == 32 for s in otlp_spans)
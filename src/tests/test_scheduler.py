@@ -0,0 +1,90 @@
+"""
+Планировщик отложенных задач: пакетная запись, параллельный запуск, ожидание обработчика
+"""
+import asyncio
+import importlib
+import sqlite3
+import time
+
+import pytest
+
+from src.database import connection
+from src.database.engine import engine
+
+
+@pytest.fixture
+def tasks_db(tmp_path, monkeypatch):
+    """Временная main.db с таблицей задач"""
+    path = str(tmp_path / "main.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE scheduled_tasks (kind TEXT NOT NULL, key TEXT NOT NULL, due_at REAL NOT NULL, payload TEXT,
+                                      PRIMARY KEY (kind, key))
+    """)
+    conn.close()
+    monkeypatch.setattr(connection, "DB_PATH", path)
+    yield
+    engine.close()
+
+
+def _stored():
+    conn = connection.get_connection()
+    try:
+        return sorted((row[0], row[1]) for row in conn.execute("SELECT kind, key FROM scheduled_tasks"))
+    finally:
+        conn.close()
+
+
+def test_scheduler_batches_writes_and_fires_concurrently(tasks_db, monkeypatch):
+    pytest.importorskip("pydantic_settings")
+    # Пакет src.servies переэкспортирует экземпляр под тем же именем, что и модуль
+    scheduler_module = importlib.import_module("src.servies.scheduler")
+
+    transactions = []
+    original_apply = scheduler_module.apply_task_writes
+
+    def counted_apply(*args):
+        transactions.append(args)
+        original_apply(*args)
+
+    monkeypatch.setattr(scheduler_module, "apply_task_writes", counted_apply)
+    scheduler = scheduler_module.Scheduler()
+    fired = []
+
+    async def slow(key, payload):
+        await asyncio.sleep(0.3)
+        fired.append((key, payload))
+
+    async def scenario():
+        scheduler.register("mute", slow)
+        now = time.time()
+        for i in range(20):
+            scheduler.schedule("mute", i, now + 3600)
+        scheduler.cancel("mute", 5)
+        scheduler.schedule_many("mute", [(1, now - 1, {"n": 1}), (2, now - 1, None), (3, now + 3600, None)], replace=False)
+        await scheduler.flush()
+        # Двадцать постановок и отмена — одна транзакция, replace=False не тронул ключи из той же пачки
+        assert len(transactions) == 1
+        assert len(_stored()) == 19
+
+        scheduler.schedule("mute", 1, now - 1, {"n": 1})
+        scheduler.schedule("mute", 2, now - 1)
+        scheduler.schedule("role", "a", now - 1)
+        started = time.monotonic()
+        scheduler.start()
+        while len(fired) < 2:
+            await asyncio.sleep(0.02)
+        # Обработчики двух наступивших задач выполнялись одновременно
+        assert time.monotonic() - started < 0.55
+        await asyncio.sleep(0.1)
+
+        # Задача без обработчика не потеряна: она в памяти и в БД и срабатывает после register
+        assert ("role", "a") in _stored()
+        scheduler.register("role", slow)
+        while len(fired) < 3:
+            await asyncio.sleep(0.02)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert sorted(fired, key=str) == sorted([("1", {"n": 1}), ("2", None), ("a", None)], key=str)
+    assert ("role", "a") not in _stored() and ("mute", "1") not in _stored() and len(_stored()) == 17
@@ -0,0 +1,55 @@
+"""
+Запуск бота: профиль кэша и интентов, загрузка расширений волнами
+"""
+import asyncio
+
+import pytest
+
+
+def test_cache_profile_intents_follow_extensions():
+    pytest.importorskip("discord")
+    from src.core.cache_profile import EXTENSION_INTENTS, PROFILES, client_options
+
+    options = client_options(PROFILES["standard"], ["src.cogs.economy", "src.cogs.help_commands"])
+    intents = options["intents"]
+    assert intents.members and intents.message_content and intents.voice_states
+    assert not intents.presences and not intents.typing
+    assert options["chunk_guilds_at_startup"] and options["member_cache_flags"].joined
+
+    lean = client_options(PROFILES["lean"], EXTENSION_INTENTS)
+    assert lean["max_messages"] is None and not lean["chunk_guilds_at_startup"]
+    assert lean["member_cache_flags"].voice and not lean["member_cache_flags"].joined
+    # Для неописанного расширения включается всё, кроме presences
+    fallback = client_options(PROFILES["standard"], ["src.cogs.unknown"])["intents"]
+    assert fallback.guild_reactions and not fallback.presences
+
+
+def test_startup_waves_and_deferred_warmup():
+    pytest.importorskip("pydantic_settings")
+    from src.servies import StartupPipeline
+
+    pipeline = StartupPipeline()
+    running, peak, warmed = set(), [], []
+
+    async def load(name):
+        running.add(name)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.discard(name)
+        return name != "c"
+
+    async def warmup():
+        warmed.append(True)
+
+    async def scenario():
+        # b ждёт a, d ждёт b; внешняя зависимость missing не учитывается
+        loaded = await pipeline.run_in_waves(["a", "b", "c", "d"], {"b": ["a"], "d": ["b", "missing"]}, load)
+        assert loaded == ["a", "b", "d"]
+        assert max(peak) == 2
+        pipeline.defer("test", warmup)
+        assert not warmed
+        pipeline.ready()
+        await pipeline.wait_warmups()
+        assert warmed and "warmup test" in pipeline.stats()["phases"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,105 @@
+"""
+Инструменты нагрузочного тестирования: loadtest, dbbench и генератор данных
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from src.database.engine import DATABASE_DIR
+from src.tests import datagen, dbbench
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_loadtest_replays_gateway_mix():
+    pytest.importorskip("discord")
+    pytest.importorskip("pydantic_settings")
+
+    out = subprocess.run(
+        [sys.executable, "-m", "src.tests.loadtest", "--members", "100", "--events", "400", "--seed", "7", "--json"],
+        cwd=ROOT, capture_output=True, text=True, timeout=120, env={**os.environ, "TOKEN": "loadtest"},
+    )
+    assert out.returncode == 0, out.stderr
+    result = json.loads(out.stdout)
+    assert result["unfinished"] == 0 and not result["errors"] and not result["rest_unhandled"]
+    assert result["handlers"]["on_message EconomyCog.on_message"]["count"] > 0
+    assert any(name.startswith("/") for name in result["handlers"])
+    # Опыт и счётчики сообщений записаны пачкой, а не запросом на каждое сообщение
+    assert 0 < result["db_commits"] < result["events"]
+
+
+def test_dbbench_covers_public_functions(tmp_path):
+    # Новая публичная функция в economy, clans, love или discipline должна получить бенчмарк
+    assert set(dbbench.public_functions()) <= dbbench.covered_functions()
+
+    out = subprocess.run(
+        [sys.executable, "-m", "src.tests.dbbench", "--sizes", "1k", "--rounds", "1", "--json",
+         "--data-dir", str(tmp_path), "--baseline", str(tmp_path / "baseline.json")],
+        cwd=ROOT, capture_output=True, text=True, timeout=300,
+    )
+    assert out.returncode == 0, out.stderr
+    result = json.loads(out.stdout)["1k"]
+    assert set(result) == set(dbbench.CASES)
+    assert all(r["min"] > 0 for r in result.values())
+
+    lines, regressions = dbbench.compare({"1k": result}, {"results": {"1k": {"economy.get_rank_by_level": 1e-9}}}, 50)
+    assert regressions and "economy.get_rank_by_level" in regressions[0]
+
+
+def test_datagen_is_deterministic_and_consistent(tmp_path):
+    def generate(out):
+        return subprocess.run(
+            [sys.executable, "-m", "src.tests.datagen", "--out", str(out), "--accounts", "3000", "--seed", "5",
+             "--now", "1750000000", "--clan-max-members", "12"],
+            cwd=ROOT, capture_output=True, text=True, timeout=120,
+        )
+
+    def dump(out, name):
+        conn = sqlite3.connect(str(out / name))
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'schema_version%'")]
+        data = {table: conn.execute(f"SELECT * FROM {table} ORDER BY rowid").fetchall() for table in tables}
+        conn.close()
+        return data
+
+    for out in (tmp_path / "a", tmp_path / "b"):
+        result = generate(out)
+        assert result.returncode == 0, result.stderr
+    for name in ("economy.db", "main.db", "strike.db", "tickets.db"):
+        assert dump(tmp_path / "a", name) == dump(tmp_path / "b", name), name
+
+    economy_db, main_db = dump(tmp_path / "a", "economy.db"), dump(tmp_path / "a", "main.db")
+    assert len(economy_db["accounts"]) == 3000
+    # Журнал сходится с балансами: одна проводка opening на каждый ненулевой счёт
+    ledger = {row[2]: (row[3], row[4]) for row in economy_db["transaction_entries"]}
+    assert all(ledger.get(row[0], (0, 0)) == (row[2], row[3]) for row in economy_db["accounts"])
+    sizes = {}
+    for row in main_db["clan_members"]:
+        sizes[row[1]] = sizes.get(row[1], 0) + 1
+    assert max(sizes.values()) <= 12
+    assert len({row[2] for row in main_db["clan_members"]}) == len(main_db["clan_members"])
+    assert len(main_db["voice_sessions"]) > len(main_db["couples"])
+
+    # В заполненные базы генератор не пишет
+    again = generate(tmp_path / "a")
+    assert again.returncode != 0 and "не пуста" in again.stderr
+
+
+def test_tools_never_write_to_live_databases(tmp_path):
+    live = {name: os.stat(os.path.join(DATABASE_DIR, name)).st_mtime_ns
+            for name in os.listdir(DATABASE_DIR) if name.endswith(".db")}
+    # Без перенаправления хранилища генератор отказывается раньше миграций
+    with pytest.raises(RuntimeError):
+        datagen.generate(10)
+    for args in (["--single-file", os.path.join(DATABASE_DIR, "main.db")], ["--out", DATABASE_DIR]):
+        out = subprocess.run([sys.executable, "-m", "src.tests.datagen", *args, "--accounts", "10"],
+                             cwd=ROOT, capture_output=True, text=True, timeout=60)
+        assert out.returncode != 0 and "Рабочий каталог" in out.stderr
+    out = subprocess.run([sys.executable, "-m", "src.tests.dbbench", "--data-dir", DATABASE_DIR],
+                         cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert out.returncode != 0
+    assert live == {name: os.stat(os.path.join(DATABASE_DIR, name)).st_mtime_ns for name in live}
@@ -0,0 +1,64 @@
+"""
+Голосовые сессии: контрольные точки и восстановление снимка после перезапуска
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.database import economy
+from src.tests.conftest import GUILD_ID, USER_ID
+
+OTHER_GUILD_ID = GUILD_ID + 1
+CHANNEL_ID = 555
+
+
+def _guild(guild_id, user_ids):
+    guild = SimpleNamespace(id=guild_id, afk_channel=None, stage_channels=[], get_member=lambda user_id: None)
+    channel = SimpleNamespace(id=CHANNEL_ID, guild=guild)
+    state = SimpleNamespace(channel=channel, self_mute=False, self_deaf=False, mute=False, deaf=False)
+    channel.voice_states = {user_id: state for user_id in user_ids}
+    guild.voice_channels = [channel]
+    return guild
+
+
+def test_checkpoint_during_restore_keeps_unrestored_snapshot(traced_db, monkeypatch):
+    pytest.importorskip("discord")
+    pytest.importorskip("pydantic_settings")
+    from src.database.repository import get_activity_repository
+    from src.servies.voice_sessions import VoiceSessionEngine
+
+    # Снимок прошлого запуска: участник второго сервера сидел в войсе минуту назад
+    started = time.time() - 60
+    economy.apply_voice_batch({}, 0.0, lambda level, xp: (level, xp),
+                              [(OTHER_GUILD_ID, USER_ID, CHANNEL_ID, 1, started)])
+    repository = get_activity_repository()
+    read_snapshot = repository.get_voice_checkpoints
+    release = asyncio.Event()
+
+    async def slow_snapshot(guild_id):
+        if guild_id == OTHER_GUILD_ID:
+            await release.wait()
+        return await read_snapshot(guild_id)
+
+    monkeypatch.setattr(repository, "get_voice_checkpoints", slow_snapshot)
+    sessions = VoiceSessionEngine(non_earning=[], recovery_grace=300.0)
+    guilds = [_guild(GUILD_ID, [USER_ID]), _guild(OTHER_GUILD_ID, [USER_ID])]
+
+    async def scenario():
+        sessions.hold(guild.id for guild in guilds)
+        restoring = asyncio.gather(*(sessions.restore(guild) for guild in guilds))
+        await asyncio.sleep(0.05)
+        # Первый сервер восстановлен, второй ждёт снимок — контрольная точка срабатывает посередине
+        await sessions.checkpoint()
+        assert set(economy.get_voice_checkpoints(OTHER_GUILD_ID)) == {USER_ID}
+        assert economy.get_voice_checkpoints(OTHER_GUILD_ID)[USER_ID][2] == started
+        release.set()
+        await restoring
+        await sessions.checkpoint()
+
+    asyncio.run(scenario())
+    # Время с прошлой контрольной точки засчитано по сохранённому снимку
+    assert economy.get_activity(USER_ID, OTHER_GUILD_ID)[2] >= 60
+    assert set(economy.get_voice_checkpoints(GUILD_ID)) == {USER_ID}
@@ -0,0 +1,145 @@
+"""
+Пакетное получение участников сервера по ID
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+
+class MemberResolver:
+    """
+    Находит участников сервера пачкой: сначала кэш гильдии, затем один gateway-запрос
+    (chunk по user_ids), а при его недоступности — ограниченное число параллельных fetch_member.
+    Ушедшие с сервера ID запоминаются на ttl секунд, чтобы не запрашивать их повторно.
+
+    Если участники не загружены при старте (профиль кэша lean), полный список
+    сервера запрашивается по требованию через all_members
+    """
+
+    # Лимит Discord на количество user_ids в одном запросе участников
+    QUERY_LIMIT = 100
+    # Сколько секунд переиспользовать полный список участников, полученный по запросу
+    MEMBERS_TTL = 60.0
+
+    def __init__(self, ttl: float = 600.0, concurrency: int = 5):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        # Сохранять ли в кэше гильдии участников, полученных по запросу (задаётся профилем кэша)
+        self.cache_chunks = True
+        self._missing: Dict[Tuple[int, int], float] = {}
+        self._members: Dict[int, Tuple[float, List[discord.Member]]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def configure(self, cache_chunks: bool) -> None:
+        self.cache_chunks = cache_chunks
+        self._members.clear()
+
+    def _is_missing(self, guild_id: int, user_id: int, now: float) -> bool:
+        expires = self._missing.get((guild_id, user_id))
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._missing[(guild_id, user_id)]
+            return False
+        return True
+
+    def forget(self, guild_id: int, user_id: int) -> None:
+        """Убирает ID из негативного кэша (например, пользователь вернулся на сервер)"""
+        self._missing.pop((guild_id, user_id), None)
+
+    async def _query(self, guild: discord.Guild, user_ids: List[int]) -> List[discord.Member]:
+        members: List[discord.Member] = []
+        for i in range(0, len(user_ids), self.QUERY_LIMIT):
+            members.extend(await guild.query_members(user_ids=user_ids[i:i + self.QUERY_LIMIT], cache=self.cache_chunks))
+        return members
+
+    async def _fetch(self, guild: discord.Guild, user_ids: List[int]) -> List[discord.Member]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(user_id: int):
+            async with semaphore:
+                try:
+                    return await guild.fetch_member(user_id)
+                except discord.NotFound:
+                    return None
+
+        results = await asyncio.gather(*(fetch_one(uid) for uid in user_ids), return_exceptions=True)
+        return [m for m in results if isinstance(m, discord.Member)]
+
+    async def resolve(self, guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, discord.Member]:
+        """
+        Возвращает {user_id: участник} для тех ID, что есть на сервере
+
+        Args:
+            guild: Сервер
+            user_ids: ID пользователей
+        """
+        now = time.monotonic()
+        result: Dict[int, discord.Member] = {}
+        unresolved: List[int] = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is not None:
+                result[user_id] = member
+            elif not self._is_missing(guild.id, user_id, now):
+                unresolved.append(user_id)
+
+        if not unresolved:
+            return result
+
+        try:
+            found = await self._query(guild, unresolved)
+        except Exception as e:
+            # Нет интента участников или gateway недоступен — запасной путь через REST
+            logging.debug(f"query_members недоступен, используем fetch_member: {e}")
+            found = await self._fetch(guild, unresolved)
+
+        for member in found:
+            result[member.id] = member
+        for user_id in unresolved:
+            if user_id not in result:
+                self._missing[(guild.id, user_id)] = now + self.ttl
+        return result
+
+    async def get(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        """Участник сервера по ID: кэш гильдии, затем запрос к Discord"""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        return (await self.resolve(guild, [user_id])).get(user_id)
+
+    async def all_members(self, guild: discord.Guild) -> List[discord.Member]:
+        """
+        Все участники сервера
+
+        Загруженный сервер отдаётся из кэша; иначе список запрашивается через gateway
+        один раз на MEMBERS_TTL секунд, параллельные вызовы ждут один запрос
+        """
+        if guild.chunked:
+            return list(guild.members)
+
+        cached = self._members.get(guild.id)
+        if cached and time.monotonic() - cached[0] < self.MEMBERS_TTL:
+            return cached[1]
+
+        lock = self._locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            cached = self._members.get(guild.id)
+            if cached and time.monotonic() - cached[0] < self.MEMBERS_TTL:
+                return cached[1]
+            try:
+                members = await guild.chunk(cache=self.cache_chunks)
+            except discord.ClientException as e:
+                # Интент участников выключен — доступен только кэш
+                logging.warning(f"⚠️ Не удалось получить участников {guild.name}: {e}")
+                return list(guild.members)
+            if guild.chunked:
+                return list(guild.members)
+            self._members[guild.id] = (time.monotonic(), members)
+            return members
+
+
+member_resolver = MemberResolver()